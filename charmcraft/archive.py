@@ -0,0 +1,281 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+"""Write the zip archives for charms and bundles."""
+
+import collections
+import logging
+import os
+import pathlib
+import struct
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# the compression levels that can be used for the whole archive; None means to
+# store everything without compression
+COMPRESSION_LEVELS = {
+    "none": None,
+    "fast": 1,
+    "default": zlib.Z_DEFAULT_COMPRESSION,
+    "max": 9,
+}
+
+# files that are already compressed, so are stored without trying to compress them
+STORED_SUFFIXES = {
+    ".7z",
+    ".bz2",
+    ".charm",
+    ".egg",
+    ".gif",
+    ".gz",
+    ".jar",
+    ".jpeg",
+    ".jpg",
+    ".png",
+    ".tgz",
+    ".webp",
+    ".whl",
+    ".xz",
+    ".zip",
+    ".zst",
+}
+
+# the archive comment, recording how its members were compressed so they can be
+# reused when repacking
+ARCHIVE_COMMENT_PREFIX = b"charmcraft compression="
+
+# files are stored without compression if that doesn't reduce their size at least
+# to this ratio (as it happens with high entropy content)
+MIN_COMPRESSION_RATIO = 0.95
+
+
+def _read_raw_member(zippath: pathlib.Path, zinfo: zipfile.ZipInfo):
+    """Read the compressed content of a member, as it is stored in the zip."""
+    with open(str(zippath), "rb") as fh:
+        fh.seek(zinfo.header_offset)
+        header = struct.unpack(
+            zipfile.structFileHeader, fh.read(zipfile.sizeFileHeader)
+        )
+        if header[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+            raise zipfile.BadZipFile(f"Bad local header for member {zinfo.filename!r}")
+        fh.seek(
+            header[zipfile._FH_FILENAME_LENGTH]
+            + header[zipfile._FH_EXTRA_FIELD_LENGTH],
+            os.SEEK_CUR,
+        )
+        return fh.read(zinfo.compress_size)
+
+
+def _compress_member(
+    filepath: pathlib.Path,
+    level,
+    previous: Optional[Tuple[pathlib.Path, zipfile.ZipInfo]] = None,
+):
+    """Read and compress a file according to the level, as it will be stored in the zip.
+
+    If the same member in a previous archive is given and it has the same CRC, its
+    compressed content is copied instead of compressing the file again.
+
+    :returns: the compression type used, the size of the original content, its CRC,
+        the content to write and if it was reused from the previous archive.
+    """
+    data = filepath.read_bytes()
+    crc = zlib.crc32(data)
+    if previous is not None:
+        previous_zippath, previous_info = previous
+        if previous_info.CRC == crc:
+            raw = _read_raw_member(previous_zippath, previous_info)
+            return previous_info.compress_type, len(data), crc, raw, True
+
+    if level is None or filepath.suffix.lower() in STORED_SUFFIXES:
+        return zipfile.ZIP_STORED, len(data), crc, data, False
+
+    # negative window bits to get a raw deflate stream, as used inside zips
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(data) + compressor.flush()
+    if len(compressed) > len(data) * MIN_COMPRESSION_RATIO:
+        return zipfile.ZIP_STORED, len(data), crc, data, False
+    return zipfile.ZIP_DEFLATED, len(data), crc, compressed, False
+
+
+# zipfile has no public way to write a member already compressed, so the deflated
+# ones are appended using these ZipFile internals (present in all the Python versions
+# from 3.6 to the latest, see `test_write_zip_raw_internals`); if they are missing,
+# the members are written through the public API, compressing them again
+_RAW_WRITE_ATTRIBUTES = ("_writecheck", "_didModify", "fp", "start_dir")
+
+
+def _can_write_raw(zipfh: zipfile.ZipFile) -> bool:
+    """Tell if the zip has the internals needed to write already compressed members."""
+    return all(hasattr(zipfh, name) for name in _RAW_WRITE_ATTRIBUTES)
+
+
+def _write_compressed(zipfh: zipfile.ZipFile, zinfo: zipfile.ZipInfo, compressed):
+    """Append an already compressed member to the zip.
+
+    The stored members are written through the public API; see
+    `_RAW_WRITE_ATTRIBUTES` for the deflated ones.
+    """
+    if zinfo.compress_type == zipfile.ZIP_DEFLATED and _can_write_raw(zipfh):
+        zipfh._writecheck(zinfo)
+        zipfh._didModify = True
+        zinfo.header_offset = zipfh.fp.tell()
+        zipfh.fp.write(zinfo.FileHeader())
+        zipfh.fp.write(compressed)
+        zipfh.filelist.append(zinfo)
+        zipfh.NameToInfo[zinfo.filename] = zinfo
+        zipfh.start_dir = zipfh.fp.tell()
+        return
+
+    if zinfo.compress_type == zipfile.ZIP_DEFLATED:
+        compressed = zlib.decompress(compressed, -zlib.MAX_WBITS)
+    with zipfh.open(zinfo, "w") as fh:
+        fh.write(compressed)
+
+
+def _load_previous_members(previous, compression):
+    """Get the members of a previous archive that can be reused.
+
+    Nothing is reused if the archive is not there, is not valid, or was written
+    using a different compression.
+    """
+    if previous is None or not os.path.exists(str(previous)):
+        return {}
+    try:
+        with zipfile.ZipFile(str(previous)) as zipfh:
+            if zipfh.comment != ARCHIVE_COMMENT_PREFIX + compression.encode("ascii"):
+                logger.debug(
+                    "Not reusing members from %r: different compression", str(previous)
+                )
+                return {}
+            infos = zipfh.infolist()
+    except (OSError, zipfile.BadZipFile) as exc:
+        logger.debug("Not reusing members from %r: %r", str(previous), exc)
+        return {}
+    # members written with a data descriptor can't be simply copied
+    return {info.filename: info for info in infos if not info.flag_bits & 0x08}
+
+
+def write_zip(
+    zippath,
+    members: Dict[str, pathlib.Path],
+    *,
+    max_workers: Optional[int] = None,
+    compression: str = "default",
+    previous: Optional[pathlib.Path] = None,
+    date_time: Optional[Tuple[int, int, int, int, int, int]] = None,
+):
+    """Write a zip with the given members, compressing them concurrently.
+
+    The members are compressed in a pool of threads (zlib releases the GIL while
+    working) and are written to the zip in the given order, so the result doesn't
+    depend on which compression finishes first.
+
+    Files that are already compressed (per their suffix) or that don't compress
+    enough are stored as they are.
+
+    If a previous archive is given, the members that didn't change (same size,
+    modification time and CRC) are copied from it without compressing them again.
+
+    :param zippath: the zip file to write.
+    :param members: the path inside the zip of each file, and its real path.
+    :param max_workers: the number of threads to use; defaults to the number of CPUs.
+    :param compression: the compression level to use, one of `COMPRESSION_LEVELS`.
+    :param previous: a previous version of the archive to reuse members from.
+    :param date_time: a fixed modification time for all the members (instead of the
+        files' one), so the same content always gives exactly the same archive.
+    """
+    level = COMPRESSION_LEVELS[compression]
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    logger.debug(
+        "Writing %d members in %r using %d threads",
+        len(members),
+        str(zippath),
+        max_workers,
+    )
+    previous_members = _load_previous_members(previous, compression)
+
+    # only a limited number of members is compressed ahead of what is being written,
+    # so everything is not held in memory at the same time
+    start = time.monotonic()
+    total_size = written_size = reused = 0
+    pending = collections.deque()
+    to_compress = iter(members.items())
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        with zipfile.ZipFile(str(zippath), "w", zipfile.ZIP_DEFLATED) as zipfh:
+            zipfh.comment = ARCHIVE_COMMENT_PREFIX + compression.encode("ascii")
+            while True:
+                while len(pending) < max_workers * 2:
+                    try:
+                        arcname, filepath = next(to_compress)
+                    except StopIteration:
+                        break
+                    zinfo = zipfile.ZipInfo.from_file(str(filepath), arcname)
+                    if date_time is not None:
+                        zinfo.date_time = date_time
+                    previous_info = previous_members.get(arcname)
+                    # the zip format stores the time with a resolution of 2 seconds
+                    rounded_time = zinfo.date_time[:5] + (zinfo.date_time[5] // 2 * 2,)
+                    if (
+                        previous_info is not None
+                        and previous_info.file_size == zinfo.file_size
+                        and previous_info.date_time == rounded_time
+                    ):
+                        reusable = (previous, previous_info)
+                    else:
+                        reusable = None
+                    future = executor.submit(
+                        _compress_member,
+                        pathlib.Path(filepath),
+                        level,
+                        reusable,
+                    )
+                    pending.append((zinfo, future))
+                if not pending:
+                    break
+
+                zinfo, future = pending.popleft()
+                (
+                    zinfo.compress_type,
+                    zinfo.file_size,
+                    zinfo.CRC,
+                    compressed,
+                    was_reused,
+                ) = future.result()
+                zinfo.compress_size = len(compressed)
+                _write_compressed(zipfh, zinfo, compressed)
+                total_size += zinfo.file_size
+                written_size += zinfo.compress_size
+                reused += was_reused
+
+    if previous_members:
+        logger.debug(
+            "Reused %d of %d members from %r", reused, len(members), str(previous)
+        )
+    logger.info(
+        "Compression %r saved %d bytes (%d to %d) in %.3f seconds",
+        compression,
+        total_size - written_size,
+        total_size,
+        written_size,
+        time.monotonic() - start,
+    )
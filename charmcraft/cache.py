@@ -0,0 +1,446 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+"""Persistent caches to reuse work between builds."""
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import zipfile
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import appdirs
+
+from charmcraft.config import Base
+from charmcraft.env import (
+    get_managed_environment_cache_path,
+    is_charmcraft_running_in_managed_mode,
+)
+from charmcraft.utils import link_or_copy
+
+logger = logging.getLogger(__name__)
+
+# the default size budget for the dependencies cache, in bytes
+DEPENDENCIES_CACHE_MAX_SIZE = 2 * 1024 ** 3
+
+# the name of the file, inside each entry, that holds the entry size
+_SIZE_FILENAME = "size"
+
+
+def get_cache_dirpath() -> pathlib.Path:
+    """Return the directory where all the persistent caches live.
+
+    In managed mode this is where the host's cache is mounted.
+    """
+    if is_charmcraft_running_in_managed_mode():
+        return get_managed_environment_cache_path()
+    return pathlib.Path(appdirs.user_cache_dir("charmcraft"))
+
+
+def link_tree(src: pathlib.Path, dest: pathlib.Path, *, replace: bool = False) -> int:
+    """Replicate the src tree into dest hard linking the files.
+
+    Files are copied if hard links are not possible (see `link_or_copy`). Symlinks
+    are replicated as is.
+
+    :param replace: if replace the files and symlinks already present in dest.
+
+    :returns: the total size of the files in the tree.
+    """
+    total_size = 0
+    for basedir, dirnames, filenames in os.walk(str(src), followlinks=False):
+        rel_basedir = os.path.relpath(basedir, str(src))
+        dest_basedir = os.path.normpath(os.path.join(str(dest), rel_basedir))
+        os.makedirs(dest_basedir, exist_ok=True)
+
+        for name in dirnames + filenames:
+            src_path = os.path.join(basedir, name)
+            dest_path = os.path.join(dest_basedir, name)
+            if replace and name in filenames and os.path.lexists(dest_path):
+                os.unlink(dest_path)
+            if os.path.islink(src_path):
+                os.symlink(os.readlink(src_path), dest_path)
+            elif name in filenames:
+                total_size += os.lstat(src_path).st_size
+                link_or_copy(src_path, dest_path)
+    return total_size
+
+
+class DependenciesCache:
+    """A content-addressed cache of installed dependencies.
+
+    Each entry holds a virtualenv as installed by pip, and is identified by a key
+    built from everything that affects that installation (see `get_key`). Entries
+    are evicted in least recently used order to keep the cache under the size budget.
+
+    :param dirpath: where the cache entries are stored.
+    :param max_size: the size budget for the whole cache, in bytes.
+    """
+
+    def __init__(
+        self, dirpath: pathlib.Path, max_size: int = DEPENDENCIES_CACHE_MAX_SIZE
+    ):
+        self.dirpath = dirpath
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(
+        requirement_paths: Iterable[pathlib.Path], base: Base, python_version: str
+    ) -> str:
+        """Build the key for the given requirement files, target base and Python version."""
+        hasher = hashlib.sha256()
+        for reqpath in requirement_paths:
+            hasher.update(hashlib.sha256(reqpath.read_bytes()).digest())
+        hasher.update(
+            "\0".join([base.name, base.channel, *base.architectures]).encode("utf8")
+        )
+        hasher.update(python_version.encode("utf8"))
+        return hasher.hexdigest()
+
+    def _get_venv_path(self, key: str) -> pathlib.Path:
+        """Return the path of the virtualenv for the given entry."""
+        return self.dirpath / key / "venv"
+
+    def get(self, key: str, destpath: pathlib.Path) -> bool:
+        """Hard link the virtualenv for the given key into destpath, if present in the cache.
+
+        :returns: True if the entry was found.
+        """
+        entry_path = self.dirpath / key
+        if not (entry_path / _SIZE_FILENAME).exists():
+            logger.debug("Dependencies not found in the cache (key %s)", key)
+            return False
+
+        logger.debug("Reusing dependencies from the cache (key %s)", key)
+        link_tree(self._get_venv_path(key), destpath)
+
+        # mark it as recently used
+        os.utime(str(entry_path))
+        return True
+
+    def store(self, key: str, srcpath: pathlib.Path) -> None:
+        """Store the virtualenv in srcpath in the cache under the given key."""
+        entry_path = self.dirpath / key
+        if entry_path.exists():
+            return
+
+        # prepare everything in a temporary directory and then move it to its final
+        # place, so other processes never see a half-stored entry
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        tmp_path = pathlib.Path(tempfile.mkdtemp(dir=str(self.dirpath), prefix=".tmp-"))
+        try:
+            size = link_tree(srcpath, tmp_path / "venv")
+            (tmp_path / _SIZE_FILENAME).write_text(str(size))
+            try:
+                tmp_path.rename(entry_path)
+            except OSError:
+                # stored in the meantime by other process
+                logger.debug("Dependencies already stored in the cache (key %s)", key)
+                return
+        finally:
+            if tmp_path.exists():
+                shutil.rmtree(str(tmp_path))
+        logger.debug("Dependencies stored in the cache (key %s, %d bytes)", key, size)
+
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until the cache is under its size budget."""
+        entries = []
+        for entry_path in self.dirpath.iterdir():
+            try:
+                size = int((entry_path / _SIZE_FILENAME).read_text())
+                last_used = entry_path.stat().st_mtime
+            except (OSError, ValueError):
+                # temporary or broken entry
+                continue
+            entries.append((last_used, size, entry_path))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logger.debug("Evicting dependencies from the cache: %s", entry_path.name)
+            shutil.rmtree(str(entry_path))
+            total_size -= size
+
+
+# the suffixes of the source distributions downloaded by pip
+_SDIST_SUFFIXES = (".tar.gz", ".tar.bz2", ".tgz", ".zip")
+
+# the parts of a wheel file name, see PEP 427 (the build tag is optional)
+_WHEEL_FILENAME_RE = re.compile(
+    r"^(?P<name>[^-]+)-(?P<version>[^-]+)(-\d[^-]*)?"
+    r"-(?P<tag>[^-]+-[^-]+-[^-]+)\.whl$"
+)
+
+
+def _unpack_wheel(wheel_path: pathlib.Path, destpath: pathlib.Path) -> None:
+    """Unpack a wheel as pip installs it with `--target`.
+
+    The libraries go to the root of destpath, and the scripts to its `bin`
+    directory; the headers and data files are not needed by charms.
+    """
+    with zipfile.ZipFile(str(wheel_path)) as zf:
+        for info in zf.infolist():
+            parts = info.filename.split("/")
+            if info.filename.endswith("/") or ".." in parts:
+                continue
+            scheme = None
+            if parts[0].endswith(".data") and len(parts) > 2:
+                scheme = parts[1]
+                if scheme in ("purelib", "platlib"):
+                    parts = parts[2:]
+                elif scheme == "scripts":
+                    parts = ["bin"] + parts[2:]
+                else:
+                    logger.debug(
+                        "Not unpacking %r from %r", info.filename, wheel_path.name
+                    )
+                    continue
+
+            path = destpath.joinpath(*parts)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            content = zf.read(info)
+            if scheme == "scripts" and content.startswith(b"#!python"):
+                # the generic shebang that installers must replace
+                content = b"#!/usr/bin/env python3" + content[len(b"#!python") :]
+            path.write_bytes(content)
+            if scheme == "scripts" or (info.external_attr >> 16) & 0o111:
+                path.chmod(0o755)
+
+
+class WheelStore:
+    """A store of unpacked wheels, to install dependencies linking their files.
+
+    Each wheel is unpacked once, in an entry identified by its name, version, tag
+    and hash, which is shared by all the projects. The wheels themselves are also
+    kept, so pip finds them locally (in `wheels_dirpath`) and only downloads or
+    builds what is missing.
+
+    :param dirpath: where the wheels and the unpacked entries are stored.
+    """
+
+    def __init__(self, dirpath: pathlib.Path):
+        self.dirpath = dirpath
+        self.wheels_dirpath = dirpath / "wheels"
+        self.unpacked_dirpath = dirpath / "unpacked"
+
+    @staticmethod
+    def get_key(wheel_path: pathlib.Path) -> str:
+        """Build the key for the wheel: its name, version, tag and content hash."""
+        match = _WHEEL_FILENAME_RE.match(wheel_path.name)
+        if match is None:
+            raise ValueError("Invalid wheel file name: {!r}".format(wheel_path.name))
+        wheel_hash = hashlib.sha256(wheel_path.read_bytes()).hexdigest()
+        return "{}-{}-{}-{}".format(
+            match.group("name").lower(),
+            match.group("version"),
+            match.group("tag"),
+            wheel_hash,
+        )
+
+    def add_wheels(self, dirpath: pathlib.Path) -> List[str]:
+        """Add the wheels in the directory to the store, unpacking the new ones.
+
+        The wheels are moved from the directory to the store (if not already there).
+
+        :returns: the keys of the wheels, in the order to install them.
+        """
+        self.wheels_dirpath.mkdir(parents=True, exist_ok=True)
+        self.unpacked_dirpath.mkdir(parents=True, exist_ok=True)
+        keys = []
+        for wheel_path in sorted(dirpath.glob("*.whl")):
+            key = self.get_key(wheel_path)
+            keys.append(key)
+            self._unpack(key, wheel_path)
+            stored_path = self.wheels_dirpath / wheel_path.name
+            if not stored_path.exists():
+                shutil.move(str(wheel_path), str(stored_path))
+        return keys
+
+    def _unpack(self, key: str, wheel_path: pathlib.Path) -> None:
+        """Unpack the wheel in its entry, if not there already."""
+        entry_path = self.unpacked_dirpath / key
+        if entry_path.exists():
+            return
+
+        # unpacked in a temporary directory and then moved to its final place, so
+        # other processes never see a half-unpacked entry
+        tmp_path = pathlib.Path(tempfile.mkdtemp(dir=str(self.dirpath), prefix=".tmp-"))
+        try:
+            _unpack_wheel(wheel_path, tmp_path)
+            try:
+                tmp_path.rename(entry_path)
+            except OSError:
+                logger.debug("Wheel already unpacked in the store (%s)", key)
+                return
+        finally:
+            if tmp_path.exists():
+                shutil.rmtree(str(tmp_path))
+        logger.debug("Wheel unpacked in the store (%s)", key)
+
+    def install(self, keys: Iterable[str], destpath: pathlib.Path) -> None:
+        """Hard link the files of the unpacked wheels into destpath."""
+        for key in keys:
+            # as pip does, what is installed later replaces what was already there
+            link_tree(self.unpacked_dirpath / key, destpath, replace=True)
+
+
+def _get_name_and_version(filename: str) -> Optional[Tuple[str, str]]:
+    """Get the project name and version from a wheel or source distribution file name."""
+    match = _WHEEL_FILENAME_RE.match(filename)
+    if match is not None:
+        return match.group("name"), match.group("version")
+    for suffix in _SDIST_SUFFIXES:
+        if filename.endswith(suffix):
+            # the version can't have dashes, but the name can
+            name, _, version = filename[: -len(suffix)].rpartition("-")
+            if name and version:
+                return name, version
+    return None
+
+
+# the prefixes of the requirements for version control systems and URLs
+_NON_INDEX_PREFIXES = ("git+", "hg+", "svn+", "bzr+", "file:", ".", "/")
+
+
+def get_non_index_requirements(requirement_paths: Iterable[pathlib.Path]) -> List[str]:
+    """Get the requirements that are not taken from the package index.
+
+    Those are the ones from version control systems, URLs, local paths, and the
+    editable ones, which can't be pinned to a version and hash in a lock. The
+    requirement files included by others are also checked.
+    """
+    found = []
+    pending = list(requirement_paths)
+    while pending:
+        reqspath = pathlib.Path(pending.pop(0))
+        for line in reqspath.read_text(encoding="utf8").splitlines():
+            line = line.split(" #")[0].strip()
+            if not line or line.startswith("#"):
+                continue
+            option, _, value = line.partition(" ")
+            option, _, attached_value = option.partition("=")
+            value = (attached_value or value).strip()
+            if option in ("-r", "--requirement"):
+                pending.append(reqspath.parent / value)
+            elif option in ("-e", "--editable"):
+                found.append(line)
+            elif line.startswith("-"):
+                continue
+            elif (
+                line.startswith(_NON_INDEX_PREFIXES)
+                or "://" in line
+                or " @ " in line
+                or line.endswith((".whl",) + _SDIST_SUFFIXES)
+            ):
+                found.append(line)
+    return found
+
+
+def build_lock(dirpath: pathlib.Path) -> str:
+    """Build the content of a lock file from the distributions downloaded by pip.
+
+    Each distribution is pinned to its version and the hash of the file, so
+    installing from the lock needs no resolution and gets exactly the same files.
+    """
+    lines = []
+    for path in sorted(dirpath.iterdir()):
+        name_and_version = _get_name_and_version(path.name)
+        if name_and_version is None:
+            logger.debug("Ignoring unknown downloaded file %r", path.name)
+            continue
+        file_hash = hashlib.sha256(path.read_bytes()).hexdigest()
+        lines.append("{}=={} --hash=sha256:{}\n".format(*name_and_version, file_hash))
+    return "".join(lines)
+
+
+class RequirementsLocks:
+    """A store of the locks resolved from the requirement files.
+
+    Each lock is identified by a key built from everything that affects the
+    resolution (see `DependenciesCache.get_key`), so it's resolved again only
+    when the requirement files change, and for each target base.
+
+    :param dirpath: where the lock files are stored.
+    """
+
+    def __init__(self, dirpath: pathlib.Path):
+        self.dirpath = dirpath
+
+    def get(self, key: str) -> Optional[pathlib.Path]:
+        """Return the path of the lock file for the given key, if present."""
+        lock_path = self.dirpath / (key + ".txt")
+        if not lock_path.exists():
+            logger.debug("Requirements lock not found (key %s)", key)
+            return None
+        logger.debug("Reusing the requirements lock (key %s)", key)
+        return lock_path
+
+    def store(self, key: str, content: str) -> pathlib.Path:
+        """Store the lock content under the given key, returning its path."""
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        lock_path = self.dirpath / (key + ".txt")
+
+        # written aside and then moved, so other processes never see a partial lock
+        fd, tmp_name = tempfile.mkstemp(dir=str(self.dirpath), prefix=".tmp-")
+        with os.fdopen(fd, "wt", encoding="utf8") as fh:
+            fh.write(content)
+        os.replace(tmp_name, str(lock_path))
+        logger.debug("Requirements lock stored (key %s)", key)
+        return lock_path
+
+
+class AnalysisCache:
+    """A store of the results of the analysis checkers, to reuse between builds.
+
+    Each entry is identified by a key built by the caller, and holds the result
+    together with the digests of the files the checker used, so the caller can
+    validate it before reusing it.
+
+    :param dirpath: where the entries are stored.
+    """
+
+    def __init__(self, dirpath: pathlib.Path):
+        self.dirpath = dirpath
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the entry stored under the given key, if present and valid."""
+        entry_path = self.dirpath / (key + ".json")
+        try:
+            return json.loads(entry_path.read_text(encoding="utf8"))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as exc:
+            logger.debug("Ignoring broken analysis cache entry (key %s): %s", key, exc)
+            return None
+
+    def store(self, key: str, content: Dict[str, Any]) -> None:
+        """Store the entry under the given key."""
+        self.dirpath.mkdir(parents=True, exist_ok=True)
+        entry_path = self.dirpath / (key + ".json")
+
+        # written aside and then moved, so other processes never see a partial entry
+        fd, tmp_name = tempfile.mkstemp(dir=str(self.dirpath), prefix=".tmp-")
+        with os.fdopen(fd, "wt", encoding="utf8") as fh:
+            json.dump(content, fh)
+        os.replace(tmp_name, str(entry_path))
@@ -16,36 +16,66 @@
 
 """Infrastructure for the 'build' command."""
 
-import errno
+import json
 import logging
 import os
 import pathlib
+import re
 import shutil
+import stat
 import subprocess
-import zipfile
-from typing import List, Optional
-
-from charmcraft import linters
-from charmcraft.bases import check_if_base_matches_host
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+import yaml
+
+from charmcraft import __version__, linters
+from charmcraft.archive import COMPRESSION_LEVELS, write_zip
+from charmcraft.bases import check_if_base_matches_host, get_host_as_base
+from charmcraft.cache import (
+    AnalysisCache,
+    DependenciesCache,
+    RequirementsLocks,
+    WheelStore,
+    build_lock,
+    get_cache_dirpath,
+    get_non_index_requirements,
+)
 from charmcraft.cmdbase import BaseCommand, CommandError
 from charmcraft.config import Base, BasesConfiguration, Config
 from charmcraft.deprecations import notify_deprecation
 from charmcraft.env import (
+    get_managed_environment_cache_path,
     get_managed_environment_home_path,
     get_managed_environment_project_path,
     is_charmcraft_running_in_managed_mode,
 )
+from charmcraft.fileindex import DIR, FILE, OTHER, SYMLINK, FileIndex, get_git_files
+from charmcraft.fingerprint import (
+    Fingerprint,
+    hash_file,
+    hash_files,
+    read_fingerprint,
+)
+from charmcraft.imports import get_reachable_modules, get_top_level_modules
 from charmcraft.jujuignore import JujuIgnore, default_juju_ignore
 from charmcraft.logsetup import message_handler
-from charmcraft.manifest import create_manifest
+from charmcraft.manifest import create_manifest, read_venv_resource
 from charmcraft.metadata import parse_metadata_yaml
+from charmcraft.prune import DEFAULT_PRUNE_PATTERNS, prune_tree
 from charmcraft.providers import (
     capture_logs_from_instance,
     ensure_provider_is_available,
     is_base_providable,
     launched_environment,
 )
-from charmcraft.utils import make_executable
+from charmcraft.utils import (
+    get_host_architecture,
+    link_or_copy,
+    load_yaml,
+    make_executable,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -53,16 +83,78 @@ logger = logging.getLogger(__name__)
 BUILD_DIRNAME = "build"
 VENV_DIRNAME = "venv"
 
+# The record of what was linked in the build directory, used for incremental builds
+BUILD_STATE_FILENAME = ".charmcraft-build-state.json"
+
+# The files tracked by git in the project, listed in the host for the instances (in
+# the project's build directory)
+GIT_FILES_FILENAME = ".charmcraft-git-files"
+
 # The file name and template for the dispatch script
 DISPATCH_FILENAME = "dispatch"
 # If Juju doesn't support the dispatch mechanism, it will execute the
 # hook, and we'd need sys.argv[0] to be the name of the hook but it's
 # geting lost by calling this dispatch, so we fake JUJU_DISPATCH_PATH
 # to be the value it would've otherwise been.
-DISPATCH_CONTENT = """#!/bin/sh
+DISPATCH_CONTENT = (
+    "#!/bin/sh\n"
+    "\n"
+    'JUJU_DISPATCH_PATH="${{JUJU_DISPATCH_PATH:-$0}}" PYTHONPATH={pythonpath} '
+    "./{entrypoint_relative_path}\n"
+)
+DISPATCH_PYTHONPATH = "lib:venv"
+
+# The formats in which the virtualenv can be included in the charm: as a directory,
+# as a single zip importable archive (plus what can't be imported from it), or
+# outside the charm in an archive that is uploaded as a charm resource
+VENV_FORMATS = ("dir", "zip", "resource")
+VENV_ZIP_FILENAME = "venv.zip"
+
+# The charm resource holding the virtualenv, and how it's unpacked in the unit: the
+# first hook that needs a specific content unpacks it out of the charm directory
+# (so it survives charm upgrades that don't change the dependencies)
+VENV_RESOURCE_NAME = "venv"
+VENV_RESOURCE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# the archives written next to the charms (see `handle_venv_resource`)
+VENV_RESOURCE_ARCHIVE_PATTERN = re.compile(r".+\.venv-[0-9a-f]{12}\.zip")
+VENV_RESOURCE_DISPATCH_CONTENT = (
+    "#!/bin/sh\n"
+    "\n"
+    'VENV_DIR="$(dirname "$PWD")/.charm-venv-{sha256}"\n'
+    'if [ ! -d "$VENV_DIR" ]; then\n'
+    '    VENV_ARCHIVE="$(resource-get {resource_name})" || exit 1\n'
+    '    if ! echo "{sha256}  $VENV_ARCHIVE" | sha256sum --check --status; then\n'
+    '        echo "The {resource_name!r} resource is not the one built for this charm" >&2\n'
+    "        exit 1\n"
+    "    fi\n"
+    '    rm -rf "$VENV_DIR.partial"\n'
+    '    python3 -m zipfile -e "$VENV_ARCHIVE" "$VENV_DIR.partial" || exit 1\n'
+    '    mv "$VENV_DIR.partial" "$VENV_DIR"\n'
+    "fi\n"
+    "\n"
+    'JUJU_DISPATCH_PATH="${{JUJU_DISPATCH_PATH:-$0}}" PYTHONPATH=lib:"$VENV_DIR" '
+    "./{entrypoint_relative_path}\n"
+)
 
-JUJU_DISPATCH_PATH="${{JUJU_DISPATCH_PATH:-$0}}" PYTHONPATH=lib:venv ./{entrypoint_relative_path}
-"""
+# The Python version and the glibc minor version of the bases whose binary wheels
+# can be downloaded from the host, and how their architectures are named in the
+# wheels' platform tags
+WHEELHOUSE_BASES = {
+    ("ubuntu", "18.04"): ("3.6", 27),
+    ("ubuntu", "20.04"): ("3.8", 31),
+    ("ubuntu", "22.04"): ("3.10", 35),
+}
+WHEEL_ARCHITECTURES = {
+    "amd64": "x86_64",
+    "arm64": "aarch64",
+    "armhf": "armv7l",
+    "ppc64el": "ppc64le",
+    "riscv64": "riscv64",
+    "s390x": "s390x",
+}
+
+# Files that can not be imported from a zip (native extensions and libraries)
+NATIVE_SUFFIXES = (".so", ".pyd", ".dll", ".dylib")
 
 # The minimum set of hooks to be provided for compatibility with old Juju
 MANDATORY_HOOK_NAMES = {"install", "start", "upgrade-charm"}
@@ -97,6 +189,25 @@ def format_charm_file_name(
     return "_".join([charm_name, _format_bases_config(bases_config)]) + ".charm"
 
 
+def get_wheelhouse_dirpath(base_name: str, channel: str, architecture: str):
+    """Return the directory of the wheels downloaded in the host for the given base."""
+    return get_cache_dirpath() / "wheelhouse" / f"{base_name}-{channel}-{architecture}"
+
+
+def get_wheel_platforms(glibc_minor: int, architecture: str) -> List[str]:
+    """Return the platform tags of the wheels that can be installed in a base.
+
+    Those are the manylinux ones for all the glibc versions up to the base's one,
+    including their legacy aliases.
+    """
+    arch = WHEEL_ARCHITECTURES[architecture]
+    platforms = [f"manylinux_2_{minor}_{arch}" for minor in range(glibc_minor, 16, -1)]
+    platforms.append(f"manylinux2014_{arch}")
+    if arch == "x86_64":
+        platforms.extend([f"manylinux2010_{arch}", f"manylinux1_{arch}"])
+    return platforms
+
+
 def _pip_needs_system():
     """Determine whether pip3 defaults to --user, needing --system to turn it off."""
     cmd = [
@@ -111,6 +222,30 @@ def _pip_needs_system():
     return proc.returncode == 0
 
 
+def _get_python_version():
+    """Get the version of the Python used by pip3 to install the dependencies."""
+    proc = subprocess.run(
+        ["python3", "--version"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    return proc.stdout.strip()
+
+
+def _get_python_cache_tag():
+    """Get the tag of the pycs generated by the Python that runs the charm."""
+    proc = subprocess.run(
+        ["python3", "-c", "import sys; print(sys.implementation.cache_tag)"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    if proc.returncode:
+        return None
+    return proc.stdout.strip()
+
+
 def polite_exec(cmd):
     """Execute a command, only showing output if error."""
     logger.debug("Running external command %s", cmd)
@@ -139,6 +274,37 @@ def relativise(src, dst):
     return pathlib.Path(os.path.relpath(str(dst), str(src.parent)))
 
 
+class StreamedCharmView:
+    """The content of a charm that is packed directly from the project.
+
+    It behaves like the charm's base directory for the linters: joining it with
+    a relative path gives the real path of that file, which is the generated one
+    in the build directory if present, or the one in the project.
+
+    :param charmdir: the project directory.
+    :param buildpath: the build directory, holding the generated content.
+    :param overlay: the files added or replaced in the project's content, with
+        their real path.
+    """
+
+    def __init__(self, charmdir, buildpath, overlay):
+        self.charmdir = charmdir
+        self.buildpath = buildpath
+        self.overlay = overlay
+
+    def __truediv__(self, relpath):
+        relpath = pathlib.PurePath(os.path.normpath(str(relpath))).as_posix()
+        if relpath in self.overlay:
+            return self.overlay[relpath]
+        if relpath.split("/")[0] == VENV_DIRNAME:
+            return self.buildpath / relpath
+        return self.charmdir / relpath
+
+    def __str__(self):
+        # stable between builds, as it identifies the charm (e.g. for the analysis cache)
+        return str(self.buildpath)
+
+
 class Builder:
     """The package builder."""
 
@@ -146,8 +312,33 @@ class Builder:
         self.charmdir = args["from"]
         self.entrypoint = args["entrypoint"]
         self.requirement_paths = args["requirement"]
+        self.incremental = args.get("incremental", False)
+        self.cache_dependencies = args.get("cache_dependencies", False)
+        self.wheel_store = args.get("wheel_store", False)
+        self.lock_requirements = args.get("lock_requirements", False)
+        self.host_wheelhouse = args.get("host_wheelhouse", False)
+        self.git_files = args.get("git_files", False)
+        self.cache_analysis = args.get("cache_analysis", False)
+        self.jobs = args.get("jobs") or 1
+        self.stream = args.get("stream", False)
+        self.compression = args.get("compression") or "default"
+        self.repack = args.get("repack", False)
+        self.force = args.get("force", False)
+        self.overlay = args.get("overlay", False)
+        self.precompile = args.get("precompile", False)
+        self.venv_format = args.get("venv_format") or "dir"
 
         self.buildpath = self.charmdir / BUILD_DIRNAME
+        bases_indices = args.get("bases_indices")
+        if is_charmcraft_running_in_managed_mode() and bases_indices:
+            # the project is shared by all the instances, that may be packing at the
+            # same time (see `jobs`), so each one uses its own build directory (the
+            # first bases index is different for each instance)
+            self.buildpath = self.buildpath / f"bases-{bases_indices[0]}"
+        self._previous_build_state = {}
+        self._build_state = {}
+        # what is needed to package again the last build, for other bases
+        self._shared_build = None
         self.ignore_rules = self._load_juju_ignore()
         self.config = config
         self.metadata = parse_metadata_yaml(self.charmdir)
@@ -161,17 +352,64 @@ class Builder:
         """
         logger.debug("Building charm in %r", str(self.buildpath))
 
-        if self.buildpath.exists():
-            shutil.rmtree(str(self.buildpath))
-        self.buildpath.mkdir()
-
-        linked_entrypoint = self.handle_generic_paths()
-        self.handle_dispatcher(linked_entrypoint)
+        if self.incremental and not self.stream and not self.overlay:
+            self.prepare_incremental_buildpath()
+        else:
+            if self.buildpath.exists():
+                shutil.rmtree(str(self.buildpath))
+            self.buildpath.mkdir(parents=True)
+
+        overlay_dirpath = None
+        if self.overlay and not self.stream:
+            overlay_dirpath = self.mount_overlay()
+        try:
+            return self._build_charm(bases_config, overlay_dirpath is not None)
+        finally:
+            if overlay_dirpath is not None:
+                self.unmount_overlay(overlay_dirpath)
+
+    def _build_charm(self, bases_config: BasesConfiguration, overlaid: bool) -> str:
+        """Build the charm once the build directory is ready.
+
+        :param overlaid: if the build directory is an overlay mount of the project.
+        """
+        # the project is walked only once, everything else uses this index
+        file_index = self.build_file_index()
+        if self.stream:
+            # the build directory only holds what is generated, the project's files
+            # are packed directly from their place
+            charm_files = self.collect_project_files(file_index)
+            overlay = self.handle_streamed_dispatcher(charm_files)
+            if "manifest.yaml" in charm_files:
+                raise CommandError(
+                    "Cannot write the manifest as there is already a 'manifest.yaml' in disk."
+                )
+            charm_view = StreamedCharmView(self.charmdir, self.buildpath, overlay)
+        else:
+            if overlaid:
+                # the project is already there, the ignored files are left out
+                # when packing as they are not in the index
+                linked_entrypoint = self.buildpath / self.entrypoint.relative_to(
+                    self.charmdir
+                )
+            else:
+                linked_entrypoint = self.handle_generic_paths(file_index)
+            self.handle_dispatcher(linked_entrypoint)
+            charm_files = self.collect_project_files(file_index, warn=False)
+            charm_view = self.buildpath
         self.handle_dependencies()
+        self.handle_venv_prune()
+        self.handle_tree_shaking()
+        generated = self.handle_precompile(charm_files) if self.precompile else {}
 
         linting_results = []
         # run linters, present them to the user according to their type, and fail if necessary
-        linting_results = linters.analyze(self.config, self.buildpath)
+        analysis_cache = None
+        if self.cache_analysis:
+            analysis_cache = AnalysisCache(get_cache_dirpath() / "analysis")
+        linting_results = linters.analyze(
+            self.config, charm_view, metadata=self.metadata, cache=analysis_cache
+        )
         for result in linting_results:
             if (
                 result.check_type == linters.CheckType.attribute
@@ -187,14 +425,59 @@ class Builder:
                 )
             # XXX Facundo 2021-07-09: support for other check types will be
             # added in the next branches
-        create_manifest(
+
+        # after the linters, as they inspect the venv directory
+        venv_resource = None
+        if self.venv_format == "zip":
+            generated.update(self.handle_venv_zip())
+        elif self.venv_format == "resource":
+            replaced, venv_resource = self.handle_venv_resource(
+                charm_files, bases_config
+            )
+            generated.update(replaced)
+
+        manifest_path = create_manifest(
             self.buildpath,
             self.config.project.started_at,
             bases_config,
             linting_results,
+            fingerprint=self.get_fingerprint(bases_config, file_index),
+            venv_resource=venv_resource,
         )
 
-        zipname = self.handle_package(bases_config)
+        if self.stream:
+            overlay.update(generated)
+            overlay[manifest_path.name] = manifest_path
+            members = self._merge_members(charm_files, overlay)
+        else:
+            members = self.get_build_members(charm_files, generated)
+        zipname = self.handle_package(bases_config, members)
+        logger.info("Created '%s'.", zipname)
+
+        # the tree can't be shared if it was an overlay (it's unmounted after the
+        # build), or if the venv resource was named after these bases
+        if not overlaid and self.venv_format != "resource":
+            self._shared_build = (members, linting_results, file_index)
+        return zipname
+
+    def repackage_charm(self, bases_config: BasesConfiguration) -> str:
+        """Package the last built tree again, for other bases configuration.
+
+        Everything built in the same environment is the same for all the bases
+        configurations but the manifest, so only that is written again.
+
+        :returns: File name of charm.
+        """
+        members, linting_results, file_index = self._shared_build
+        (self.buildpath / "manifest.yaml").unlink()
+        create_manifest(
+            self.buildpath,
+            self.config.project.started_at,
+            bases_config,
+            linting_results,
+            fingerprint=self.get_fingerprint(bases_config, file_index),
+        )
+        zipname = self.handle_package(bases_config, members)
         logger.info("Created '%s'.", zipname)
         return zipname
 
@@ -208,9 +491,20 @@ class Builder:
         each base configuration that is incompatible.  Error if unable to
         produce any builds for any bases configuration.
 
-        :returns: List of charm files created.
+        The build tree is shared by all the bases configurations built in the same
+        environment, so after the first build the rest are only packaged again.
+        When using providers, the bases configurations with the same build-on base
+        are packed together in one instance.
+
+        When using providers and more than one job is allowed, the different
+        instances are run concurrently.
+
+        :returns: List of charm files created, in the same order than the bases.
         """
-        charms: List[str] = []
+        charms: Dict[int, str] = {}
+        pending_packs = []
+        packs_by_build_on = {}
+        self._shared_build = None
 
         managed_mode = is_charmcraft_running_in_managed_mode()
         if not managed_mode and not destructive_mode:
@@ -219,6 +513,9 @@ class Builder:
         if not (self.charmdir / "charmcraft.yaml").exists():
             notify_deprecation("dn02")
 
+        if self.host_wheelhouse and self.requirement_paths and not managed_mode:
+            self.prepare_wheelhouses(bases_indices, destructive_mode)
+
         for bases_index, bases_config in enumerate(self.config.bases):
             if bases_indices and bases_index not in bases_indices:
                 logger.debug(
@@ -227,6 +524,19 @@ class Builder:
                 )
                 continue
 
+            # the instance is not even launched if the charm is already there and
+            # nothing that affects it changed
+            if not managed_mode and not self.force:
+                charm_name = format_charm_file_name(self.metadata.name, bases_config)
+                if self.is_charm_up_to_date(charm_name, bases_config):
+                    logger.info(
+                        "Skipping 'bases[%d]': charm %r is up to date.",
+                        bases_index,
+                        charm_name,
+                    )
+                    charms[bases_index] = charm_name
+                    continue
+
             for build_on_index, build_on in enumerate(bases_config.build_on):
                 if managed_mode or destructive_mode:
                     matches, reason = check_if_base_matches_host(build_on)
@@ -240,15 +550,28 @@ class Builder:
                         build_on_index,
                     )
                     if managed_mode or destructive_mode:
-                        charm_name = self.build_charm(bases_config)
-                    else:
-                        charm_name = self.pack_charm_in_instance(
-                            bases_index=bases_index,
-                            build_on=build_on,
-                            build_on_index=build_on_index,
+                        if self._shared_build is None:
+                            charms[bases_index] = self.build_charm(bases_config)
+                        else:
+                            logger.debug(
+                                "Reusing the build tree for 'bases[%d]'.", bases_index
+                            )
+                            charms[bases_index] = self.repackage_charm(bases_config)
+                        break
+
+                    build_on_key = _format_run_on_base(build_on)
+                    if build_on_key in packs_by_build_on:
+                        shared_pack = packs_by_build_on[build_on_key]
+                        logger.debug(
+                            "Packing 'bases[%d]' in the same instance than 'bases[%d]'.",
+                            bases_index,
+                            shared_pack[0],
                         )
-
-                    charms.append(charm_name)
+                        shared_pack[3].append(bases_index)
+                    else:
+                        pack = (bases_index, build_on, build_on_index, [])
+                        packs_by_build_on[build_on_key] = pack
+                        pending_packs.append(pack)
                     break
                 else:
                     logger.info(
@@ -263,17 +586,318 @@ class Builder:
                     bases_index,
                 )
 
+        if self.jobs > 1 and pending_packs:
+            packed = self._pack_charms_in_parallel(pending_packs)
+        else:
+            packed = [
+                self.pack_charm_in_instance(
+                    bases_index=bases_index,
+                    build_on=build_on,
+                    build_on_index=build_on_index,
+                    shared_bases_indices=shared_bases_indices,
+                )
+                for bases_index, build_on, build_on_index, shared_bases_indices in (
+                    pending_packs
+                )
+            ]
+        for (bases_index, _, _, shared_bases_indices), charm_name in zip(
+            pending_packs, packed
+        ):
+            charms[bases_index] = charm_name
+            for shared_index in shared_bases_indices:
+                charms[shared_index] = format_charm_file_name(
+                    self.metadata.name, self.config.bases[shared_index]
+                )
+
         if not charms:
             raise CommandError(
                 "No suitable 'build-on' environment found in any 'bases' configuration."
             )
 
+        return [charms[bases_index] for bases_index in sorted(charms)]
+
+    def get_fingerprint(
+        self, bases_config: BasesConfiguration, file_index: Optional[FileIndex] = None
+    ) -> str:
+        """Get the fingerprint of everything that affects the charm for the given bases.
+
+        It covers the charmcraft version, the bases configuration, the entrypoint,
+        the requirements, the compression, the precompilation, the venv format, and
+        the project's files (the same ones that are included in the charm, but the
+        charms built in the project itself).
+
+        :param file_index: the index of the project; it's built if not given.
+        """
+        fingerprint = Fingerprint()
+        fingerprint.add("charmcraft", __version__)
+        fingerprint.add("build-on", *map(_format_run_on_base, bases_config.build_on))
+        fingerprint.add("run-on", *map(_format_run_on_base, bases_config.run_on))
+        fingerprint.add("entrypoint", self.entrypoint.relative_to(self.charmdir))
+        fingerprint.add("compression", self.compression)
+        fingerprint.add("precompile", self.precompile)
+        fingerprint.add("venv-format", self.venv_format)
+        requirement_hashes = hash_files(self.requirement_paths)
+        fingerprint.add("requirements", *(x.hex() for x in requirement_hashes))
+
+        entries = []
+        files = []
+        for entry in self._walk_project(file_index):
+            abs_path = self.charmdir / entry.relpath
+            if entry.kind == FILE:
+                if "/" not in entry.relpath and (
+                    entry.relpath.endswith((".charm", ".part"))
+                    or VENV_RESOURCE_ARCHIVE_PATTERN.fullmatch(entry.relpath)
+                ):
+                    continue
+                files.append((entry.relpath, stat.S_IMODE(entry.mode), abs_path))
+            elif entry.kind == SYMLINK:
+                entries.append((entry.relpath, entry.kind, os.readlink(str(abs_path))))
+            else:
+                entries.append((entry.relpath, entry.kind, entry.mode))
+        file_hashes = hash_files(abs_path for _, _, abs_path in files)
+        for (rel_path, mode, _), file_hash in zip(files, file_hashes):
+            entries.append((rel_path, "file", mode, file_hash.hex()))
+
+        for entry in sorted(entries):
+            fingerprint.add(*entry)
+        return fingerprint.hexdigest()
+
+    def is_charm_up_to_date(
+        self, charm_name: str, bases_config: BasesConfiguration
+    ) -> bool:
+        """Tell if the charm was already built with the same fingerprint."""
+        charm_path = pathlib.Path.cwd() / charm_name
+        if not charm_path.exists():
+            return False
+        previous = read_fingerprint(charm_path)
+        if previous is None:
+            return False
+        current = self.get_fingerprint(bases_config)
+        logger.debug(
+            "Fingerprint for %r: previous %s, current %s", charm_name, previous, current
+        )
+        if previous != current:
+            return False
+        venv_resource = read_venv_resource(charm_path)
+        if venv_resource is not None:
+            # the charm is useless without its venv
+            resource_path = charm_path.with_name(venv_resource["filename"])
+            if not resource_path.exists():
+                logger.debug("Missing the venv resource %r", resource_path.name)
+                return False
+        return True
+
+    def prepare_wheelhouses(
+        self, bases_indices: Optional[List[int]], destructive_mode: bool
+    ) -> None:
+        """Download in the host the wheels for all the bases that will be built on.
+
+        The wheels for each base are downloaded concurrently, targeting its Python
+        version and platform, so the network heavy part is done only once and
+        outside the instances, which then install offline from these wheelhouses
+        (they are in the host's cache, which is shared with the instances).
+        """
+        targets = set()
+        for bases_index, bases_config in enumerate(self.config.bases):
+            if bases_indices and bases_index not in bases_indices:
+                continue
+            for build_on in bases_config.build_on:
+                if destructive_mode:
+                    matches, _ = check_if_base_matches_host(build_on)
+                else:
+                    matches, _ = is_base_providable(build_on)
+                if matches:
+                    # the instances run in the host's architecture
+                    targets.add((build_on.name, build_on.channel))
+                    break
+
+        architecture = get_host_architecture()
+        with ThreadPoolExecutor(max_workers=max(len(targets), 1)) as executor:
+            futures = [
+                executor.submit(
+                    self._download_wheelhouse, base_name, channel, architecture
+                )
+                for base_name, channel in sorted(targets)
+            ]
+        for future in futures:
+            future.result()
+
+    def _download_wheelhouse(
+        self, base_name: str, channel: str, architecture: str
+    ) -> None:
+        """Download the binary wheels of the requirements for the given base.
+
+        If that is not possible (the base is not known, or some requirement has no
+        binary wheel for it) the wheelhouse is not left, and the dependencies are
+        installed normally inside the instance.
+        """
+        base_id = f"{base_name}-{channel}-{architecture}"
+        try:
+            python_version, glibc_minor = WHEELHOUSE_BASES[(base_name, channel)]
+            platforms = get_wheel_platforms(glibc_minor, architecture)
+        except KeyError:
+            logger.warning("Cannot download the wheels in the host for %r.", base_id)
+            return
+
+        wheelhouse = get_wheelhouse_dirpath(base_name, channel, architecture)
+        wheelhouse.mkdir(parents=True, exist_ok=True)
+        abi = "cp" + python_version.replace(".", "")
+        cmd = [
+            "pip3",
+            "download",
+            "--dest={}".format(wheelhouse),
+            "--only-binary=:all:",
+            "--python-version={}".format(python_version),
+            "--implementation=cp",
+            "--abi={}".format(abi),
+            "--abi=abi3",
+            "--abi=none",
+        ]
+        cmd.extend("--platform={}".format(platform) for platform in platforms)
+        for reqspath in self.requirement_paths:
+            cmd.append("--requirement={}".format(reqspath))
+        logger.debug("Downloading the wheels in the host for %r", base_id)
+        retcode = polite_exec(cmd)
+        if retcode:
+            logger.warning(
+                "Cannot download the wheels in the host for %r, they will be "
+                "installed in the instance.",
+                base_id,
+            )
+            shutil.rmtree(str(wheelhouse))
+
+    def get_index_args(self) -> List[str]:
+        """Return the pip arguments to use the host's wheelhouse instead of the index.
+
+        That happens only if it was prepared for the base being built.
+        """
+        if not self.host_wheelhouse:
+            return []
+        host_base = get_host_as_base()
+        wheelhouse = get_wheelhouse_dirpath(
+            host_base.name, host_base.channel, host_base.architectures[0]
+        )
+        if not wheelhouse.is_dir():
+            logger.debug("No wheelhouse prepared in the host in %r", str(wheelhouse))
+            return []
+        logger.debug("Installing the dependencies from the host's wheelhouse")
+        return ["--no-index", "--find-links={}".format(wheelhouse)]
+
+    def _pack_charms_in_parallel(self, pending_packs) -> List[str]:
+        """Pack the charms in their instances concurrently, according to the jobs limit.
+
+        All the packs are run even if some of them fail, and all the problems are
+        reported together at the end.
+
+        :returns: List of charm files created, in the same order than requested.
+        """
+        logger.debug(
+            "Packing %d charms using up to %d jobs.", len(pending_packs), self.jobs
+        )
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [
+                executor.submit(
+                    self.pack_charm_in_instance,
+                    bases_index=bases_index,
+                    build_on=build_on,
+                    build_on_index=build_on_index,
+                    shared_bases_indices=shared_bases_indices,
+                )
+                for bases_index, build_on, build_on_index, shared_bases_indices in (
+                    pending_packs
+                )
+            ]
+
+        charms = []
+        errors = []
+        for (bases_index, _, _, _), future in zip(pending_packs, futures):
+            try:
+                charms.append(future.result())
+            except Exception as error:
+                logger.debug("Packing for 'bases[%d]' failed: %r", bases_index, error)
+                errors.append(f"- bases[{bases_index}]: {error}")
+
+        if errors:
+            raise CommandError(
+                f"Failed to build {len(errors)} of {len(pending_packs)} charms:\n"
+                + "\n".join(errors)
+            )
         return charms
 
+    def _execute_run_prefixed(self, instance, cmd, *, cwd, prefix):
+        """Run the command in the instance, logging its output with the given prefix.
+
+        :raises subprocess.CalledProcessError: if the command failed.
+        """
+        proc = instance.execute_popen(
+            cmd,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        )
+        for line in proc.stdout:
+            logger.info("[%s] %s", prefix, line.rstrip())
+        retcode = proc.wait()
+        if retcode:
+            raise subprocess.CalledProcessError(retcode, cmd)
+
+    def _pull_charm_atomically(self, instance, source, destination):
+        """Pull the charm from the instance, never leaving a partial file in its final place."""
+        partial_destination = destination.with_name(destination.name + ".part")
+        instance.pull_file(source=source, destination=partial_destination)
+        os.replace(str(partial_destination), str(destination))
+
+    def _pull_charm(self, instance, instance_output_dir, charm_name):
+        """Pull a charm packed in the instance, and its venv resource if any."""
+        cwd = pathlib.Path.cwd()
+        try:
+            if self.jobs > 1:
+                self._pull_charm_atomically(
+                    instance,
+                    source=instance_output_dir / charm_name,
+                    destination=cwd / charm_name,
+                )
+            else:
+                instance.pull_file(
+                    source=instance_output_dir / charm_name,
+                    destination=cwd / charm_name,
+                )
+        except FileNotFoundError as error:
+            raise CommandError(
+                "Unexpected error retrieving charm from instance."
+            ) from error
+
+        # the venv resource, if any, was written next to the charm
+        venv_resource = read_venv_resource(cwd / charm_name)
+        if venv_resource is not None:
+            resource_name = venv_resource["filename"]
+            try:
+                self._pull_charm_atomically(
+                    instance,
+                    source=instance_output_dir / resource_name,
+                    destination=cwd / resource_name,
+                )
+            except FileNotFoundError as error:
+                raise CommandError(
+                    "Unexpected error retrieving the venv resource from instance."
+                ) from error
+
     def pack_charm_in_instance(
-        self, *, bases_index: int, build_on: Base, build_on_index: int
+        self,
+        *,
+        bases_index: int,
+        build_on: Base,
+        build_on_index: int,
+        shared_bases_indices: Sequence[int] = (),
     ) -> str:
-        """Pack instance in Charm."""
+        """Pack instance in Charm.
+
+        :param shared_bases_indices: other bases configurations to pack in the same
+            instance, sharing the build.
+
+        :returns: File name of the charm for the main bases configuration.
+        """
         charm_name = format_charm_file_name(
             self.metadata.name, self.config.bases[bases_index]
         )
@@ -292,12 +916,43 @@ class Builder:
             pull_charm = True
 
         cmd = ["charmcraft", "pack", "--bases-index", str(bases_index)]
+        for shared_index in shared_bases_indices:
+            cmd.extend(["--bases-index", str(shared_index)])
+        if self.incremental:
+            cmd.append("--incremental")
+        if self.cache_dependencies:
+            cmd.append("--cache-dependencies")
+        if self.wheel_store:
+            cmd.append("--wheel-store")
+        if self.lock_requirements:
+            cmd.append("--lock-requirements")
+        if self.host_wheelhouse:
+            cmd.append("--host-wheelhouse")
+        if self.git_files:
+            cmd.append("--git-files")
+        if self.cache_analysis:
+            cmd.append("--cache-analysis")
+        if self.stream:
+            cmd.append("--stream")
+        if self.compression != "default":
+            cmd.extend(["--compression", self.compression])
+        if self.repack:
+            cmd.append("--repack")
+        if self.overlay:
+            cmd.append("--overlay")
+        if self.precompile:
+            cmd.append("--precompile")
+        if self.venv_format != "dir":
+            cmd.extend(["--venv-format", self.venv_format])
 
         if message_handler.mode == message_handler.VERBOSE:
             cmd.append("--verbose")
         elif message_handler.mode == message_handler.QUIET:
             cmd.append("--quiet")
 
+        if self.git_files:
+            self.save_git_files()
+
         logger.info(f"Packing charm {charm_name!r}...")
         with launched_environment(
             charm_name=self.metadata.name,
@@ -306,12 +961,35 @@ class Builder:
             bases_index=bases_index,
             build_on_index=build_on_index,
         ) as instance:
-            try:
-                instance.execute_run(
-                    cmd,
-                    check=True,
-                    cwd=instance_output_dir.as_posix(),
+            if (
+                self.cache_dependencies
+                or self.wheel_store
+                or self.lock_requirements
+                or self.host_wheelhouse
+                or self.cache_analysis
+            ):
+                # share the host's cache with the instance
+                cache_dirpath = get_cache_dirpath()
+                cache_dirpath.mkdir(parents=True, exist_ok=True)
+                instance.mount(
+                    host_source=cache_dirpath,
+                    target=get_managed_environment_cache_path(),
                 )
+
+            try:
+                if self.jobs > 1:
+                    self._execute_run_prefixed(
+                        instance,
+                        cmd,
+                        cwd=instance_output_dir.as_posix(),
+                        prefix=f"bases[{bases_index}]",
+                    )
+                else:
+                    instance.execute_run(
+                        cmd,
+                        check=True,
+                        cwd=instance_output_dir.as_posix(),
+                    )
             except subprocess.CalledProcessError as error:
                 capture_logs_from_instance(instance)
                 raise CommandError(
@@ -319,18 +997,101 @@ class Builder:
                 ) from error
 
             if pull_charm:
-                try:
-                    instance.pull_file(
-                        source=instance_output_dir / charm_name,
-                        destination=cwd / charm_name,
+                for pulled_index in [bases_index, *shared_bases_indices]:
+                    self._pull_charm(
+                        instance,
+                        instance_output_dir,
+                        format_charm_file_name(
+                            self.metadata.name, self.config.bases[pulled_index]
+                        ),
                     )
-                except FileNotFoundError as error:
-                    raise CommandError(
-                        "Unexpected error retrieving charm from instance."
-                    ) from error
 
         return charm_name
 
+    def mount_overlay(self) -> Optional[pathlib.Path]:
+        """Mount the build directory as an overlay with the project as its lower layer.
+
+        Everything generated in the build directory (dispatch, hooks, venv, manifest)
+        goes to the upper layer, which lives in a temporary directory, so the project
+        is never touched and nothing needs to be linked.
+
+        :returns: the temporary directory holding the upper layer, or None if the
+            overlay could not be mounted (then the build directory stays as a plain
+            directory, to be filled the usual way).
+        """
+        lowerdir = str(self.charmdir)
+        if any(char in lowerdir for char in ",:\\"):
+            logger.debug(
+                "Cannot use an overlay for the build: unsupported project path"
+            )
+            return None
+
+        overlay_dirpath = pathlib.Path(tempfile.mkdtemp(prefix="charmcraft-overlay-"))
+        upperdir = overlay_dirpath / "upper"
+        workdir = overlay_dirpath / "work"
+        upperdir.mkdir()
+        workdir.mkdir()
+        options = f"lowerdir={lowerdir},upperdir={upperdir},workdir={workdir}"
+        cmd = ["mount", "-t", "overlay", "overlay", "-o", options, str(self.buildpath)]
+        try:
+            self._hide_ignored_paths(upperdir)
+            subprocess.run(
+                cmd,
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+            )
+        except (OSError, subprocess.CalledProcessError) as exc:
+            logger.debug("Cannot use an overlay for the build, linking files: %r", exc)
+            shutil.rmtree(str(overlay_dirpath))
+            return None
+
+        logger.debug("Build directory mounted as an overlay of the project")
+        return overlay_dirpath
+
+    def _hide_ignored_paths(self, upperdir: pathlib.Path) -> None:
+        """Hide the project's ignored paths that the build would find in the overlay.
+
+        What is generated in the build directory (the venv, dispatch, the hooks and
+        the manifest) is explored to be packed, so ignored paths in the project (e.g.
+        the developer's own virtualenv in `venv`) must not show through: they are
+        covered with whiteouts in the upper layer, as if they were not linked.
+        """
+
+        def whiteout(relpath):
+            logger.debug("Hiding ignored path in the overlay: %r", relpath)
+            os.mknod(str(upperdir / relpath), stat.S_IFCHR, os.makedev(0, 0))
+
+        for entry in os.scandir(str(self.charmdir)):
+            is_dir = entry.is_dir()
+            if self.ignore_rules.match(entry.name, is_dir=is_dir):
+                whiteout(entry.name)
+            elif entry.name == HOOKS_DIR and is_dir:
+                for hook_entry in os.scandir(entry.path):
+                    relpath = f"{HOOKS_DIR}/{hook_entry.name}"
+                    if self.ignore_rules.match(relpath, is_dir=hook_entry.is_dir()):
+                        (upperdir / HOOKS_DIR).mkdir(exist_ok=True)
+                        whiteout(relpath)
+
+    def unmount_overlay(self, overlay_dirpath: pathlib.Path) -> None:
+        """Unmount the build directory overlay and remove its upper layer."""
+        try:
+            subprocess.run(
+                ["umount", str(self.buildpath)],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                universal_newlines=True,
+            )
+        except (OSError, subprocess.CalledProcessError) as exc:
+            # leave the upper layer in place, it's still in use
+            logger.warning(
+                "Cannot unmount the build directory %r: %r", str(self.buildpath), exc
+            )
+            return
+        shutil.rmtree(str(overlay_dirpath))
+
     def _load_juju_ignore(self):
         ignore = JujuIgnore(default_juju_ignore)
         path = self.charmdir / ".jujuignore"
@@ -339,23 +1100,252 @@ class Builder:
                 ignore.extend_patterns(ignores)
         return ignore
 
+    def _load_build_state(self):
+        """Load the record of what was linked in the build directory by a previous build.
+
+        Return an empty record if there is no previous build or it can not be used.
+        """
+        state_path = self.buildpath / BUILD_STATE_FILENAME
+        try:
+            with state_path.open("rt", encoding="utf8") as fh:
+                state = json.load(fh)
+        except (OSError, ValueError) as exc:
+            logger.debug("Cannot use previous build state: %r", exc)
+            return {}
+        if not isinstance(state, dict) or state.get("charmdir") != str(self.charmdir):
+            logger.debug("Previous build state is for another project, ignoring it")
+            return {}
+        return state.get("entries", {})
+
+    def _save_build_state(self):
+        """Save the record of what was linked in the build directory."""
+        state = {"charmdir": str(self.charmdir), "entries": self._build_state}
+        state_path = self.buildpath / BUILD_STATE_FILENAME
+        with state_path.open("wt", encoding="utf8") as fh:
+            json.dump(state, fh)
+
+    def _remove_from_buildpath(self, dest_path):
+        """Remove whatever is in the build directory in the given path (if anything)."""
+        if dest_path.is_symlink() or not dest_path.is_dir():
+            if os.path.lexists(str(dest_path)):
+                dest_path.unlink()
+        else:
+            shutil.rmtree(str(dest_path))
+
+    def prepare_incremental_buildpath(self):
+        """Prepare the build directory reusing what was linked in a previous build.
+
+        Everything that was generated by the previous build (dispatch, hooks, venv,
+        manifest, etc.) is removed, as it will be generated again; what was linked
+        from the project is kept and later verified by `handle_generic_paths`.
+        """
+        self._previous_build_state = self._load_build_state()
+        if not self._previous_build_state:
+            logger.debug("Building from scratch as there is no previous build state")
+            if self.buildpath.exists():
+                shutil.rmtree(str(self.buildpath))
+            self.buildpath.mkdir(parents=True)
+            return
+
+        logger.debug("Reusing previous build state for an incremental build")
+        for basedir, dirnames, filenames in os.walk(
+            str(self.buildpath), followlinks=False
+        ):
+            abs_basedir = pathlib.Path(basedir)
+            rel_basedir = abs_basedir.relative_to(self.buildpath)
+
+            generated = []
+            for pos, name in enumerate(dirnames):
+                rel_path = str(rel_basedir / name)
+                if rel_path not in self._previous_build_state:
+                    generated.append(pos)
+                    self._remove_from_buildpath(abs_basedir / name)
+            for pos in reversed(generated):
+                del dirnames[pos]
+
+            for name in filenames:
+                rel_path = str(rel_basedir / name)
+                if rel_path != BUILD_STATE_FILENAME and (
+                    rel_path not in self._previous_build_state
+                ):
+                    (abs_basedir / name).unlink()
+
+    def _is_still_linked(self, rel_path, entry_state):
+        """Tell if an entry from the previous build can be reused as is."""
+        if self._previous_build_state.get(str(rel_path)) != entry_state:
+            return False
+        return os.path.lexists(str(self.buildpath / rel_path))
+
     def create_symlink(self, src_path, dest_path):
         """Create a symlink in dest_path pointing relatively like src_path.
 
         It also verifies that the linked dir or file is inside the project.
         """
+        resolved_path = self._resolve_internal_symlink(src_path)
+        if resolved_path is None:
+            return
+
+        relative_link = relativise(src_path, resolved_path)
+        if self.incremental:
+            rel_path = dest_path.relative_to(self.buildpath)
+            entry_state = ["symlink", str(relative_link)]
+            self._build_state[str(rel_path)] = entry_state
+            if self._is_still_linked(rel_path, entry_state) and os.readlink(
+                str(dest_path)
+            ) == str(relative_link):
+                return
+            self._remove_from_buildpath(dest_path)
+        dest_path.symlink_to(relative_link)
+
+    def _resolve_internal_symlink(self, src_path, warn=True):
+        """Return where the symlink points to, if it's inside the project; else None."""
         resolved_path = src_path.resolve()
         if self.charmdir in resolved_path.parents:
-            relative_link = relativise(src_path, resolved_path)
-            dest_path.symlink_to(relative_link)
-        else:
+            return resolved_path
+
+        if warn:
             rel_path = src_path.relative_to(self.charmdir)
             logger.warning(
                 "Ignoring symlink because targets outside the project: %r",
                 str(rel_path),
             )
+        return None
+
+    def _create_directory(self, entry, dest_path):
+        """Create a directory in the build dir with the same permissions than in the project."""
+        mode = entry.mode
+        if self.incremental:
+            entry_state = ["dir", mode]
+            self._build_state[entry.relpath] = entry_state
+            if self._is_still_linked(entry.relpath, entry_state):
+                return
+            # start again from an empty directory, anything inside will be linked later
+            self._remove_from_buildpath(dest_path)
+        dest_path.mkdir(mode=mode)
+
+    def _link_file(self, src_path, dest_path, entry):
+        """Hard link the file in the build dir, copying it if that's not possible."""
+        if self.incremental:
+            entry_state = ["file", entry.inode, entry.mtime_ns, entry.size, entry.mode]
+            self._build_state[entry.relpath] = entry_state
+            if self._is_still_linked(entry.relpath, entry_state):
+                return
+            self._remove_from_buildpath(dest_path)
+
+        link_or_copy(src_path, dest_path)
+
+    def _remove_stale_entries(self):
+        """Remove what was linked in the previous build but is not part of this one."""
+        stale = set(self._previous_build_state) - set(self._build_state)
+        # deepest first, so directories are removed after their content
+        for rel_path in sorted(stale, reverse=True):
+            if self._is_under_symlink(rel_path):
+                # its parent was replaced in this build, so it's already gone (and
+                # the path now points to what is inside the symlinked directory)
+                continue
+            logger.debug("Removing stale path from previous build: %r", rel_path)
+            self._remove_from_buildpath(self.buildpath / rel_path)
+
+    def _is_under_symlink(self, rel_path):
+        """Tell if any parent of the path in the build directory is a symlink."""
+        parent = self.buildpath
+        for part in pathlib.PurePath(rel_path).parts[:-1]:
+            parent = parent / part
+            try:
+                if stat.S_ISLNK(os.lstat(str(parent)).st_mode):
+                    return True
+            except FileNotFoundError:
+                return False
+        return False
+
+    def save_git_files(self) -> None:
+        """List the files tracked by git in the project, for the instance to use them.
+
+        Inside the instance git usually can't be used on the project (it's not
+        installed, or it refuses the mounted directory because of its owner), so the
+        list is written in the project's build directory (if the project is in a git
+        working tree) to be read from there.
+        """
+        git_files_path = self.charmdir / BUILD_DIRNAME / GIT_FILES_FILENAME
+        git_files = get_git_files(self.charmdir)
+        if git_files is None:
+            if git_files_path.exists():
+                git_files_path.unlink()
+            return
+
+        git_files_path.parent.mkdir(parents=True, exist_ok=True)
+        # written aside and then moved, so other instances never see a partial list
+        fd, tmp_name = tempfile.mkstemp(dir=str(git_files_path.parent), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(b"\0".join(os.fsencode(relpath) for relpath in git_files))
+        os.replace(tmp_name, str(git_files_path))
+
+    def _get_git_files(self) -> Optional[List[str]]:
+        """Get the files tracked by git in the project (see `save_git_files`)."""
+        if not is_charmcraft_running_in_managed_mode():
+            return get_git_files(self.charmdir)
+
+        git_files_path = self.charmdir / BUILD_DIRNAME / GIT_FILES_FILENAME
+        try:
+            content = git_files_path.read_bytes()
+        except FileNotFoundError:
+            logger.debug("The files tracked by git were not listed in the host")
+            return None
+        return [os.fsdecode(relpath) for relpath in content.split(b"\0") if relpath]
+
+    def build_file_index(self) -> FileIndex:
+        """Index the project in a single walk, skipping what is ignored by the rules.
+
+        If configured, only the files tracked by git are indexed (if the project is
+        in a git working tree), so the rest of the project is not even walked.
+        """
+
+        def skip(relpath, is_dir):
+            if VENV_RESOURCE_ARCHIVE_PATTERN.fullmatch(relpath) and not is_dir:
+                # from previous builds, never part of the charm
+                logger.debug("Ignoring venv resource archive: %r", relpath)
+                return True
+            if not self.ignore_rules.match(relpath, is_dir=is_dir):
+                return False
+            if is_dir:
+                logger.debug("Ignoring directory because of rules: %r", relpath)
+            else:
+                logger.debug("Ignoring file because of rules: %r", relpath)
+            return True
+
+        def prune(relpath):
+            if self.ignore_rules.can_keep_under(relpath):
+                return False
+            logger.debug(
+                "Ignoring the content of directory because of rules: %r", relpath
+            )
+            return True
+
+        if self.git_files:
+            git_files = self._get_git_files()
+            if git_files is not None:
+                logger.debug("Indexing the %d files tracked by git", len(git_files))
+                return FileIndex.build_from_paths(
+                    self.charmdir, git_files, skip=skip, prune=prune
+                )
+        return FileIndex.build(self.charmdir, skip=skip, prune=prune)
+
+    def _walk_project(self, file_index=None):
+        """Iterate the project entries that need to be included in the charm.
 
-    def handle_generic_paths(self):
+        Entries of other types than directories, files and symlinks are ignored.
+
+        :param file_index: the index of the project; it's built if not given.
+        """
+        if file_index is None:
+            file_index = self.build_file_index()
+        for entry in file_index:
+            if entry.kind == OTHER:
+                logger.debug("Ignoring file because of type: %r", entry.relpath)
+            else:
+                yield entry
+
+    def handle_generic_paths(self, file_index=None):
         """Handle all files and dirs except what's ignored and what will be handled later.
 
         Works differently for the different file types:
@@ -363,64 +1353,130 @@ class Builder:
         - directories: created
         - symlinks: respected if are internal to the project
         - other types (blocks, mount points, etc): ignored
+
+        In incremental mode, what is still valid from the previous build is kept, and
+        a record of what was linked is saved for the next build.
+
+        :param file_index: the index of the project; it's built if not given.
         """
         logger.debug("Linking in generic paths")
 
-        for basedir, dirnames, filenames in os.walk(
-            str(self.charmdir), followlinks=False
-        ):
-            abs_basedir = pathlib.Path(basedir)
-            rel_basedir = abs_basedir.relative_to(self.charmdir)
+        for entry in self._walk_project(file_index):
+            src_path = self.charmdir / entry.relpath
+            dest_path = self.buildpath / entry.relpath
+            if entry.kind == SYMLINK:
+                self.create_symlink(src_path, dest_path)
+            elif entry.kind == DIR:
+                self._create_directory(entry, dest_path)
+            else:
+                self._link_file(src_path, dest_path, entry)
 
-            # process the directories
-            ignored = []
-            for pos, name in enumerate(dirnames):
-                rel_path = rel_basedir / name
-                abs_path = abs_basedir / name
+        if self.incremental:
+            self._remove_stale_entries()
+            self._save_build_state()
 
-                if self.ignore_rules.match(str(rel_path), is_dir=True):
-                    logger.debug(
-                        "Ignoring directory because of rules: %r", str(rel_path)
+        # the linked entrypoint is calculated here because it's when it's really in the build dir
+        linked_entrypoint = self.buildpath / self.entrypoint.relative_to(self.charmdir)
+        return linked_entrypoint
+
+    def collect_project_files(self, file_index=None, *, warn=True):
+        """Collect the project files to include in the charm, without linking them.
+
+        Internal symlinks are expanded to the files they point to (as it happens
+        when packing a build directory), and the rest is handled like in
+        `handle_generic_paths`.
+
+        :param file_index: the index of the project; it's built if not given.
+        :param warn: if warn about the symlinks pointing outside the project.
+        :returns: a dict with the path inside the charm of each file, and the real
+            path of that file in the project.
+        """
+        logger.debug("Collecting generic paths")
+
+        files = {}
+        symlinks = {}
+        for entry in self._walk_project(file_index):
+            abs_path = self.charmdir / entry.relpath
+            if entry.kind == FILE:
+                files[entry.relpath] = abs_path
+            elif entry.kind == SYMLINK:
+                resolved_path = self._resolve_internal_symlink(abs_path, warn=warn)
+                if resolved_path is not None:
+                    target = resolved_path.relative_to(self.charmdir).as_posix()
+                    symlinks[entry.relpath] = target
+
+        charm_files = dict(files)
+
+        def expand(link_path, target, seen):
+            """Include what's in the target (file or directory) under the link path."""
+            if target in files:
+                charm_files[link_path] = files[target]
+                return
+            prefix = target + "/"
+            for path, real_path in files.items():
+                if path.startswith(prefix):
+                    charm_files[link_path + path[len(prefix) - 1 :]] = real_path
+            for path, sub_target in symlinks.items():
+                if path.startswith(prefix):
+                    if path in seen:
+                        logger.debug("Ignoring symlink because of loop: %r", path)
+                        continue
+                    expand(
+                        link_path + path[len(prefix) - 1 :], sub_target, seen | {path}
                     )
-                    ignored.append(pos)
-                elif abs_path.is_symlink():
-                    dest_path = self.buildpath / rel_path
-                    self.create_symlink(abs_path, dest_path)
-                else:
-                    dest_path = self.buildpath / rel_path
-                    dest_path.mkdir(mode=abs_path.stat().st_mode)
 
-            # in the future don't go inside ignored directories
-            for pos in reversed(ignored):
-                del dirnames[pos]
+        for link_path, target in symlinks.items():
+            expand(link_path, target, {link_path})
+        return charm_files
 
-            # process the files
-            for name in filenames:
-                rel_path = rel_basedir / name
-                abs_path = abs_basedir / name
-
-                if self.ignore_rules.match(str(rel_path), is_dir=False):
-                    logger.debug("Ignoring file because of rules: %r", str(rel_path))
-                elif abs_path.is_symlink():
-                    dest_path = self.buildpath / rel_path
-                    self.create_symlink(abs_path, dest_path)
-                elif abs_path.is_file():
-                    dest_path = self.buildpath / rel_path
-                    try:
-                        os.link(str(abs_path), str(dest_path))
-                    except PermissionError:
-                        # when not allowed to create hard links
-                        shutil.copy2(str(abs_path), str(dest_path))
-                    except OSError as e:
-                        if e.errno != errno.EXDEV:
-                            raise
-                        shutil.copy2(str(abs_path), str(dest_path))
-                else:
-                    logger.debug("Ignoring file because of type: %r", str(rel_path))
+    def handle_streamed_dispatcher(self, charm_files):
+        """Handle modern and classic dispatch mechanisms when streaming the charm.
 
-        # the linked entrypoint is calculated here because it's when it's really in the build dir
-        linked_entrypoint = self.buildpath / self.entrypoint.relative_to(self.charmdir)
-        return linked_entrypoint
+        Same logic than `handle_dispatcher`, but the generated dispatch script (if
+        needed) is the only file written in the build directory; the hooks are just
+        pointed to it.
+
+        :returns: a dict with the path inside the charm and real path of each file
+            that is added or replaced in the project's content.
+        """
+        overlay = {}
+        dispatch_path = charm_files.get(DISPATCH_FILENAME)
+        if dispatch_path is None:
+            logger.debug("Creating the dispatch mechanism")
+            dispatch_path = self.buildpath / DISPATCH_FILENAME
+            dispatch_content = DISPATCH_CONTENT.format(
+                entrypoint_relative_path=self.entrypoint.relative_to(self.charmdir),
+                pythonpath=self.get_dispatch_pythonpath(),
+            )
+            with dispatch_path.open("wt", encoding="utf8") as fh:
+                fh.write(dispatch_content)
+                make_executable(fh)
+            overlay[DISPATCH_FILENAME] = dispatch_path
+
+        # replace the included hooks that are pointing directly to the entrypoint, and
+        # include the mandatory ones (if not already there)
+        real_entrypoint = self.entrypoint.resolve()
+        for path, real_path in charm_files.items():
+            dirname, _, hookname = path.rpartition("/")
+            if dirname == HOOKS_DIR and real_path.resolve() == real_entrypoint:
+                logger.debug(
+                    "Replacing existing hook %r as it's a symlink to the entrypoint",
+                    hookname,
+                )
+                overlay[path] = dispatch_path
+        for hookname in MANDATORY_HOOK_NAMES:
+            logger.debug("Creating the %r hook script pointing to dispatch", hookname)
+            hook_path = f"{HOOKS_DIR}/{hookname}"
+            if hook_path not in charm_files:
+                overlay[hook_path] = dispatch_path
+        return overlay
+
+    def get_dispatch_pythonpath(self):
+        """Return the PYTHONPATH set by the dispatch script, according to the venv format."""
+        if self.venv_format == "zip":
+            # what can't be imported from the zip is still in the directory
+            return f"{DISPATCH_PYTHONPATH}:{VENV_ZIP_FILENAME}"
+        return DISPATCH_PYTHONPATH
 
     def handle_dispatcher(self, linked_entrypoint):
         """Handle modern and classic dispatch mechanisms."""
@@ -429,7 +1485,8 @@ class Builder:
         if not dispatch_path.exists():
             logger.debug("Creating the dispatch mechanism")
             dispatch_content = DISPATCH_CONTENT.format(
-                entrypoint_relative_path=linked_entrypoint.relative_to(self.buildpath)
+                entrypoint_relative_path=linked_entrypoint.relative_to(self.buildpath),
+                pythonpath=self.get_dispatch_pythonpath(),
             )
             with dispatch_path.open("wt", encoding="utf8") as fh:
                 fh.write(dispatch_content)
@@ -469,42 +1526,478 @@ class Builder:
 
         # virtualenv with other dependencies (if any)
         if self.requirement_paths:
+            venvpath = self.buildpath / VENV_DIRNAME
+
+            if self.cache_dependencies:
+                cache = DependenciesCache(get_cache_dirpath() / "dependencies")
+                cache_key = cache.get_key(
+                    self.requirement_paths, get_host_as_base(), _get_python_version()
+                )
+                if cache.get(cache_key, venvpath):
+                    return
+
             retcode = polite_exec(["pip3", "list"])
             if retcode:
                 raise CommandError("problems using pip")
 
-            venvpath = self.buildpath / VENV_DIRNAME
+            if self.lock_requirements:
+                # everything is pinned in the lock, no need to resolve anything
+                requirement_args = [
+                    "--no-deps",
+                    "--requirement={}".format(self.get_requirements_lock()),
+                ]
+            else:
+                requirement_args = [
+                    "--requirement={}".format(reqspath)
+                    for reqspath in self.requirement_paths
+                ]
+
+            if self.wheel_store:
+                self._install_from_wheel_store(venvpath, requirement_args)
+            else:
+                self._pip_install(venvpath, requirement_args)
+
+            if self.cache_dependencies and venvpath.exists():
+                cache.store(cache_key, venvpath)
+
+    def get_requirements_lock(self):
+        """Return the path of the lock for the requirements, resolving them if needed.
+
+        The requirements are resolved downloading them with pip, once for each
+        content of the requirement files and target base.
+        """
+        non_index = get_non_index_requirements(self.requirement_paths)
+        if non_index:
+            raise CommandError(
+                "Cannot lock requirements that are not taken from the package index "
+                "(from version control systems, URLs or local paths): {}.".format(
+                    ", ".join(repr(line) for line in non_index)
+                )
+            )
+
+        locks = RequirementsLocks(get_cache_dirpath() / "locks")
+        key = DependenciesCache.get_key(
+            self.requirement_paths, get_host_as_base(), _get_python_version()
+        )
+        lock_path = locks.get(key)
+        if lock_path is not None:
+            return lock_path
+
+        logger.debug("Resolving the requirements to lock them")
+        with tempfile.TemporaryDirectory(prefix="charmcraft-lock-") as tmp_dirpath:
+            cmd = ["pip3", "download", "--dest={}".format(tmp_dirpath)]
+            cmd.extend(self.get_index_args())
+            for reqspath in self.requirement_paths:
+                cmd.append("--requirement={}".format(reqspath))
+            retcode = polite_exec(cmd)
+            if retcode:
+                raise CommandError("problems resolving dependencies")
+            return locks.store(key, build_lock(pathlib.Path(tmp_dirpath)))
+
+    def _pip_install(self, venvpath, requirement_args):
+        """Install the requirements in the venv using pip directly."""
+        cmd = [
+            "pip3",
+            "install",  # base command
+            "--target={}".format(
+                venvpath
+            ),  # put all the resulting files in that specific dir
+        ]
+        if _pip_needs_system():
+            logger.debug("adding --system to work around pip3 defaulting to --user")
+            cmd.append("--system")
+        cmd.extend(self.get_index_args())
+        cmd.extend(requirement_args)  # the dependencies file(s)
+        retcode = polite_exec(cmd)
+        if retcode:
+            raise CommandError("problems installing dependencies")
+
+    def _install_from_wheel_store(self, venvpath, requirement_args):
+        """Install the requirements in the venv linking the wheels unpacked in the store.
+
+        Only the wheels that are not already in the store are downloaded or built.
+        """
+        store = WheelStore(get_cache_dirpath() / "wheels")
+        store.wheels_dirpath.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(
+            dir=str(store.dirpath), prefix=".tmp-"
+        ) as tmp_dirpath:
             cmd = [
                 "pip3",
-                "install",  # base command
-                "--target={}".format(
-                    venvpath
-                ),  # put all the resulting files in that specific dir
+                "wheel",
+                "--wheel-dir={}".format(tmp_dirpath),
+                "--find-links={}".format(store.wheels_dirpath),
             ]
-            if _pip_needs_system():
-                logger.debug("adding --system to work around pip3 defaulting to --user")
-                cmd.append("--system")
-            for reqspath in self.requirement_paths:
-                cmd.append(
-                    "--requirement={}".format(reqspath)
-                )  # the dependencies file(s)
+            cmd.extend(self.get_index_args())
+            cmd.extend(requirement_args)
             retcode = polite_exec(cmd)
             if retcode:
                 raise CommandError("problems installing dependencies")
+            keys = store.add_wheels(pathlib.Path(tmp_dirpath))
+        store.install(keys, venvpath)
+        logger.debug("Installed %d wheels from the store", len(keys))
+
+    def handle_venv_prune(self):
+        """Remove from the venv what is not needed to run the charm.
+
+        What is removed is configured in the 'venv-prune' section of the charm part;
+        nothing is done if that is not configured.
+        """
+        venv_prune = self.config.parts.charm.venv_prune
+        venvpath = self.buildpath / VENV_DIRNAME
+        if venv_prune is None or not venvpath.exists():
+            return
+
+        logger.debug("Pruning the venv")
+        patterns = list(venv_prune.remove)
+        if venv_prune.defaults:
+            patterns.extend(DEFAULT_PRUNE_PATTERNS)
+        report = prune_tree(
+            venvpath,
+            patterns,
+            keep=venv_prune.keep,
+            only_non_packages=DEFAULT_PRUNE_PATTERNS if venv_prune.defaults else (),
+            cache_tag=_get_python_cache_tag() if venv_prune.defaults else None,
+            strip=venv_prune.defaults,
+        )
+
+        total_files = total_size = 0
+        for rule, (files, size) in sorted(report.items()):
+            logger.debug("Pruned by %r: %d files, %d bytes", rule, files, size)
+            total_files += files
+            total_size += size
+        logger.info(
+            "Pruned the venv: %d files removed, %d bytes saved", total_files, total_size
+        )
+
+    def handle_tree_shaking(self):
+        """Remove from the venv the packages that are never imported by the charm.
+
+        The imports are followed from the entrypoint through the charm's sources,
+        its libs and the venv itself; only the venv is trimmed. This is done only
+        if configured in the 'tree-shaking' section of the charm part.
+        """
+        tree_shaking = self.config.parts.charm.tree_shaking
+        venvpath = self.buildpath / VENV_DIRNAME
+        if tree_shaking is None or not venvpath.exists():
+            return
+
+        logger.debug("Removing the venv packages not reachable from the entrypoint")
+        # the same order than in the Python path when the charm runs
+        search_paths = [self.entrypoint.parent, self.charmdir / "lib", venvpath]
+        reachable = get_reachable_modules(
+            self.entrypoint, search_paths, tree_shaking.extra_roots
+        )
+
+        removed = []
+        for name, paths in sorted(get_top_level_modules(venvpath).items()):
+            if name in reachable:
+                continue
+            for path in paths:
+                self._remove_from_buildpath(path)
+            removed.append(name)
+        logger.info(
+            "Removed %d venv packages not reachable from the entrypoint", len(removed)
+        )
+        if removed:
+            logger.debug("Unreachable venv packages: %s", ", ".join(removed))
+
+    def handle_precompile(self, charm_files):
+        """Byte-compile the Python files of the charm, so hooks don't compile them.
 
-    def handle_package(self, bases_config: Optional[BasesConfiguration] = None):
-        """Handle the final package creation."""
+        The files are compiled by the Python that runs the charm, in a pool of
+        processes, into "checked hash" pycs: those are valid as long as the source
+        doesn't change, no matter the timestamps the files get when unpacked.
+
+        When streaming, the project files are not in the build directory, so only
+        the virtualenv is compiled.
+
+        :returns: a dict with the path inside the charm and real path of each pyc
+            generated for the project's files (the virtualenv ones are packed with
+            the rest of it).
+        """
+        python_version = _get_python_version()
+        match = re.match(r"Python (\d+)\.(\d+)", python_version)
+        if match is None or tuple(map(int, match.groups())) < (3, 7):
+            logger.warning(
+                "Cannot precompile Python files: checked hash pycs are not "
+                "supported by %r",
+                python_version,
+            )
+            return {}
+
+        sources = {}
+        if not self.stream:
+            for path in charm_files:
+                if path.endswith(".py"):
+                    dirname, _, filename = path.rpartition("/")
+                    sources.setdefault(dirname, set()).add(filename[:-3])
+        # the top level directories holding Python files, and the loose ones
+        targets = {path.split("/")[0] for path in sources if path}
+        if "" in sources:
+            targets.update(name + ".py" for name in sources[""])
+        if (self.buildpath / VENV_DIRNAME).exists():
+            targets.add(VENV_DIRNAME)
+        if not targets:
+            return {}
+
+        logger.debug("Precompiling Python files")
+        cmd = [
+            "python3",
+            "-m",
+            "compileall",
+            "-q",
+            "-f",  # pip already wrote timestamp pycs, which must be replaced
+            "-j",
+            "0",  # as many processes as CPUs
+            "--invalidation-mode",
+            "checked-hash",
+        ]
+        cmd.extend(str(self.buildpath / target) for target in sorted(targets))
+        retcode = polite_exec(cmd)
+        if retcode:
+            # the files that can't be compiled (e.g. syntax for other Python
+            # versions) will just be compiled when imported, if ever
+            logger.warning("Some Python files could not be precompiled")
+
+        # only the pycs of the included sources are packed (in the directories with
+        # sources, only those are listed)
+        precompiled = {}
+        for dirname, modules in sources.items():
+            rel_cachedir = f"{dirname}/__pycache__" if dirname else "__pycache__"
+            try:
+                names = os.listdir(str(self.buildpath / rel_cachedir))
+            except FileNotFoundError:
+                continue
+            for name in names:
+                if name.endswith(".pyc") and name.split(".")[0] in modules:
+                    arcname = f"{rel_cachedir}/{name}"
+                    precompiled[arcname] = self.buildpath / arcname
+        return precompiled
+
+    def _is_zip_importable(self, path):
+        """Tell if a top level entry of the venv can be imported from a zip."""
+        if path.name == "bin":
+            # scripts, not importable at all
+            return False
+        if not path.is_dir():
+            return not path.name.endswith(NATIVE_SUFFIXES)
+        for dirpath, dirnames, filenames in os.walk(str(path), followlinks=True):
+            for filename in filenames:
+                # also versioned libraries, like 'libfoo.so.1'
+                if filename.endswith(NATIVE_SUFFIXES) or ".so." in filename:
+                    return False
+        return True
+
+    def handle_venv_zip(self):
+        """Pack the venv into a single zip archive, to be imported from there.
+
+        The top level packages and modules that can't be imported from a zip (as
+        they have native extensions) are left unpacked in the venv directory. The
+        pycs (if precompiled) are placed next to their sources, where zipimport
+        finds them.
+
+        :returns: a dict with the path inside the charm and real path of the archive.
+        """
+        venvpath = self.buildpath / VENV_DIRNAME
+        if not venvpath.exists():
+            return {}
+
+        logger.debug("Packing the venv in a zip archive")
+        members = {}
+        zipped = []
+        for path in sorted(venvpath.iterdir()):
+            if not self._is_zip_importable(path):
+                logger.debug(
+                    "Leaving %r unpacked as it's not zip importable", path.name
+                )
+                continue
+            zipped.append(path)
+            if not path.is_dir():
+                members[path.name] = path
+                continue
+            for dirpath, dirnames, filenames in os.walk(str(path), followlinks=True):
+                dirnames.sort()
+                rel_dirpath = pathlib.Path(dirpath).relative_to(venvpath)
+                for filename in sorted(filenames):
+                    if rel_dirpath.name != "__pycache__":
+                        members[(rel_dirpath / filename).as_posix()] = (
+                            pathlib.Path(dirpath) / filename
+                        )
+                        continue
+                    module, _, suffix = filename.partition(".")
+                    if suffix.endswith(".pyc"):
+                        arcname = (rel_dirpath.parent / (module + ".pyc")).as_posix()
+                        members[arcname] = pathlib.Path(dirpath) / filename
+
+        zippath = self.buildpath / VENV_ZIP_FILENAME
+        write_zip(zippath, members, compression=self.compression)
+        for path in zipped:
+            self._remove_from_buildpath(path)
+        logger.debug(
+            "Packed %d files from %d venv entries in %r",
+            len(members),
+            len(zipped),
+            VENV_ZIP_FILENAME,
+        )
+        return {VENV_ZIP_FILENAME: zippath}
+
+    def handle_venv_resource(self, charm_files, bases_config):
+        """Move the venv out of the charm, to an archive uploaded as a charm resource.
+
+        The archive is written next to the charm, named after its content hash. It's
+        built deterministically, so the same dependencies give the same archive and
+        it's only uploaded again when they change. The charm's metadata declares the
+        resource, and its dispatch script unpacks the archive in the unit (once per
+        content) before running the entrypoint.
+
+        :returns: a dict with the path inside the charm and real path of the files
+            replaced in the charm, and the information of the resource for the
+            manifest (None if there is no venv).
+        """
+        venvpath = self.buildpath / VENV_DIRNAME
+        if not venvpath.exists():
+            return {}, None
+
+        if DISPATCH_FILENAME in charm_files:
+            raise CommandError(
+                "Cannot put the venv in a resource as the project provides its own "
+                "dispatch script."
+            )
+        metadata = load_yaml(self.charmdir / "metadata.yaml")
+        resources = metadata.get("resources") or {}
+        if VENV_RESOURCE_NAME in resources:
+            raise CommandError(
+                "Cannot put the venv in a resource as the charm already declares "
+                "a {!r} resource.".format(VENV_RESOURCE_NAME)
+            )
+
+        logger.debug("Packing the venv in the %r resource", VENV_RESOURCE_NAME)
+        members = {}
+        for dirpath, dirnames, filenames in os.walk(str(venvpath), followlinks=True):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                filepath = pathlib.Path(dirpath) / filename
+                members[filepath.relative_to(venvpath).as_posix()] = filepath
+        charm_stem = pathlib.Path(
+            format_charm_file_name(self.metadata.name, bases_config)
+        ).stem
+        partial_path = pathlib.Path(charm_stem + ".venv.zip.part")
+        write_zip(
+            partial_path,
+            members,
+            compression=self.compression,
+            date_time=VENV_RESOURCE_DATE_TIME,
+        )
+        sha256 = hash_file(partial_path).hex()
+        filename = f"{charm_stem}.venv-{sha256[:12]}.zip"
+        os.replace(str(partial_path), filename)
+        self._remove_from_buildpath(venvpath)
+        logger.info("Created '%s' for the %r resource.", filename, VENV_RESOURCE_NAME)
+
+        # declare the resource; the file is written in the build directory (never
+        # through the link to the project's one)
+        resources[VENV_RESOURCE_NAME] = {
+            "type": "file",
+            "filename": VENV_ZIP_FILENAME,
+            "description": "The Python dependencies of the charm.",
+        }
+        metadata["resources"] = resources
+        metadata_path = self.buildpath / "metadata.yaml"
+        self._remove_from_buildpath(metadata_path)
+        if self._build_state.pop("metadata.yaml", None) is not None:
+            # it's not linked anymore, so it's generated again in the next build
+            self._save_build_state()
+        metadata_path.write_text(yaml.safe_dump(metadata, sort_keys=False))
+
+        dispatch_path = self.buildpath / DISPATCH_FILENAME
+        dispatch_content = VENV_RESOURCE_DISPATCH_CONTENT.format(
+            entrypoint_relative_path=self.entrypoint.relative_to(self.charmdir),
+            resource_name=VENV_RESOURCE_NAME,
+            sha256=sha256,
+        )
+        with dispatch_path.open("wt", encoding="utf8") as fh:
+            fh.write(dispatch_content)
+            make_executable(fh)
+
+        venv_resource = {
+            "name": VENV_RESOURCE_NAME,
+            "filename": filename,
+            "sha256": sha256,
+        }
+        return {"metadata.yaml": metadata_path}, venv_resource
+
+    def handle_package(
+        self,
+        bases_config: Optional[BasesConfiguration] = None,
+        members: Optional[Dict[str, pathlib.Path]] = None,
+    ):
+        """Handle the final package creation.
+
+        The package holds everything in the build directory, unless the members
+        are given: the path inside the package of each file, and its real path.
+        """
         logger.debug("Creating the package itself")
         zipname = format_charm_file_name(self.metadata.name, bases_config)
-        zipfh = zipfile.ZipFile(zipname, "w", zipfile.ZIP_DEFLATED)
-        for dirpath, dirnames, filenames in os.walk(self.buildpath, followlinks=True):
+
+        if members is None:
+            members = {}
+            for dirpath, dirnames, filenames in os.walk(
+                self.buildpath, followlinks=True
+            ):
+                dirpath = pathlib.Path(dirpath)
+                for filename in filenames:
+                    filepath = dirpath / filename
+                    if filepath == self.buildpath / BUILD_STATE_FILENAME:
+                        continue
+                    members[str(filepath.relative_to(self.buildpath))] = filepath
+
+        # write the charm in a temporary file, and then move it to its final name, so
+        # a partially written charm is never found in its final place
+        partial_zipname = zipname + ".part"
+        # when repacking, what didn't change is copied from the previous charm
+        previous = pathlib.Path(zipname) if self.repack else None
+        write_zip(
+            partial_zipname,
+            members,
+            compression=self.compression,
+            previous=previous,
+        )
+        os.replace(partial_zipname, zipname)
+        return zipname
+
+    def get_build_members(self, charm_files, generated=None):
+        """Get what is packed from the build directory.
+
+        What was linked from the project is known from its index, so only the
+        generated content needs to be explored.
+
+        :param generated: other files generated in the build directory, with their
+            path inside the charm.
+        """
+        overlay = dict(generated or {})
+        for name in (DISPATCH_FILENAME, "manifest.yaml"):
+            overlay[name] = self.buildpath / name
+        for hook_path in (self.buildpath / HOOKS_DIR).iterdir():
+            arcname = f"{HOOKS_DIR}/{hook_path.name}"
+            if arcname not in charm_files and hook_path.is_file():
+                overlay[arcname] = hook_path
+        linked = {arcname: self.buildpath / arcname for arcname in charm_files}
+        return self._merge_members(linked, overlay)
+
+    def _merge_members(self, charm_files, overlay):
+        """Merge the project files, the generated ones and the venv, sorted to be packed."""
+        members = dict(charm_files)
+        members.update(overlay)
+
+        venvpath = self.buildpath / VENV_DIRNAME
+        for dirpath, dirnames, filenames in os.walk(venvpath, followlinks=True):
             dirpath = pathlib.Path(dirpath)
             for filename in filenames:
                 filepath = dirpath / filename
-                zipfh.write(str(filepath), str(filepath.relative_to(self.buildpath)))
+                members[str(filepath.relative_to(self.buildpath))] = filepath
 
-        zipfh.close()
-        return zipname
+        return {arcname: members[arcname] for arcname in sorted(members)}
 
 
 class Validator:
@@ -513,6 +2006,21 @@ class Validator:
     _options = [
         "from",  # this needs to be processed first, as it's a base dir to find other files
         "destructive_mode",
+        "incremental",
+        "cache_dependencies",
+        "wheel_store",
+        "lock_requirements",
+        "host_wheelhouse",
+        "git_files",
+        "cache_analysis",
+        "jobs",
+        "stream",
+        "compression",
+        "repack",
+        "force",
+        "overlay",
+        "precompile",
+        "venv_format",
         "entrypoint",
         "requirement",
         "bases_indices",
@@ -558,6 +2066,126 @@ class Validator:
 
         return destructive_mode
 
+    def validate_incremental(self, incremental):
+        """Validate that incremental option is valid."""
+        if not isinstance(incremental, bool):
+            return False
+
+        return incremental
+
+    def validate_cache_dependencies(self, cache_dependencies):
+        """Validate that cache dependencies option is valid."""
+        if not isinstance(cache_dependencies, bool):
+            return False
+
+        return cache_dependencies
+
+    def validate_wheel_store(self, wheel_store):
+        """Validate that wheel store option is valid."""
+        if not isinstance(wheel_store, bool):
+            return False
+
+        return wheel_store
+
+    def validate_lock_requirements(self, lock_requirements):
+        """Validate that lock requirements option is valid."""
+        if not isinstance(lock_requirements, bool):
+            return False
+
+        return lock_requirements
+
+    def validate_host_wheelhouse(self, host_wheelhouse):
+        """Validate that host wheelhouse option is valid."""
+        if not isinstance(host_wheelhouse, bool):
+            return False
+
+        return host_wheelhouse
+
+    def validate_git_files(self, git_files):
+        """Validate that git files option is valid."""
+        if not isinstance(git_files, bool):
+            return False
+        return git_files
+
+    def validate_cache_analysis(self, cache_analysis):
+        """Validate that cache analysis option is valid."""
+        if not isinstance(cache_analysis, bool):
+            return False
+        return cache_analysis
+
+    def validate_jobs(self, jobs):
+        """Validate that the number of jobs is valid."""
+        if jobs is None:
+            return 1
+
+        if jobs < 1:
+            raise CommandError(f"Jobs number '{jobs}' is invalid (must be >= 1).")
+
+        return jobs
+
+    def validate_stream(self, stream):
+        """Validate that stream option is valid."""
+        if not isinstance(stream, bool):
+            return False
+
+        return stream
+
+    def validate_compression(self, compression):
+        """Validate that the compression level is valid."""
+        if compression is None:
+            return "default"
+
+        if compression not in COMPRESSION_LEVELS:
+            raise CommandError(
+                "Compression level {!r} is invalid (must be one of {}).".format(
+                    compression, ", ".join(COMPRESSION_LEVELS)
+                )
+            )
+
+        return compression
+
+    def validate_repack(self, repack):
+        """Validate that repack option is valid."""
+        if not isinstance(repack, bool):
+            return False
+
+        return repack
+
+    def validate_force(self, force):
+        """Validate that force option is valid."""
+        if not isinstance(force, bool):
+            return False
+
+        return force
+
+    def validate_overlay(self, overlay):
+        """Validate that overlay option is valid."""
+        if not isinstance(overlay, bool):
+            return False
+
+        return overlay
+
+    def validate_precompile(self, precompile):
+        """Validate that precompile option is valid."""
+        if not isinstance(precompile, bool):
+            return False
+
+        return precompile
+
+    def validate_venv_format(self, venv_format):
+        """Validate that the venv format is valid."""
+        if venv_format is None:
+            return "dir"
+
+        if venv_format not in VENV_FORMATS:
+            raise CommandError(
+                "Venv format {!r} is invalid (must be one of {}).".format(
+                    venv_format, ", ".join(VENV_FORMATS)
+                )
+            )
+
+        return venv_format
+
     def validate_from(self, dirpath):
         """Validate that the charm dir is there and yes, a directory."""
         if dirpath is None:
@@ -17,9 +17,9 @@
 """Infrastructure for the 'pack' command."""
 
 import logging
-import zipfile
 from argparse import Namespace
 
+from charmcraft.archive import COMPRESSION_LEVELS, write_zip
 from charmcraft.cmdbase import BaseCommand, CommandError
 from charmcraft.commands import build
 from charmcraft.manifest import create_manifest
@@ -33,10 +33,8 @@ MANDATORY_FILES = {"bundle.yaml", "manifest.yaml", "README.md"}
 
 def build_zip(zippath, basedir, fpaths):
     """Build the final file."""
-    zipfh = zipfile.ZipFile(zippath, "w", zipfile.ZIP_DEFLATED)
-    for fpath in fpaths:
-        zipfh.write(fpath, fpath.relative_to(basedir))
-    zipfh.close()
+    members = {str(fpath.relative_to(basedir)): fpath for fpath in fpaths}
+    write_zip(zippath, members)
 
 
 def get_paths_to_include(config):
@@ -103,6 +101,119 @@ class PackCommand(BaseCommand):
                 "changes to system configuration"
             ),
         )
+        parser.add_argument(
+            "--incremental",
+            action="store_true",
+            help=(
+                "Reuse what is still valid from the previous build directory instead "
+                "of building it from scratch"
+            ),
+        )
+        parser.add_argument(
+            "--cache-dependencies",
+            action="store_true",
+            help=(
+                "Reuse the installed dependencies from a persistent cache when the "
+                "requirements did not change"
+            ),
+        )
+        parser.add_argument(
+            "--wheel-store",
+            action="store_true",
+            help=(
+                "Install the dependencies linking them from a store of unpacked "
+                "wheels shared by all projects, only getting the missing ones"
+            ),
+        )
+        parser.add_argument(
+            "--lock-requirements",
+            action="store_true",
+            help=(
+                "Resolve the requirements only when they change (for each base), "
+                "and install them from the pinned and hash-checked result"
+            ),
+        )
+        parser.add_argument(
+            "--host-wheelhouse",
+            action="store_true",
+            help=(
+                "Download the binary wheels for all the bases in the host, to "
+                "install the dependencies offline inside each instance"
+            ),
+        )
+        parser.add_argument(
+            "--git-files",
+            action="store_true",
+            help=(
+                "Take the project files from the git index instead of walking the "
+                "project directory (untracked files are not included)"
+            ),
+        )
+        parser.add_argument(
+            "--cache-analysis",
+            action="store_true",
+            help=(
+                "Reuse the results of the analysis checkers while the files they "
+                "inspect don't change"
+            ),
+        )
+        parser.add_argument(
+            "--stream",
+            action="store_true",
+            help=(
+                "Pack the project files directly, without linking them in the "
+                "build directory first"
+            ),
+        )
+        parser.add_argument(
+            "--compression",
+            choices=list(COMPRESSION_LEVELS),
+            help=(
+                "How much to compress the charm: 'none' is the fastest, 'max' "
+                "produces the smallest files; defaults to 'default'"
+            ),
+        )
+        parser.add_argument(
+            "--repack",
+            action="store_true",
+            help=(
+                "Reuse the unchanged files already compressed in the previous "
+                "charm instead of compressing them again"
+            ),
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help=(
+                "Build the charm even if it is already there and nothing that "
+                "affects it changed"
+            ),
+        )
+        parser.add_argument(
+            "--overlay",
+            action="store_true",
+            help=(
+                "Mount the build directory as an overlay of the project instead "
+                "of linking its files, if the system allows it"
+            ),
+        )
+        parser.add_argument(
+            "--precompile",
+            action="store_true",
+            help=(
+                "Byte-compile the charm's Python files, so hooks don't need to "
+                "compile them when they start"
+            ),
+        )
+        parser.add_argument(
+            "--venv-format",
+            choices=list(build.VENV_FORMATS),
+            help=(
+                "How to include the virtualenv in the charm: 'zip' packs what can "
+                "be imported from an archive in a single file, 'resource' moves it "
+                "to a separate archive to upload as a charm resource; defaults to 'dir'"
+            ),
+        )
         parser.add_argument(
             "-e",
             "--entrypoint",
@@ -128,6 +239,13 @@ class PackCommand(BaseCommand):
             help="Index of 'bases' configuration to build (can be used multiple "
             "times); defaults to all",
         )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            help="Number of 'bases' configurations to build concurrently, each in "
+            "its own instance; defaults to 1",
+        )
 
     def run(self, parsed_args):
         """Run the command."""
@@ -151,10 +269,25 @@ class PackCommand(BaseCommand):
         build_args = Namespace(
             **{
                 "destructive_mode": parsed_args.destructive_mode,
+                "incremental": parsed_args.incremental,
+                "cache_dependencies": parsed_args.cache_dependencies,
+                "wheel_store": parsed_args.wheel_store,
+                "lock_requirements": parsed_args.lock_requirements,
+                "host_wheelhouse": parsed_args.host_wheelhouse,
+                "git_files": parsed_args.git_files,
+                "cache_analysis": parsed_args.cache_analysis,
                 "from": self.config.project.dirpath,
                 "entrypoint": parsed_args.entrypoint,
                 "requirement": parsed_args.requirement,
                 "bases_indices": parsed_args.bases_index,
+                "jobs": parsed_args.jobs,
+                "stream": parsed_args.stream,
+                "compression": parsed_args.compression,
+                "repack": parsed_args.repack,
+                "force": parsed_args.force,
+                "overlay": parsed_args.overlay,
+                "precompile": parsed_args.precompile,
+                "venv_format": parsed_args.venv_format,
             }
         )
 
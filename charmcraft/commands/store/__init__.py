@@ -32,6 +32,7 @@ from humanize import naturalsize
 from tabulate import tabulate
 
 from charmcraft.cmdbase import BaseCommand, CommandError
+from charmcraft.manifest import read_venv_resource
 from charmcraft.utils import (
     ResourceOption,
     SingleOptionEnsurer,
@@ -343,6 +344,10 @@ class UploadCommand(BaseCommand):
         will report details of the failure, otherwise it will give you the
         new charm or bundle revision.
 
+        If the charm was packed with its virtualenv in a resource, that
+        resource is also uploaded (only if its content is not already in
+        Charmhub), and attached to the charm when releasing it.
+
         Upload will take you through login if needed.
     """
     )
@@ -381,6 +386,48 @@ class UploadCommand(BaseCommand):
                 "command: {}".format(", ".join(tainted_filenames))
             )
 
+    def _upload_venv_resource(self, store, charm_name, charm_path, venv_resource):
+        """Upload the resource with the charm's venv, if Charmhub doesn't have it yet.
+
+        :returns: the resource revision to attach to the charm, or None if the
+            upload failed.
+        """
+        resource_name = venv_resource["name"]
+        for revision in store.list_resource_revisions(charm_name, resource_name):
+            if revision.sha256 == venv_resource["sha256"]:
+                logger.info(
+                    "Reusing revision %s of resource %r, which has the same content",
+                    revision.revision,
+                    resource_name,
+                )
+                return revision.revision
+
+        resource_path = charm_path.parent / venv_resource["filename"]
+        if not resource_path.exists():
+            raise CommandError(
+                "Cannot find the file {!r} for the resource {!r} next to the "
+                "charm.".format(venv_resource["filename"], resource_name)
+            )
+        result = store.upload_resource(
+            charm_name, resource_name, ResourceType.file, resource_path
+        )
+        if not result.ok:
+            logger.info(
+                "Upload of resource %r failed with status %r:",
+                resource_name,
+                result.status,
+            )
+            for error in result.errors:
+                logger.info("- %s: %s", error.code, error.message)
+            return None
+        logger.info(
+            "Revision %s created of resource %r for charm %r",
+            result.revision,
+            resource_name,
+            charm_name,
+        )
+        return result.revision
+
     def run(self, parsed_args):
         """Run the command."""
         name = get_name_from_zip(parsed_args.filepath)
@@ -389,9 +436,22 @@ class UploadCommand(BaseCommand):
         result = store.upload(name, parsed_args.filepath)
         if result.ok:
             logger.info("Revision %s of %r created", result.revision, str(name))
+
+            resources = []
+            venv_resource = read_venv_resource(parsed_args.filepath)
+            if venv_resource is not None:
+                resource_revision = self._upload_venv_resource(
+                    store, name, parsed_args.filepath, venv_resource
+                )
+                if resource_revision is None:
+                    return
+                resources.append(
+                    ResourceOption(venv_resource["name"], resource_revision)
+                )
+
             if parsed_args.release:
                 # also release!
-                store.release(name, result.revision, parsed_args.release)
+                store.release(name, result.revision, parsed_args.release, resources)
                 logger.info("Revision released to %s", ", ".join(parsed_args.release))
         else:
             logger.info("Upload failed with status %r:", result.status)
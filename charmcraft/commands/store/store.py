@@ -41,7 +41,7 @@ Library = namedtuple(
     "Library", "api content content_hash lib_id lib_name charm_name patch"
 )
 Resource = namedtuple("Resource", "name optional revision resource_type")
-ResourceRevision = namedtuple("ResourceRevision", "revision created_at size")
+ResourceRevision = namedtuple("ResourceRevision", "revision created_at size sha256")
 RegistryCredentials = namedtuple("RegistryCredentials", "image_name username password")
 Base = namedtuple("Base", "architecture channel name")
 
@@ -77,6 +77,7 @@ def _build_resource_revision(item):
         revision=item["revision"],
         created_at=parser.parse(item["created-at"]),
         size=item["size"],
+        sha256=item["sha256"],
     )
     return rev
 
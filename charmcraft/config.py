@@ -32,6 +32,13 @@ charmhub:
 parts:
   bundle:
     prime: [list of strings]
+  charm:
+    venv-prune: optional, to remove what is not needed from the installed venv
+      defaults: [boolean] apply the default rules, defaults to true
+      remove: [list of glob patterns] to remove, relative to the venv
+      keep: [list of glob patterns] to never remove, relative to the venv
+    tree-shaking: optional, to remove the venv packages not imported by the charm
+      extra-roots: [list of module names] imported dynamically, to always keep
 
 bases: [list of bases and/or long-form base configurations]
 
@@ -245,10 +252,38 @@ class Part(ModelConfigDefaults):
     prime: List[RelativePath] = []
 
 
+class VenvPrune(ModelConfigDefaults):
+    """Definition of how the venv is pruned after installing the dependencies."""
+
+    defaults: bool = True
+    remove: List[pydantic.StrictStr] = []
+    keep: List[pydantic.StrictStr] = []
+
+
+class TreeShaking(
+    ModelConfigDefaults,
+    alias_generator=lambda s: s.replace("_", "-"),
+):
+    """Definition of how the venv packages not imported by the charm are removed."""
+
+    extra_roots: List[pydantic.StrictStr] = []
+
+
+class CharmPart(
+    ModelConfigDefaults,
+    alias_generator=lambda s: s.replace("_", "-"),
+):
+    """Definition of the charm part."""
+
+    venv_prune: Optional[VenvPrune] = None
+    tree_shaking: Optional[TreeShaking] = None
+
+
 class Parts(ModelConfigDefaults):
     """Definition of parts to build."""
 
     bundle: Part = Part()
+    charm: CharmPart = CharmPart()
 
     def get(self, part_name) -> Part:
         """Get part by name.
@@ -259,6 +294,8 @@ class Parts(ModelConfigDefaults):
         """
         if part_name == "bundle":
             return self.bundle
+        if part_name == "charm":
+            return self.charm
         raise KeyError(part_name)
 
 
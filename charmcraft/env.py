@@ -30,6 +30,11 @@ def get_managed_environment_home_path():
     return pathlib.Path("/root")
 
 
+def get_managed_environment_cache_path():
+    """Path for charmcraft cache when running in managed environment."""
+    return get_managed_environment_home_path() / "cache"
+
+
 def get_managed_environment_log_path():
     """Path for charmcraft log when running in managed environment."""
     return pathlib.Path("/tmp/charmcraft.log")
@@ -0,0 +1,213 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+"""An index of the files in a directory tree, built walking it only once."""
+
+import array
+import logging
+import os
+import pathlib
+import stat
+import subprocess
+from collections import namedtuple
+from typing import Callable, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# the different kinds of entries
+DIR = "dir"
+FILE = "file"
+SYMLINK = "symlink"
+OTHER = "other"  # blocks, sockets, etc.
+_KINDS = (DIR, FILE, SYMLINK, OTHER)
+_KIND_CODES = {kind: code for code, kind in enumerate(_KINDS)}
+
+FileEntry = namedtuple("FileEntry", "relpath kind mode size mtime_ns inode")
+
+
+class FileIndex:
+    """A compact index of the entries in a directory tree.
+
+    The information of the entries is kept in parallel arrays (instead of one object
+    per entry) to keep it small for trees with lots of files. For each entry it
+    holds the path relative to the tree's base directory, its kind (see `_KINDS`),
+    and its mode, size, modification time and inode (without following symlinks).
+
+    :param basedir: the base directory of the tree.
+    """
+
+    def __init__(self, basedir: pathlib.Path):
+        self.basedir = basedir
+        self._relpaths = []
+        self._kinds = array.array("B")
+        self._modes = array.array("L")
+        self._sizes = array.array("Q")
+        self._mtimes = array.array("q")
+        self._inodes = array.array("Q")
+
+    @classmethod
+    def build(
+        cls,
+        basedir: pathlib.Path,
+        skip: Optional[Callable[[str, bool], bool]] = None,
+        prune: Optional[Callable[[str], bool]] = None,
+    ) -> "FileIndex":
+        """Build the index walking the tree in basedir with `os.scandir`.
+
+        The entries in each directory are indexed sorted by name, and always after the
+        directory itself. The walk doesn't go inside skipped or symlinked directories.
+
+        :param skip: a function that receives the relative path of each entry and if
+            it's a directory (following symlinks), and returns True if the entry must
+            not be included.
+        :param prune: a function that receives the relative path of each included
+            directory, and returns True if its content must not be walked.
+        """
+        index = cls(basedir)
+        pending = [""]
+        while pending:
+            rel_dirpath = pending.pop()
+            with os.scandir(os.path.join(str(basedir), rel_dirpath)) as dir_iterator:
+                dir_entries = sorted(dir_iterator, key=lambda entry: entry.name)
+
+            subdirs = []
+            for dir_entry in dir_entries:
+                relpath = os.path.join(rel_dirpath, dir_entry.name)
+                if skip is not None and skip(relpath, dir_entry.is_dir()):
+                    continue
+
+                if dir_entry.is_symlink():
+                    kind = SYMLINK
+                elif dir_entry.is_dir(follow_symlinks=False):
+                    kind = DIR
+                    if prune is None or not prune(relpath):
+                        subdirs.append(relpath)
+                elif dir_entry.is_file(follow_symlinks=False):
+                    kind = FILE
+                else:
+                    kind = OTHER
+                index._append(relpath, kind, dir_entry.stat(follow_symlinks=False))
+
+            # in reverse, so they are walked in order
+            pending.extend(reversed(subdirs))
+        return index
+
+    @classmethod
+    def build_from_paths(
+        cls,
+        basedir: pathlib.Path,
+        relpaths: Iterable[str],
+        skip: Optional[Callable[[str, bool], bool]] = None,
+        prune: Optional[Callable[[str], bool]] = None,
+    ) -> "FileIndex":
+        """Build the index for the given files of the tree in basedir, without walking it.
+
+        The directories are indexed from the paths of the files in them, and the
+        entries are in the same order than when walking the tree (see `build`). The
+        paths that are not in disk are left out.
+
+        :param relpaths: the paths of the files, relative to basedir and using '/'.
+        :param skip: the same than in `build`.
+        :param prune: the same than in `build`.
+        """
+        tree = {}
+        for relpath in relpaths:
+            node = tree
+            for part in relpath.split("/"):
+                node = node.setdefault(part, {})
+
+        index = cls(basedir)
+        pending = [("", tree)]
+        while pending:
+            rel_dirpath, node = pending.pop()
+
+            subdirs = []
+            for name in sorted(node):
+                relpath = os.path.join(rel_dirpath, name)
+                abs_path = os.path.join(str(basedir), relpath)
+                try:
+                    stat_result = os.lstat(abs_path)
+                except OSError:
+                    continue
+                if stat.S_ISLNK(stat_result.st_mode):
+                    kind = SYMLINK
+                    is_dir = os.path.isdir(abs_path)
+                elif stat.S_ISDIR(stat_result.st_mode):
+                    kind = DIR
+                    is_dir = True
+                elif stat.S_ISREG(stat_result.st_mode):
+                    kind = FILE
+                    is_dir = False
+                else:
+                    kind = OTHER
+                    is_dir = False
+                if skip is not None and skip(relpath, is_dir):
+                    continue
+
+                if kind == DIR and (prune is None or not prune(relpath)):
+                    subdirs.append((relpath, node[name]))
+                index._append(relpath, kind, stat_result)
+
+            # in reverse, so they are walked in order
+            pending.extend(reversed(subdirs))
+        return index
+
+    def _append(self, relpath: str, kind: str, stat_result: os.stat_result) -> None:
+        """Add an entry to the index."""
+        self._relpaths.append(relpath)
+        self._kinds.append(_KIND_CODES[kind])
+        self._modes.append(stat_result.st_mode)
+        self._sizes.append(stat_result.st_size)
+        self._mtimes.append(stat_result.st_mtime_ns)
+        self._inodes.append(stat_result.st_ino)
+
+    def __len__(self) -> int:
+        return len(self._relpaths)
+
+    def __iter__(self) -> Iterator[FileEntry]:
+        for pos, relpath in enumerate(self._relpaths):
+            yield FileEntry(
+                relpath,
+                _KINDS[self._kinds[pos]],
+                self._modes[pos],
+                self._sizes[pos],
+                self._mtimes[pos],
+                self._inodes[pos],
+            )
+
+
+def get_git_files(basedir: pathlib.Path) -> Optional[List[str]]:
+    """Get the files tracked by git in the tree (from its index), without walking it.
+
+    The paths are relative to basedir (which may be a subdirectory of the working
+    tree), and include the files of the submodules.
+
+    :returns: None if the tree is not in a git working tree, or git is not available.
+    """
+    cmd = ["git", "ls-files", "-z", "--cached", "--recurse-submodules"]
+    try:
+        proc = subprocess.run(
+            cmd, cwd=str(basedir), stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+    except FileNotFoundError:
+        logger.debug("Cannot list the files from git: git not available")
+        return None
+    if proc.returncode:
+        logger.debug(
+            "Cannot list the files from git: %s", os.fsdecode(proc.stderr).strip()
+        )
+        return None
+    return [os.fsdecode(relpath) for relpath in proc.stdout.split(b"\0") if relpath]
@@ -0,0 +1,86 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+"""Fingerprints of everything that affects a build, to avoid repeating it."""
+
+import hashlib
+import logging
+import mmap
+import os
+import pathlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+# the key in manifest.yaml that holds the fingerprint of the build
+MANIFEST_FINGERPRINT_KEY = "charmcraft-fingerprint"
+
+
+def hash_file(path: pathlib.Path) -> bytes:
+    """Return the SHA256 digest of the file content, mapping it in memory."""
+    hasher = hashlib.sha256()
+    with open(str(path), "rb") as fh:
+        # empty files can not be mapped
+        if os.fstat(fh.fileno()).st_size:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+    return hasher.digest()
+
+
+def hash_files(
+    paths: Iterable[pathlib.Path], max_workers: Optional[int] = None
+) -> List[bytes]:
+    """Return the SHA256 digest of each file, hashing them concurrently.
+
+    The digests are returned in the same order than the paths.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(hash_file, paths))
+
+
+class Fingerprint:
+    """Accumulate everything that affects a build into a single digest."""
+
+    def __init__(self):
+        self._hasher = hashlib.sha256()
+
+    def add(self, *fields) -> None:
+        """Add a record of the given fields."""
+        record = "\0".join(str(field) for field in fields) + "\n"
+        self._hasher.update(record.encode("utf8"))
+
+    def hexdigest(self) -> str:
+        """Return the fingerprint of everything added."""
+        return self._hasher.hexdigest()
+
+
+def read_fingerprint(charm_path: pathlib.Path) -> Optional[str]:
+    """Return the fingerprint stored in the manifest of a built charm, if any."""
+    try:
+        with zipfile.ZipFile(str(charm_path)) as zf:
+            manifest = yaml.safe_load(zf.read("manifest.yaml"))
+    except (OSError, KeyError, zipfile.BadZipFile, yaml.YAMLError) as exc:
+        logger.debug("Cannot read the fingerprint from %r: %r", str(charm_path), exc)
+        return None
+    if not isinstance(manifest, dict):
+        return None
+    return manifest.get(MANIFEST_FINGERPRINT_KEY)
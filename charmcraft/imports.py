@@ -0,0 +1,140 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+"""Analyze the imports of Python code, to know which packages are really used."""
+
+import ast
+import logging
+import os
+import pathlib
+from collections import defaultdict
+from typing import Dict, Generator, Iterable, List, Set
+
+logger = logging.getLogger(__name__)
+
+# suffixes of the native modules, which can't be parsed but can be imported
+NATIVE_MODULE_SUFFIXES = (".so", ".pyd")
+
+
+def get_imports(filepath: pathlib.Path) -> Generator[List[str], None, None]:
+    """Parse a Python filepath and yield its imports.
+
+    If the file does not exist or cannot be parsed, return empty. Otherwise
+    return the name for each imported module, splitted by possible dots. Relative
+    imports are not included, as they refer to the same package.
+    """
+    if not os.access(str(filepath), os.R_OK):
+        return
+    try:
+        parsed = ast.parse(filepath.read_bytes())
+    except (SyntaxError, ValueError):
+        return
+
+    for node in ast.walk(parsed):
+        if isinstance(node, ast.Import):
+            for name in node.names:
+                yield name.name.split(".")
+        elif isinstance(node, ast.ImportFrom):
+            if node.level == 0:
+                yield node.module.split(".")
+
+
+def _is_python_package(dirpath: str) -> bool:
+    """Tell if the directory holds Python code (a regular or namespace package)."""
+    for _, _, filenames in os.walk(dirpath):
+        for filename in filenames:
+            if filename.endswith((".py",) + NATIVE_MODULE_SUFFIXES):
+                return True
+    return False
+
+
+def get_top_level_modules(dirpath: pathlib.Path) -> Dict[str, List[pathlib.Path]]:
+    """Get the modules and packages that can be imported from the directory.
+
+    :returns: the paths of each top level module name (more than one, for example,
+        for a package and its native module with the same name).
+    """
+    modules = defaultdict(list)
+    if not dirpath.is_dir():
+        return modules
+    with os.scandir(str(dirpath)) as dir_iterator:
+        for entry in dir_iterator:
+            if entry.is_dir():
+                if entry.name.isidentifier() and _is_python_package(entry.path):
+                    modules[entry.name].append(pathlib.Path(entry.path))
+            elif entry.name.endswith((".py",) + NATIVE_MODULE_SUFFIXES):
+                name = entry.name.split(".")[0]
+                if name.isidentifier():
+                    modules[name].append(pathlib.Path(entry.path))
+    return modules
+
+
+def _get_python_files(path: pathlib.Path) -> Iterable[pathlib.Path]:
+    """Get the Python files of a module or package."""
+    if not path.is_dir():
+        if path.suffix == ".py":
+            yield path
+        return
+    for dirpath, dirnames, filenames in os.walk(str(path)):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith(".py"):
+                yield pathlib.Path(dirpath) / filename
+
+
+def get_reachable_modules(
+    entrypoint: pathlib.Path,
+    search_paths: Iterable[pathlib.Path],
+    extra_roots: Iterable[str] = (),
+) -> Set[str]:
+    """Get the top level modules reachable importing from the entrypoint.
+
+    The whole package is analyzed when any part of it is imported, so the result
+    is a superset of what is really used. Imports done dynamically (for example,
+    with `importlib`) can not be detected, those modules need to be given as
+    extra roots.
+
+    :param search_paths: the directories from where the modules are imported, in
+        the same order than they are in the Python path.
+    :param extra_roots: modules that are imported in other ways, to always include.
+    """
+    available = defaultdict(list)
+    for search_path in search_paths:
+        for name, paths in get_top_level_modules(search_path).items():
+            available[name].extend(paths)
+
+    reachable = set()
+    pending = [entrypoint]
+
+    def reach(name):
+        if name in reachable or name not in available:
+            # already analyzed, or from the standard library
+            return
+        reachable.add(name)
+        for path in available[name]:
+            pending.extend(_get_python_files(path))
+
+    for name in extra_roots:
+        reach(name.split(".")[0])
+    while pending:
+        filepath = pending.pop()
+        for import_parts in get_imports(filepath):
+            reach(import_parts[0])
+
+    logger.debug(
+        "Reachable modules from %r: %s", str(entrypoint), ", ".join(sorted(reachable))
+    )
+    return reachable
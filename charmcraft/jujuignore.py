@@ -22,10 +22,6 @@ import typing
 
 logger = logging.getLogger(__name__)
 
-KEEP = "keep"
-SKIP = "skip"
-FORCEKEEP = "forcekeep"
-
 _unescapes = {
     r"\!": "!",
     r"\ ": " ",
@@ -118,43 +114,114 @@ def _rule_to_regex(rule):
     return res
 
 
-class _Matcher:
-    """Couple a regex with other metadata for how we should match a given pattern."""
-
-    def __init__(
-        self,
-        line_num: int,
-        orig_rule: str,
-        invert: bool,
-        only_dirs: bool,
-        regex: typing.Pattern,
-    ):
-        self.line_num = line_num
-        self.orig_rule = orig_rule
-        self.invert = invert
-        self.only_dirs = only_dirs
-        self.compiled = re.compile(regex, re.DOTALL)
-
-    def match(self, path: str, is_dir: bool) -> str:
-        """Check if a path matches.
-
-        Returns:
-            Can return one of KEEP, SKIP, FORCEKEEP
+def _is_literal(rule: str) -> bool:
+    """Tell if the rule has no wildcards, so it can be compared as a plain string."""
+    return bool(rule) and not any(char in rule for char in "*?[")
+
+
+def _could_match_below(rule: str, dirpath: str) -> bool:
+    """Tell if the rule could match any path below the directory.
+
+    It's conservative: it only answers False when it's sure.
+    """
+    if not rule.startswith("/"):
+        # it may match at any depth
+        return True
+    rule_parts = rule[1:].split("/")
+    dir_parts = dirpath[1:].split("/")
+    for pos, (rule_part, dir_part) in enumerate(zip(rule_parts, dir_parts)):
+        # a '**' may match across directories, also the part before a '/**/' (it's
+        # translated as '.*/'), and brackets may match a '/'
+        if "**" in "".join(rule_parts[pos : pos + 2]) or "[" in rule_part:
+            return True
+        if re.match(_rule_to_regex(rule_part), dir_part, re.DOTALL) is None:
+            return False
+    return len(rule_parts) > len(dir_parts)
+
+
+class _CompiledRules:
+    """A group of rules compiled together, to tell if any of them matches a path.
+
+    The simplest rules are checked without regexes: names without wildcards (like
+    `.git`) are looked up in a set of basenames, rules like `*.pyc` are checked against
+    the basename's suffix, and paths without wildcards are compared directly. The rest
+    of the rules are combined in one regex.
+    """
+
+    def __init__(self):
+        self._basenames = set()
+        self._paths = set()
+        self._path_suffixes = []
+        self._basename_suffixes = []
+        self._regexes = []
+        self._compiled = None
+
+    def add(self, rule: str) -> str:
+        """Add a rule (already unescaped, and without the trailing '/').
+
+        :returns: how the rule is checked, for logging purposes.
         """
-        if self.only_dirs and not is_dir:
-            return KEEP
-        if self.compiled.match(path):
-            if self.invert:
-                return FORCEKEEP
-            return SKIP
-        return KEEP
+        self._compiled = None
+        if rule.startswith("/"):
+            if _is_literal(rule):
+                self._paths.add(rule)
+                return f"path {rule!r}"
+            regex = r"\A" + _rule_to_regex(rule)
+        elif _is_literal(rule):
+            if "/" in rule:
+                self._path_suffixes.append("/" + rule)
+                return f"path suffix {'/' + rule!r}"
+            self._basenames.add(rule)
+            return f"name {rule!r}"
+        elif rule.startswith("*") and _is_literal(rule[1:]) and "/" not in rule:
+            self._basename_suffixes.append(rule[1:])
+            return f"name suffix {rule[1:]!r}"
+        else:
+            # not anchored, so it can start after any '/' of the path
+            regex = _rule_to_regex("/" + rule)
+        self._regexes.append(regex)
+        return f"regex {regex!r}"
+
+    def _compile(self):
+        """Build the structures used to match, once all the rules are added."""
+        if self._regexes:
+            regex = re.compile(
+                "|".join(f"(?:{regex})" for regex in self._regexes), re.DOTALL
+            )
+        else:
+            regex = None
+        self._compiled = (
+            tuple(self._path_suffixes),
+            tuple(self._basename_suffixes),
+            regex,
+        )
+
+    def match(self, path: str, basename: str) -> bool:
+        """Tell if any rule matches the path (which always starts with '/')."""
+        if basename in self._basenames or path in self._paths:
+            return True
+        if self._compiled is None:
+            self._compile()
+        path_suffixes, basename_suffixes, regex = self._compiled
+        if path.endswith(path_suffixes) or basename.endswith(basename_suffixes):
+            return True
+        return regex is not None and regex.search(path) is not None
 
 
 class JujuIgnore:
     """Track a set of ignore patterns from a .jujuignore file."""
 
     def __init__(self, patterns: typing.Iterable[str]):
-        self._matchers = []
+        # the rules are grouped by their outcome, and if they apply only to directories
+        self._rules = {
+            (invert, only_dirs): _CompiledRules()
+            for invert in (False, True)
+            for only_dirs in (False, True)
+        }
+        # the directories whose content is all ignored (from rules like 'foo/**'),
+        # and the negated rules which could bring back something from there
+        self._ignored_contents = _CompiledRules()
+        self._negated_rules = []
         self._compile_from(patterns)
 
     def extend_patterns(self, patterns: typing.Iterable[str]) -> None:
@@ -176,21 +243,13 @@ class JujuIgnore:
             if rule.endswith("/"):
                 only_dirs = True
                 rule = rule.rstrip("/")
-            if not rule.startswith("/"):
-                # A rule that doesn't start with '/' means to match any
-                # subdirectory
-                rule = "**/" + rule
-            regex = _rule_to_regex(rule)
-            m = _Matcher(
-                line_num=line_num,
-                orig_rule=orig_rule,
-                invert=invert,
-                only_dirs=only_dirs,
-                regex=regex,
-            )
-            self._matchers.append(m)
+            translated = self._rules[invert, only_dirs].add(rule)
+            if invert:
+                self._negated_rules.append(rule)
+            elif not only_dirs and rule.endswith("/**") and len(rule) > 3:
+                self._ignored_contents.add(rule[:-3])
             logger.debug(
-                'Translated .jujuignore %d "%s" => "%s"', line_num, orig_rule, regex
+                'Translated .jujuignore %d "%s" => %s', line_num, orig_rule, translated
             )
 
     def match(self, path: str, is_dir: bool) -> bool:
@@ -206,15 +265,35 @@ class JujuIgnore:
         """
         if not path.startswith("/"):
             path = "/" + path
-        keep = True
-        for matcher in self._matchers:
-            matchRes = matcher.match(path, is_dir)
-            if matchRes == SKIP:
-                keep = False
-            elif matchRes == FORCEKEEP:
-                keep = True
-                break
-        return not keep
+        basename = path.rpartition("/")[2]
+
+        # a path matched by a negated rule is always kept, whatever the other rules say,
+        # so those are checked first; otherwise it's ignored if any other rule matches
+        for invert in (True, False):
+            if self._rules[invert, False].match(path, basename) or (
+                is_dir and self._rules[invert, True].match(path, basename)
+            ):
+                return not invert
+        return False
+
+    def can_keep_under(self, path: str) -> bool:
+        """Check if anything under the given directory could be kept.
+
+        It's False when a rule ignores everything in the directory (like 'foo/**')
+        and no negated rule could match anything in there, so its content doesn't
+        need to be explored at all. Note that this is not about the directory itself.
+
+        Args:
+            path: A local path (eg /foo/bar or foo/bar) from the root directory of the project.
+        Return:
+            A boolean indicating whether something under the directory could be kept.
+        """
+        if not path.startswith("/"):
+            path = "/" + path
+        basename = path.rpartition("/")[2]
+        if not self._ignored_contents.match(path, basename):
+            return True
+        return any(_could_match_below(rule, path) for rule in self._negated_rules)
 
 
 # default_juju_ignore is the initial set of ignores.
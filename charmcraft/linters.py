@@ -16,15 +16,25 @@
 
 """Analyze and lint charm structures and files."""
 
-import ast
+import copy
+import hashlib
+import json
+import logging
 import os
 import pathlib
 import shlex
+import stat
+import threading
 from collections import namedtuple, defaultdict
-from typing import List, Generator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from charmcraft import config
-from charmcraft.metadata import parse_metadata_yaml
+from charmcraft.cache import AnalysisCache
+from charmcraft.imports import get_imports
+from charmcraft.metadata import CHARM_METADATA, CharmMetadata, parse_metadata_yaml
+
+logger = logging.getLogger(__name__)
 
 CheckType = namedtuple("CheckType", "attribute lint")(
     attribute="attribute", lint="lint"
@@ -38,8 +48,82 @@ UNKNOWN = "unknown"
 IGNORED = "ignored"
 FATAL = "fatal"
 
-# shared state between checkers, to reuse analysis results and/or other intermediate information
-shared_state = defaultdict(dict)
+
+class AnalysisContext:
+    """What is shared between the checkers in one analysis.
+
+    It holds the results from the checkers already run and other information they
+    expose to the rest, and memoizes the reading and parsing of the charm's files,
+    as different checkers usually need the same ones. It can be used concurrently
+    from different threads.
+
+    Each checker runs with its own copy of the context (see `for_checker`), that
+    records the paths the checker used (its inputs), to know when its result can
+    be reused from a previous analysis.
+
+    :param basedir: the directory of the charm being analyzed.
+    :param metadata: the charm's metadata, if it was already parsed.
+    """
+
+    def __init__(self, basedir: pathlib.Path, metadata: Optional[CharmMetadata] = None):
+        self.basedir = basedir
+        # the result of each checker, and other information it shares (which must
+        # be serializable to JSON, as it's cached together with the result)
+        self.results: Dict[str, str] = {}
+        self.info: Dict[str, Dict[str, Any]] = defaultdict(dict)
+        self.inputs: Set[str] = set()
+        self._memoized: Dict[Tuple[str, str], Tuple[Any, Optional[Exception]]] = {}
+        self._lock = threading.Lock()
+        if metadata is not None:
+            self._memoized["metadata", ""] = (metadata, None)
+
+    def for_checker(self) -> "AnalysisContext":
+        """Return a context that shares everything with this one but the inputs."""
+        context = copy.copy(self)
+        context.inputs = set()
+        return context
+
+    def use(self, path: pathlib.Path) -> None:
+        """Record that the path (a file or directory, present or not) was used.
+
+        The checkers must call this for every path they inspect other than through
+        this context's methods (which record the paths by themselves).
+        """
+        self.inputs.add(str(path))
+
+    def _memoize(self, key: Tuple[str, str], function: Callable[[], Any]) -> Any:
+        """Return the value (or raise the error) from calling the function only once."""
+        try:
+            value, error = self._memoized[key]
+        except KeyError:
+            try:
+                value, error = function(), None
+            except Exception as exc:
+                value, error = None, exc
+            with self._lock:
+                value, error = self._memoized.setdefault(key, (value, error))
+        if error is not None:
+            raise error
+        return value
+
+    def read_text(self, path: pathlib.Path) -> str:
+        """Return the text in the file."""
+        self.use(path)
+        return self._memoize(
+            ("text", str(path)), lambda: path.read_text(encoding="utf8")
+        )
+
+    def get_imports(self, path: pathlib.Path) -> List[List[str]]:
+        """Return the imports in the Python file (see `imports.get_imports`)."""
+        self.use(path)
+        return self._memoize(("imports", str(path)), lambda: list(get_imports(path)))
+
+    def get_metadata(self) -> CharmMetadata:
+        """Return the charm's metadata."""
+        self.use(self.basedir / CHARM_METADATA)
+        return self._memoize(
+            ("metadata", ""), lambda: parse_metadata_yaml(self.basedir)
+        )
 
 
 class Language:
@@ -60,25 +144,33 @@ class Language:
     # different result constants
     Result = namedtuple("Result", "python unknown")(python="python", unknown=UNKNOWN)
 
-    def run(self, basedir: pathlib.Path) -> str:
+    depends_on = ()
+    version = 1
+
+    def run(
+        self, basedir: pathlib.Path, context: Optional[AnalysisContext] = None
+    ) -> str:
         """Run the proper verifications."""
+        if context is None:
+            context = AnalysisContext(basedir)
+
         # get the entrypoint from the last useful dispatch line
         dispatch = basedir / "dispatch"
         entrypoint_str = ""
         try:
-            with dispatch.open("rt", encoding="utf8") as fh:
-                last_line = None
-                for line in fh:
-                    if line.strip():
-                        last_line = line
-                if last_line:
-                    entrypoint_str = shlex.split(last_line)[-1]
+            last_line = None
+            for line in context.read_text(dispatch).splitlines():
+                if line.strip():
+                    last_line = line
+            if last_line:
+                entrypoint_str = shlex.split(last_line)[-1]
         except (IOError, UnicodeDecodeError):
             return self.Result.unknown
 
         entrypoint = basedir / entrypoint_str
+        context.use(entrypoint)
         if entrypoint.suffix == ".py" and os.access(entrypoint, os.X_OK):
-            shared_state[self.name]["entrypoint"] = entrypoint
+            context.info[self.name]["entrypoint"] = entrypoint_str
             return self.Result.python
         return self.Result.unknown
 
@@ -101,6 +193,8 @@ class Framework:
 
     check_type = CheckType.attribute
     name = "framework"
+    depends_on = (Language.name,)
+    version = 1
     url = "https://juju.is/docs/sdk/charmcraft-analyze#heading--framework"
 
     # different result constants
@@ -127,51 +221,32 @@ class Framework:
             )
         return self.result_texts[self.result]
 
-    def _get_imports(self, filepath: pathlib.Path) -> Generator[List[str], None, None]:
-        """Parse a Python filepath and yield its imports.
-
-        If the file does not exist or cannot be parsed, return empty. Otherwise
-        return the name for each imported module, splitted by possible dots.
-        """
-        if not os.access(filepath, os.R_OK):
-            return
-        try:
-            parsed = ast.parse(filepath.read_bytes())
-        except SyntaxError:
-            return
-
-        for node in ast.walk(parsed):
-            if isinstance(node, ast.Import):
-                for name in node.names:
-                    yield name.name.split(".")
-            elif isinstance(node, ast.ImportFrom):
-                yield node.module.split(".")
-
-    def _check_operator(self, basedir: pathlib.Path) -> bool:
+    def _check_operator(self, basedir: pathlib.Path, context: AnalysisContext) -> bool:
         """Detect if the Operator Framework is used."""
-        language_info = shared_state[Language.name]
-        if language_info["result"] != Language.Result.python:
+        if context.results.get(Language.name) != Language.Result.python:
             return False
 
         opsdir = basedir / "venv" / "ops"
+        context.use(opsdir)
         if not opsdir.exists() or not opsdir.is_dir():
             return False
 
-        entrypoint = language_info["entrypoint"]
-        for import_parts in self._get_imports(entrypoint):
+        entrypoint = basedir / context.info[Language.name]["entrypoint"]
+        for import_parts in context.get_imports(entrypoint):
             if import_parts[0] == "ops":
                 return True
         return False
 
-    def _check_reactive(self, basedir: pathlib.Path) -> bool:
+    def _check_reactive(self, basedir: pathlib.Path, context: AnalysisContext) -> bool:
         """Detect if the Reactive Framework is used."""
         try:
-            entrypoint_name = parse_metadata_yaml(basedir).name
+            entrypoint_name = context.get_metadata().name
         except Exception:
             # file not found, corrupted, no name in it, etc.
             return False
 
         wheelhouse_dir = basedir / "wheelhouse"
+        context.use(wheelhouse_dir)
         if not wheelhouse_dir.exists():
             return False
         if not any(
@@ -180,16 +255,21 @@ class Framework:
             return False
 
         entrypoint = basedir / "reactive" / f"{entrypoint_name}.py"
-        for import_parts in self._get_imports(entrypoint):
+        for import_parts in context.get_imports(entrypoint):
             if import_parts[0] == "charms" and import_parts[1] == "reactive":
                 return True
         return False
 
-    def run(self, basedir: pathlib.Path) -> str:
+    def run(
+        self, basedir: pathlib.Path, context: Optional[AnalysisContext] = None
+    ) -> str:
         """Run the proper verifications."""
-        if self._check_operator(basedir):
+        if context is None:
+            context = AnalysisContext(basedir)
+
+        if self._check_operator(basedir, context):
             result = self.Result.operator
-        elif self._check_reactive(basedir):
+        elif self._check_reactive(basedir, context):
             result = self.Result.reactive
         else:
             result = self.Result.unknown
@@ -197,17 +277,132 @@ class Framework:
         return result
 
 
-# all checkers to run; the order here is important, as some checkers depend on the
-# results from others
+# all checkers to run; each one is run when the ones it depends on (its `depends_on`
+# names) are finished, and the results are reported in this order (a checker's
+# `version` must be increased when it changes, to not reuse its cached results)
 CHECKERS = [
     Language,
     Framework,
 ]
 
 
-def analyze(config: config.Config, basedir: pathlib.Path) -> List[CheckResult]:
-    """Run all checkers and linters."""
-    all_results = []
+def _get_path_digest(path: str) -> str:
+    """Get a digest of what a checker may see of a path.
+
+    For files it's built from their content and permissions; for directories, from
+    the names in them (not their content, as the checkers record any path they
+    inspect inside).
+    """
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return "missing"
+    hasher = hashlib.sha256()
+    if stat.S_ISDIR(stat_result.st_mode):
+        hasher.update(b"dir")
+        for name in sorted(os.listdir(path)):
+            hasher.update(b"\0" + os.fsencode(name))
+    else:
+        hasher.update(b"file%o\0" % stat.S_IMODE(stat_result.st_mode))
+        try:
+            with open(path, "rb") as fh:
+                for chunk in iter(lambda: fh.read(2 ** 20), b""):
+                    hasher.update(chunk)
+        except OSError:
+            hasher.update(b"unreadable")
+    return hasher.hexdigest()
+
+
+def _get_cache_key(cls, basedir: pathlib.Path, context: AnalysisContext) -> str:
+    """Get the key for the cached results of a checker.
+
+    It's built from the checker's version and the results and information shared by
+    the ones it depends on; the digests of its inputs are validated when getting the
+    cached result.
+    """
+    dependencies = {
+        name: [context.results.get(name), context.info.get(name, {})]
+        for name in getattr(cls, "depends_on", ())
+    }
+    key_info = [cls.name, getattr(cls, "version", 0), str(basedir), dependencies]
+    return hashlib.sha256(json.dumps(key_info, sort_keys=True).encode()).hexdigest()
+
+
+def _run_checker(
+    cls,
+    basedir: pathlib.Path,
+    context: AnalysisContext,
+    cache: Optional[AnalysisCache] = None,
+) -> CheckResult:
+    """Run one checker, handling its crashes, or reuse its cached result."""
+    if cache is not None:
+        key = _get_cache_key(cls, basedir, context)
+        cached = cache.get(key)
+        if cached is not None and all(
+            _get_path_digest(path) == digest
+            for path, digest in cached["inputs"].items()
+        ):
+            logger.debug("Reusing the cached result for checker %r", cls.name)
+            context.info[cls.name].update(cached["info"])
+            return CheckResult(
+                check_type=cls.check_type,
+                name=cls.name,
+                url=cls.url,
+                text=cached["text"],
+                result=cached["result"],
+            )
+
+    checker = cls()
+    checker_context = context.for_checker()
+    try:
+        result = checker.run(basedir, checker_context)
+    except Exception:
+        result = UNKNOWN if checker.check_type == CheckType.attribute else FATAL
+        crashed = True
+    else:
+        crashed = False
+    check_result = CheckResult(
+        check_type=checker.check_type,
+        name=checker.name,
+        url=checker.url,
+        text=checker.text,
+        result=result,
+    )
+
+    # a crash may be caused by something outside the recorded inputs
+    if cache is not None and not crashed:
+        inputs = {path: _get_path_digest(path) for path in checker_context.inputs}
+        cache.store(
+            key,
+            {
+                "inputs": inputs,
+                "info": context.info.get(cls.name, {}),
+                "text": check_result.text,
+                "result": check_result.result,
+            },
+        )
+    return check_result
+
+
+def analyze(
+    config: config.Config,
+    basedir: pathlib.Path,
+    *,
+    metadata: Optional[CharmMetadata] = None,
+    cache: Optional[AnalysisCache] = None,
+) -> List[CheckResult]:
+    """Run all checkers and linters.
+
+    The checkers are run concurrently, each one as soon as the ones it depends on
+    are finished, all sharing the same context for this analysis.
+
+    :param metadata: the charm's metadata, if it was already parsed.
+    :param cache: if given, the results of the checkers are reused from it while
+        their inputs don't change, and stored there otherwise.
+    """
+    context = AnalysisContext(basedir, metadata=metadata)
+    all_results = {}
+    pending = []
     for cls in CHECKERS:
         # do not run the ignored ones
         if cls.check_type == CheckType.attribute:
@@ -215,30 +410,43 @@ def analyze(config: config.Config, basedir: pathlib.Path) -> List[CheckResult]:
         else:
             ignore_list = config.analysis.ignore.linters
         if cls.name in ignore_list:
-            all_results.append(
-                CheckResult(
-                    check_type=cls.check_type,
-                    name=cls.name,
-                    result=IGNORED,
-                    url=None,
-                    text=None,
-                )
+            all_results[cls.name] = CheckResult(
+                check_type=cls.check_type,
+                name=cls.name,
+                result=IGNORED,
+                url=None,
+                text=None,
             )
-            continue
+            context.results[cls.name] = IGNORED
+        else:
+            pending.append(cls)
 
-        checker = cls()
-        try:
-            result = checker.run(basedir)
-        except Exception:
-            result = UNKNOWN if checker.check_type == CheckType.attribute else FATAL
-        shared_state[checker.name]["result"] = result
-        all_results.append(
-            CheckResult(
-                check_type=checker.check_type,
-                name=checker.name,
-                url=checker.url,
-                text=checker.text,
-                result=result,
-            )
+    known_names = {cls.name for cls in CHECKERS}
+
+    def dependencies_met(cls):
+        return all(
+            name not in known_names or name in context.results
+            for name in getattr(cls, "depends_on", ())
         )
-    return all_results
+
+    running = {}
+    with ThreadPoolExecutor() as executor:
+        while pending or running:
+            for cls in [cls for cls in pending if dependencies_met(cls)]:
+                pending.remove(cls)
+                future = executor.submit(_run_checker, cls, basedir, context, cache)
+                running[future] = cls
+            if not running:
+                names = ", ".join(cls.name for cls in pending)
+                raise RuntimeError(
+                    f"Cannot run checkers with circular dependencies: {names}."
+                )
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                cls = running.pop(future)
+                check_result = future.result()
+                all_results[cls.name] = check_result
+                context.results[cls.name] = check_result.result
+
+    return [all_results[cls.name] for cls in CHECKERS]
@@ -19,21 +19,28 @@
 import datetime
 import logging
 import pathlib
-from typing import Optional, List
+import zipfile
+from typing import Any, Dict, Optional, List
 
 import yaml
 
 from charmcraft import __version__, config, linters
 from charmcraft.cmdbase import CommandError
+from charmcraft.fingerprint import MANIFEST_FINGERPRINT_KEY
 
 logger = logging.getLogger(__name__)
 
+# the key in the manifest of the information of the resource holding the venv
+MANIFEST_VENV_RESOURCE_KEY = "venv-resource"
+
 
 def create_manifest(
     basedir: pathlib.Path,
     started_at: datetime.datetime,
     bases_config: Optional[config.BasesConfiguration],
     linting_results: List[linters.CheckResult],
+    fingerprint: Optional[str] = None,
+    venv_resource: Optional[Dict[str, Any]] = None,
 ):
     """Create manifest.yaml in basedir for given base configuration.
 
@@ -43,6 +50,9 @@ def create_manifest(
     :param basedir: Directory to create Charm in.
     :param started_at: Build start time.
     :param bases_config: Relevant bases configuration, if any.
+    :param fingerprint: The fingerprint of the build inputs, if any.
+    :param venv_resource: The name, file name and hash of the resource holding
+        the venv, if any.
 
     :returns: Path to created manifest.yaml.
     """
@@ -71,6 +81,12 @@ def create_manifest(
     ]
     content["analysis"] = {"attributes": attributes_info}
 
+    if fingerprint is not None:
+        content[MANIFEST_FINGERPRINT_KEY] = fingerprint
+
+    if venv_resource is not None:
+        content[MANIFEST_VENV_RESOURCE_KEY] = venv_resource
+
     filepath = basedir / "manifest.yaml"
     if filepath.exists():
         raise CommandError(
@@ -78,3 +94,16 @@ def create_manifest(
         )
     filepath.write_text(yaml.dump(content))
     return filepath
+
+
+def read_venv_resource(charm_path: pathlib.Path) -> Optional[Dict[str, Any]]:
+    """Return the information of the venv resource stored in a built charm, if any."""
+    try:
+        with zipfile.ZipFile(str(charm_path)) as zf:
+            manifest = yaml.safe_load(zf.read("manifest.yaml"))
+    except (OSError, KeyError, zipfile.BadZipFile, yaml.YAMLError) as exc:
+        logger.debug("Cannot read the manifest from %r: %r", str(charm_path), exc)
+        return None
+    if not isinstance(manifest, dict):
+        return None
+    return manifest.get(MANIFEST_VENV_RESOURCE_KEY)
@@ -23,6 +23,7 @@ import pathlib
 import re
 import subprocess
 import tempfile
+import threading
 from typing import Dict, List, Optional, Tuple, Union
 
 from craft_providers import Executor, bases, lxd
@@ -46,6 +47,10 @@ BASE_CHANNEL_TO_BUILDD_IMAGE_ALIAS = {
     "20.04": bases.BuilddBaseAlias.FOCAL,
 }
 
+# instances are launched one at a time, even if later used concurrently, as the
+# remote, project and base snapshots are shared between them
+_launch_lock = threading.Lock()
+
 
 def capture_logs_from_instance(instance: Executor) -> None:
     """Retrieve logs from instance.
@@ -252,22 +257,23 @@ def launched_environment(
     )
 
     environment = get_command_environment()
-    image_remote = configure_buildd_image_remote()
-    base_configuration = CharmcraftBuilddBaseConfiguration(
-        alias=alias, environment=environment, hostname=instance_name
-    )
-    instance = lxd.launch(
-        name=instance_name,
-        base_configuration=base_configuration,
-        image_name=base.channel,
-        image_remote=image_remote,
-        auto_clean=True,
-        auto_create_project=True,
-        map_user_uid=True,
-        use_snapshots=True,
-        project=lxd_project,
-        remote=lxd_remote,
-    )
+    with _launch_lock:
+        image_remote = configure_buildd_image_remote()
+        base_configuration = CharmcraftBuilddBaseConfiguration(
+            alias=alias, environment=environment, hostname=instance_name
+        )
+        instance = lxd.launch(
+            name=instance_name,
+            base_configuration=base_configuration,
+            image_name=base.channel,
+            image_remote=image_remote,
+            auto_clean=True,
+            auto_create_project=True,
+            map_user_uid=True,
+            use_snapshots=True,
+            project=lxd_project,
+            remote=lxd_remote,
+        )
 
     # Mount project.
     instance.mount(
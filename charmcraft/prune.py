@@ -0,0 +1,173 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+"""Remove from an installed tree what is not needed at run time."""
+
+import collections
+import fnmatch
+import logging
+import os
+import pathlib
+import shutil
+import subprocess
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# what is removed by default from an installed venv (paths relative to it); the
+# directories are only removed if they are not Python packages, as those may be
+# imported at run time (e.g. `botocore.docs`)
+DEFAULT_PRUNE_PATTERNS = (
+    "tests",
+    "*/tests",
+    "*/test",
+    "*/docs",
+    "*.dist-info/RECORD",
+    "*.h",
+    "*.hpp",
+    "*.pxd",
+    "*.pyx",
+)
+
+# the names of the rules that are not patterns, for the report
+STALE_PYCS_RULE = "pycs for other interpreters"
+STRIP_RULE = "debug symbols"
+
+
+def _tree_size(path: pathlib.Path) -> Tuple[int, int]:
+    """Return the quantity of files and their total size in the given tree."""
+    if path.is_symlink() or not path.is_dir():
+        return 1, path.lstat().st_size
+    files = size = 0
+    for dirpath, dirnames, filenames in os.walk(str(path)):
+        for filename in filenames:
+            files += 1
+            size += os.lstat(os.path.join(dirpath, filename)).st_size
+    return files, size
+
+
+def _strip_debug(path: pathlib.Path) -> int:
+    """Remove the debug symbols from a native library, returning the bytes saved.
+
+    The stripped library is written aside and then moved to the original place,
+    so other hard links to the same file (e.g. from a cache) are not affected.
+    """
+    stripped_path = path.with_name(path.name + ".stripped")
+    cmd = ["strip", "--strip-debug", "-o", str(stripped_path), str(path)]
+    proc = subprocess.run(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True
+    )
+    if proc.returncode:
+        logger.debug("Cannot strip %r: %s", str(path), proc.stdout.strip())
+        if stripped_path.exists():
+            stripped_path.unlink()
+        return 0
+    saved = path.stat().st_size - stripped_path.stat().st_size
+    shutil.copymode(str(path), str(stripped_path))
+    os.replace(str(stripped_path), str(path))
+    return saved
+
+
+def prune_tree(
+    basedir: pathlib.Path,
+    patterns: Sequence[str],
+    *,
+    keep: Sequence[str] = (),
+    only_non_packages: Sequence[str] = (),
+    cache_tag: Optional[str] = None,
+    strip: bool = False,
+) -> Dict[str, List[int]]:
+    """Remove the files and directories that match the patterns in the tree.
+
+    The patterns are matched (using `fnmatch`) against the paths relative to the
+    tree's base directory; matching directories are removed completely.
+
+    :param keep: patterns of paths that are never removed nor stripped.
+    :param only_non_packages: patterns (also in `patterns`) that don't remove the
+        directories that are Python packages (those holding an `__init__.py`).
+    :param cache_tag: if given, the pycs in `__pycache__` directories that are not
+        for this interpreter (e.g. 'cpython-38') are removed.
+    :param strip: if remove the debug symbols of the native libraries (only if the
+        `strip` tool is available).
+    :returns: for each rule that removed something, the quantity of files and the
+        bytes removed.
+    """
+    if strip and shutil.which("strip") is None:
+        logger.debug("Not stripping native libraries: 'strip' not available")
+        strip = False
+
+    report = collections.defaultdict(lambda: [0, 0])
+
+    def is_kept(relpath):
+        return any(fnmatch.fnmatchcase(relpath, pattern) for pattern in keep)
+
+    def get_rule(relpath, package=False):
+        for pattern in patterns:
+            if package and pattern in only_non_packages:
+                continue
+            if fnmatch.fnmatchcase(relpath, pattern):
+                return pattern
+        return None
+
+    for dirpath, dirnames, filenames in os.walk(str(basedir)):
+        abs_dirpath = pathlib.Path(dirpath)
+        rel_dirpath = abs_dirpath.relative_to(basedir)
+
+        for dirname in list(dirnames):
+            relpath = (rel_dirpath / dirname).as_posix()
+            if is_kept(relpath):
+                continue
+            package = (abs_dirpath / dirname / "__init__.py").exists()
+            rule = get_rule(relpath, package)
+            if rule is not None:
+                files, size = _tree_size(abs_dirpath / dirname)
+                logger.debug("Pruning directory %r (%s)", relpath, rule)
+                if (abs_dirpath / dirname).is_symlink():
+                    (abs_dirpath / dirname).unlink()
+                else:
+                    shutil.rmtree(str(abs_dirpath / dirname))
+                report[rule][0] += files
+                report[rule][1] += size
+                dirnames.remove(dirname)
+
+        for filename in filenames:
+            relpath = (rel_dirpath / filename).as_posix()
+            abs_path = abs_dirpath / filename
+            if is_kept(relpath):
+                continue
+            rule = get_rule(relpath)
+            if (
+                rule is None
+                and cache_tag is not None
+                and rel_dirpath.name == "__pycache__"
+                and filename.endswith(".pyc")
+                and filename.split(".")[1] != cache_tag
+            ):
+                rule = STALE_PYCS_RULE
+            if rule is not None:
+                report[rule][0] += 1
+                report[rule][1] += abs_path.lstat().st_size
+                abs_path.unlink()
+            elif (
+                strip
+                and not abs_path.is_symlink()
+                and (filename.endswith(".so") or ".so." in filename)
+            ):
+                saved = _strip_debug(abs_path)
+                if saved > 0:
+                    report[STRIP_RULE][1] += saved
+
+    return dict(report)
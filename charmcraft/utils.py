@@ -16,12 +16,14 @@
 
 """Collection of utilities for charmcraft."""
 
+import errno
 import logging
 import os
 import pathlib
 import platform
+import shutil
 import sys
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from stat import S_IRGRP, S_IROTH, S_IRUSR, S_IXGRP, S_IXOTH, S_IXUSR
 
 import attr
@@ -61,6 +63,116 @@ def make_executable(fh):
     os.fchmod(fileno, mode)
 
 
+# the ioctl to clone a file sharing its data blocks (in btrfs, xfs, etc)
+FICLONE = 0x40049409
+
+# errors that mean a way of copying files is not possible between two filesystems
+_UNSUPPORTED_COPY_ERRNOS = {
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EINVAL,
+}
+
+
+def _reflink(src, dest):
+    """Clone the file, sharing its data blocks."""
+    import fcntl  # not available in all platforms
+
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dest)
+
+
+def _copy_file_range(src, dest):
+    """Copy the file in the kernel, which may also share or offload the data."""
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdest.fileno(), remaining)
+            if not copied:
+                raise OSError(errno.EIO, "Short copy", src)
+            remaining -= copied
+    shutil.copystat(src, dest)
+
+
+def _sendfile(src, dest):
+    """Copy the file in the kernel, without passing the data through userspace."""
+    with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+        size = os.fstat(fsrc.fileno()).st_size
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(fdest.fileno(), fsrc.fileno(), offset, size - offset)
+            if not sent:
+                raise OSError(errno.EIO, "Short copy", src)
+            offset += sent
+    shutil.copystat(src, dest)
+
+
+# the different ways of copying a file (after trying to hard link it), from the
+# most to the least efficient one
+_COPY_STRATEGIES = [("reflink", _reflink)]
+if hasattr(os, "copy_file_range"):
+    _COPY_STRATEGIES.append(("copy_file_range", _copy_file_range))
+if hasattr(os, "sendfile"):
+    _COPY_STRATEGIES.append(("sendfile", _sendfile))
+
+# the copy strategies that are not possible between two devices, and the strategies
+# already informed as used between them
+_unsupported_copy_strategies = defaultdict(set)
+_informed_copy_strategies = set()
+
+
+def link_or_copy(src: pathlib.Path, dest: pathlib.Path) -> str:
+    """Hard link the src file in dest, or copy it as efficiently as possible.
+
+    After hard linking, it tries cloning the file (reflink), copying it inside the
+    kernel (copy_file_range, sendfile), and finally a regular copy. What can not be
+    used between two devices is remembered, so it's not tried again.
+
+    :returns: the name of the used strategy.
+    """
+    src = str(src)
+    dest = str(dest)
+    try:
+        os.link(src, dest)
+        return "hardlink"
+    except PermissionError:
+        # when not allowed to create hard links
+        pass
+    except OSError as exc:
+        if exc.errno not in (errno.EXDEV, errno.EMLINK):
+            raise
+
+    devices = (os.stat(src).st_dev, os.stat(os.path.dirname(dest)).st_dev)
+    unsupported = _unsupported_copy_strategies[devices]
+    for name, copy_function in _COPY_STRATEGIES + [("copy", shutil.copy2)]:
+        if name in unsupported:
+            continue
+        try:
+            copy_function(src, dest)
+        except OSError as exc:
+            if name == "copy":
+                raise
+            if os.path.lexists(dest):
+                os.unlink(dest)
+            if exc.errno in _UNSUPPORTED_COPY_ERRNOS:
+                logger.debug(
+                    "Cannot use %s to copy files from device %d to %d: %r",
+                    name,
+                    *devices,
+                    exc,
+                )
+                unsupported.add(name)
+            continue
+
+        if (devices, name) not in _informed_copy_strategies:
+            _informed_copy_strategies.add((devices, name))
+            logger.debug("Using %s to copy files from device %d to %d", name, *devices)
+        return name
+
+
 def load_yaml(fpath):
     """Return the content of a YAML file."""
     if not fpath.is_file():
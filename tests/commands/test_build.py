@@ -16,37 +16,52 @@
 
 import errno
 import filecmp
+import hashlib
+import io
+import json
 import logging
 import os
 import pathlib
+import py_compile
 import re
+import shutil
 import socket
+import stat
 import subprocess
 import sys
 import zipfile
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import dedent
 from typing import List
-from unittest.mock import call, patch
+from unittest.mock import ANY, call, patch
 
 import pytest
 import yaml
 
 from charmcraft import linters
 from charmcraft.bases import get_host_as_base
+from charmcraft.cache import DependenciesCache
 from charmcraft.cmdbase import CommandError
 from charmcraft.commands.build import (
     BUILD_DIRNAME,
+    BUILD_STATE_FILENAME,
     DISPATCH_CONTENT,
     DISPATCH_FILENAME,
+    DISPATCH_PYTHONPATH,
+    GIT_FILES_FILENAME,
     VENV_DIRNAME,
+    VENV_ZIP_FILENAME,
     Builder,
     Validator,
     format_charm_file_name,
+    get_wheel_platforms,
     polite_exec,
     relativise,
 )
 from charmcraft.config import Base, BasesConfiguration, load
+from charmcraft.fileindex import FileIndex
+from charmcraft.fingerprint import read_fingerprint
 from charmcraft.logsetup import message_handler
 from charmcraft.metadata import CHARM_METADATA
 
@@ -238,6 +253,73 @@ def test_validator_bases_index_invalid(bases_indices, config):
         validator.validate_bases_indices(bases_indices)
 
 
+def test_validator_jobs_default(config):
+    """The jobs number defaults to 1."""
+    validator = Validator(config)
+    assert validator.validate_jobs(None) == 1
+
+
+def test_validator_jobs_simple(config):
+    """The jobs number is respected."""
+    validator = Validator(config)
+    assert validator.validate_jobs(4) == 4
+
+
+@pytest.mark.parametrize("jobs", [0, -1])
+def test_validator_jobs_invalid(jobs, config):
+    """The jobs number must be at least 1."""
+    validator = Validator(config)
+    with pytest.raises(CommandError) as cm:
+        validator.validate_jobs(jobs)
+    assert str(cm.value) == f"Jobs number '{jobs}' is invalid (must be >= 1)."
+
+
+def test_validator_compression_default(config):
+    """The compression level defaults to 'default'."""
+    validator = Validator(config)
+    assert validator.validate_compression(None) == "default"
+
+
+@pytest.mark.parametrize("compression", ["none", "fast", "default", "max"])
+def test_validator_compression_simple(compression, config):
+    """The compression level is respected."""
+    validator = Validator(config)
+    assert validator.validate_compression(compression) == compression
+
+
+def test_validator_compression_invalid(config):
+    """The compression level must be a known one."""
+    validator = Validator(config)
+    with pytest.raises(CommandError) as cm:
+        validator.validate_compression("whatever")
+    assert str(cm.value) == (
+        "Compression level 'whatever' is invalid (must be one of none, fast, default, max)."
+    )
+
+
+def test_validator_venv_format_default(config):
+    """The venv format defaults to 'dir'."""
+    validator = Validator(config)
+    assert validator.validate_venv_format(None) == "dir"
+
+
+@pytest.mark.parametrize("venv_format", ["dir", "zip"])
+def test_validator_venv_format_simple(venv_format, config):
+    """The venv format is respected."""
+    validator = Validator(config)
+    assert validator.validate_venv_format(venv_format) == venv_format
+
+
+def test_validator_venv_format_invalid(config):
+    """The venv format must be a known one."""
+    validator = Validator(config)
+    with pytest.raises(CommandError) as cm:
+        validator.validate_venv_format("whatever")
+    assert str(cm.value) == (
+        "Venv format 'whatever' is invalid (must be one of dir, zip, resource)."
+    )
+
+
 def test_validator_entrypoint_simple(tmp_path, config):
     """'entrypoint' param: simple validation."""
     testfile = tmp_path / "testfile"
@@ -511,9 +593,9 @@ def test_build_basic_complete_structure(basic_project, caplog, monkeypatch, conf
     zf = zipfile.ZipFile(zipnames[0])
     assert zf.read("metadata.yaml") == metadata_raw
     assert zf.read("src/charm.py") == b"all the magic"
-    dispatch = DISPATCH_CONTENT.format(entrypoint_relative_path="src/charm.py").encode(
-        "ascii"
-    )
+    dispatch = DISPATCH_CONTENT.format(
+        entrypoint_relative_path="src/charm.py", pythonpath=DISPATCH_PYTHONPATH
+    ).encode("ascii")
     assert zf.read("dispatch") == dispatch
     assert zf.read("hooks/install") == dispatch
     assert zf.read("hooks/start") == dispatch
@@ -586,324 +668,960 @@ def test_build_with_charmcraft_yaml_managed_mode(
     assert "Building for 'bases[0]' as host matches 'build-on[0]'." in records
 
 
-def test_build_checks_provider(basic_project, mock_ensure_provider_is_available):
-    """Test cases for base-index parameter."""
+def _get_fingerprint_builder(basic_project, **extra_args):
+    """Return a Builder for the basic project, with the given extra arguments."""
     config = load(basic_project)
-    builder = Builder(
+    return Builder(
         {
             "from": basic_project,
             "entrypoint": basic_project / "src" / "charm.py",
             "requirement": [],
+            **extra_args,
         },
         config,
     )
 
-    with patch("charmcraft.commands.build.launched_environment"):
-        builder.run()
 
-    mock_ensure_provider_is_available.assert_called_once()
+def test_build_fingerprint_stable(basic_project):
+    """The fingerprint only depends on the inputs."""
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+    fingerprint = builder.get_fingerprint(bases_config)
+    assert fingerprint == builder.get_fingerprint(bases_config)
 
+    # ignored files and the charms built in the project don't affect it
+    (basic_project / "build" / "whatever").write_text("ignored")
+    (basic_project / "name-from-metadata.charm").write_text("built")
+    (basic_project / "name-from-metadata.venv-0123456789ab.zip").write_text("built")
+    assert fingerprint == builder.get_fingerprint(bases_config)
 
-def test_build_checks_provider_error(basic_project, mock_ensure_provider_is_available):
-    """Test cases for base-index parameter."""
-    mock_ensure_provider_is_available.side_effect = RuntimeError("foo")
-    config = load(basic_project)
-    builder = Builder(
-        {
-            "from": basic_project,
-            "entrypoint": basic_project / "src" / "charm.py",
-            "requirement": [],
-        },
-        config,
+
+@pytest.mark.parametrize(
+    "change",
+    [
+        lambda project: (project / "src" / "charm.py").write_text("new magic"),
+        lambda project: (project / "src" / "new.py").touch(),
+        lambda project: (project / "src" / "link").symlink_to("charm.py"),
+        lambda project: (project / "lib").chmod(0o700),
+        lambda project: (project / "src" / "charm.py").chmod(0o700),
+        lambda project: (project / "requirements.txt").write_text("ops"),
+    ],
+)
+def test_build_fingerprint_changes(basic_project, change):
+    """The fingerprint changes if something that affects the charm changes."""
+    (basic_project / "requirements.txt").touch()
+    builder = _get_fingerprint_builder(
+        basic_project, requirement=[basic_project / "requirements.txt"]
     )
+    bases_config = builder.config.bases[0]
+    fingerprint = builder.get_fingerprint(bases_config)
+
+    change(basic_project)
+    assert fingerprint != builder.get_fingerprint(bases_config)
+
+
+def test_build_fingerprint_options(basic_project):
+    """The fingerprint changes with the options that affect the charm."""
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+    fingerprint = builder.get_fingerprint(bases_config)
+    for extra_args in (
+        {"compression": "max"},
+        {"precompile": True},
+        {"venv_format": "zip"},
+    ):
+        other_builder = _get_fingerprint_builder(basic_project, **extra_args)
+        assert fingerprint != other_builder.get_fingerprint(bases_config)
 
-    with pytest.raises(RuntimeError, match="foo"):
-        builder.run()
 
-    mock_ensure_provider_is_available.assert_called_once()
+def test_build_fingerprint_in_manifest(basic_project, monkeypatch):
+    """The built charm includes its fingerprint in the manifest."""
+    monkeypatch.chdir(basic_project)
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+    fingerprint = builder.get_fingerprint(bases_config)
 
+    zipname = builder.build_charm(bases_config)
 
-def test_build_without_charmcraft_yaml_issues_dn02(basic_project, caplog, monkeypatch):
-    """Test cases for base-index parameter."""
-    config = load(basic_project)
-    builder = Builder(
-        {
-            "from": basic_project,
-            "entrypoint": basic_project / "src" / "charm.py",
-            "requirement": [],
-        },
-        config,
-    )
+    assert read_fingerprint(basic_project / zipname) == fingerprint
 
-    with patch("charmcraft.commands.build.launched_environment"):
-        builder.run()
 
-    assert "DEPRECATED: A charmcraft.yaml configuration file is now required." in [
-        r.message for r in caplog.records
+def test_build_skipped_when_up_to_date(
+    basic_project, tmp_path_factory, monkeypatch, caplog
+):
+    """The charm is not built again if it's there and nothing changed."""
+    caplog.set_level(logging.INFO, logger="charmcraft.commands")
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+    zipname = builder.build_charm(bases_config)
+
+    with patch.object(builder, "pack_charm_in_instance") as mock_pack:
+        zipnames = builder.run()
+
+    mock_pack.assert_not_called()
+    assert zipnames == [zipname]
+    assert f"Skipping 'bases[0]': charm {zipname!r} is up to date." in [
+        rec.message for rec in caplog.records
     ]
 
 
-def test_build_multiple_with_charmcraft_yaml_destructive_mode(
-    basic_project_builder, monkeypatch, caplog
+def test_build_not_skipped_when_changed(basic_project, tmp_path_factory, monkeypatch):
+    """The charm is built again if something changed."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+    zipname = builder.build_charm(bases_config)
+    (basic_project / "src" / "charm.py").write_text("new magic")
+
+    with patch.object(builder, "pack_charm_in_instance") as mock_pack:
+        mock_pack.return_value = zipname
+        builder.run()
+
+    mock_pack.assert_called_once()
+
+
+def test_build_not_skipped_when_mode_changed(
+    basic_project, tmp_path_factory, monkeypatch
 ):
-    """Build multiple charms for multiple matching bases, skipping one unmatched config."""
-    caplog.set_level(logging.DEBUG)
-    host_base = get_host_as_base()
-    unmatched_base = Base(
-        name="unmatched-name",
-        channel="unmatched-channel",
-        architectures=["unmatched-arch1"],
-    )
-    matched_cross_base = Base(
-        name="cross-name",
-        channel="cross-channel",
-        architectures=["cross-arch1"],
-    )
-    builder = basic_project_builder(
-        [
-            BasesConfiguration(**{"build-on": [host_base], "run-on": [host_base]}),
-            BasesConfiguration(
-                **{"build-on": [unmatched_base], "run-on": [unmatched_base]}
-            ),
-            BasesConfiguration(
-                **{"build-on": [host_base], "run-on": [matched_cross_base]}
-            ),
-        ]
-    )
+    """The charm is built again if only the mode of a file changed."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    hook_path = basic_project / "hooks" / "foo"
+    hook_path.parent.mkdir()
+    hook_path.write_text("hook")
+    hook_path.chmod(0o644)
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+    zipname = builder.build_charm(bases_config)
+    hook_path.chmod(0o755)
+
+    with patch.object(builder, "pack_charm_in_instance") as mock_pack:
+        mock_pack.return_value = zipname
+        builder.run()
 
-    zipnames = builder.run(destructive_mode=True)
+    mock_pack.assert_called_once()
 
-    host_arch = host_base.architectures[0]
-    assert zipnames == [
-        f"name-from-metadata_{host_base.name}-{host_base.channel}-{host_arch}.charm",
-        "name-from-metadata_cross-name-cross-channel-cross-arch1.charm",
-    ]
 
-    records = [r.message for r in caplog.records]
+def test_build_not_skipped_when_forced(basic_project, tmp_path_factory, monkeypatch):
+    """The charm is built again if forced."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project, force=True)
+    bases_config = builder.config.bases[0]
+    zipname = builder.build_charm(bases_config)
 
-    assert "Building for 'bases[0]' as host matches 'build-on[0]'." in records
-    assert (
-        "No suitable 'build-on' environment found in 'bases[1]' configuration."
-        in records
-    )
-    assert "Building for 'bases[2]' as host matches 'build-on[0]'." in records
+    with patch.object(builder, "pack_charm_in_instance") as mock_pack:
+        mock_pack.return_value = zipname
+        builder.run()
 
+    mock_pack.assert_called_once()
 
-def test_build_multiple_with_charmcraft_yaml_managed_mode(
-    basic_project_builder, monkeypatch, caplog
+
+def test_build_not_skipped_in_managed_mode(
+    basic_project, tmp_path_factory, monkeypatch
 ):
-    """Build multiple charms for multiple matching bases, skipping one unmatched config."""
-    caplog.set_level(logging.DEBUG)
-    host_base = get_host_as_base()
-    unmatched_base = Base(
-        name="unmatched-name",
-        channel="unmatched-channel",
-        architectures=["unmatched-arch1"],
+    """Inside the instance the charm is always built, the host already decided."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+    zipname = builder.build_charm(bases_config)
+
+    with patch.object(builder, "build_charm") as mock_build:
+        mock_build.return_value = zipname
+        with patch(
+            "charmcraft.commands.build.check_if_base_matches_host",
+            return_value=(True, None),
+        ):
+            builder.run()
+
+    mock_build.assert_called_once()
+
+
+def test_build_project_walked_once(basic_project, tmp_path_factory, monkeypatch):
+    """The project is walked only once in the whole build."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+
+    with patch.object(FileIndex, "build", wraps=FileIndex.build) as mock_build:
+        with patch("os.walk", wraps=os.walk) as mock_walk:
+            zipname = builder.build_charm(bases_config)
+
+    mock_build.assert_called_once()
+    mock_walk.assert_called_once_with(
+        basic_project / BUILD_DIRNAME / "venv", followlinks=True
     )
-    matched_cross_base = Base(
-        name="cross-name",
-        channel="cross-channel",
-        architectures=["cross-arch1"],
+    with zipfile.ZipFile(zipname) as zf:
+        assert "lib/ops/stuff.txt" in zf.namelist()
+
+
+def test_build_overlay_mounted(basic_project, tmp_path_factory, monkeypatch):
+    """With an overlay the project files are not linked in the build directory."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project, overlay=True)
+    bases_config = builder.config.bases[0]
+    overlay_dirpath = tmp_path_factory.mktemp("overlay")
+    link_project = builder.handle_generic_paths
+
+    def fake_mount():
+        # simulate the lower layer being visible through the build directory
+        link_project()
+        return overlay_dirpath
+
+    with patch.object(builder, "mount_overlay", side_effect=fake_mount):
+        with patch.object(builder, "unmount_overlay") as mock_unmount:
+            with patch.object(builder, "handle_generic_paths") as mock_link:
+                zipname = builder.build_charm(bases_config)
+
+    mock_link.assert_not_called()
+    mock_unmount.assert_called_once_with(overlay_dirpath)
+    with zipfile.ZipFile(zipname) as zf:
+        assert "lib/ops/stuff.txt" in zf.namelist()
+        assert "dispatch" in zf.namelist()
+
+
+def test_build_overlay_unmounted_on_error(basic_project, monkeypatch):
+    """The overlay is unmounted even if the build fails."""
+    builder = _get_fingerprint_builder(basic_project, overlay=True)
+    bases_config = builder.config.bases[0]
+
+    with patch.object(builder, "mount_overlay", return_value=pathlib.Path("/tmp/x")):
+        with patch.object(builder, "unmount_overlay") as mock_unmount:
+            with patch.object(builder, "_build_charm", side_effect=CommandError("no")):
+                with pytest.raises(CommandError):
+                    builder.build_charm(bases_config)
+
+    mock_unmount.assert_called_once_with(pathlib.Path("/tmp/x"))
+
+
+def test_build_overlay_fallback(basic_project, tmp_path_factory, monkeypatch, caplog):
+    """If the overlay can not be mounted the project files are linked as usual."""
+    caplog.set_level(logging.DEBUG, logger="charmcraft.commands")
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project, overlay=True)
+    bases_config = builder.config.bases[0]
+
+    error = subprocess.CalledProcessError(32, ["mount"], output="permission denied")
+    with patch("charmcraft.commands.build.subprocess.run", side_effect=error):
+        with patch.object(builder, "unmount_overlay") as mock_unmount:
+            zipname = builder.build_charm(bases_config)
+
+    mock_unmount.assert_not_called()
+    assert any(
+        rec.message.startswith("Cannot use an overlay for the build, linking files")
+        for rec in caplog.records
     )
-    builder = basic_project_builder(
-        [
-            BasesConfiguration(**{"build-on": [host_base], "run-on": [host_base]}),
-            BasesConfiguration(
-                **{"build-on": [unmatched_base], "run-on": [unmatched_base]}
-            ),
-            BasesConfiguration(
-                **{"build-on": [host_base], "run-on": [matched_cross_base]}
-            ),
+    assert (basic_project / BUILD_DIRNAME / "lib" / "ops" / "stuff.txt").exists()
+    with zipfile.ZipFile(zipname) as zf:
+        assert "lib/ops/stuff.txt" in zf.namelist()
+
+
+def test_build_overlay_mount_command(basic_project):
+    """The build directory is mounted with the project as the lower layer."""
+    builder = _get_fingerprint_builder(basic_project, overlay=True)
+
+    with patch("charmcraft.commands.build.subprocess.run") as mock_run:
+        overlay_dirpath = builder.mount_overlay()
+    try:
+        (cmd,), _ = mock_run.call_args
+        assert cmd == [
+            "mount",
+            "-t",
+            "overlay",
+            "overlay",
+            "-o",
+            f"lowerdir={basic_project},upperdir={overlay_dirpath / 'upper'},"
+            f"workdir={overlay_dirpath / 'work'}",
+            str(basic_project / BUILD_DIRNAME),
         ]
-    )
 
-    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
-    zipnames = builder.run()
+        with patch("charmcraft.commands.build.subprocess.run") as mock_run:
+            builder.unmount_overlay(overlay_dirpath)
+        (cmd,), _ = mock_run.call_args
+        assert cmd == ["umount", str(basic_project / BUILD_DIRNAME)]
+        assert not overlay_dirpath.exists()
+    finally:
+        shutil.rmtree(str(overlay_dirpath), ignore_errors=True)
+
+
+def test_build_overlay_ignored_paths_hidden(basic_project):
+    """The ignored project paths are covered with whiteouts in the upper layer."""
+    (basic_project / "venv" / "lib").mkdir(parents=True)
+    (basic_project / "venv" / "lib" / "site.py").write_text("developer's venv")
+    (basic_project / "hooks").mkdir()
+    (basic_project / "hooks" / "install").write_text("the hook")
+    (basic_project / "hooks" / "install~").write_text("backup")
+    (basic_project / ".jujuignore").write_text("/venv\n*~\n")
+    builder = _get_fingerprint_builder(basic_project, overlay=True)
+
+    with patch("charmcraft.commands.build.subprocess.run"):
+        overlay_dirpath = builder.mount_overlay()
+    try:
+        upperdir = overlay_dirpath / "upper"
+        whiteouts = [
+            str(path.relative_to(upperdir))
+            for path in sorted(upperdir.rglob("*"))
+            if stat.S_ISCHR(path.lstat().st_mode)
+        ]
+        assert whiteouts == [".jujuignore", "build", "hooks/install~", "venv"]
+        assert os.lstat(str(upperdir / "venv")).st_rdev == os.makedev(0, 0)
+    finally:
+        shutil.rmtree(str(overlay_dirpath), ignore_errors=True)
 
-    host_arch = host_base.architectures[0]
-    assert zipnames == [
-        f"name-from-metadata_{host_base.name}-{host_base.channel}-{host_arch}.charm",
-        "name-from-metadata_cross-name-cross-channel-cross-arch1.charm",
-    ]
 
-    records = [r.message for r in caplog.records]
+def test_build_overlay_cannot_hide_ignored_paths(basic_project, caplog):
+    """If the whiteouts can not be created the overlay is not used."""
+    caplog.set_level(logging.DEBUG, logger="charmcraft.commands")
+    (basic_project / "venv").mkdir()
+    (basic_project / ".jujuignore").write_text("/venv\n")
+    builder = _get_fingerprint_builder(basic_project, overlay=True)
 
-    assert "Building for 'bases[0]' as host matches 'build-on[0]'." in records
-    assert (
-        "No suitable 'build-on' environment found in 'bases[1]' configuration."
-        in records
+    with patch("charmcraft.commands.build.subprocess.run") as mock_run:
+        with patch("os.mknod", side_effect=PermissionError("not allowed")):
+            assert builder.mount_overlay() is None
+
+    mock_run.assert_not_called()
+    assert any(
+        rec.message.startswith("Cannot use an overlay for the build, linking files")
+        for rec in caplog.records
     )
-    assert "Building for 'bases[2]' as host matches 'build-on[0]'." in records
 
 
-def test_build_project_is_cwd(
+@pytest.mark.parametrize(
+    "options, flags",
+    [
+        ({"overlay": True}, ["--overlay"]),
+        ({"git_files": True}, ["--git-files"]),
+        ({"precompile": True}, ["--precompile"]),
+        ({"venv_format": "zip"}, ["--venv-format", "zip"]),
+        ({"incremental": True}, ["--incremental"]),
+        ({"stream": True}, ["--stream"]),
+        ({"compression": "max"}, ["--compression", "max"]),
+        ({"repack": True}, ["--repack"]),
+    ],
+)
+def test_build_options_forwarded_to_instance(
     basic_project,
-    caplog,
     mock_capture_logs_from_instance,
     mock_ensure_provider_is_available,
     monkeypatch,
+    options,
+    flags,
 ):
-    """Test cases for base-index parameter."""
-    mode = message_handler.NORMAL
-    monkeypatch.setattr(message_handler, "mode", mode)
-    host_base = get_host_as_base()
-    host_arch = host_base.architectures[0]
-    charmcraft_file = basic_project / "charmcraft.yaml"
-    charmcraft_file.write_text(
-        dedent(
-            f"""\
-                type: charm
-                bases:
-                  - name: ubuntu
-                    channel: "18.04"
-                    architectures: {host_base.architectures!r}
-                """
-        )
-    )
-    config = load(basic_project)
-    builder = Builder(
-        {
-            "from": basic_project,
-            "entrypoint": basic_project / "src" / "charm.py",
-            "requirement": [],
-        },
-        config,
-    )
+    """The options are used when packing inside the instance."""
+    monkeypatch.setattr(message_handler, "mode", message_handler.NORMAL)
+    builder = _get_fingerprint_builder(basic_project, **options)
+    config = builder.config
 
     monkeypatch.chdir(basic_project)
     with patch("charmcraft.commands.build.launched_environment") as mock_launch:
-        zipnames = builder.run([0])
+        with patch(
+            "charmcraft.commands.build.get_git_files", return_value=["src/charm.py"]
+        ):
+            builder.pack_charm_in_instance(
+                bases_index=0, build_on=config.bases[0].build_on[0], build_on_index=0
+            )
 
-    assert zipnames == [
-        f"name-from-metadata_ubuntu-18.04-{host_arch}.charm",
-    ]
-    assert mock_launch.mock_calls == [
-        call(
-            charm_name="name-from-metadata",
-            project_path=basic_project,
-            base=Base(name="ubuntu", channel="18.04", architectures=[host_arch]),
-            bases_index=0,
-            build_on_index=0,
-        ),
-        call().__enter__(),
-        call()
-        .__enter__()
-        .execute_run(
-            ["charmcraft", "pack", "--bases-index", "0"],
-            check=True,
-            cwd="/root/project",
-        ),
-        call().__exit__(None, None, None),
-    ]
+    assert mock_launch.mock_calls[2] == call().__enter__().execute_run(
+        ["charmcraft", "pack", "--bases-index", "0", *flags],
+        check=True,
+        cwd="/root/project",
+    )
+    # the git files are listed in the host, as git may not be usable in the instance
+    git_files_path = basic_project / BUILD_DIRNAME / GIT_FILES_FILENAME
+    assert git_files_path.exists() == ("--git-files" in flags)
 
 
-def test_build_project_is_not_cwd(
-    basic_project,
-    caplog,
-    mock_capture_logs_from_instance,
-    mock_ensure_provider_is_available,
-    monkeypatch,
-):
-    """Test cases for base-index parameter."""
-    mode = message_handler.NORMAL
-    monkeypatch.setattr(message_handler, "mode", mode)
-    host_base = get_host_as_base()
-    host_arch = host_base.architectures[0]
-    charmcraft_file = basic_project / "charmcraft.yaml"
-    charmcraft_file.write_text(
-        dedent(
-            f"""\
-                type: charm
-                bases:
-                  - name: ubuntu
-                    channel: "18.04"
-                    architectures: {host_base.architectures!r}
-                """
-        )
-    )
-    config = load(basic_project)
-    builder = Builder(
-        {
-            "from": basic_project,
-            "entrypoint": basic_project / "src" / "charm.py",
-            "requirement": [],
-        },
-        config,
+def test_build_git_files_from_host(basic_project, monkeypatch):
+    """Inside the instance the files listed in the host are used, not git."""
+    builder = _get_fingerprint_builder(basic_project, git_files=True)
+    with patch(
+        "charmcraft.commands.build.get_git_files",
+        return_value=["metadata.yaml", "src/charm.py", "dir with spaces/file"],
+    ):
+        builder.save_git_files()
+
+    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    with patch(
+        "charmcraft.commands.build.get_git_files",
+        side_effect=AssertionError("git used in the instance"),
+    ):
+        assert builder._get_git_files() == [
+            "metadata.yaml",
+            "src/charm.py",
+            "dir with spaces/file",
+        ]
+
+
+def test_build_git_files_from_host_not_in_git(basic_project, monkeypatch):
+    """If the project is not in git the previous list is removed, and it's walked."""
+    builder = _get_fingerprint_builder(basic_project, git_files=True)
+    with patch("charmcraft.commands.build.get_git_files", return_value=["stale"]):
+        builder.save_git_files()
+    with patch("charmcraft.commands.build.get_git_files", return_value=None):
+        builder.save_git_files()
+
+    assert not (basic_project / BUILD_DIRNAME / GIT_FILES_FILENAME).exists()
+    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    assert builder._get_git_files() is None
+
+
+def test_build_precompile(basic_project, tmp_path_factory, monkeypatch):
+    """The Python files are byte-compiled into checked hash pycs."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    (basic_project / "src" / "charm.py").write_text("value = 42")
+    (basic_project / "lib" / "ops" / "module.py").write_text("value = 42")
+    (basic_project / "ignored.py").write_text("value = 42")
+    (basic_project / ".jujuignore").write_text("ignored.py")
+    builder = _get_fingerprint_builder(basic_project, precompile=True)
+    bases_config = builder.config.bases[0]
+
+    zipname = builder.build_charm(bases_config)
+
+    with zipfile.ZipFile(zipname) as zf:
+        pycs = [name for name in zf.namelist() if name.endswith(".pyc")]
+        assert sorted(name.split("/__pycache__/")[0] for name in pycs) == [
+            "lib/ops",
+            "src",
+        ]
+        for name in pycs:
+            # the flags after the magic number: hash based and checked
+            assert zf.read(name)[4:8] == b"\x03\x00\x00\x00"
+    # the project itself is not touched
+    assert not (basic_project / "src" / "__pycache__").exists()
+
+
+def test_build_precompile_replaces_timestamp_pycs(basic_project):
+    """The pycs already in the venv (e.g. written by pip) are compiled again."""
+    builder = _get_fingerprint_builder(basic_project, precompile=True)
+    module_path = builder.buildpath / "venv" / "module.py"
+    module_path.parent.mkdir(parents=True)
+    module_path.write_text("value = 42")
+    py_compile.compile(
+        str(module_path), invalidation_mode=py_compile.PycInvalidationMode.TIMESTAMP
     )
 
-    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
-        zipnames = builder.run([0])
+    builder.handle_precompile({})
 
-    assert zipnames == [
-        f"name-from-metadata_ubuntu-18.04-{host_arch}.charm",
+    (pyc_path,) = (module_path.parent / "__pycache__").iterdir()
+    # the flags after the magic number: hash based and checked
+    assert pyc_path.read_bytes()[4:8] == b"\x03\x00\x00\x00"
+
+
+def test_build_precompile_not_supported(basic_project, caplog):
+    """Pythons without checked hash pycs don't get the files precompiled."""
+    builder = _get_fingerprint_builder(basic_project, precompile=True)
+
+    with patch(
+        "charmcraft.commands.build._get_python_version", return_value="Python 3.6.9"
+    ):
+        with patch("charmcraft.commands.build.polite_exec") as mock_exec:
+            precompiled = builder.handle_precompile({"src/charm.py": None})
+
+    assert precompiled == {}
+    mock_exec.assert_not_called()
+    assert (
+        "Cannot precompile Python files: checked hash pycs are not supported by "
+        "'Python 3.6.9'" in [rec.message for rec in caplog.records]
+    )
+
+
+def test_build_precompile_error(basic_project, caplog):
+    """Files that can not be precompiled are left as they are."""
+    (basic_project / "src" / "other.py").write_text("print('ok')")
+    builder = _get_fingerprint_builder(basic_project, precompile=True)
+    builder.handle_generic_paths()
+
+    precompiled = builder.handle_precompile(
+        {"src/charm.py": None, "src/other.py": None}
+    )
+
+    # the charm.py in the basic project is not valid Python
+    assert [path.split(".")[0] for path in precompiled] == ["src/__pycache__/other"]
+    assert "Some Python files could not be precompiled" in [
+        rec.message for rec in caplog.records
     ]
-    assert mock_launch.mock_calls == [
-        call(
-            charm_name="name-from-metadata",
-            project_path=basic_project,
-            base=Base(name="ubuntu", channel="18.04", architectures=[host_arch]),
-            bases_index=0,
-            build_on_index=0,
-        ),
-        call().__enter__(),
-        call()
-        .__enter__()
-        .execute_run(
-            ["charmcraft", "pack", "--bases-index", "0"],
-            check=True,
-            cwd="/root",
-        ),
-        call()
-        .__enter__()
-        .pull_file(
-            source=pathlib.Path("/root") / zipnames[0],
-            destination=pathlib.Path.cwd() / zipnames[0],
-        ),
-        call().__exit__(None, None, None),
+
+
+def _fake_venv_installation(builder):
+    """Return a function that fills the venv with pure and native packages."""
+
+    def install():
+        venvpath = builder.buildpath / VENV_DIRNAME
+        for relpath, content in [
+            ("purepkg/__init__.py", "value = 42"),
+            ("purepkg/__pycache__/__init__.cpython-38.pyc", "compiled"),
+            ("purepkg-1.0.dist-info/METADATA", "metadata"),
+            ("nativepkg/__init__.py", "from ._ext import *"),
+            ("nativepkg/_ext.cpython-38-x86_64-linux-gnu.so", "native"),
+            ("nativepkg.libs/libstuff-1234.so.1.0", "native"),
+            ("bin/script", "#!/bin/sh"),
+            ("six.py", "six = 6"),
+        ]:
+            path = venvpath / relpath
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(content)
+
+    return install
+
+
+def test_build_venv_zip(basic_project, tmp_path_factory, monkeypatch):
+    """The venv is packed in a zip, but for what can't be imported from it."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project, venv_format="zip")
+    bases_config = builder.config.bases[0]
+
+    with patch.object(
+        builder, "handle_dependencies", side_effect=_fake_venv_installation(builder)
+    ):
+        zipname = builder.build_charm(bases_config)
+
+    with zipfile.ZipFile(zipname) as zf:
+        venv_members = [name for name in zf.namelist() if name.startswith(VENV_DIRNAME)]
+        assert venv_members == [
+            "venv.zip",
+            "venv/bin/script",
+            "venv/nativepkg.libs/libstuff-1234.so.1.0",
+            "venv/nativepkg/__init__.py",
+            "venv/nativepkg/_ext.cpython-38-x86_64-linux-gnu.so",
+        ]
+        assert b"PYTHONPATH=lib:venv:venv.zip " in zf.read("dispatch")
+        venv_zip = zipfile.ZipFile(io.BytesIO(zf.read("venv.zip")))
+
+    assert venv_zip.namelist() == [
+        "purepkg/__init__.py",
+        "purepkg/__init__.pyc",
+        "purepkg-1.0.dist-info/METADATA",
+        "six.py",
     ]
+    assert venv_zip.read("purepkg/__init__.pyc") == b"compiled"
 
 
-@pytest.mark.parametrize(
-    "mode,cmd_flags",
-    [
-        (message_handler.VERBOSE, ["--verbose"]),
-        (message_handler.QUIET, ["--quiet"]),
-        (message_handler.NORMAL, []),
-    ],
-)
-def test_build_bases_index_scenarios_provider(
-    mode,
-    cmd_flags,
+def test_build_venv_zip_importable(basic_project, tmp_path_factory, monkeypatch):
+    """The modules in the venv zip can be imported."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project, venv_format="zip")
+    _fake_venv_installation(builder)()
+
+    (venv_zip_path,) = builder.handle_venv_zip().values()
+
+    cmd = [sys.executable, "-c", "import purepkg, six; print(purepkg.value, six.six)"]
+    proc = subprocess.run(
+        cmd,
+        env={"PYTHONPATH": str(venv_zip_path)},
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    assert proc.stdout == b"42 6\n"
+
+
+def test_build_venv_zip_no_venv(basic_project):
+    """Nothing is packed if there is no venv."""
+    builder = _get_fingerprint_builder(basic_project, venv_format="zip")
+    assert builder.handle_venv_zip() == {}
+    assert not (basic_project / BUILD_DIRNAME / VENV_ZIP_FILENAME).exists()
+
+
+def test_build_venv_resource(basic_project, tmp_path_factory, monkeypatch):
+    """The venv is moved to an archive next to the charm, declared as a resource."""
+    output_dir = tmp_path_factory.mktemp("output")
+    monkeypatch.chdir(output_dir)
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    bases_config = builder.config.bases[0]
+
+    with patch.object(
+        builder, "handle_dependencies", side_effect=_fake_venv_installation(builder)
+    ):
+        zipname = builder.build_charm(bases_config)
+
+    with zipfile.ZipFile(zipname) as zf:
+        assert not [name for name in zf.namelist() if name.startswith(VENV_DIRNAME)]
+        metadata = yaml.safe_load(zf.read("metadata.yaml"))
+        manifest = yaml.safe_load(zf.read("manifest.yaml"))
+        dispatch = zf.read("dispatch").decode("utf8")
+
+    venv_resource = manifest["venv-resource"]
+    resource_path = output_dir / venv_resource["filename"]
+    assert venv_resource["name"] == "venv"
+    assert (
+        venv_resource["sha256"]
+        == hashlib.sha256(resource_path.read_bytes()).hexdigest()
+    )
+    assert venv_resource["filename"] == (
+        zipname[: -len(".charm")] + ".venv-" + venv_resource["sha256"][:12] + ".zip"
+    )
+    assert metadata["name"] == "name-from-metadata"
+    assert metadata["resources"]["venv"]["type"] == "file"
+    assert metadata["resources"]["venv"]["filename"] == "venv.zip"
+    assert venv_resource["sha256"] in dispatch
+
+    with zipfile.ZipFile(str(resource_path)) as zf:
+        assert "purepkg/__init__.py" in zf.namelist()
+        assert "nativepkg/_ext.cpython-38-x86_64-linux-gnu.so" in zf.namelist()
+
+    # the project's metadata is untouched
+    assert "resources" not in yaml.safe_load(
+        (basic_project / "metadata.yaml").read_text()
+    )
+
+
+def test_build_venv_resource_in_project(basic_project, monkeypatch):
+    """Building from the project directory, the archive doesn't change the next build."""
+    monkeypatch.chdir(basic_project)
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    bases_config = builder.config.bases[0]
+    fingerprint = builder.get_fingerprint(bases_config)
+
+    with patch.object(
+        builder, "handle_dependencies", side_effect=_fake_venv_installation(builder)
+    ):
+        builder.build_charm(bases_config)
+    (resource_path,) = basic_project.glob("*.venv-*.zip")
+
+    assert builder.get_fingerprint(bases_config) == fingerprint
+    charm_files = builder.collect_project_files(warn=False)
+    assert resource_path.name not in charm_files
+
+
+def test_build_venv_resource_deterministic(
+    basic_project, tmp_path_factory, monkeypatch
+):
+    """Building again the same venv gives exactly the same archive."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    bases_config = builder.config.bases[0]
+
+    resources = []
+    for timestamp in (1000000000, 1234567890):
+        _fake_venv_installation(builder)()
+        os.utime(str(builder.buildpath / VENV_DIRNAME / "six.py"), (timestamp,) * 2)
+        (builder.buildpath / "metadata.yaml").write_text("name: name-from-metadata")
+        _, venv_resource = builder.handle_venv_resource({}, bases_config)
+        resources.append(venv_resource)
+
+    assert resources[0] == resources[1]
+
+
+def test_build_venv_resource_dispatch(basic_project, tmp_path_factory, monkeypatch):
+    """The dispatch unpacks the resource once, and runs the charm with the venv."""
+    output_dir = tmp_path_factory.mktemp("output")
+    monkeypatch.chdir(output_dir)
+    (basic_project / "src" / "charm.py").write_text(
+        "#!/usr/bin/env python3\nimport purepkg, six\nprint(purepkg.value, six.six)\n"
+    )
+    (basic_project / "src" / "charm.py").chmod(0o755)
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    bases_config = builder.config.bases[0]
+    with patch.object(
+        builder, "handle_dependencies", side_effect=_fake_venv_installation(builder)
+    ):
+        zipname = builder.build_charm(bases_config)
+    with zipfile.ZipFile(zipname) as zf:
+        venv_resource = yaml.safe_load(zf.read("manifest.yaml"))["venv-resource"]
+
+    # a unit with the charm, and a fake resource-get that gives the built archive
+    unit_dir = tmp_path_factory.mktemp("unit")
+    charm_dir = unit_dir / "charm"
+    charm_dir.mkdir()
+    (charm_dir / "src").mkdir()
+    with zipfile.ZipFile(zipname) as zf:
+        for name in ("dispatch", "src/charm.py"):
+            (charm_dir / name).write_bytes(zf.read(name))
+            (charm_dir / name).chmod(0o755)
+    tools_dir = tmp_path_factory.mktemp("tools")
+    resource_get = tools_dir / "resource-get"
+    resource_get.write_text(
+        "#!/bin/sh\necho {}\n".format(output_dir / venv_resource["filename"])
+    )
+    resource_get.chmod(0o755)
+    env = dict(os.environ, PATH="{}:{}".format(tools_dir, os.environ["PATH"]))
+
+    for _ in range(2):
+        proc = subprocess.run(
+            ["./dispatch"], cwd=str(charm_dir), env=env, stdout=subprocess.PIPE
+        )
+        assert proc.returncode == 0
+        assert proc.stdout == b"42 6\n"
+        # the second time it's already unpacked
+        resource_get.write_text("#!/bin/sh\nexit 1\n")
+
+    venv_dirs = [path.name for path in unit_dir.iterdir() if path.name != "charm"]
+    assert venv_dirs == [".charm-venv-" + venv_resource["sha256"]]
+
+
+def test_build_venv_resource_dispatch_wrong_resource(
+    basic_project, tmp_path_factory, monkeypatch
+):
+    """The dispatch fails if the resource is not the one built with the charm."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    _fake_venv_installation(builder)()
+    (builder.buildpath / "metadata.yaml").write_text("name: name-from-metadata")
+    builder.handle_venv_resource({}, builder.config.bases[0])
+
+    unit_dir = tmp_path_factory.mktemp("unit")
+    charm_dir = unit_dir / "charm"
+    charm_dir.mkdir()
+    shutil.copy(str(builder.buildpath / "dispatch"), str(charm_dir / "dispatch"))
+    tools_dir = tmp_path_factory.mktemp("tools")
+    other_resource = tools_dir / "venv.zip"
+    with zipfile.ZipFile(str(other_resource), "w") as zf:
+        zf.writestr("other.py", "")
+    resource_get = tools_dir / "resource-get"
+    resource_get.write_text("#!/bin/sh\necho {}\n".format(other_resource))
+    resource_get.chmod(0o755)
+    env = dict(os.environ, PATH="{}:{}".format(tools_dir, os.environ["PATH"]))
+
+    proc = subprocess.run(
+        ["./dispatch"], cwd=str(charm_dir), env=env, stderr=subprocess.PIPE
+    )
+
+    assert proc.returncode == 1
+    assert b"The 'venv' resource is not the one built for this charm" in proc.stderr
+    assert list(unit_dir.iterdir()) == [charm_dir]
+
+
+def test_build_venv_resource_no_venv(basic_project):
+    """Nothing is moved to a resource if there is no venv."""
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    assert builder.handle_venv_resource({}, builder.config.bases[0]) == ({}, None)
+
+
+def test_build_venv_resource_project_dispatch(basic_project):
+    """The venv can't be moved to a resource if the project has its own dispatch."""
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    _fake_venv_installation(builder)()
+
+    with pytest.raises(CommandError) as cm:
+        builder.handle_venv_resource(
+            {"dispatch": basic_project / "dispatch"}, builder.config.bases[0]
+        )
+    assert str(cm.value) == (
+        "Cannot put the venv in a resource as the project provides its own "
+        "dispatch script."
+    )
+
+
+def test_build_venv_resource_already_declared(basic_project):
+    """The venv can't be moved to a resource if the charm declares one with its name."""
+    (basic_project / "metadata.yaml").write_text(
+        "name: name-from-metadata\nresources:\n  venv:\n    type: file\n"
+    )
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    _fake_venv_installation(builder)()
+
+    with pytest.raises(CommandError) as cm:
+        builder.handle_venv_resource({}, builder.config.bases[0])
+    assert str(cm.value) == (
+        "Cannot put the venv in a resource as the charm already declares "
+        "a 'venv' resource."
+    )
+
+
+def test_build_venv_resource_keeps_other_resources(
+    basic_project, tmp_path_factory, monkeypatch
+):
+    """The resources already declared by the charm are kept."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    (basic_project / "metadata.yaml").write_text(
+        "name: name-from-metadata\nresources:\n  image:\n    type: oci-image\n"
+    )
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    _fake_venv_installation(builder)()
+
+    (metadata_path,) = builder.handle_venv_resource({}, builder.config.bases[0])[
+        0
+    ].values()
+
+    resources = yaml.safe_load(metadata_path.read_text())["resources"]
+    assert list(resources) == ["image", "venv"]
+    assert resources["image"] == {"type": "oci-image"}
+
+
+def test_build_not_skipped_when_venv_resource_missing(
+    basic_project, tmp_path_factory, monkeypatch
+):
+    """The charm is built again if its venv resource is not there anymore."""
+    output_dir = tmp_path_factory.mktemp("output")
+    monkeypatch.chdir(output_dir)
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    bases_config = builder.config.bases[0]
+    with patch.object(
+        builder, "handle_dependencies", side_effect=_fake_venv_installation(builder)
+    ):
+        zipname = builder.build_charm(bases_config)
+    assert builder.is_charm_up_to_date(zipname, bases_config)
+
+    (resource_path,) = output_dir.glob("*.venv-*.zip")
+    resource_path.unlink()
+    assert not builder.is_charm_up_to_date(zipname, bases_config)
+
+
+def test_build_venv_resource_pulled_from_instance(
     basic_project,
-    caplog,
     mock_capture_logs_from_instance,
     mock_ensure_provider_is_available,
+    tmp_path_factory,
     monkeypatch,
 ):
-    """Test cases for base-index parameter."""
-    monkeypatch.setattr(message_handler, "mode", mode)
-    host_base = get_host_as_base()
-    host_arch = host_base.architectures[0]
-    charmcraft_file = basic_project / "charmcraft.yaml"
-    charmcraft_file.write_text(
+    """The venv resource is retrieved from the instance together with the charm."""
+    cwd = tmp_path_factory.mktemp("output")
+    monkeypatch.chdir(cwd)
+    builder = _get_fingerprint_builder(basic_project, venv_format="resource")
+    config = builder.config
+    venv_resource = {"name": "venv", "filename": "test.venv-1234.zip", "sha256": "1234"}
+
+    def fake_pull_file(*, source, destination):
+        if source.name.endswith(".charm"):
+            with zipfile.ZipFile(str(destination), "w") as zf:
+                zf.writestr(
+                    "manifest.yaml", yaml.dump({"venv-resource": venv_resource})
+                )
+        else:
+            destination.write_text("venv content")
+
+    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
+        instance = mock_launch.return_value.__enter__.return_value
+        instance.pull_file.side_effect = fake_pull_file
+        zipname = builder.pack_charm_in_instance(
+            bases_index=0, build_on=config.bases[0].build_on[0], build_on_index=0
+        )
+
+    assert instance.pull_file.mock_calls == [
+        call(source=pathlib.Path("/root") / zipname, destination=cwd / zipname),
+        call(
+            source=pathlib.Path("/root/test.venv-1234.zip"),
+            destination=cwd / "test.venv-1234.zip.part",
+        ),
+    ]
+    assert (cwd / "test.venv-1234.zip").read_text() == "venv content"
+
+
+def test_build_venv_prune(basic_project, tmp_path_factory, monkeypatch, caplog):
+    """The venv is pruned as configured, reporting what was removed."""
+    caplog.set_level(logging.DEBUG, logger="charmcraft.commands")
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    (basic_project / "charmcraft.yaml").write_text(
         dedent(
-            f"""\
-                type: charm
-                bases:
-                  - name: ubuntu
-                    channel: "18.04"
-                    architectures: {host_base.architectures!r}
-                  - name: ubuntu
-                    channel: "20.04"
-                    architectures: {host_base.architectures!r}
-                  - name: ubuntu
-                    channel: "unsupported-channel"
-                    architectures: {host_base.architectures!r}
-                """
+            """\
+            type: charm
+            parts:
+              charm:
+                venv-prune:
+                  remove: ["*.dist-info"]
+                  keep: ["nativepkg.libs/*"]
+            """
+        )
+    )
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+
+    def install():
+        _fake_venv_installation(builder)()
+        tests_path = builder.buildpath / VENV_DIRNAME / "purepkg" / "tests"
+        tests_path.mkdir()
+        (tests_path / "test_purepkg.py").write_text("test")
+        # a package imported at run time, even if it matches a default rule
+        docs_path = builder.buildpath / VENV_DIRNAME / "purepkg" / "docs"
+        docs_path.mkdir()
+        (docs_path / "__init__.py").write_text("docs")
+
+    with patch.object(builder, "handle_dependencies", side_effect=install):
+        with patch("charmcraft.prune._strip_debug", return_value=0) as mock_strip:
+            with patch(
+                "charmcraft.commands.build._get_python_cache_tag",
+                return_value="cpython-38",
+            ):
+                zipname = builder.build_charm(bases_config)
+
+    with zipfile.ZipFile(zipname) as zf:
+        venv_members = [
+            name for name in zf.namelist() if name.startswith(VENV_DIRNAME + "/")
+        ]
+    assert venv_members == [
+        "venv/bin/script",
+        "venv/nativepkg.libs/libstuff-1234.so.1.0",
+        "venv/nativepkg/__init__.py",
+        "venv/nativepkg/_ext.cpython-38-x86_64-linux-gnu.so",
+        "venv/purepkg/__init__.py",
+        "venv/purepkg/__pycache__/__init__.cpython-38.pyc",
+        "venv/purepkg/docs/__init__.py",
+        "venv/six.py",
+    ]
+    # the kept libraries are not stripped either
+    assert mock_strip.call_count == 1
+    messages = [rec.message for rec in caplog.records]
+    assert "Pruned by '*.dist-info': 1 files, 8 bytes" in messages
+    assert "Pruned by '*/tests': 1 files, 4 bytes" in messages
+    assert "Pruned the venv: 2 files removed, 12 bytes saved" in messages
+
+
+def test_build_venv_prune_not_configured(basic_project):
+    """Nothing is pruned if not configured."""
+    builder = _get_fingerprint_builder(basic_project)
+    _fake_venv_installation(builder)()
+
+    with patch("charmcraft.commands.build.prune_tree") as mock_prune:
+        builder.handle_venv_prune()
+
+    mock_prune.assert_not_called()
+
+
+def test_build_tree_shaking(basic_project, tmp_path_factory, monkeypatch, caplog):
+    """The venv packages not reachable from the entrypoint are removed."""
+    caplog.set_level(logging.DEBUG, logger="charmcraft.commands")
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    (basic_project / "charmcraft.yaml").write_text(
+        dedent(
+            """\
+            type: charm
+            parts:
+              charm:
+                tree-shaking:
+                  extra-roots: ["six"]
+            """
         )
     )
+    (basic_project / "src" / "charm.py").write_text("import purepkg")
+    builder = _get_fingerprint_builder(basic_project)
+    bases_config = builder.config.bases[0]
+
+    with patch.object(
+        builder, "handle_dependencies", side_effect=_fake_venv_installation(builder)
+    ):
+        zipname = builder.build_charm(bases_config)
+
+    with zipfile.ZipFile(zipname) as zf:
+        venv_members = [
+            name for name in zf.namelist() if name.startswith(VENV_DIRNAME + "/")
+        ]
+    assert venv_members == [
+        "venv/bin/script",
+        "venv/nativepkg.libs/libstuff-1234.so.1.0",
+        "venv/purepkg-1.0.dist-info/METADATA",
+        "venv/purepkg/__init__.py",
+        "venv/purepkg/__pycache__/__init__.cpython-38.pyc",
+        "venv/six.py",
+    ]
+    messages = [rec.message for rec in caplog.records]
+    assert "Removed 1 venv packages not reachable from the entrypoint" in messages
+    assert "Unreachable venv packages: nativepkg" in messages
+
+
+def test_build_tree_shaking_not_configured(basic_project):
+    """Nothing is removed if not configured."""
+    builder = _get_fingerprint_builder(basic_project)
+    _fake_venv_installation(builder)()
+
+    with patch("charmcraft.commands.build.get_reachable_modules") as mock_reachable:
+        builder.handle_tree_shaking()
+
+    mock_reachable.assert_not_called()
+
+
+def test_build_checks_provider(basic_project, mock_ensure_provider_is_available):
+    """Test cases for base-index parameter."""
     config = load(basic_project)
-    monkeypatch.chdir(basic_project)
     builder = Builder(
         {
             "from": basic_project,
@@ -913,991 +1631,2599 @@ def test_build_bases_index_scenarios_provider(
         config,
     )
 
-    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
-        zipnames = builder.run([0])
-        assert zipnames == [
-            f"name-from-metadata_ubuntu-18.04-{host_arch}.charm",
-        ]
+    with patch("charmcraft.commands.build.launched_environment"):
+        builder.run()
 
-        assert mock_launch.mock_calls == [
-            call(
-                charm_name="name-from-metadata",
-                project_path=basic_project,
-                base=Base(name="ubuntu", channel="18.04", architectures=[host_arch]),
-                bases_index=0,
-                build_on_index=0,
-            ),
-            call().__enter__(),
-            call()
-            .__enter__()
-            .execute_run(
-                ["charmcraft", "pack", "--bases-index", "0"] + cmd_flags,
-                check=True,
-                cwd="/root/project",
-            ),
-            call().__exit__(None, None, None),
-        ]
-        assert (
-            f"Packing charm 'name-from-metadata_ubuntu-18.04-{host_arch}.charm'..."
-            in [r.message for r in caplog.records]
-        )
-        mock_ensure_provider_is_available.assert_called_once()
-        mock_launch.reset_mock()
+    mock_ensure_provider_is_available.assert_called_once()
 
-        zipnames = builder.run([1])
-        assert zipnames == [
-            f"name-from-metadata_ubuntu-20.04-{host_arch}.charm",
-        ]
-        assert mock_launch.mock_calls == [
-            call(
-                charm_name="name-from-metadata",
-                project_path=basic_project,
-                base=Base(name="ubuntu", channel="20.04", architectures=[host_arch]),
-                bases_index=1,
-                build_on_index=0,
-            ),
-            call().__enter__(),
-            call()
-            .__enter__()
-            .execute_run(
-                ["charmcraft", "pack", "--bases-index", "1"] + cmd_flags,
-                check=True,
-                cwd="/root/project",
-            ),
-            call().__exit__(None, None, None),
-        ]
-        mock_launch.reset_mock()
 
-        zipnames = builder.run([0, 1])
-        assert zipnames == [
-            f"name-from-metadata_ubuntu-18.04-{host_arch}.charm",
-            f"name-from-metadata_ubuntu-20.04-{host_arch}.charm",
-        ]
-        assert mock_launch.mock_calls == [
-            call(
-                charm_name="name-from-metadata",
-                project_path=basic_project,
-                base=Base(name="ubuntu", channel="18.04", architectures=[host_arch]),
-                bases_index=0,
-                build_on_index=0,
+def test_build_checks_provider_error(basic_project, mock_ensure_provider_is_available):
+    """Test cases for base-index parameter."""
+    mock_ensure_provider_is_available.side_effect = RuntimeError("foo")
+    config = load(basic_project)
+    builder = Builder(
+        {
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
+            "requirement": [],
+        },
+        config,
+    )
+
+    with pytest.raises(RuntimeError, match="foo"):
+        builder.run()
+
+    mock_ensure_provider_is_available.assert_called_once()
+
+
+def test_build_without_charmcraft_yaml_issues_dn02(basic_project, caplog, monkeypatch):
+    """Test cases for base-index parameter."""
+    config = load(basic_project)
+    builder = Builder(
+        {
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
+            "requirement": [],
+        },
+        config,
+    )
+
+    with patch("charmcraft.commands.build.launched_environment"):
+        builder.run()
+
+    assert "DEPRECATED: A charmcraft.yaml configuration file is now required." in [
+        r.message for r in caplog.records
+    ]
+
+
+def test_build_multiple_with_charmcraft_yaml_destructive_mode(
+    basic_project_builder, monkeypatch, caplog
+):
+    """Build multiple charms for multiple matching bases, skipping one unmatched config."""
+    caplog.set_level(logging.DEBUG)
+    host_base = get_host_as_base()
+    unmatched_base = Base(
+        name="unmatched-name",
+        channel="unmatched-channel",
+        architectures=["unmatched-arch1"],
+    )
+    matched_cross_base = Base(
+        name="cross-name",
+        channel="cross-channel",
+        architectures=["cross-arch1"],
+    )
+    builder = basic_project_builder(
+        [
+            BasesConfiguration(**{"build-on": [host_base], "run-on": [host_base]}),
+            BasesConfiguration(
+                **{"build-on": [unmatched_base], "run-on": [unmatched_base]}
             ),
-            call().__enter__(),
-            call()
-            .__enter__()
-            .execute_run(
-                ["charmcraft", "pack", "--bases-index", "0"] + cmd_flags,
-                check=True,
-                cwd="/root/project",
+            BasesConfiguration(
+                **{"build-on": [host_base], "run-on": [matched_cross_base]}
             ),
-            call().__exit__(None, None, None),
-            call(
-                charm_name="name-from-metadata",
-                project_path=basic_project,
-                base=Base(name="ubuntu", channel="20.04", architectures=[host_arch]),
-                bases_index=1,
-                build_on_index=0,
+        ]
+    )
+
+    zipnames = builder.run(destructive_mode=True)
+
+    host_arch = host_base.architectures[0]
+    assert zipnames == [
+        f"name-from-metadata_{host_base.name}-{host_base.channel}-{host_arch}.charm",
+        "name-from-metadata_cross-name-cross-channel-cross-arch1.charm",
+    ]
+
+    records = [r.message for r in caplog.records]
+
+    assert "Building for 'bases[0]' as host matches 'build-on[0]'." in records
+    assert (
+        "No suitable 'build-on' environment found in 'bases[1]' configuration."
+        in records
+    )
+    assert "Building for 'bases[2]' as host matches 'build-on[0]'." in records
+
+
+def test_build_multiple_shares_the_build(
+    basic_project_builder, tmp_path_factory, monkeypatch
+):
+    """The tree is built once, and packaged again with its manifest for other bases."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    host_base = get_host_as_base()
+    cross_base = Base(
+        name="cross-name", channel="cross-channel", architectures=["cross-arch1"]
+    )
+    builder = basic_project_builder(
+        [
+            BasesConfiguration(**{"build-on": [host_base], "run-on": [host_base]}),
+            BasesConfiguration(**{"build-on": [host_base], "run-on": [cross_base]}),
+        ]
+    )
+
+    with patch.object(
+        builder, "handle_dependencies", wraps=builder.handle_dependencies
+    ) as mock_deps:
+        zipnames = builder.run(destructive_mode=True)
+
+    mock_deps.assert_called_once()
+    contents = []
+    for zipname in zipnames:
+        with zipfile.ZipFile(zipname) as zf:
+            manifest = yaml.safe_load(zf.read("manifest.yaml"))
+            contents.append(
+                {
+                    name: zf.read(name)
+                    for name in zf.namelist()
+                    if name != "manifest.yaml"
+                }
+            )
+        assert manifest["bases"][0]["name"] == (
+            host_base.name if zipname == zipnames[0] else "cross-name"
+        )
+        assert read_fingerprint(pathlib.Path(zipname)) == builder.get_fingerprint(
+            builder.config.bases[zipnames.index(zipname)]
+        )
+    assert contents[0] == contents[1]
+
+
+def test_build_multiple_shared_only_in_the_same_run(
+    basic_project_builder, tmp_path_factory, monkeypatch
+):
+    """A new run always builds the tree again."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    host_base = get_host_as_base()
+    builder = basic_project_builder(
+        [BasesConfiguration(**{"build-on": [host_base], "run-on": [host_base]})]
+    )
+    builder.force = True
+
+    with patch.object(
+        builder, "handle_dependencies", wraps=builder.handle_dependencies
+    ) as mock_deps:
+        builder.run(destructive_mode=True)
+        builder.run(destructive_mode=True)
+
+    assert mock_deps.call_count == 2
+
+
+def test_build_multiple_shared_instance(
+    basic_project_builder,
+    mock_capture_logs_from_instance,
+    mock_ensure_provider_is_available,
+    tmp_path_factory,
+    monkeypatch,
+):
+    """The bases with the same build-on are packed in one instance, pulling all the charms."""
+    monkeypatch.setattr(message_handler, "mode", message_handler.NORMAL)
+    cwd = tmp_path_factory.mktemp("output")
+    monkeypatch.chdir(cwd)
+    build_base = Base(
+        name="ubuntu",
+        channel="20.04",
+        architectures=[get_host_as_base().architectures[0]],
+    )
+    run_bases = [
+        Base(name="ubuntu", channel=channel, architectures=["amd64"])
+        for channel in ["18.04", "20.04", "22.04"]
+    ]
+    builder = basic_project_builder(
+        [
+            BasesConfiguration(**{"build-on": [build_base], "run-on": [run_base]})
+            for run_base in run_bases
+        ]
+    )
+    builder.force = True
+
+    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
+        instance = mock_launch.return_value.__enter__.return_value
+        zipnames = builder.run()
+
+    assert zipnames == [
+        f"name-from-metadata_ubuntu-{channel}-amd64.charm"
+        for channel in ["18.04", "20.04", "22.04"]
+    ]
+    assert mock_launch.call_count == 1
+    assert instance.execute_run.mock_calls == [
+        call(
+            [
+                "charmcraft",
+                "pack",
+                "--bases-index",
+                "0",
+                "--bases-index",
+                "1",
+                "--bases-index",
+                "2",
+            ],
+            check=True,
+            cwd="/root",
+        )
+    ]
+    assert instance.pull_file.mock_calls == [
+        call(source=pathlib.Path("/root") / zipname, destination=cwd / zipname)
+        for zipname in zipnames
+    ]
+
+
+def test_build_managed_mode_own_buildpath(
+    basic_project_builder, tmp_path_factory, monkeypatch
+):
+    """Each instance packing at the same time uses its own build directory."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    host_base = get_host_as_base()
+    host_arch = host_base.architectures[0]
+    builder = basic_project_builder(
+        [
+            BasesConfiguration(**{"build-on": [host_base], "run-on": [Base(**run_on)]})
+            for run_on in [
+                dict(name="ubuntu", channel="18.04", architectures=[host_arch]),
+                dict(name="ubuntu", channel="20.04", architectures=[host_arch]),
+            ]
+        ]
+    )
+    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    builders = [
+        Builder(
+            {
+                "from": builder.charmdir,
+                "entrypoint": builder.entrypoint,
+                "requirement": [],
+                "bases_indices": [bases_index],
+            },
+            builder.config,
+        )
+        for bases_index in [0, 1]
+    ]
+
+    with ThreadPoolExecutor() as executor:
+        zipnames = list(
+            executor.map(
+                lambda item: item[0].build_charm(item[1]),
+                zip(builders, builder.config.bases),
+            )
+        )
+
+    buildpaths = [item.buildpath for item in builders]
+    assert buildpaths == [
+        builder.charmdir / "build" / "bases-0",
+        builder.charmdir / "build" / "bases-1",
+    ]
+    for zipname in zipnames:
+        with zipfile.ZipFile(zipname) as zf:
+            assert "src/charm.py" in zf.namelist()
+
+
+def test_build_multiple_with_charmcraft_yaml_managed_mode(
+    basic_project_builder, monkeypatch, caplog
+):
+    """Build multiple charms for multiple matching bases, skipping one unmatched config."""
+    caplog.set_level(logging.DEBUG)
+    host_base = get_host_as_base()
+    unmatched_base = Base(
+        name="unmatched-name",
+        channel="unmatched-channel",
+        architectures=["unmatched-arch1"],
+    )
+    matched_cross_base = Base(
+        name="cross-name",
+        channel="cross-channel",
+        architectures=["cross-arch1"],
+    )
+    builder = basic_project_builder(
+        [
+            BasesConfiguration(**{"build-on": [host_base], "run-on": [host_base]}),
+            BasesConfiguration(
+                **{"build-on": [unmatched_base], "run-on": [unmatched_base]}
             ),
-            call().__enter__(),
-            call()
-            .__enter__()
-            .execute_run(
-                ["charmcraft", "pack", "--bases-index", "1"] + cmd_flags,
-                check=True,
-                cwd="/root/project",
+            BasesConfiguration(
+                **{"build-on": [host_base], "run-on": [matched_cross_base]}
             ),
-            call().__exit__(None, None, None),
         ]
+    )
 
-        with pytest.raises(
-            CommandError,
-            match=r"No suitable 'build-on' environment found in any 'bases' configuration.",
-        ):
-            builder.run([3])
+    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    zipnames = builder.run()
+
+    host_arch = host_base.architectures[0]
+    assert zipnames == [
+        f"name-from-metadata_{host_base.name}-{host_base.channel}-{host_arch}.charm",
+        "name-from-metadata_cross-name-cross-channel-cross-arch1.charm",
+    ]
+
+    records = [r.message for r in caplog.records]
+
+    assert "Building for 'bases[0]' as host matches 'build-on[0]'." in records
+    assert (
+        "No suitable 'build-on' environment found in 'bases[1]' configuration."
+        in records
+    )
+    assert "Building for 'bases[2]' as host matches 'build-on[0]'." in records
+
+
+def test_build_project_is_cwd(
+    basic_project,
+    caplog,
+    mock_capture_logs_from_instance,
+    mock_ensure_provider_is_available,
+    monkeypatch,
+):
+    """Test cases for base-index parameter."""
+    mode = message_handler.NORMAL
+    monkeypatch.setattr(message_handler, "mode", mode)
+    host_base = get_host_as_base()
+    host_arch = host_base.architectures[0]
+    charmcraft_file = basic_project / "charmcraft.yaml"
+    charmcraft_file.write_text(
+        dedent(
+            f"""\
+                type: charm
+                bases:
+                  - name: ubuntu
+                    channel: "18.04"
+                    architectures: {host_base.architectures!r}
+                """
+        )
+    )
+    config = load(basic_project)
+    builder = Builder(
+        {
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
+            "requirement": [],
+        },
+        config,
+    )
+
+    monkeypatch.chdir(basic_project)
+    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
+        zipnames = builder.run([0])
+
+    assert zipnames == [
+        f"name-from-metadata_ubuntu-18.04-{host_arch}.charm",
+    ]
+    assert mock_launch.mock_calls == [
+        call(
+            charm_name="name-from-metadata",
+            project_path=basic_project,
+            base=Base(name="ubuntu", channel="18.04", architectures=[host_arch]),
+            bases_index=0,
+            build_on_index=0,
+        ),
+        call().__enter__(),
+        call()
+        .__enter__()
+        .execute_run(
+            ["charmcraft", "pack", "--bases-index", "0"],
+            check=True,
+            cwd="/root/project",
+        ),
+        call().__exit__(None, None, None),
+    ]
+
+
+def test_build_project_is_not_cwd(
+    basic_project,
+    caplog,
+    mock_capture_logs_from_instance,
+    mock_ensure_provider_is_available,
+    monkeypatch,
+):
+    """Test cases for base-index parameter."""
+    mode = message_handler.NORMAL
+    monkeypatch.setattr(message_handler, "mode", mode)
+    host_base = get_host_as_base()
+    host_arch = host_base.architectures[0]
+    charmcraft_file = basic_project / "charmcraft.yaml"
+    charmcraft_file.write_text(
+        dedent(
+            f"""\
+                type: charm
+                bases:
+                  - name: ubuntu
+                    channel: "18.04"
+                    architectures: {host_base.architectures!r}
+                """
+        )
+    )
+    config = load(basic_project)
+    builder = Builder(
+        {
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
+            "requirement": [],
+        },
+        config,
+    )
+
+    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
+        zipnames = builder.run([0])
+
+    assert zipnames == [
+        f"name-from-metadata_ubuntu-18.04-{host_arch}.charm",
+    ]
+    assert mock_launch.mock_calls == [
+        call(
+            charm_name="name-from-metadata",
+            project_path=basic_project,
+            base=Base(name="ubuntu", channel="18.04", architectures=[host_arch]),
+            bases_index=0,
+            build_on_index=0,
+        ),
+        call().__enter__(),
+        call()
+        .__enter__()
+        .execute_run(
+            ["charmcraft", "pack", "--bases-index", "0"],
+            check=True,
+            cwd="/root",
+        ),
+        call()
+        .__enter__()
+        .pull_file(
+            source=pathlib.Path("/root") / zipnames[0],
+            destination=pathlib.Path.cwd() / zipnames[0],
+        ),
+        call().__exit__(None, None, None),
+    ]
+
+
+@pytest.fixture
+def parallel_builder(basic_project_builder):
+    """A builder with three bases configurations to pack concurrently."""
+    bases = [
+        Base(
+            name="ubuntu",
+            channel=channel,
+            architectures=[get_host_as_base().architectures[0]],
+        )
+        for channel in ["18.04", "20.04", "20.04"]
+    ]
+    builder = basic_project_builder(
+        [BasesConfiguration(**{"build-on": [base], "run-on": [base]}) for base in bases]
+    )
+    builder.jobs = 2
+    return builder
+
+
+def test_build_parallel_packs(parallel_builder):
+    """Pack the bases concurrently, sharing the instances, keeping the order in the results."""
+
+    def fake_pack(*, bases_index, build_on, build_on_index, shared_bases_indices):
+        return f"charm-{bases_index}.charm"
+
+    with patch.object(
+        parallel_builder, "pack_charm_in_instance", side_effect=fake_pack
+    ) as mock_pack:
+        zipnames = parallel_builder.run()
+
+    shared_zipname = format_charm_file_name(
+        "name-from-metadata", parallel_builder.config.bases[2]
+    )
+    assert zipnames == ["charm-0.charm", "charm-1.charm", shared_zipname]
+    assert sorted(
+        (c.kwargs["bases_index"], c.kwargs["shared_bases_indices"])
+        for c in mock_pack.call_args_list
+    ) == [(0, []), (1, [2])]
+
+
+def test_build_parallel_aggregated_errors(parallel_builder):
+    """All the bases are packed even if some fail, and the errors reported together."""
+
+    def fake_pack(*, bases_index, build_on, build_on_index, shared_bases_indices):
+        raise CommandError(f"Failed to build charm for bases index '{bases_index}'.")
+
+    with patch.object(
+        parallel_builder, "pack_charm_in_instance", side_effect=fake_pack
+    ) as mock_pack:
+        with pytest.raises(CommandError) as cm:
+            parallel_builder.run()
+
+    assert mock_pack.call_count == 2
+    assert str(cm.value) == (
+        "Failed to build 2 of 2 charms:\n"
+        "- bases[0]: Failed to build charm for bases index '0'.\n"
+        "- bases[1]: Failed to build charm for bases index '1'."
+    )
+
+
+def test_build_parallel_output_prefixed(
+    parallel_builder, tmp_path_factory, monkeypatch, caplog
+):
+    """The output from each instance is logged with a prefix, and the charm pulled atomically."""
+    caplog.set_level(logging.INFO, logger="charmcraft.commands")
+    monkeypatch.setattr(message_handler, "mode", message_handler.NORMAL)
+    cwd = tmp_path_factory.mktemp("output")
+    monkeypatch.chdir(cwd)
+
+    def fake_pull_file(*, source, destination):
+        destination.write_text("charm content")
+
+    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
+        instance = mock_launch.return_value.__enter__.return_value
+        instance.execute_popen.return_value.stdout = ["line 1\n", "line 2\n"]
+        instance.execute_popen.return_value.wait.return_value = 0
+        instance.pull_file.side_effect = fake_pull_file
+        zipname = parallel_builder.pack_charm_in_instance(
+            bases_index=1,
+            build_on=parallel_builder.config.bases[1].build_on[0],
+            build_on_index=0,
+        )
+
+    records = [r.message for r in caplog.records]
+    assert "[bases[1]] line 1" in records
+    assert "[bases[1]] line 2" in records
+    assert instance.execute_popen.mock_calls[0] == call(
+        ["charmcraft", "pack", "--bases-index", "1"],
+        cwd="/root",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=True,
+    )
+    assert instance.pull_file.mock_calls == [
+        call(
+            source=pathlib.Path("/root") / zipname,
+            destination=cwd / (zipname + ".part"),
+        )
+    ]
+    assert (cwd / zipname).read_text() == "charm content"
+    assert not (cwd / (zipname + ".part")).exists()
+
+
+def test_build_parallel_instance_failure(
+    parallel_builder, mock_capture_logs_from_instance, monkeypatch
+):
+    """A failure in the instance is properly reported."""
+    monkeypatch.setattr(message_handler, "mode", message_handler.NORMAL)
+    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
+        instance = mock_launch.return_value.__enter__.return_value
+        instance.execute_popen.return_value.stdout = []
+        instance.execute_popen.return_value.wait.return_value = 1
+        with pytest.raises(CommandError) as cm:
+            parallel_builder.pack_charm_in_instance(
+                bases_index=0,
+                build_on=parallel_builder.config.bases[0].build_on[0],
+                build_on_index=0,
+            )
+
+    assert str(cm.value) == "Failed to build charm for bases index '0'."
+    assert isinstance(cm.value.__cause__, subprocess.CalledProcessError)
+    mock_capture_logs_from_instance.assert_called_once_with(instance)
+
+
+@pytest.mark.parametrize(
+    "mode,cmd_flags",
+    [
+        (message_handler.VERBOSE, ["--verbose"]),
+        (message_handler.QUIET, ["--quiet"]),
+        (message_handler.NORMAL, []),
+    ],
+)
+def test_build_bases_index_scenarios_provider(
+    mode,
+    cmd_flags,
+    basic_project,
+    caplog,
+    mock_capture_logs_from_instance,
+    mock_ensure_provider_is_available,
+    monkeypatch,
+):
+    """Test cases for base-index parameter."""
+    monkeypatch.setattr(message_handler, "mode", mode)
+    host_base = get_host_as_base()
+    host_arch = host_base.architectures[0]
+    charmcraft_file = basic_project / "charmcraft.yaml"
+    charmcraft_file.write_text(
+        dedent(
+            f"""\
+                type: charm
+                bases:
+                  - name: ubuntu
+                    channel: "18.04"
+                    architectures: {host_base.architectures!r}
+                  - name: ubuntu
+                    channel: "20.04"
+                    architectures: {host_base.architectures!r}
+                  - name: ubuntu
+                    channel: "unsupported-channel"
+                    architectures: {host_base.architectures!r}
+                """
+        )
+    )
+    config = load(basic_project)
+    monkeypatch.chdir(basic_project)
+    builder = Builder(
+        {
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
+            "requirement": [],
+        },
+        config,
+    )
+
+    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
+        zipnames = builder.run([0])
+        assert zipnames == [
+            f"name-from-metadata_ubuntu-18.04-{host_arch}.charm",
+        ]
+
+        assert mock_launch.mock_calls == [
+            call(
+                charm_name="name-from-metadata",
+                project_path=basic_project,
+                base=Base(name="ubuntu", channel="18.04", architectures=[host_arch]),
+                bases_index=0,
+                build_on_index=0,
+            ),
+            call().__enter__(),
+            call()
+            .__enter__()
+            .execute_run(
+                ["charmcraft", "pack", "--bases-index", "0"] + cmd_flags,
+                check=True,
+                cwd="/root/project",
+            ),
+            call().__exit__(None, None, None),
+        ]
+        assert (
+            f"Packing charm 'name-from-metadata_ubuntu-18.04-{host_arch}.charm'..."
+            in [r.message for r in caplog.records]
+        )
+        mock_ensure_provider_is_available.assert_called_once()
+        mock_launch.reset_mock()
+
+        zipnames = builder.run([1])
+        assert zipnames == [
+            f"name-from-metadata_ubuntu-20.04-{host_arch}.charm",
+        ]
+        assert mock_launch.mock_calls == [
+            call(
+                charm_name="name-from-metadata",
+                project_path=basic_project,
+                base=Base(name="ubuntu", channel="20.04", architectures=[host_arch]),
+                bases_index=1,
+                build_on_index=0,
+            ),
+            call().__enter__(),
+            call()
+            .__enter__()
+            .execute_run(
+                ["charmcraft", "pack", "--bases-index", "1"] + cmd_flags,
+                check=True,
+                cwd="/root/project",
+            ),
+            call().__exit__(None, None, None),
+        ]
+        mock_launch.reset_mock()
+
+        zipnames = builder.run([0, 1])
+        assert zipnames == [
+            f"name-from-metadata_ubuntu-18.04-{host_arch}.charm",
+            f"name-from-metadata_ubuntu-20.04-{host_arch}.charm",
+        ]
+        assert mock_launch.mock_calls == [
+            call(
+                charm_name="name-from-metadata",
+                project_path=basic_project,
+                base=Base(name="ubuntu", channel="18.04", architectures=[host_arch]),
+                bases_index=0,
+                build_on_index=0,
+            ),
+            call().__enter__(),
+            call()
+            .__enter__()
+            .execute_run(
+                ["charmcraft", "pack", "--bases-index", "0"] + cmd_flags,
+                check=True,
+                cwd="/root/project",
+            ),
+            call().__exit__(None, None, None),
+            call(
+                charm_name="name-from-metadata",
+                project_path=basic_project,
+                base=Base(name="ubuntu", channel="20.04", architectures=[host_arch]),
+                bases_index=1,
+                build_on_index=0,
+            ),
+            call().__enter__(),
+            call()
+            .__enter__()
+            .execute_run(
+                ["charmcraft", "pack", "--bases-index", "1"] + cmd_flags,
+                check=True,
+                cwd="/root/project",
+            ),
+            call().__exit__(None, None, None),
+        ]
+
+        with pytest.raises(
+            CommandError,
+            match=r"No suitable 'build-on' environment found in any 'bases' configuration.",
+        ):
+            builder.run([3])
+
+        mock_launch.reset_mock()
+
+        expected_msg = re.escape("Failed to build charm for bases index '0'.")
+        with pytest.raises(
+            CommandError,
+            match=expected_msg,
+        ):
+            mock_instance = mock_launch.return_value.__enter__.return_value
+            mock_instance.execute_run.side_effect = subprocess.CalledProcessError(
+                -1,
+                ["charmcraft", "pack", "..."],
+                "some output",
+                "some error",
+            )
+            builder.run([0])
+
+        assert mock_instance.mock_calls == [
+            call.execute_run(
+                ["charmcraft", "pack", "--bases-index", "0"] + cmd_flags,
+                check=True,
+                cwd="/root/project",
+            ),
+        ]
+        assert mock_capture_logs_from_instance.mock_calls == [call(mock_instance)]
+
+
+def test_build_bases_index_scenarios_managed_mode(basic_project, monkeypatch, caplog):
+    """Test cases for base-index parameter."""
+    host_base = get_host_as_base()
+    host_arch = host_base.architectures[0]
+    charmcraft_file = basic_project / "charmcraft.yaml"
+    charmcraft_file.write_text(
+        dedent(
+            f"""\
+                type: charm
+                bases:
+                  - build-on:
+                      - name: {host_base.name!r}
+                        channel: {host_base.channel!r}
+                        architectures: {host_base.architectures!r}
+                    run-on:
+                      - name: {host_base.name!r}
+                        channel: {host_base.channel!r}
+                        architectures: {host_base.architectures!r}
+                  - build-on:
+                      - name: unmatched-name
+                        channel: unmatched-channel
+                        architectures: [unmatched-arch1]
+                    run-on:
+                      - name: unmatched-name
+                        channel: unmatched-channel
+                        architectures: [unmatched-arch1]
+                  - build-on:
+                      - name: {host_base.name!r}
+                        channel: {host_base.channel!r}
+                        architectures: {host_base.architectures!r}
+                    run-on:
+                      - name: cross-name
+                        channel: cross-channel
+                        architectures: [cross-arch1]
+                """
+        )
+    )
+    config = load(basic_project)
+    monkeypatch.chdir(basic_project)
+    builder = Builder(
+        {
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
+            "requirement": [],
+        },
+        config,
+    )
+
+    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    zipnames = builder.run([0])
+    assert zipnames == [
+        f"name-from-metadata_{host_base.name}-{host_base.channel}-{host_arch}.charm",
+    ]
+
+    with pytest.raises(
+        CommandError,
+        match=r"No suitable 'build-on' environment found in any 'bases' configuration.",
+    ):
+        builder.run([1])
+
+    zipnames = builder.run([2])
+    assert zipnames == [
+        "name-from-metadata_cross-name-cross-channel-cross-arch1.charm",
+    ]
+
+
+@patch(
+    "charmcraft.bases.get_host_as_base",
+    return_value=Base(name="xname", channel="xchannel", architectures=["xarch"]),
+)
+def test_build_error_no_match_with_charmcraft_yaml(
+    mock_host_base, basic_project, monkeypatch, caplog
+):
+    """Error when no charms are buildable with host base, verifying each mismatched reason."""
+    caplog.set_level(logging.DEBUG)
+    charmcraft_file = basic_project / "charmcraft.yaml"
+    charmcraft_file.write_text(
+        dedent(
+            """\
+                type: charm
+                bases:
+                  - name: unmatched-name
+                    channel: xchannel
+                    architectures: [xarch]
+                  - name: xname
+                    channel: unmatched-channel
+                    architectures: [xarch]
+                  - name: xname
+                    channel: xchannel
+                    architectures: [unmatched-arch1, unmatched-arch2]
+                """
+        )
+    )
+    config = load(basic_project)
+    monkeypatch.chdir(basic_project)
+    builder = Builder(
+        {
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
+            "requirement": [],
+        },
+        config,
+    )
+
+    # Managed bases build.
+    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    with pytest.raises(
+        CommandError,
+        match=r"No suitable 'build-on' environment found in any 'bases' configuration.",
+    ):
+        builder.run()
+
+    records = [r.message for r in caplog.records]
+
+    assert (
+        "Skipping 'bases[0].build-on[0]': "
+        "name 'unmatched-name' does not match host 'xname'."
+    ) in records
+    assert (
+        "No suitable 'build-on' environment found in 'bases[0]' configuration."
+        in records
+    )
+    assert (
+        "Skipping 'bases[1].build-on[0]': "
+        "channel 'unmatched-channel' does not match host 'xchannel'."
+    ) in records
+    assert (
+        "No suitable 'build-on' environment found in 'bases[1]' configuration."
+        in records
+    )
+    assert (
+        "Skipping 'bases[2].build-on[0]': "
+        "host architecture 'xarch' not in base architectures "
+        "['unmatched-arch1', 'unmatched-arch2']."
+    ) in records
+    assert (
+        "No suitable 'build-on' environment found in 'bases[2]' configuration."
+        in records
+    )
+
+
+def test_build_generics_simple_files(tmp_path, config):
+    """Check transferred metadata and simple entrypoint, also return proper linked entrypoint."""
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+    linked_entrypoint = builder.handle_generic_paths()
+
+    # check files are there, are files, and are really hard links (so no
+    # check for permissions needed)
+    built_metadata = build_dir / CHARM_METADATA
+    assert built_metadata.is_file()
+    assert built_metadata.stat().st_ino == metadata.stat().st_ino
+
+    built_entrypoint = build_dir / "crazycharm.py"
+    assert built_entrypoint.is_file()
+    assert built_entrypoint.stat().st_ino == entrypoint.stat().st_ino
+
+    assert linked_entrypoint == built_entrypoint
+
+
+def test_build_generics_simple_dir(tmp_path, config):
+    """Check transferred any directory, with proper permissions."""
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+
+    somedir = tmp_path / "somedir"
+    somedir.mkdir(mode=0o700)
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+    builder.handle_generic_paths()
+
+    built_dir = build_dir / "somedir"
+    assert built_dir.is_dir()
+    assert built_dir.stat().st_mode & 0xFFF == 0o700
+
+
+def test_build_generics_ignored_file(tmp_path, caplog, config):
+    """Don't include ignored filed."""
+    caplog.set_level(logging.DEBUG)
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+
+    # create two files (and the needed entrypoint)
+    file1 = tmp_path / "file1.txt"
+    file1.touch()
+    file2 = tmp_path / "file2.txt"
+    file2.touch()
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+
+    # set it up to ignore file 2 and make it work
+    builder.ignore_rules.extend_patterns(["file2.*"])
+    builder.handle_generic_paths()
+
+    assert (build_dir / "file1.txt").exists()
+    assert not (build_dir / "file2.txt").exists()
+
+    expected = "Ignoring file because of rules: 'file2.txt'"
+    assert expected in [rec.message for rec in caplog.records]
+
+
+def test_build_generics_ignored_dir(tmp_path, caplog, config):
+    """Don't include ignored dir."""
+    caplog.set_level(logging.DEBUG)
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+
+    # create two files (and the needed entrypoint)
+    dir1 = tmp_path / "dir1"
+    dir1.mkdir()
+    dir2 = tmp_path / "dir2"
+    dir2.mkdir()
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+
+    # set it up to ignore dir 2 and make it work
+    builder.ignore_rules.extend_patterns(["dir2"])
+    builder.handle_generic_paths()
+
+    assert (build_dir / "dir1").exists()
+    assert not (build_dir / "dir2").exists()
+
+    expected = "Ignoring directory because of rules: 'dir2'"
+    assert expected in [rec.message for rec in caplog.records]
+
+
+def test_build_generics_ignored_dir_content(tmp_path, caplog, config):
+    """The content of a dir is not walked if nothing in there can be included."""
+    caplog.set_level(logging.DEBUG)
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+    for dirname in ("dir1", "dir2"):
+        (tmp_path / dirname / "sub").mkdir(parents=True)
+        (tmp_path / dirname / "sub" / "keep.txt").touch()
+        (tmp_path / dirname / "other.txt").touch()
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+
+    # everything in both dirs is ignored, but something can be brought back in dir2
+    builder.ignore_rules.extend_patterns(["dir1/**", "dir2/**", "!/dir2/other.txt"])
+    builder.handle_generic_paths()
+
+    assert (build_dir / "dir1").is_dir()
+    assert list((build_dir / "dir1").iterdir()) == []
+    assert list((build_dir / "dir2").iterdir()) == [build_dir / "dir2" / "other.txt"]
+
+    messages = [rec.message for rec in caplog.records]
+    assert "Ignoring the content of directory because of rules: 'dir1'" in messages
+    assert "Ignoring the content of directory because of rules: 'dir2'" not in messages
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+def test_build_generics_git_files(tmp_path, config):
+    """Only the files tracked by git are included, if configured."""
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+    (tmp_path / "tracked.txt").touch()
+    (tmp_path / "ignored.txt").touch()
+    (tmp_path / ".tox" / "env").mkdir(parents=True)
+    (tmp_path / ".tox" / "env" / "untracked.txt").touch()
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    subprocess.run(
+        ["git", "add", CHARM_METADATA, "crazycharm.py", "tracked.txt", "ignored.txt"],
+        cwd=str(tmp_path),
+        check=True,
+    )
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+            "git_files": True,
+        },
+        config,
+    )
+    builder.ignore_rules.extend_patterns(["ignored.txt"])
+    with patch("os.scandir", side_effect=AssertionError("walked")):
+        builder.handle_generic_paths()
+
+    assert sorted(path.name for path in build_dir.iterdir()) == [
+        "crazycharm.py",
+        CHARM_METADATA,
+        "tracked.txt",
+    ]
+
+
+def test_build_generics_git_files_not_available(tmp_path, config, monkeypatch):
+    """The project is walked if the files can't be taken from git."""
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+            "git_files": True,
+        },
+        config,
+    )
+    with patch("charmcraft.commands.build.get_git_files", return_value=None):
+        builder.handle_generic_paths()
+
+    assert sorted(path.name for path in build_dir.iterdir()) == [
+        "crazycharm.py",
+        CHARM_METADATA,
+    ]
+
+
+def _test_build_generics_tree(tmp_path, caplog, config, *, expect_hardlinks):
+    caplog.set_level(logging.DEBUG)
+
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+
+    # create this structure:
+    # ├─ crazycharm.py  (entrypoint)
+    # ├─ file1.txt
+    # ├─ dir1
+    # │  └─ dir3  (ignored!)
+    # └─ dir2
+    #    ├─ file2.txt
+    #    ├─ file3.txt  (ignored!)
+    #    ├─ dir4  (ignored!)
+    #    │   └─ file4.txt
+    #    └─ dir5
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    file1 = tmp_path / "file1.txt"
+    file1.touch()
+    dir1 = tmp_path / "dir1"
+    dir1.mkdir()
+    dir3 = dir1 / "dir3"
+    dir3.mkdir()
+    dir2 = tmp_path / "dir2"
+    dir2.mkdir()
+    file2 = dir2 / "file2.txt"
+    file2.touch()
+    file3 = dir2 / "file3.txt"
+    file3.touch()
+    dir4 = dir2 / "dir4"
+    dir4.mkdir()
+    file4 = dir4 / "file4.txt"
+    file4.touch()
+    dir5 = dir2 / "dir5"
+    dir5.mkdir()
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+
+    # set it up to ignore some stuff and make it work
+    builder.ignore_rules.extend_patterns(
+        [
+            "dir1/dir3",
+            "dir2/file3.txt",
+            "dir2/dir4",
+        ]
+    )
+    builder.handle_generic_paths()
+
+    assert (build_dir / "crazycharm.py").exists()
+    assert (build_dir / "file1.txt").exists()
+    assert (build_dir / "dir1").exists()
+    assert not (build_dir / "dir1" / "dir3").exists()
+    assert (build_dir / "dir2").exists()
+    assert (build_dir / "dir2" / "file2.txt").exists()
+    assert not (build_dir / "dir2" / "file3.txt").exists()
+    assert not (build_dir / "dir2" / "dir4").exists()
+    assert (build_dir / "dir2" / "dir5").exists()
+
+    for (p1, p2) in [
+        (build_dir / "crazycharm.py", entrypoint),
+        (build_dir / "file1.txt", file1),
+        (build_dir / "dir2" / "file2.txt", file2),
+    ]:
+        if expect_hardlinks:
+            # they're hard links
+            assert p1.samefile(p2)
+        else:
+            # they're *not* hard links
+            assert not p1.samefile(p2)
+            # but they're essentially the same
+            assert filecmp.cmp(str(p1), str(p2), shallow=False)
+            assert p1.stat().st_mode == p2.stat().st_mode
+            assert p1.stat().st_size == p2.stat().st_size
+            assert p1.stat().st_atime == pytest.approx(p2.stat().st_atime)
+            assert p1.stat().st_mtime == pytest.approx(p2.stat().st_mtime)
+
+
+def test_build_generics_tree(tmp_path, caplog, config):
+    """Manages ok a deep tree, including internal ignores."""
+    _test_build_generics_tree(tmp_path, caplog, config, expect_hardlinks=True)
+
+
+def test_build_generics_tree_vagrant(tmp_path, caplog, config):
+    """Manages ok a deep tree, including internal ignores, when hardlinks aren't allowed."""
+    with patch("os.link") as mock_link:
+        mock_link.side_effect = PermissionError("No you don't.")
+        _test_build_generics_tree(tmp_path, caplog, config, expect_hardlinks=False)
+
+
+def test_build_generics_tree_xdev(tmp_path, caplog, config):
+    """Manages ok a deep tree, including internal ignores, when hardlinks can't be done."""
+    with patch("os.link") as mock_link:
+        mock_link.side_effect = OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        _test_build_generics_tree(tmp_path, caplog, config, expect_hardlinks=False)
+
+
+def test_build_generics_symlink_file(tmp_path, config):
+    """Respects a symlinked file."""
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+    the_symlink = tmp_path / "somehook.py"
+    the_symlink.symlink_to(entrypoint)
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+    builder.handle_generic_paths()
+
+    built_symlink = build_dir / "somehook.py"
+    assert built_symlink.is_symlink()
+    assert built_symlink.resolve() == build_dir / "crazycharm.py"
+    real_link = os.readlink(str(built_symlink))
+    assert real_link == "crazycharm.py"
+
+
+def test_build_generics_symlink_dir(tmp_path, config):
+    """Respects a symlinked dir."""
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+    somedir = tmp_path / "somedir"
+    somedir.mkdir()
+    somefile = somedir / "sanity check"
+    somefile.touch()
+    the_symlink = tmp_path / "thelink"
+    the_symlink.symlink_to(somedir)
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+    builder.handle_generic_paths()
+
+    built_symlink = build_dir / "thelink"
+    assert built_symlink.is_symlink()
+    assert built_symlink.resolve() == build_dir / "somedir"
+    real_link = os.readlink(str(built_symlink))
+    assert real_link == "somedir"
+
+    # as a sanity check, the file inside the linked dir should exist
+    assert (build_dir / "thelink" / "sanity check").exists()
+
+
+def test_build_generics_symlink_deep(tmp_path, config):
+    """Correctly re-links a symlink across deep dirs."""
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+
+    dir1 = tmp_path / "dir1"
+    dir1.mkdir()
+    dir2 = tmp_path / "dir2"
+    dir2.mkdir()
+    original_target = dir1 / "file.real"
+    original_target.touch()
+    the_symlink = dir2 / "file.link"
+    the_symlink.symlink_to(original_target)
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+    builder.handle_generic_paths()
+
+    built_symlink = build_dir / "dir2" / "file.link"
+    assert built_symlink.is_symlink()
+    assert built_symlink.resolve() == build_dir / "dir1" / "file.real"
+    real_link = os.readlink(str(built_symlink))
+    assert real_link == "../dir1/file.real"
+
+
+def test_build_generics_symlink_file_outside(tmp_path, caplog, config):
+    """Ignores (with warning) a symlink pointing a file outside projects dir."""
+    caplog.set_level(logging.WARNING)
+
+    project_dir = tmp_path / "test-project"
+    project_dir.mkdir()
+
+    metadata = project_dir / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    build_dir = project_dir / BUILD_DIRNAME
+    build_dir.mkdir()
+    entrypoint = project_dir / "crazycharm.py"
+    entrypoint.touch()
+
+    outside_project = tmp_path / "dangerous.txt"
+    outside_project.touch()
+    the_symlink = project_dir / "external-file"
+    the_symlink.symlink_to(outside_project)
+
+    builder = Builder(
+        {
+            "from": project_dir,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+    builder.handle_generic_paths()
+
+    assert not (build_dir / "external-file").exists()
+    expected = "Ignoring symlink because targets outside the project: 'external-file'"
+    assert expected in [rec.message for rec in caplog.records]
+
+
+def test_build_generics_symlink_directory_outside(tmp_path, caplog, config):
+    """Ignores (with warning) a symlink pointing a dir outside projects dir."""
+    caplog.set_level(logging.WARNING)
+
+    project_dir = tmp_path / "test-project"
+    project_dir.mkdir()
+
+    metadata = project_dir / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    build_dir = project_dir / BUILD_DIRNAME
+    build_dir.mkdir()
+    entrypoint = project_dir / "crazycharm.py"
+    entrypoint.touch()
+
+    outside_project = tmp_path / "dangerous"
+    outside_project.mkdir()
+    the_symlink = project_dir / "external-dir"
+    the_symlink.symlink_to(outside_project)
+
+    builder = Builder(
+        {
+            "from": project_dir,
+            "entrypoint": entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+    builder.handle_generic_paths()
+
+    assert not (build_dir / "external-dir").exists()
+    expected = "Ignoring symlink because targets outside the project: 'external-dir'"
+    assert expected in [rec.message for rec in caplog.records]
+
+
+def test_build_generics_different_filetype(tmp_path, caplog, monkeypatch, config):
+    """Ignores whatever is not a regular file, symlink or dir."""
+    caplog.set_level(logging.DEBUG)
+
+    # change into the tmp path and do everything locally, because otherwise the socket path
+    # will be too long for mac os
+    monkeypatch.chdir(tmp_path)
+
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    build_dir = pathlib.Path(BUILD_DIRNAME)
+    build_dir.mkdir()
+    entrypoint = pathlib.Path("crazycharm.py")
+    entrypoint.touch()
+
+    # create a socket
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind("test-socket")
+
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": tmp_path / entrypoint,
+            "requirement": [],
+        },
+        config,
+    )
+    builder.handle_generic_paths()
 
-        mock_launch.reset_mock()
+    assert not (build_dir / "test-socket").exists()
+    expected = "Ignoring file because of type: 'test-socket'"
+    assert expected in [rec.message for rec in caplog.records]
 
-        expected_msg = re.escape("Failed to build charm for bases index '0'.")
-        with pytest.raises(
-            CommandError,
-            match=expected_msg,
-        ):
-            mock_instance = mock_launch.return_value.__enter__.return_value
-            mock_instance.execute_run.side_effect = subprocess.CalledProcessError(
-                -1,
-                ["charmcraft", "pack", "..."],
-                "some output",
-                "some error",
-            )
-            builder.run([0])
 
-        assert mock_instance.mock_calls == [
-            call.execute_run(
-                ["charmcraft", "pack", "--bases-index", "0"] + cmd_flags,
-                check=True,
-                cwd="/root/project",
-            ),
-        ]
-        assert mock_capture_logs_from_instance.mock_calls == [call(mock_instance)]
+@pytest.fixture
+def incremental_project(tmp_path):
+    """Create a simple project to be built incrementally."""
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.touch()
+    return tmp_path
 
 
-def test_build_bases_index_scenarios_managed_mode(basic_project, monkeypatch, caplog):
-    """Test cases for base-index parameter."""
-    host_base = get_host_as_base()
-    host_arch = host_base.architectures[0]
-    charmcraft_file = basic_project / "charmcraft.yaml"
-    charmcraft_file.write_text(
-        dedent(
-            f"""\
-                type: charm
-                bases:
-                  - build-on:
-                      - name: {host_base.name!r}
-                        channel: {host_base.channel!r}
-                        architectures: {host_base.architectures!r}
-                    run-on:
-                      - name: {host_base.name!r}
-                        channel: {host_base.channel!r}
-                        architectures: {host_base.architectures!r}
-                  - build-on:
-                      - name: unmatched-name
-                        channel: unmatched-channel
-                        architectures: [unmatched-arch1]
-                    run-on:
-                      - name: unmatched-name
-                        channel: unmatched-channel
-                        architectures: [unmatched-arch1]
-                  - build-on:
-                      - name: {host_base.name!r}
-                        channel: {host_base.channel!r}
-                        architectures: {host_base.architectures!r}
-                    run-on:
-                      - name: cross-name
-                        channel: cross-channel
-                        architectures: [cross-arch1]
-                """
-        )
-    )
-    config = load(basic_project)
-    monkeypatch.chdir(basic_project)
-    builder = Builder(
+def _get_incremental_builder(tmp_path, config):
+    """Return a Builder in incremental mode for the given project."""
+    return Builder(
         {
-            "from": basic_project,
-            "entrypoint": basic_project / "src" / "charm.py",
+            "from": tmp_path,
+            "entrypoint": tmp_path / "crazycharm.py",
             "requirement": [],
+            "incremental": True,
         },
         config,
     )
 
-    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
-    zipnames = builder.run([0])
-    assert zipnames == [
-        f"name-from-metadata_{host_base.name}-{host_base.channel}-{host_arch}.charm",
-    ]
 
-    with pytest.raises(
-        CommandError,
-        match=r"No suitable 'build-on' environment found in any 'bases' configuration.",
-    ):
-        builder.run([1])
+def _get_build_tree(build_dir):
+    """Return a simple representation of the build tree, to compare builds."""
+    tree = {}
+    for basedir, dirnames, filenames in os.walk(str(build_dir)):
+        basedir = pathlib.Path(basedir)
+        for name in dirnames + filenames:
+            path = basedir / name
+            rel_path = str(path.relative_to(build_dir))
+            if path.is_symlink():
+                tree[rel_path] = ("symlink", os.readlink(str(path)))
+            elif path.is_dir():
+                tree[rel_path] = ("dir",)
+            else:
+                tree[rel_path] = ("file", path.read_bytes())
+    return tree
+
+
+def test_build_incremental_from_scratch(incremental_project, config):
+    """Without a previous build state everything is built, and the state is saved."""
+    tmp_path = incremental_project
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    leftover = build_dir / "leftover"
+    leftover.touch()
+    somedir = tmp_path / "somedir"
+    somedir.mkdir()
+    (somedir / "file.txt").write_text("content")
 
-    zipnames = builder.run([2])
-    assert zipnames == [
-        "name-from-metadata_cross-name-cross-channel-cross-arch1.charm",
+    builder = _get_incremental_builder(tmp_path, config)
+    builder.prepare_incremental_buildpath()
+    builder.handle_generic_paths()
+
+    assert not leftover.exists()
+    assert (build_dir / "somedir" / "file.txt").read_text() == "content"
+    state_path = build_dir / BUILD_STATE_FILENAME
+    state = json.loads(state_path.read_text())
+    assert state["charmdir"] == str(tmp_path)
+    assert sorted(state["entries"]) == [
+        "crazycharm.py",
+        "metadata.yaml",
+        "somedir",
+        "somedir/file.txt",
     ]
 
 
-@patch(
-    "charmcraft.bases.get_host_as_base",
-    return_value=Base(name="xname", channel="xchannel", architectures=["xarch"]),
-)
-def test_build_error_no_match_with_charmcraft_yaml(
-    mock_host_base, basic_project, monkeypatch, caplog
+def test_build_incremental_reuse(incremental_project, config):
+    """Only what changed in the project is linked again, generated stuff is removed."""
+    tmp_path = incremental_project
+    build_dir = tmp_path / BUILD_DIRNAME
+    unchanged = tmp_path / "unchanged.txt"
+    unchanged.write_text("unchanged")
+    replaced = tmp_path / "replaced.txt"
+    replaced.write_text("old content")
+    removed = tmp_path / "removed.txt"
+    removed.write_text("removed")
+    removed_dir = tmp_path / "removed_dir"
+    removed_dir.mkdir()
+    (removed_dir / "inside.txt").touch()
+
+    builder = _get_incremental_builder(tmp_path, config)
+    builder.prepare_incremental_buildpath()
+    builder.handle_generic_paths()
+
+    # simulate stuff generated by the build after linking
+    (build_dir / "manifest.yaml").touch()
+    (build_dir / "venv").mkdir()
+    (build_dir / "venv" / "lib.py").touch()
+
+    # change the project: replace one file (new inode), remove others, add a new one
+    replaced.unlink()
+    replaced.write_text("new content")
+    removed.unlink()
+    (removed_dir / "inside.txt").unlink()
+    removed_dir.rmdir()
+    added = tmp_path / "added.txt"
+    added.write_text("added")
+
+    builder = _get_incremental_builder(tmp_path, config)
+    with patch("os.link", wraps=os.link) as mock_link:
+        builder.prepare_incremental_buildpath()
+        builder.handle_generic_paths()
+
+    linked = sorted(pathlib.Path(c[0][1]).name for c in mock_link.call_args_list)
+    assert linked == ["added.txt", "replaced.txt"]
+    assert (build_dir / "replaced.txt").read_text() == "new content"
+    assert (build_dir / "added.txt").read_text() == "added"
+    assert (build_dir / "unchanged.txt").stat().st_ino == unchanged.stat().st_ino
+    assert not (build_dir / "removed.txt").exists()
+    assert not (build_dir / "removed_dir").exists()
+    assert not (build_dir / "manifest.yaml").exists()
+    assert not (build_dir / "venv").exists()
+
+
+def test_build_incremental_type_changed(incremental_project, config):
+    """A path that changed its type is properly replaced."""
+    tmp_path = incremental_project
+    build_dir = tmp_path / BUILD_DIRNAME
+    changing = tmp_path / "changing"
+    changing.mkdir()
+    (changing / "inside.txt").touch()
+
+    builder = _get_incremental_builder(tmp_path, config)
+    builder.prepare_incremental_buildpath()
+    builder.handle_generic_paths()
+
+    (changing / "inside.txt").unlink()
+    changing.rmdir()
+    changing.symlink_to("crazycharm.py")
+
+    builder = _get_incremental_builder(tmp_path, config)
+    builder.prepare_incremental_buildpath()
+    builder.handle_generic_paths()
+
+    assert (build_dir / "changing").is_symlink()
+    assert os.readlink(str(build_dir / "changing")) == "crazycharm.py"
+
+
+def test_build_incremental_dir_replaced_by_symlink(incremental_project, config):
+    """A directory replaced by a symlink doesn't remove what the symlink points to."""
+    tmp_path = incremental_project
+    build_dir = tmp_path / BUILD_DIRNAME
+    for dirname in ("foo", "bar"):
+        (tmp_path / dirname).mkdir()
+        (tmp_path / dirname / "x").write_text(dirname)
+
+    builder = _get_incremental_builder(tmp_path, config)
+    builder.prepare_incremental_buildpath()
+    builder.handle_generic_paths()
+
+    shutil.rmtree(str(tmp_path / "foo"))
+    (tmp_path / "foo").symlink_to("bar")
+
+    builder = _get_incremental_builder(tmp_path, config)
+    builder.prepare_incremental_buildpath()
+    builder.handle_generic_paths()
+
+    assert (build_dir / "bar" / "x").read_text() == "bar"
+    assert os.readlink(str(build_dir / "foo")) == "bar"
+
+
+def test_build_incremental_mode_changed(incremental_project, config):
+    """A file copied in the previous build is copied again if its mode changed."""
+    tmp_path = incremental_project
+    build_dir = tmp_path / BUILD_DIRNAME
+    entrypoint = tmp_path / "crazycharm.py"
+    entrypoint.chmod(0o644)
+
+    with patch("os.link", side_effect=PermissionError("No you don't.")):
+        builder = _get_incremental_builder(tmp_path, config)
+        builder.prepare_incremental_buildpath()
+        builder.handle_generic_paths()
+
+        entrypoint.chmod(0o755)
+        builder = _get_incremental_builder(tmp_path, config)
+        builder.prepare_incremental_buildpath()
+        builder.handle_generic_paths()
+
+    assert (build_dir / "crazycharm.py").stat().st_mode & 0o777 == 0o755
+
+
+def test_build_incremental_other_project_state(incremental_project, config):
+    """The state from a different project is not used."""
+    tmp_path = incremental_project
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    (build_dir / "crazycharm.py").touch()
+    state = {"charmdir": "/other/project", "entries": {"crazycharm.py": ["file"]}}
+    (build_dir / BUILD_STATE_FILENAME).write_text(json.dumps(state))
+
+    builder = _get_incremental_builder(tmp_path, config)
+    builder.prepare_incremental_buildpath()
+    builder.handle_generic_paths()
+
+    entrypoint = tmp_path / "crazycharm.py"
+    assert (build_dir / "crazycharm.py").stat().st_ino == entrypoint.stat().st_ino
+
+
+def test_build_incremental_same_as_clean(
+    basic_project, tmp_path_factory, monkeypatch, config
 ):
-    """Error when no charms are buildable with host base, verifying each mismatched reason."""
-    caplog.set_level(logging.DEBUG)
-    charmcraft_file = basic_project / "charmcraft.yaml"
-    charmcraft_file.write_text(
-        dedent(
-            """\
-                type: charm
-                bases:
-                  - name: unmatched-name
-                    channel: xchannel
-                    architectures: [xarch]
-                  - name: xname
-                    channel: unmatched-channel
-                    architectures: [xarch]
-                  - name: xname
-                    channel: xchannel
-                    architectures: [unmatched-arch1, unmatched-arch2]
-                """
+    """An incremental build produces the same tree than a clean one."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    hooks_dir = basic_project / "hooks"
+    hooks_dir.mkdir()
+    (hooks_dir / "install").symlink_to("../src/charm.py")
+    build_dir = basic_project / BUILD_DIRNAME
+
+    def _build(incremental):
+        builder = Builder(
+            {
+                "from": basic_project,
+                "entrypoint": basic_project / "src" / "charm.py",
+                "requirement": [],
+                "incremental": incremental,
+                "force": True,
+            },
+            config,
         )
-    )
-    config = load(basic_project)
-    monkeypatch.chdir(basic_project)
+        with patch(
+            "charmcraft.commands.build.check_if_base_matches_host",
+            return_value=(True, None),
+        ):
+            builder.run()
+        tree = _get_build_tree(build_dir)
+        tree.pop(BUILD_STATE_FILENAME, None)
+        return tree
+
+    _build(incremental=False)
+    _build(incremental=True)
+    (basic_project / "src" / "other.py").write_text("new file")
+    incremental_tree = _build(incremental=True)
+    assert incremental_tree["src/other.py"] == ("file", b"new file")
+    assert incremental_tree == _build(incremental=False)
+
+
+def test_build_incremental_state_not_packed(incremental_project, monkeypatch, config):
+    """The build state is not included in the charm."""
+    tmp_path = incremental_project
+    monkeypatch.chdir(tmp_path)
+    builder = _get_incremental_builder(tmp_path, config)
+    builder.prepare_incremental_buildpath()
+    builder.handle_generic_paths()
+    zipname = builder.handle_package()
+
+    zf = zipfile.ZipFile(zipname)
+    assert BUILD_STATE_FILENAME not in zf.namelist()
+    assert "metadata.yaml" in zf.namelist()
+
+
+def _get_charm_content(zipname):
+    """Return the content of the packed charm, to compare charms."""
+    with zipfile.ZipFile(zipname) as zf:
+        return {name: zf.read(name) for name in zf.namelist()}
+
+
+def test_build_stream_same_as_clean(
+    basic_project, tmp_path_factory, monkeypatch, config
+):
+    """A streamed charm has the same content than one packed from the build dir."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    hooks_dir = basic_project / "hooks"
+    hooks_dir.mkdir()
+    (hooks_dir / "install").symlink_to("../src/charm.py")
+    (hooks_dir / "other").write_text("other hook")
+    (basic_project / "mylib").mkdir()
+    (basic_project / "mylib" / "module.py").write_text("module")
+    (basic_project / "linkedlib").symlink_to("mylib")
+    (basic_project / "linkedfile").symlink_to("mylib/module.py")
+    (basic_project / "outside").symlink_to("/")
+
+    def _fake_dependencies(self):
+        venvpath = self.buildpath / "venv"
+        venvpath.mkdir()
+        (venvpath / "dependency.py").write_text("dependency")
+
+    def _build(stream):
+        builder = Builder(
+            {
+                "from": basic_project,
+                "entrypoint": basic_project / "src" / "charm.py",
+                "requirement": [],
+                "stream": stream,
+            },
+            config,
+        )
+        with patch.object(Builder, "handle_dependencies", _fake_dependencies):
+            zipname = builder.build_charm(config.bases[0])
+        return _get_charm_content(zipname)
+
+    clean_content = _build(stream=False)
+    streamed_content = _build(stream=True)
+    assert streamed_content == clean_content
+    assert streamed_content["hooks/install"] == streamed_content["dispatch"]
+    assert streamed_content["linkedlib/module.py"] == b"module"
+    assert "venv/dependency.py" in streamed_content
+
+
+def test_build_stream_only_generated_in_buildpath(
+    basic_project, tmp_path_factory, monkeypatch, config
+):
+    """When streaming, the project files are not linked in the build directory."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
     builder = Builder(
         {
             "from": basic_project,
             "entrypoint": basic_project / "src" / "charm.py",
             "requirement": [],
+            "stream": True,
         },
         config,
     )
+    builder.build_charm(config.bases[0])
 
-    # Managed bases build.
-    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
-    with pytest.raises(
-        CommandError,
-        match=r"No suitable 'build-on' environment found in any 'bases' configuration.",
-    ):
-        builder.run()
+    build_dir = basic_project / BUILD_DIRNAME
+    assert sorted(os.listdir(str(build_dir))) == ["dispatch", "manifest.yaml"]
 
-    records = [r.message for r in caplog.records]
 
-    assert (
-        "Skipping 'bases[0].build-on[0]': "
-        "name 'unmatched-name' does not match host 'xname'."
-    ) in records
-    assert (
-        "No suitable 'build-on' environment found in 'bases[0]' configuration."
-        in records
-    )
-    assert (
-        "Skipping 'bases[1].build-on[0]': "
-        "channel 'unmatched-channel' does not match host 'xchannel'."
-    ) in records
-    assert (
-        "No suitable 'build-on' environment found in 'bases[1]' configuration."
-        in records
-    )
-    assert (
-        "Skipping 'bases[2].build-on[0]': "
-        "host architecture 'xarch' not in base architectures "
-        "['unmatched-arch1', 'unmatched-arch2']."
-    ) in records
-    assert (
-        "No suitable 'build-on' environment found in 'bases[2]' configuration."
-        in records
+def test_build_stream_linters_use_project_files(
+    basic_project, tmp_path_factory, monkeypatch, config
+):
+    """The linters find the files in the project or generated in the build dir."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    builder = Builder(
+        {
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
+            "requirement": [],
+            "stream": True,
+        },
+        config,
     )
+    with patch("charmcraft.linters.analyze", return_value=[]) as mock_analyze:
+        builder.build_charm(config.bases[0])
 
+    (_, charm_view) = mock_analyze.call_args[0]
+    build_dir = basic_project / BUILD_DIRNAME
+    assert charm_view / "dispatch" == build_dir / "dispatch"
+    assert charm_view / "./src/charm.py" == basic_project / "src" / "charm.py"
+    assert charm_view / "venv" / "ops" == build_dir / "venv" / "ops"
 
-def test_build_generics_simple_files(tmp_path, config):
-    """Check transferred metadata and simple entrypoint, also return proper linked entrypoint."""
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
-
-    metadata = tmp_path / CHARM_METADATA
-    metadata.write_text("name: crazycharm")
-
-    entrypoint = tmp_path / "crazycharm.py"
-    entrypoint.touch()
 
+def test_build_stream_manifest_in_project(
+    basic_project, tmp_path_factory, monkeypatch, config
+):
+    """Fail when streaming a project that already has a manifest."""
+    monkeypatch.chdir(tmp_path_factory.mktemp("output"))
+    (basic_project / "manifest.yaml").touch()
     builder = Builder(
         {
-            "from": tmp_path,
-            "entrypoint": entrypoint,
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
             "requirement": [],
+            "stream": True,
         },
         config,
     )
-    linked_entrypoint = builder.handle_generic_paths()
-
-    # check files are there, are files, and are really hard links (so no
-    # check for permissions needed)
-    built_metadata = build_dir / CHARM_METADATA
-    assert built_metadata.is_file()
-    assert built_metadata.stat().st_ino == metadata.stat().st_ino
-
-    built_entrypoint = build_dir / "crazycharm.py"
-    assert built_entrypoint.is_file()
-    assert built_entrypoint.stat().st_ino == entrypoint.stat().st_ino
-
-    assert linked_entrypoint == built_entrypoint
+    with pytest.raises(CommandError) as cm:
+        builder.build_charm(config.bases[0])
+    assert str(cm.value) == (
+        "Cannot write the manifest as there is already a 'manifest.yaml' in disk."
+    )
 
 
-def test_build_generics_simple_dir(tmp_path, config):
-    """Check transferred any directory, with proper permissions."""
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
-    entrypoint = tmp_path / "crazycharm.py"
-    entrypoint.touch()
+def test_build_stream_symlinks_loop(tmp_path, config):
+    """Symlinks creating a loop are expanded only once."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-
     somedir = tmp_path / "somedir"
-    somedir.mkdir(mode=0o700)
+    somedir.mkdir()
+    (somedir / "file.txt").write_text("content")
+    (somedir / "subdir").mkdir()
+    (somedir / "subdir" / "loop").symlink_to("..")
 
     builder = Builder(
         {
             "from": tmp_path,
-            "entrypoint": entrypoint,
+            "entrypoint": "whatever",
             "requirement": [],
+            "stream": True,
         },
         config,
     )
-    builder.handle_generic_paths()
+    charm_files = builder.collect_project_files()
 
-    built_dir = build_dir / "somedir"
-    assert built_dir.is_dir()
-    assert built_dir.stat().st_mode & 0xFFF == 0o700
+    assert charm_files["somedir/file.txt"] == somedir / "file.txt"
+    assert charm_files["somedir/subdir/loop/file.txt"] == somedir / "file.txt"
+    assert "somedir/subdir/loop/subdir/loop/file.txt" not in charm_files
 
 
-def test_build_generics_ignored_file(tmp_path, caplog, config):
-    """Don't include ignored filed."""
-    caplog.set_level(logging.DEBUG)
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
+def test_build_dispatcher_modern_dispatch_created(tmp_path, config):
+    """The dispatcher script is properly built."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
 
-    # create two files (and the needed entrypoint)
-    file1 = tmp_path / "file1.txt"
-    file1.touch()
-    file2 = tmp_path / "file2.txt"
-    file2.touch()
-    entrypoint = tmp_path / "crazycharm.py"
-    entrypoint.touch()
+    linked_entrypoint = build_dir / "somestuff.py"
 
     builder = Builder(
         {
             "from": tmp_path,
-            "entrypoint": entrypoint,
+            "entrypoint": "whatever",
             "requirement": [],
         },
         config,
     )
+    builder.handle_dispatcher(linked_entrypoint)
 
-    # set it up to ignore file 2 and make it work
-    builder.ignore_rules.extend_patterns(["file2.*"])
-    builder.handle_generic_paths()
-
-    assert (build_dir / "file1.txt").exists()
-    assert not (build_dir / "file2.txt").exists()
-
-    expected = "Ignoring file because of rules: 'file2.txt'"
-    assert expected in [rec.message for rec in caplog.records]
+    included_dispatcher = build_dir / DISPATCH_FILENAME
+    with included_dispatcher.open("rt", encoding="utf8") as fh:
+        dispatcher_code = fh.read()
+    assert dispatcher_code == DISPATCH_CONTENT.format(
+        entrypoint_relative_path="somestuff.py", pythonpath=DISPATCH_PYTHONPATH
+    )
 
 
-def test_build_generics_ignored_dir(tmp_path, caplog, config):
-    """Don't include ignored dir."""
-    caplog.set_level(logging.DEBUG)
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
+def test_build_dispatcher_modern_dispatch_respected(tmp_path, config):
+    """The already included dispatcher script is left untouched."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
 
-    # create two files (and the needed entrypoint)
-    dir1 = tmp_path / "dir1"
-    dir1.mkdir()
-    dir2 = tmp_path / "dir2"
-    dir2.mkdir()
-    entrypoint = tmp_path / "crazycharm.py"
-    entrypoint.touch()
+    already_present_dispatch = build_dir / DISPATCH_FILENAME
+    with already_present_dispatch.open("wb") as fh:
+        fh.write(b"abc")
 
     builder = Builder(
         {
             "from": tmp_path,
-            "entrypoint": entrypoint,
+            "entrypoint": "whatever",
             "requirement": [],
         },
         config,
     )
+    builder.handle_dispatcher("whatever")
 
-    # set it up to ignore dir 2 and make it work
-    builder.ignore_rules.extend_patterns(["dir2"])
-    builder.handle_generic_paths()
-
-    assert (build_dir / "dir1").exists()
-    assert not (build_dir / "dir2").exists()
-
-    expected = "Ignoring directory because of rules: 'dir2'"
-    assert expected in [rec.message for rec in caplog.records]
-
+    with already_present_dispatch.open("rb") as fh:
+        assert fh.read() == b"abc"
 
-def _test_build_generics_tree(tmp_path, caplog, config, *, expect_hardlinks):
-    caplog.set_level(logging.DEBUG)
 
+def test_build_dispatcher_classic_hooks_mandatory_created(tmp_path, config):
+    """The mandatory classic hooks are implemented ok if not present."""
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
     build_dir = tmp_path / BUILD_DIRNAME
     build_dir.mkdir()
 
-    # create this structure:
-    # ├─ crazycharm.py  (entrypoint)
-    # ├─ file1.txt
-    # ├─ dir1
-    # │  └─ dir3  (ignored!)
-    # └─ dir2
-    #    ├─ file2.txt
-    #    ├─ file3.txt  (ignored!)
-    #    ├─ dir4  (ignored!)
-    #    │   └─ file4.txt
-    #    └─ dir5
-    entrypoint = tmp_path / "crazycharm.py"
-    entrypoint.touch()
-    metadata = tmp_path / CHARM_METADATA
-    metadata.write_text("name: crazycharm")
-    file1 = tmp_path / "file1.txt"
-    file1.touch()
-    dir1 = tmp_path / "dir1"
-    dir1.mkdir()
-    dir3 = dir1 / "dir3"
-    dir3.mkdir()
-    dir2 = tmp_path / "dir2"
-    dir2.mkdir()
-    file2 = dir2 / "file2.txt"
-    file2.touch()
-    file3 = dir2 / "file3.txt"
-    file3.touch()
-    dir4 = dir2 / "dir4"
-    dir4.mkdir()
-    file4 = dir4 / "file4.txt"
-    file4.touch()
-    dir5 = dir2 / "dir5"
-    dir5.mkdir()
+    linked_entrypoint = build_dir / "somestuff.py"
+    included_dispatcher = build_dir / DISPATCH_FILENAME
 
     builder = Builder(
         {
             "from": tmp_path,
-            "entrypoint": entrypoint,
+            "entrypoint": "whatever",
             "requirement": [],
         },
         config,
     )
+    with patch("charmcraft.commands.build.MANDATORY_HOOK_NAMES", {"testhook"}):
+        builder.handle_dispatcher(linked_entrypoint)
 
-    # set it up to ignore some stuff and make it work
-    builder.ignore_rules.extend_patterns(
-        [
-            "dir1/dir3",
-            "dir2/file3.txt",
-            "dir2/dir4",
-        ]
-    )
-    builder.handle_generic_paths()
-
-    assert (build_dir / "crazycharm.py").exists()
-    assert (build_dir / "file1.txt").exists()
-    assert (build_dir / "dir1").exists()
-    assert not (build_dir / "dir1" / "dir3").exists()
-    assert (build_dir / "dir2").exists()
-    assert (build_dir / "dir2" / "file2.txt").exists()
-    assert not (build_dir / "dir2" / "file3.txt").exists()
-    assert not (build_dir / "dir2" / "dir4").exists()
-    assert (build_dir / "dir2" / "dir5").exists()
+    test_hook = build_dir / "hooks" / "testhook"
+    assert test_hook.is_symlink()
+    assert test_hook.resolve() == included_dispatcher
+    real_link = os.readlink(str(test_hook))
+    assert real_link == os.path.join("..", DISPATCH_FILENAME)
 
-    for (p1, p2) in [
-        (build_dir / "crazycharm.py", entrypoint),
-        (build_dir / "file1.txt", file1),
-        (build_dir / "dir2" / "file2.txt", file2),
-    ]:
-        if expect_hardlinks:
-            # they're hard links
-            assert p1.samefile(p2)
-        else:
-            # they're *not* hard links
-            assert not p1.samefile(p2)
-            # but they're essentially the same
-            assert filecmp.cmp(str(p1), str(p2), shallow=False)
-            assert p1.stat().st_mode == p2.stat().st_mode
-            assert p1.stat().st_size == p2.stat().st_size
-            assert p1.stat().st_atime == pytest.approx(p2.stat().st_atime)
-            assert p1.stat().st_mtime == pytest.approx(p2.stat().st_mtime)
 
+def test_build_dispatcher_classic_hooks_mandatory_respected(tmp_path, config):
+    """The already included mandatory classic hooks are left untouched."""
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
 
-def test_build_generics_tree(tmp_path, caplog, config):
-    """Manages ok a deep tree, including internal ignores."""
-    _test_build_generics_tree(tmp_path, caplog, config, expect_hardlinks=True)
+    built_hooks_dir = build_dir / "hooks"
+    built_hooks_dir.mkdir()
+    test_hook = built_hooks_dir / "testhook"
+    with test_hook.open("wb") as fh:
+        fh.write(b"abc")
 
+    linked_entrypoint = build_dir / "somestuff.py"
 
-def test_build_generics_tree_vagrant(tmp_path, caplog, config):
-    """Manages ok a deep tree, including internal ignores, when hardlinks aren't allowed."""
-    with patch("os.link") as mock_link:
-        mock_link.side_effect = PermissionError("No you don't.")
-        _test_build_generics_tree(tmp_path, caplog, config, expect_hardlinks=False)
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": "whatever",
+            "requirement": [],
+        },
+        config,
+    )
+    with patch("charmcraft.commands.build.MANDATORY_HOOK_NAMES", {"testhook"}):
+        builder.handle_dispatcher(linked_entrypoint)
 
+    with test_hook.open("rb") as fh:
+        assert fh.read() == b"abc"
 
-def test_build_generics_tree_xdev(tmp_path, caplog, config):
-    """Manages ok a deep tree, including internal ignores, when hardlinks can't be done."""
-    with patch("os.link") as mock_link:
-        mock_link.side_effect = OSError(errno.EXDEV, os.strerror(errno.EXDEV))
-        _test_build_generics_tree(tmp_path, caplog, config, expect_hardlinks=False)
 
+def test_build_dispatcher_classic_hooks_linking_charm_replaced(
+    tmp_path, caplog, config
+):
+    """Hooks that are just a symlink to the entrypoint are replaced."""
+    caplog.set_level(logging.DEBUG, logger="charmcraft")
 
-def test_build_generics_symlink_file(tmp_path, config):
-    """Respects a symlinked file."""
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
     build_dir = tmp_path / BUILD_DIRNAME
     build_dir.mkdir()
 
-    metadata = tmp_path / CHARM_METADATA
-    metadata.write_text("name: crazycharm")
-    entrypoint = tmp_path / "crazycharm.py"
-    entrypoint.touch()
-    the_symlink = tmp_path / "somehook.py"
-    the_symlink.symlink_to(entrypoint)
+    # simple source code
+    src_dir = build_dir / "src"
+    src_dir.mkdir()
+    built_charm_script = src_dir / "charm.py"
+    with built_charm_script.open("wb") as fh:
+        fh.write(b"all the magic")
+
+    # a test hook, just a symlink to the charm
+    built_hooks_dir = build_dir / "hooks"
+    built_hooks_dir.mkdir()
+    test_hook = built_hooks_dir / "somehook"
+    test_hook.symlink_to(built_charm_script)
+
+    included_dispatcher = build_dir / DISPATCH_FILENAME
 
     builder = Builder(
         {
             "from": tmp_path,
-            "entrypoint": entrypoint,
+            "entrypoint": "whatever",
             "requirement": [],
         },
         config,
     )
-    builder.handle_generic_paths()
-
-    built_symlink = build_dir / "somehook.py"
-    assert built_symlink.is_symlink()
-    assert built_symlink.resolve() == build_dir / "crazycharm.py"
-    real_link = os.readlink(str(built_symlink))
-    assert real_link == "crazycharm.py"
+    builder.handle_dispatcher(built_charm_script)
 
+    # the test hook is still there and a symlink, but now pointing to the dispatcher
+    assert test_hook.is_symlink()
+    assert test_hook.resolve() == included_dispatcher
+    expected = "Replacing existing hook 'somehook' as it's a symlink to the entrypoint"
+    assert expected in [rec.message for rec in caplog.records]
 
-def test_build_generics_symlink_dir(tmp_path, config):
-    """Respects a symlinked dir."""
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
 
+def test_build_dependencies_virtualenv_simple(tmp_path, config):
+    """A virtualenv is created with the specified requirements file."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-    entrypoint = tmp_path / "crazycharm.py"
-    entrypoint.touch()
-    somedir = tmp_path / "somedir"
-    somedir.mkdir()
-    somefile = somedir / "sanity check"
-    somefile.touch()
-    the_symlink = tmp_path / "thelink"
-    the_symlink.symlink_to(somedir)
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
 
     builder = Builder(
         {
             "from": tmp_path,
-            "entrypoint": entrypoint,
-            "requirement": [],
+            "entrypoint": "whatever",
+            "requirement": ["reqs.txt"],
         },
         config,
     )
-    builder.handle_generic_paths()
 
-    built_symlink = build_dir / "thelink"
-    assert built_symlink.is_symlink()
-    assert built_symlink.resolve() == build_dir / "somedir"
-    real_link = os.readlink(str(built_symlink))
-    assert real_link == "somedir"
-
-    # as a sanity check, the file inside the linked dir should exist
-    assert (build_dir / "thelink" / "sanity check").exists()
+    with patch("charmcraft.commands.build.subprocess.run") as mock_run:
+        mock_run.return_value.returncode = 1
+        with patch("charmcraft.commands.build.polite_exec") as mock:
+            mock.return_value = 0
+            builder.handle_dependencies()
 
+    envpath = build_dir / VENV_DIRNAME
+    assert mock.mock_calls == [
+        call(["pip3", "list"]),
+        call(
+            ["pip3", "install", "--target={}".format(envpath), "--requirement=reqs.txt"]
+        ),
+    ]
+    assert mock_run.mock_calls == [
+        call(
+            [
+                "python3",
+                "-c",
+                (
+                    "from pip.commands.install import InstallCommand; "
+                    'assert InstallCommand().cmd_opts.get_option("--system") is not None'
+                ),
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        ),
+    ]
 
-def test_build_generics_symlink_deep(tmp_path, config):
-    """Correctly re-links a symlink across deep dirs."""
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
 
+def test_build_dependencies_needs_system(tmp_path, config):
+    """pip3 is called with --system when pip3 needs it."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-    entrypoint = tmp_path / "crazycharm.py"
-    entrypoint.touch()
-
-    dir1 = tmp_path / "dir1"
-    dir1.mkdir()
-    dir2 = tmp_path / "dir2"
-    dir2.mkdir()
-    original_target = dir1 / "file.real"
-    original_target.touch()
-    the_symlink = dir2 / "file.link"
-    the_symlink.symlink_to(original_target)
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
 
     builder = Builder(
         {
             "from": tmp_path,
-            "entrypoint": entrypoint,
-            "requirement": [],
+            "entrypoint": "whatever",
+            "requirement": ["reqs"],
         },
         config,
     )
-    builder.handle_generic_paths()
-
-    built_symlink = build_dir / "dir2" / "file.link"
-    assert built_symlink.is_symlink()
-    assert built_symlink.resolve() == build_dir / "dir1" / "file.real"
-    real_link = os.readlink(str(built_symlink))
-    assert real_link == "../dir1/file.real"
 
+    with patch("charmcraft.commands.build.subprocess.run") as mock_run:
+        mock_run.return_value.returncode = 0
+        with patch("charmcraft.commands.build.polite_exec") as mock:
+            mock.return_value = 0
+            builder.handle_dependencies()
 
-def test_build_generics_symlink_file_outside(tmp_path, caplog, config):
-    """Ignores (with warning) a symlink pointing a file outside projects dir."""
-    caplog.set_level(logging.WARNING)
+    envpath = build_dir / VENV_DIRNAME
+    assert mock.mock_calls == [
+        call(["pip3", "list"]),
+        call(
+            [
+                "pip3",
+                "install",
+                "--target={}".format(envpath),
+                "--system",
+                "--requirement=reqs",
+            ]
+        ),
+    ]
 
-    project_dir = tmp_path / "test-project"
-    project_dir.mkdir()
 
-    metadata = project_dir / CHARM_METADATA
+def test_build_dependencies_virtualenv_multiple(tmp_path, config):
+    """A virtualenv is created with multiple requirements files."""
+    metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-    build_dir = project_dir / BUILD_DIRNAME
+    build_dir = tmp_path / BUILD_DIRNAME
     build_dir.mkdir()
-    entrypoint = project_dir / "crazycharm.py"
-    entrypoint.touch()
-
-    outside_project = tmp_path / "dangerous.txt"
-    outside_project.touch()
-    the_symlink = project_dir / "external-file"
-    the_symlink.symlink_to(outside_project)
 
     builder = Builder(
         {
-            "from": project_dir,
-            "entrypoint": entrypoint,
-            "requirement": [],
+            "from": tmp_path,
+            "entrypoint": "whatever",
+            "requirement": ["reqs1.txt", "reqs2.txt"],
         },
         config,
     )
-    builder.handle_generic_paths()
-
-    assert not (build_dir / "external-file").exists()
-    expected = "Ignoring symlink because targets outside the project: 'external-file'"
-    assert expected in [rec.message for rec in caplog.records]
 
+    with patch("charmcraft.commands.build.subprocess.run") as mock_run:
+        mock_run.return_value.returncode = 1
+        with patch("charmcraft.commands.build.polite_exec") as mock:
+            mock.return_value = 0
+            builder.handle_dependencies()
 
-def test_build_generics_symlink_directory_outside(tmp_path, caplog, config):
-    """Ignores (with warning) a symlink pointing a dir outside projects dir."""
-    caplog.set_level(logging.WARNING)
+    envpath = build_dir / VENV_DIRNAME
+    assert mock.mock_calls == [
+        call(["pip3", "list"]),
+        call(
+            [
+                "pip3",
+                "install",
+                "--target={}".format(envpath),
+                "--requirement=reqs1.txt",
+                "--requirement=reqs2.txt",
+            ]
+        ),
+    ]
 
-    project_dir = tmp_path / "test-project"
-    project_dir.mkdir()
 
-    metadata = project_dir / CHARM_METADATA
+def test_build_dependencies_virtualenv_none(tmp_path, config):
+    """The virtualenv is NOT created if no needed."""
+    metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-    build_dir = project_dir / BUILD_DIRNAME
+    build_dir = tmp_path / BUILD_DIRNAME
     build_dir.mkdir()
-    entrypoint = project_dir / "crazycharm.py"
-    entrypoint.touch()
-
-    outside_project = tmp_path / "dangerous"
-    outside_project.mkdir()
-    the_symlink = project_dir / "external-dir"
-    the_symlink.symlink_to(outside_project)
 
     builder = Builder(
         {
-            "from": project_dir,
-            "entrypoint": entrypoint,
+            "from": tmp_path,
+            "entrypoint": "whatever",
             "requirement": [],
         },
         config,
     )
-    builder.handle_generic_paths()
-
-    assert not (build_dir / "external-dir").exists()
-    expected = "Ignoring symlink because targets outside the project: 'external-dir'"
-    assert expected in [rec.message for rec in caplog.records]
 
+    with patch("charmcraft.commands.build.polite_exec") as mock:
+        builder.handle_dependencies()
 
-def test_build_generics_different_filetype(tmp_path, caplog, monkeypatch, config):
-    """Ignores whatever is not a regular file, symlink or dir."""
-    caplog.set_level(logging.DEBUG)
+    mock.assert_not_called()
 
-    # change into the tmp path and do everything locally, because otherwise the socket path
-    # will be too long for mac os
-    monkeypatch.chdir(tmp_path)
 
+def test_build_dependencies_cache_miss(tmp_path, config):
+    """Dependencies are installed and stored in the cache when not there."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-    build_dir = pathlib.Path(BUILD_DIRNAME)
+    build_dir = tmp_path / BUILD_DIRNAME
     build_dir.mkdir()
-    entrypoint = pathlib.Path("crazycharm.py")
-    entrypoint.touch()
-
-    # create a socket
-    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    sock.bind("test-socket")
+    reqs = tmp_path / "reqs.txt"
+    reqs.write_text("ops")
 
     builder = Builder(
         {
             "from": tmp_path,
-            "entrypoint": tmp_path / entrypoint,
-            "requirement": [],
+            "entrypoint": "whatever",
+            "requirement": [reqs],
+            "cache_dependencies": True,
         },
         config,
     )
-    builder.handle_generic_paths()
 
-    assert not (build_dir / "test-socket").exists()
-    expected = "Ignoring file because of type: 'test-socket'"
-    assert expected in [rec.message for rec in caplog.records]
+    envpath = build_dir / VENV_DIRNAME
 
+    def fake_install(cmd):
+        if cmd[1] == "install":
+            envpath.mkdir()
+            (envpath / "ops.py").write_text("ops code")
+        return 0
+
+    cache_dir = tmp_path / "cache"
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.commands.build._pip_needs_system", return_value=False):
+            with patch("charmcraft.commands.build.polite_exec") as mock:
+                mock.side_effect = fake_install
+                builder.handle_dependencies()
 
-def test_build_dispatcher_modern_dispatch_created(tmp_path, config):
-    """The dispatcher script is properly built."""
+    assert mock.mock_calls == [
+        call(["pip3", "list"]),
+        call(
+            [
+                "pip3",
+                "install",
+                "--target={}".format(envpath),
+                "--requirement={}".format(reqs),
+            ]
+        ),
+    ]
+    (entry,) = (cache_dir / "dependencies").iterdir()
+    assert (entry / "venv" / "ops.py").read_text() == "ops code"
+
+
+def test_build_dependencies_cache_hit(tmp_path, config):
+    """Dependencies are reused from the cache when there, pip is not even called."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
     build_dir = tmp_path / BUILD_DIRNAME
     build_dir.mkdir()
-
-    linked_entrypoint = build_dir / "somestuff.py"
+    reqs = tmp_path / "reqs.txt"
+    reqs.write_text("ops")
 
     builder = Builder(
         {
             "from": tmp_path,
             "entrypoint": "whatever",
-            "requirement": [],
+            "requirement": [reqs],
+            "cache_dependencies": True,
         },
         config,
     )
-    builder.handle_dispatcher(linked_entrypoint)
 
-    included_dispatcher = build_dir / DISPATCH_FILENAME
-    with included_dispatcher.open("rt", encoding="utf8") as fh:
-        dispatcher_code = fh.read()
-    assert dispatcher_code == DISPATCH_CONTENT.format(
-        entrypoint_relative_path="somestuff.py"
-    )
+    cache_dir = tmp_path / "cache"
+    with patch("charmcraft.commands.build._get_python_version", return_value="3.8"):
+        key = DependenciesCache.get_key([reqs], get_host_as_base(), "3.8")
+        cached_venv = cache_dir / "dependencies" / key / "venv"
+        cached_venv.mkdir(parents=True)
+        (cached_venv / "ops.py").write_text("ops code")
+        (cached_venv.parent / "size").write_text("8")
 
+        with patch(
+            "charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir
+        ):
+            with patch("charmcraft.commands.build.polite_exec") as mock:
+                builder.handle_dependencies()
 
-def test_build_dispatcher_modern_dispatch_respected(tmp_path, config):
-    """The already included dispatcher script is left untouched."""
+    assert mock.mock_calls == []
+    envpath = build_dir / VENV_DIRNAME
+    assert (envpath / "ops.py").stat().st_ino == (cached_venv / "ops.py").stat().st_ino
+
+
+def test_build_dependencies_lock_requirements(tmp_path, config):
+    """The requirements are resolved once, and always installed from the lock."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
     build_dir = tmp_path / BUILD_DIRNAME
     build_dir.mkdir()
-
-    already_present_dispatch = build_dir / DISPATCH_FILENAME
-    with already_present_dispatch.open("wb") as fh:
-        fh.write(b"abc")
+    reqs = tmp_path / "reqs.txt"
+    reqs.write_text("ops")
 
     builder = Builder(
         {
             "from": tmp_path,
             "entrypoint": "whatever",
-            "requirement": [],
+            "requirement": [reqs],
+            "lock_requirements": True,
         },
         config,
     )
-    builder.handle_dispatcher("whatever")
 
-    with already_present_dispatch.open("rb") as fh:
-        assert fh.read() == b"abc"
+    def fake_pip(cmd):
+        if cmd[1] == "download":
+            dest = pathlib.Path(cmd[2].split("=", 1)[1])
+            (dest / "ops-1.2.0-py3-none-any.whl").write_bytes(b"ops wheel")
+        return 0
 
+    cache_dir = tmp_path / "cache"
+    envpath = build_dir / VENV_DIRNAME
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.commands.build._pip_needs_system", return_value=False):
+            with patch("charmcraft.commands.build.polite_exec") as mock:
+                mock.side_effect = fake_pip
+                builder.handle_dependencies()
+                builder.handle_dependencies()
 
-def test_build_dispatcher_classic_hooks_mandatory_created(tmp_path, config):
-    """The mandatory classic hooks are implemented ok if not present."""
+    (lock_path,) = (cache_dir / "locks").iterdir()
+    assert lock_path.read_text() == (
+        "ops==1.2.0 --hash=sha256:{}\n".format(hashlib.sha256(b"ops wheel").hexdigest())
+    )
+    install_call = call(
+        [
+            "pip3",
+            "install",
+            "--target={}".format(envpath),
+            "--no-deps",
+            "--requirement={}".format(lock_path),
+        ]
+    )
+    assert mock.mock_calls == [
+        call(["pip3", "list"]),
+        call(["pip3", "download", ANY, "--requirement={}".format(reqs)]),
+        install_call,
+        call(["pip3", "list"]),
+        install_call,
+    ]
+
+
+def test_build_dependencies_lock_requirements_changed(tmp_path, config):
+    """The requirements are resolved again when they change."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
-
-    linked_entrypoint = build_dir / "somestuff.py"
-    included_dispatcher = build_dir / DISPATCH_FILENAME
+    reqs = tmp_path / "reqs.txt"
+    reqs.write_text("ops")
 
     builder = Builder(
         {
             "from": tmp_path,
             "entrypoint": "whatever",
-            "requirement": [],
+            "requirement": [reqs],
+            "lock_requirements": True,
         },
         config,
     )
-    with patch("charmcraft.commands.build.MANDATORY_HOOK_NAMES", {"testhook"}):
-        builder.handle_dispatcher(linked_entrypoint)
 
-    test_hook = build_dir / "hooks" / "testhook"
-    assert test_hook.is_symlink()
-    assert test_hook.resolve() == included_dispatcher
-    real_link = os.readlink(str(test_hook))
-    assert real_link == os.path.join("..", DISPATCH_FILENAME)
+    cache_dir = tmp_path / "cache"
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.commands.build.polite_exec", return_value=0) as mock:
+            lock_path_1 = builder.get_requirements_lock()
+            reqs.write_text("ops==1.2.0")
+            lock_path_2 = builder.get_requirements_lock()
 
+    assert lock_path_1 != lock_path_2
+    assert [c[1][0][1] for c in mock.mock_calls] == ["download", "download"]
 
-def test_build_dispatcher_classic_hooks_mandatory_respected(tmp_path, config):
-    """The already included mandatory classic hooks are left untouched."""
+
+def test_build_dependencies_lock_requirements_non_index(tmp_path, config):
+    """The requirements not taken from the package index can't be locked."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
-
-    built_hooks_dir = build_dir / "hooks"
-    built_hooks_dir.mkdir()
-    test_hook = built_hooks_dir / "testhook"
-    with test_hook.open("wb") as fh:
-        fh.write(b"abc")
-
-    linked_entrypoint = build_dir / "somestuff.py"
+    reqs = tmp_path / "reqs.txt"
+    reqs.write_text("ops\ngit+https://github.com/canonical/operator#egg=ops\n")
 
     builder = Builder(
         {
             "from": tmp_path,
             "entrypoint": "whatever",
-            "requirement": [],
+            "requirement": [reqs],
+            "lock_requirements": True,
         },
         config,
     )
-    with patch("charmcraft.commands.build.MANDATORY_HOOK_NAMES", {"testhook"}):
-        builder.handle_dispatcher(linked_entrypoint)
 
-    with test_hook.open("rb") as fh:
-        assert fh.read() == b"abc"
+    cache_dir = tmp_path / "cache"
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.commands.build.polite_exec") as mock:
+            with pytest.raises(CommandError) as cm:
+                builder.get_requirements_lock()
 
+    assert str(cm.value) == (
+        "Cannot lock requirements that are not taken from the package index (from "
+        "version control systems, URLs or local paths): "
+        "'git+https://github.com/canonical/operator#egg=ops'."
+    )
+    mock.assert_not_called()
+    assert not (cache_dir / "locks").exists()
 
-def test_build_dispatcher_classic_hooks_linking_charm_replaced(
-    tmp_path, caplog, config
-):
-    """Hooks that are just a symlink to the entrypoint are replaced."""
-    caplog.set_level(logging.DEBUG, logger="charmcraft")
 
+def test_build_dependencies_lock_requirements_error(tmp_path, config):
+    """Process is properly interrupted if resolving the requirements fails."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
-
-    # simple source code
-    src_dir = build_dir / "src"
-    src_dir.mkdir()
-    built_charm_script = src_dir / "charm.py"
-    with built_charm_script.open("wb") as fh:
-        fh.write(b"all the magic")
-
-    # a test hook, just a symlink to the charm
-    built_hooks_dir = build_dir / "hooks"
-    built_hooks_dir.mkdir()
-    test_hook = built_hooks_dir / "somehook"
-    test_hook.symlink_to(built_charm_script)
-
-    included_dispatcher = build_dir / DISPATCH_FILENAME
+    reqs = tmp_path / "reqs.txt"
+    reqs.write_text("ops")
 
     builder = Builder(
         {
             "from": tmp_path,
             "entrypoint": "whatever",
-            "requirement": [],
+            "requirement": [reqs],
+            "lock_requirements": True,
         },
         config,
     )
-    builder.handle_dispatcher(built_charm_script)
 
-    # the test hook is still there and a symlink, but now pointing to the dispatcher
-    assert test_hook.is_symlink()
-    assert test_hook.resolve() == included_dispatcher
-    expected = "Replacing existing hook 'somehook' as it's a symlink to the entrypoint"
-    assert expected in [rec.message for rec in caplog.records]
+    cache_dir = tmp_path / "cache"
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.commands.build.polite_exec", return_value=1):
+            with pytest.raises(CommandError, match="problems resolving dependencies"):
+                builder.get_requirements_lock()
+    assert not (cache_dir / "locks").exists()
+
+
+def test_get_wheel_platforms():
+    """The platforms are all the manylinux ones supported by the base."""
+    assert get_wheel_platforms(19, "amd64") == [
+        "manylinux_2_19_x86_64",
+        "manylinux_2_18_x86_64",
+        "manylinux_2_17_x86_64",
+        "manylinux2014_x86_64",
+        "manylinux2010_x86_64",
+        "manylinux1_x86_64",
+    ]
+    assert get_wheel_platforms(17, "arm64") == [
+        "manylinux_2_17_aarch64",
+        "manylinux2014_aarch64",
+    ]
 
 
-def test_build_dependencies_virtualenv_simple(tmp_path, config):
-    """A virtualenv is created with the specified requirements file."""
+def _get_wheelhouse_builder(tmp_path, config, **extra_args):
+    """Return a Builder with requirements, using the host wheelhouse."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
-
-    builder = Builder(
+    reqs = tmp_path / "reqs.txt"
+    reqs.write_text("ops")
+    return Builder(
         {
             "from": tmp_path,
             "entrypoint": "whatever",
-            "requirement": ["reqs.txt"],
+            "requirement": [reqs],
+            "host_wheelhouse": True,
+            **extra_args,
         },
         config,
     )
 
-    with patch("charmcraft.commands.build.subprocess.run") as mock_run:
-        mock_run.return_value.returncode = 1
-        with patch("charmcraft.commands.build.polite_exec") as mock:
-            mock.return_value = 0
-            builder.handle_dependencies()
 
-    envpath = build_dir / VENV_DIRNAME
-    assert mock.mock_calls == [
-        call(["pip3", "list"]),
-        call(
-            ["pip3", "install", "--target={}".format(envpath), "--requirement=reqs.txt"]
-        ),
-    ]
-    assert mock_run.mock_calls == [
-        call(
-            [
-                "python3",
-                "-c",
-                (
-                    "from pip.commands.install import InstallCommand; "
-                    'assert InstallCommand().cmd_opts.get_option("--system") is not None'
-                ),
-            ],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        ),
+def test_build_prepare_wheelhouses(tmp_path, config):
+    """The wheels are downloaded in the host once for each base, targeting it."""
+    config.set(
+        bases=[
+            BasesConfiguration(
+                **{
+                    "build-on": [Base(name="ubuntu", channel="20.04")],
+                    "run-on": [Base(name="ubuntu", channel="20.04")],
+                }
+            ),
+            BasesConfiguration(
+                **{
+                    "build-on": [Base(name="ubuntu", channel="18.04")],
+                    "run-on": [Base(name="ubuntu", channel="18.04")],
+                }
+            ),
+            BasesConfiguration(
+                **{
+                    "build-on": [Base(name="ubuntu", channel="20.04")],
+                    "run-on": [Base(name="ubuntu", channel="20.04")],
+                }
+            ),
+        ]
+    )
+    builder = _get_wheelhouse_builder(tmp_path, config)
+
+    cache_dir = tmp_path / "cache"
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch(
+            "charmcraft.commands.build.is_base_providable", return_value=(True, None)
+        ):
+            with patch(
+                "charmcraft.commands.build.get_host_architecture", return_value="amd64"
+            ):
+                with patch(
+                    "charmcraft.commands.build.polite_exec", return_value=0
+                ) as mock:
+                    builder.prepare_wheelhouses(None, destructive_mode=False)
+
+    commands = sorted(c[1][0] for c in mock.mock_calls)
+    assert len(commands) == 2
+    wheelhouse = cache_dir / "wheelhouse" / "ubuntu-18.04-amd64"
+    assert commands[0][:9] == [
+        "pip3",
+        "download",
+        "--dest={}".format(wheelhouse),
+        "--only-binary=:all:",
+        "--python-version=3.6",
+        "--implementation=cp",
+        "--abi=cp36",
+        "--abi=abi3",
+        "--abi=none",
     ]
+    assert "--platform=manylinux_2_27_x86_64" in commands[0]
+    assert commands[0][-1] == "--requirement={}".format(tmp_path / "reqs.txt")
+    assert "--python-version=3.8" in commands[1]
+    assert wheelhouse.is_dir()
 
 
-def test_build_dependencies_needs_system(tmp_path, config):
-    """pip3 is called with --system when pip3 needs it."""
-    metadata = tmp_path / CHARM_METADATA
-    metadata.write_text("name: crazycharm")
-    build_dir = tmp_path / BUILD_DIRNAME
-    build_dir.mkdir()
+def test_build_prepare_wheelhouses_failure(tmp_path, config, caplog):
+    """The wheelhouse is not left if the wheels can not be downloaded."""
+    builder = _get_wheelhouse_builder(tmp_path, config)
+    cache_dir = tmp_path / "cache"
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.commands.build.polite_exec", return_value=1):
+            builder._download_wheelhouse("ubuntu", "20.04", "amd64")
 
-    builder = Builder(
-        {
-            "from": tmp_path,
-            "entrypoint": "whatever",
-            "requirement": ["reqs"],
-        },
-        config,
+    assert not (cache_dir / "wheelhouse" / "ubuntu-20.04-amd64").exists()
+    assert (
+        "Cannot download the wheels in the host for 'ubuntu-20.04-amd64', they will "
+        "be installed in the instance." in [rec.message for rec in caplog.records]
     )
 
-    with patch("charmcraft.commands.build.subprocess.run") as mock_run:
-        mock_run.return_value.returncode = 0
-        with patch("charmcraft.commands.build.polite_exec") as mock:
-            mock.return_value = 0
-            builder.handle_dependencies()
 
-    envpath = build_dir / VENV_DIRNAME
+def test_build_prepare_wheelhouses_unknown_base(tmp_path, config, caplog):
+    """Nothing is downloaded for bases without known Python and platform."""
+    builder = _get_wheelhouse_builder(tmp_path, config)
+    with patch("charmcraft.commands.build.polite_exec") as mock:
+        builder._download_wheelhouse("centos", "7", "amd64")
+
+    mock.assert_not_called()
+    assert "Cannot download the wheels in the host for 'centos-7-amd64'." in [
+        rec.message for rec in caplog.records
+    ]
+
+
+def test_build_dependencies_from_wheelhouse(tmp_path, config):
+    """The dependencies are installed offline from the wheelhouse, if there."""
+    builder = _get_wheelhouse_builder(tmp_path, config)
+    (tmp_path / BUILD_DIRNAME).mkdir()
+    host_base = get_host_as_base()
+    cache_dir = tmp_path / "cache"
+    wheelhouse = (
+        cache_dir
+        / "wheelhouse"
+        / "{}-{}-{}".format(
+            host_base.name, host_base.channel, host_base.architectures[0]
+        )
+    )
+
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.commands.build._pip_needs_system", return_value=False):
+            with patch("charmcraft.commands.build.polite_exec", return_value=0) as mock:
+                builder.handle_dependencies()
+                wheelhouse.mkdir(parents=True)
+                builder.handle_dependencies()
+
+    envpath = tmp_path / BUILD_DIRNAME / VENV_DIRNAME
+    reqs_arg = "--requirement={}".format(tmp_path / "reqs.txt")
     assert mock.mock_calls == [
+        call(["pip3", "list"]),
+        call(["pip3", "install", "--target={}".format(envpath), reqs_arg]),
         call(["pip3", "list"]),
         call(
             [
                 "pip3",
                 "install",
                 "--target={}".format(envpath),
-                "--system",
-                "--requirement=reqs",
+                "--no-index",
+                "--find-links={}".format(wheelhouse),
+                reqs_arg,
             ]
         ),
     ]
 
 
-def test_build_dependencies_virtualenv_multiple(tmp_path, config):
-    """A virtualenv is created with multiple requirements files."""
+@pytest.mark.parametrize(
+    "managed_mode, requirement, prepared",
+    [(False, True, True), (True, True, False), (False, False, False)],
+)
+def test_build_run_prepares_wheelhouses(
+    basic_project, monkeypatch, managed_mode, requirement, prepared
+):
+    """The wheelhouses are prepared only in the host, and if there are requirements."""
+    if managed_mode:
+        monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    reqs = basic_project / "reqs.txt"
+    reqs.write_text("ops")
+    builder = _get_fingerprint_builder(
+        basic_project, host_wheelhouse=True, requirement=[reqs] if requirement else []
+    )
+
+    with patch.object(builder, "prepare_wheelhouses") as mock_prepare:
+        with patch.object(builder, "build_charm", return_value="test.charm"):
+            with patch(
+                "charmcraft.commands.build.check_if_base_matches_host",
+                return_value=(True, None),
+            ):
+                builder.run([0], destructive_mode=True)
+
+    if prepared:
+        mock_prepare.assert_called_once_with([0], True)
+    else:
+        mock_prepare.assert_not_called()
+
+
+def _build_wheel(wheel_path, members):
+    """Create a wheel with the given members (path and content)."""
+    with zipfile.ZipFile(str(wheel_path), "w") as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+
+
+def test_build_dependencies_wheel_store(tmp_path, config):
+    """Dependencies are installed linking the wheels unpacked in the store."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
     build_dir = tmp_path / BUILD_DIRNAME
     build_dir.mkdir()
+    reqs = tmp_path / "reqs.txt"
+    reqs.write_text("ops")
 
     builder = Builder(
         {
             "from": tmp_path,
             "entrypoint": "whatever",
-            "requirement": ["reqs1.txt", "reqs2.txt"],
+            "requirement": [reqs],
+            "wheel_store": True,
         },
         config,
     )
 
-    with patch("charmcraft.commands.build.subprocess.run") as mock_run:
-        mock_run.return_value.returncode = 1
-        with patch("charmcraft.commands.build.polite_exec") as mock:
-            mock.return_value = 0
-            builder.handle_dependencies()
+    cache_dir = tmp_path / "cache"
+    store_wheels_dir = cache_dir / "wheels" / "wheels"
+    pip_calls = []
+
+    def fake_pip(cmd):
+        if cmd[1] == "wheel":
+            pip_calls.append(cmd)
+            wheel_dir = pathlib.Path(cmd[2].split("=", 1)[1])
+            # pip gets the wheel from the store if it's already there
+            wheel_path = wheel_dir / "ops-1.2.0-py3-none-any.whl"
+            if (store_wheels_dir / wheel_path.name).exists():
+                shutil.copy(str(store_wheels_dir / wheel_path.name), str(wheel_path))
+            else:
+                _build_wheel(wheel_path, {"ops/__init__.py": "ops code"})
+        return 0
 
     envpath = build_dir / VENV_DIRNAME
-    assert mock.mock_calls == [
-        call(["pip3", "list"]),
-        call(
-            [
-                "pip3",
-                "install",
-                "--target={}".format(envpath),
-                "--requirement=reqs1.txt",
-                "--requirement=reqs2.txt",
-            ]
-        ),
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.commands.build.polite_exec", side_effect=fake_pip):
+            builder.handle_dependencies()
+            shutil.rmtree(str(envpath))
+            builder.handle_dependencies()
+
+    (first_call, _) = pip_calls
+    assert first_call[:2] == ["pip3", "wheel"]
+    assert first_call[3:] == [
+        "--find-links={}".format(store_wheels_dir),
+        "--requirement={}".format(reqs),
     ]
+    (entry,) = (cache_dir / "wheels" / "unpacked").iterdir()
+    assert (envpath / "ops" / "__init__.py").read_text() == "ops code"
+    assert (envpath / "ops" / "__init__.py").stat().st_ino == (
+        (entry / "ops" / "__init__.py").stat().st_ino
+    )
+    assert [
+        p.name for p in (cache_dir / "wheels").iterdir() if p.name.startswith(".")
+    ] == []
 
 
-def test_build_dependencies_virtualenv_none(tmp_path, config):
-    """The virtualenv is NOT created if no needed."""
+def test_build_dependencies_wheel_store_error(tmp_path, config):
+    """Process is properly interrupted if getting the wheels fails."""
     metadata = tmp_path / CHARM_METADATA
     metadata.write_text("name: crazycharm")
     build_dir = tmp_path / BUILD_DIRNAME
@@ -1907,15 +4233,66 @@ def test_build_dependencies_virtualenv_none(tmp_path, config):
         {
             "from": tmp_path,
             "entrypoint": "whatever",
-            "requirement": [],
+            "requirement": ["something"],
+            "wheel_store": True,
         },
         config,
     )
 
-    with patch("charmcraft.commands.build.polite_exec") as mock:
-        builder.handle_dependencies()
+    cache_dir = tmp_path / "cache"
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.commands.build.polite_exec") as mock:
+            mock.side_effect = lambda cmd: 1 if cmd[1] == "wheel" else 0
+            with pytest.raises(CommandError, match="problems installing dependencies"):
+                builder.handle_dependencies()
 
-    mock.assert_not_called()
+
+@pytest.mark.parametrize(
+    "option, flag",
+    [
+        ("cache_dependencies", "--cache-dependencies"),
+        ("wheel_store", "--wheel-store"),
+        ("lock_requirements", "--lock-requirements"),
+        ("host_wheelhouse", "--host-wheelhouse"),
+        ("cache_analysis", "--cache-analysis"),
+    ],
+)
+def test_build_cache_mounted_in_instance(
+    basic_project,
+    tmp_path_factory,
+    mock_capture_logs_from_instance,
+    mock_ensure_provider_is_available,
+    monkeypatch,
+    option,
+    flag,
+):
+    """The host cache is shared with the instance, and the option is passed to it."""
+    monkeypatch.setattr(message_handler, "mode", message_handler.NORMAL)
+    builder = _get_fingerprint_builder(basic_project, **{option: True})
+    config = builder.config
+
+    cache_dir = tmp_path_factory.mktemp("cache")
+    monkeypatch.chdir(basic_project)
+    with patch("charmcraft.commands.build.launched_environment") as mock_launch:
+        with patch(
+            "charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir
+        ):
+            builder.pack_charm_in_instance(
+                bases_index=0, build_on=config.bases[0].build_on[0], build_on_index=0
+            )
+
+    assert mock_launch.mock_calls[2:4] == [
+        call()
+        .__enter__()
+        .mount(host_source=cache_dir, target=pathlib.Path("/root/cache")),
+        call()
+        .__enter__()
+        .execute_run(
+            ["charmcraft", "pack", "--bases-index", "0", flag],
+            check=True,
+            cwd="/root/project",
+        ),
+    ]
 
 
 def test_build_dependencies_virtualenv_error_basicpip(tmp_path, config):
@@ -2061,6 +4438,62 @@ def test_build_package_name(tmp_path, monkeypatch, config):
     zipname = builder.handle_package()
 
     assert zipname == "name-from-metadata.charm"
+    assert not (tmp_path / "name-from-metadata.charm.part").exists()
+
+
+def test_build_package_compression(tmp_path, monkeypatch, config):
+    """The package is written with the indicated compression."""
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    (build_dir / "file.txt").write_text("content " * 1000)
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+
+    monkeypatch.chdir(tmp_path)  # so the zip file is left in the temp dir
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": "whatever",
+            "requirement": [],
+            "compression": "none",
+        },
+        config,
+    )
+    zipname = builder.handle_package()
+
+    with zipfile.ZipFile(zipname) as zf:
+        info = zf.getinfo("file.txt")
+    assert info.compress_type == zipfile.ZIP_STORED
+
+
+def test_build_package_repack(tmp_path, monkeypatch, config):
+    """When repacking, the previous charm is used to reuse the unchanged members."""
+    build_dir = tmp_path / BUILD_DIRNAME
+    build_dir.mkdir()
+    (build_dir / "file.txt").write_text("content")
+    metadata = tmp_path / CHARM_METADATA
+    metadata.write_text("name: crazycharm")
+
+    monkeypatch.chdir(tmp_path)  # so the zip file is left in the temp dir
+    builder = Builder(
+        {
+            "from": tmp_path,
+            "entrypoint": "whatever",
+            "requirement": [],
+            "repack": True,
+        },
+        config,
+    )
+    with patch("charmcraft.commands.build.write_zip") as mock_write:
+        mock_write.side_effect = lambda zippath, *a, **k: pathlib.Path(zippath).touch()
+        zipname = builder.handle_package()
+
+    mock_write.assert_called_with(
+        zipname + ".part",
+        {"file.txt": build_dir / "file.txt"},
+        compression="default",
+        previous=pathlib.Path(zipname),
+    )
 
 
 def test_builder_without_jujuignore(tmp_path, config):
@@ -2150,7 +4583,9 @@ def test_build_using_linters_attributes(basic_project, caplog, monkeypatch, conf
             zipnames = builder.run()
 
     # check the analyze function was called properly
-    mock_analyze.assert_called_with(config, builder.buildpath)
+    mock_analyze.assert_called_with(
+        config, builder.buildpath, metadata=builder.metadata, cache=None
+    )
 
     # logs (do NOT see the ignored check)
     expected = [
@@ -2171,6 +4606,27 @@ def test_build_using_linters_attributes(basic_project, caplog, monkeypatch, conf
     assert manifest["analysis"] == expected
 
 
+def test_build_using_linters_cache(basic_project, tmp_path_factory, config):
+    """The analysis reuses the results from the cache, if indicated."""
+    builder = Builder(
+        {
+            "from": basic_project,
+            "entrypoint": basic_project / "src" / "charm.py",
+            "requirement": [],
+            "cache_analysis": True,
+        },
+        config,
+    )
+
+    cache_dir = tmp_path_factory.mktemp("cache")
+    with patch("charmcraft.commands.build.get_cache_dirpath", return_value=cache_dir):
+        with patch("charmcraft.linters.analyze", return_value=[]) as mock_analyze:
+            builder.build_charm(config.bases[0])
+
+    (call_args,) = mock_analyze.call_args_list
+    assert call_args[1]["cache"].dirpath == cache_dir / "analysis"
+
+
 # --- tests for relativise helper
 
 
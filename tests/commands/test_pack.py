@@ -36,6 +36,21 @@ noargs = Namespace(
     requirement=None,
     bases_index=[],
     destructive_mode=False,
+    incremental=False,
+    cache_dependencies=False,
+    wheel_store=False,
+    lock_requirements=False,
+    host_wheelhouse=False,
+    git_files=False,
+    cache_analysis=False,
+    jobs=None,
+    stream=False,
+    compression=None,
+    repack=False,
+    force=False,
+    overlay=False,
+    precompile=False,
+    venv_format=None,
 )
 
 
@@ -139,8 +154,9 @@ def test_bundle_simple_succesful_build(tmp_path, caplog, bundle_yaml, config):
     assert zf.read("bundle.yaml") == content.encode("ascii")
     assert zf.read("README.md") == b"test readme"
 
-    expected = "Created '{}'.".format(zipname)
-    assert [expected] == [rec.message for rec in caplog.records]
+    report, created = [rec.message for rec in caplog.records]
+    assert report.startswith("Compression 'default' saved ")
+    assert created == "Created '{}'.".format(zipname)
 
     # check the manifest is present and with particular values that depend on given info
     manifest = yaml.safe_load(zf.read("manifest.yaml"))
@@ -429,10 +445,146 @@ def test_charm_parameters_entrypoint(config):
     assert action.type.converter is useful_filepath
 
 
+def test_charm_parameters_incremental(config):
+    """The --incremental option is a simple flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).incremental is False
+    assert parser.parse_args(["--incremental"]).incremental is True
+
+
+def test_charm_parameters_wheel_store(config):
+    """The --wheel-store option is a flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).wheel_store is False
+    assert parser.parse_args(["--wheel-store"]).wheel_store is True
+
+
+def test_charm_parameters_lock_requirements(config):
+    """The --lock-requirements option is a flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).lock_requirements is False
+    assert parser.parse_args(["--lock-requirements"]).lock_requirements is True
+
+
+def test_charm_parameters_host_wheelhouse(config):
+    """The --host-wheelhouse option is a flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).host_wheelhouse is False
+    assert parser.parse_args(["--host-wheelhouse"]).host_wheelhouse is True
+
+
+def test_charm_parameters_git_files(config):
+    """The --git-files option is a flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).git_files is False
+    assert parser.parse_args(["--git-files"]).git_files is True
+
+
+def test_charm_parameters_cache_analysis(config):
+    """The --cache-analysis option is a flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).cache_analysis is False
+    assert parser.parse_args(["--cache-analysis"]).cache_analysis is True
+
+
+def test_charm_parameters_stream(config):
+    """The --stream option is a simple flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).stream is False
+    assert parser.parse_args(["--stream"]).stream is True
+
+
+def test_charm_parameters_compression(config):
+    """The --compression option only accepts the known levels."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).compression is None
+    assert parser.parse_args(["--compression", "none"]).compression == "none"
+    with pytest.raises(SystemExit):
+        parser.parse_args(["--compression", "whatever"])
+
+
+def test_charm_parameters_repack(config):
+    """The --repack option is a simple flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).repack is False
+    assert parser.parse_args(["--repack"]).repack is True
+
+
+def test_charm_parameters_force(config):
+    """The --force option is a simple flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).force is False
+    assert parser.parse_args(["--force"]).force is True
+
+
+def test_charm_parameters_overlay(config):
+    """The --overlay option is a simple flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).overlay is False
+    assert parser.parse_args(["--overlay"]).overlay is True
+
+
+def test_charm_parameters_precompile(config):
+    """The --precompile option is a simple flag."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).precompile is False
+    assert parser.parse_args(["--precompile"]).precompile is True
+
+
+def test_charm_parameters_venv_format(config):
+    """The --venv-format option only accepts the known formats."""
+    cmd = PackCommand("group", config)
+    parser = ArgumentParser()
+    cmd.fill_parser(parser)
+    assert parser.parse_args([]).venv_format is None
+    assert parser.parse_args(["--venv-format", "zip"]).venv_format == "zip"
+    with pytest.raises(SystemExit):
+        parser.parse_args(["--venv-format", "whatever"])
+
+
 def test_charm_parameters_validator(config, tmp_path):
     """Check that build.Builder is properly called."""
     args = Namespace(
         destructive_mode=True,
+        incremental=True,
+        cache_dependencies=True,
+        wheel_store=True,
+        lock_requirements=True,
+        host_wheelhouse=True,
+        git_files=True,
+        cache_analysis=True,
+        jobs=3,
+        stream=True,
+        compression="max",
+        repack=True,
+        force=True,
+        overlay=True,
+        precompile=True,
+        venv_format="zip",
         requirement="test-reqs",
         entrypoint="test-epoint",
         bases_index=[],
@@ -451,10 +603,25 @@ def test_charm_parameters_validator(config, tmp_path):
         Namespace(
             **{
                 "destructive_mode": True,
+                "incremental": True,
+                "cache_dependencies": True,
+                "wheel_store": True,
+                "lock_requirements": True,
+                "host_wheelhouse": True,
+                "git_files": True,
+                "cache_analysis": True,
                 "from": tmp_path,
                 "requirement": "test-reqs",
                 "entrypoint": "test-epoint",
                 "bases_indices": [],
+                "jobs": 3,
+                "stream": True,
+                "compression": "max",
+                "repack": True,
+                "force": True,
+                "overlay": True,
+                "precompile": True,
+                "venv_format": "zip",
             }
         )
     )
@@ -1172,6 +1172,7 @@ def test_list_resource_revisions_ok(client_mock, config):
     assert item.revision == 1
     assert item.created_at == parser.parse("2021-02-11T13:43:22.396606")
     assert item.size == 500
+    assert item.sha256 == "1bf0399c2de1240777ba73785f1ff1de5331f12853765a0"
 
 
 def test_list_resource_revisions_empty(client_mock, config):
@@ -492,7 +492,7 @@ def test_upload_call_ok_including_release(caplog, store_mock, config, tmp_path):
 
     assert store_mock.mock_calls == [
         call.upload("mycharm", test_charm),
-        call.release("mycharm", 7, ["edge"]),
+        call.release("mycharm", 7, ["edge"], []),
     ]
     expected = [
         "Revision 7 of 'mycharm' created",
@@ -517,7 +517,7 @@ def test_upload_call_ok_including_release_multiple(
 
     assert store_mock.mock_calls == [
         call.upload("mycharm", test_charm),
-        call.release("mycharm", 7, ["edge", "stable"]),
+        call.release("mycharm", 7, ["edge", "stable"], []),
     ]
     expected = [
         "Revision 7 of 'mycharm' created",
@@ -543,6 +543,135 @@ def test_upload_call_error_including_release(caplog, store_mock, config, tmp_pat
     assert store_mock.mock_calls == [call.upload("mycharm", test_charm)]
 
 
+def _build_charm_with_venv_resource(charm_path, resource_content=b"venv content"):
+    """Create a charm with a venv resource, and the resource next to it."""
+    resource_name = "mystuff.venv-1234.zip"
+    venv_resource = {
+        "name": "venv",
+        "filename": resource_name,
+        "sha256": hashlib.sha256(resource_content).hexdigest(),
+    }
+    with zipfile.ZipFile(str(charm_path), "w") as zf:
+        zf.writestr("metadata.yaml", yaml.dump({"name": "mycharm"}))
+        zf.writestr("manifest.yaml", yaml.dump({"venv-resource": venv_resource}))
+    resource_path = charm_path.parent / resource_name
+    resource_path.write_bytes(resource_content)
+    return resource_path
+
+
+def test_upload_call_venv_resource_new(caplog, store_mock, config, tmp_path):
+    """The venv resource is uploaded and attached when releasing."""
+    caplog.set_level(logging.INFO, logger="charmcraft.commands")
+    store_mock.upload.return_value = Uploaded(
+        ok=True, status=200, revision=7, errors=[]
+    )
+    store_mock.list_resource_revisions.return_value = [
+        ResourceRevision(revision=1, size=5, created_at=None, sha256="other"),
+    ]
+    store_mock.upload_resource.return_value = Uploaded(
+        ok=True, status=200, revision=2, errors=[]
+    )
+
+    test_charm = tmp_path / "mystuff.charm"
+    resource_path = _build_charm_with_venv_resource(test_charm)
+    args = Namespace(filepath=test_charm, release=["edge"])
+    UploadCommand("group", config).run(args)
+
+    assert store_mock.mock_calls == [
+        call.upload("mycharm", test_charm),
+        call.list_resource_revisions("mycharm", "venv"),
+        call.upload_resource("mycharm", "venv", "file", resource_path),
+        call.release("mycharm", 7, ["edge"], [ResourceOption("venv", 2)]),
+    ]
+    expected = [
+        "Revision 7 of 'mycharm' created",
+        "Revision 2 created of resource 'venv' for charm 'mycharm'",
+        "Revision released to edge",
+    ]
+    assert expected == [rec.message for rec in caplog.records]
+
+
+def test_upload_call_venv_resource_reused(caplog, store_mock, config, tmp_path):
+    """The venv resource is not uploaded again if Charmhub has the same content."""
+    caplog.set_level(logging.INFO, logger="charmcraft.commands")
+    store_mock.upload.return_value = Uploaded(
+        ok=True, status=200, revision=7, errors=[]
+    )
+    store_mock.list_resource_revisions.return_value = [
+        ResourceRevision(
+            revision=1,
+            size=12,
+            created_at=None,
+            sha256=hashlib.sha256(b"venv content").hexdigest(),
+        ),
+    ]
+
+    test_charm = tmp_path / "mystuff.charm"
+    resource_path = _build_charm_with_venv_resource(test_charm)
+    resource_path.unlink()  # not even needed
+    args = Namespace(filepath=test_charm, release=["edge"])
+    UploadCommand("group", config).run(args)
+
+    assert store_mock.mock_calls == [
+        call.upload("mycharm", test_charm),
+        call.list_resource_revisions("mycharm", "venv"),
+        call.release("mycharm", 7, ["edge"], [ResourceOption("venv", 1)]),
+    ]
+    expected = [
+        "Revision 7 of 'mycharm' created",
+        "Reusing revision 1 of resource 'venv', which has the same content",
+        "Revision released to edge",
+    ]
+    assert expected == [rec.message for rec in caplog.records]
+
+
+def test_upload_call_venv_resource_missing(store_mock, config, tmp_path):
+    """The venv resource must be next to the charm if Charmhub doesn't have it."""
+    store_mock.upload.return_value = Uploaded(
+        ok=True, status=200, revision=7, errors=[]
+    )
+    store_mock.list_resource_revisions.return_value = []
+
+    test_charm = tmp_path / "mystuff.charm"
+    resource_path = _build_charm_with_venv_resource(test_charm)
+    resource_path.unlink()
+    args = Namespace(filepath=test_charm, release=["edge"])
+    with pytest.raises(CommandError) as cm:
+        UploadCommand("group", config).run(args)
+
+    assert str(cm.value) == (
+        "Cannot find the file 'mystuff.venv-1234.zip' for the resource 'venv' "
+        "next to the charm."
+    )
+    store_mock.release.assert_not_called()
+
+
+def test_upload_call_venv_resource_error(caplog, store_mock, config, tmp_path):
+    """The charm is not released if the venv resource upload failed."""
+    caplog.set_level(logging.INFO, logger="charmcraft.commands")
+    store_mock.upload.return_value = Uploaded(
+        ok=True, status=200, revision=7, errors=[]
+    )
+    store_mock.list_resource_revisions.return_value = []
+    errors = [Error(message="text", code="problem")]
+    store_mock.upload_resource.return_value = Uploaded(
+        ok=False, status=400, revision=None, errors=errors
+    )
+
+    test_charm = tmp_path / "mystuff.charm"
+    _build_charm_with_venv_resource(test_charm)
+    args = Namespace(filepath=test_charm, release=["edge"])
+    UploadCommand("group", config).run(args)
+
+    store_mock.release.assert_not_called()
+    expected = [
+        "Revision 7 of 'mycharm' created",
+        "Upload of resource 'venv' failed with status 400:",
+        "- problem: text",
+    ]
+    assert expected == [rec.message for rec in caplog.records]
+
+
 def test_upload_charm_with_init_template_todo_token(tmp_path, config):
     """Avoid uploading a charm that is not really ready to be shown to the world."""
     # create a charm zip file all valid but with files having the token from
@@ -3277,7 +3406,10 @@ def test_resourcerevisions_simple(caplog, store_mock, config):
 
     store_response = [
         ResourceRevision(
-            revision=1, size=50, created_at=datetime.datetime(2020, 7, 3, 2, 30, 40)
+            revision=1,
+            size=50,
+            created_at=datetime.datetime(2020, 7, 3, 2, 30, 40),
+            sha256=None,
         ),
     ]
     store_mock.list_resource_revisions.return_value = store_response
@@ -3319,10 +3451,10 @@ def test_resourcerevisions_ordered_by_revision(caplog, store_mock, config):
     # we really assert later that it was used for ordering
     tstamp = datetime.datetime(2020, 7, 3, 20, 30, 40)
     store_response = [
-        ResourceRevision(revision=1, size=5000, created_at=tstamp),
-        ResourceRevision(revision=3, size=34450520, created_at=tstamp),
-        ResourceRevision(revision=4, size=876543, created_at=tstamp),
-        ResourceRevision(revision=2, size=50, created_at=tstamp),
+        ResourceRevision(revision=1, size=5000, created_at=tstamp, sha256=None),
+        ResourceRevision(revision=3, size=34450520, created_at=tstamp, sha256=None),
+        ResourceRevision(revision=4, size=876543, created_at=tstamp, sha256=None),
+        ResourceRevision(revision=2, size=50, created_at=tstamp, sha256=None),
     ]
     store_mock.list_resource_revisions.return_value = store_response
 
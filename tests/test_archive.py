@@ -0,0 +1,316 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+import logging
+import os
+import random
+import zipfile
+import zlib
+from unittest.mock import patch
+
+import pytest
+
+from charmcraft.archive import _can_write_raw, write_zip
+
+
+def test_write_zip_content(tmp_path):
+    """The zip has all the members, in order, with their content and attributes."""
+    (tmp_path / "subdir").mkdir()
+    file1 = tmp_path / "file1.txt"
+    file1.write_text("content " * 1000)
+    file2 = tmp_path / "subdir" / "file2.bin"
+    file2.write_bytes(os.urandom(10000))
+    file2.chmod(0o755)
+    empty = tmp_path / "empty"
+    empty.touch()
+    members = {"zfile.txt": file1, "subdir/file2.bin": file2, "empty": empty}
+
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, members, max_workers=2)
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["zfile.txt", "subdir/file2.bin", "empty"]
+        assert zf.read("zfile.txt") == file1.read_bytes()
+        assert zf.read("subdir/file2.bin") == file2.read_bytes()
+        assert zf.read("empty") == b""
+        info = zf.getinfo("subdir/file2.bin")
+        assert (info.external_attr >> 16) & 0o777 == 0o755
+        assert zf.getinfo("zfile.txt").compress_type == zipfile.ZIP_DEFLATED
+        assert zf.getinfo("zfile.txt").compress_size < 1000
+
+
+def test_write_zip_same_as_zipfile(tmp_path):
+    """The members are compressed the same way than zipfile does it."""
+    members = {}
+    for idx in range(1, 20):
+        filepath = tmp_path / f"file{idx}"
+        filepath.write_text(f"content {idx} " * idx * 100)
+        members[filepath.name] = filepath
+
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, members)
+    expected_path = tmp_path / "expected.zip"
+    with zipfile.ZipFile(str(expected_path), "w", zipfile.ZIP_DEFLATED) as zf:
+        for arcname, filepath in members.items():
+            zf.write(str(filepath), arcname)
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        with zipfile.ZipFile(str(expected_path)) as expected_zf:
+            for info, expected_info in zip(zf.infolist(), expected_zf.infolist()):
+                assert info.filename == expected_info.filename
+                assert info.CRC == expected_info.CRC
+                assert info.compress_size == expected_info.compress_size
+                assert info.date_time == expected_info.date_time
+
+
+def test_write_zip_raw_internals(tmp_path):
+    """The ZipFile internals used to write already compressed members are there.
+
+    This runs in every supported Python version, so a change in them is noticed.
+    """
+    with zipfile.ZipFile(str(tmp_path / "test.zip"), "w") as zf:
+        assert _can_write_raw(zf)
+
+
+@pytest.mark.parametrize("compression", ["none", "default", "max"])
+def test_write_zip_without_raw_internals(tmp_path, compression):
+    """Without the internals the members are written through the public API."""
+    file1 = tmp_path / "file1.txt"
+    file1.write_text("content " * 1000)
+    file2 = tmp_path / "file2.bin"
+    file2.write_bytes(bytes(random.getrandbits(8) for _ in range(1000)))
+    members = {"file1.txt": file1, "file2.bin": file2}
+
+    zippath = tmp_path / "test.zip"
+    with patch("charmcraft.archive._can_write_raw", return_value=False):
+        write_zip(zippath, members, compression=compression)
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        assert zf.testzip() is None
+        for arcname, filepath in members.items():
+            assert zf.read(arcname) == filepath.read_bytes()
+
+
+def test_write_zip_fixed_date_time(tmp_path):
+    """With a fixed date time the same content always gives the same archive."""
+    filepath = tmp_path / "file.txt"
+    filepath.write_text("content")
+    date_time = (1980, 1, 1, 0, 0, 0)
+
+    zippath1 = tmp_path / "test1.zip"
+    write_zip(zippath1, {"file.txt": filepath}, date_time=date_time)
+    os.utime(str(filepath), (1234567890, 1234567890))
+    zippath2 = tmp_path / "test2.zip"
+    write_zip(zippath2, {"file.txt": filepath}, date_time=date_time)
+
+    assert zippath1.read_bytes() == zippath2.read_bytes()
+    with zipfile.ZipFile(str(zippath1)) as zf:
+        assert zf.getinfo("file.txt").date_time == date_time
+
+
+def test_write_zip_members_date_time(tmp_path):
+    """Each member keeps its own modification time."""
+    file1 = tmp_path / "file1.txt"
+    file1.write_text("content")
+    os.utime(str(file1), (978307200, 978307200))  # 2001-01-01
+    file2 = tmp_path / "file2.txt"
+    file2.write_text("other content")
+    os.utime(str(file2), (1420070400, 1420070400))  # 2015-01-01
+
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, {"file1.txt": file1, "file2.txt": file2})
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        assert zf.getinfo("file1.txt").date_time[0] == 2001
+        assert zf.getinfo("file2.txt").date_time[0] == 2015
+
+
+def test_write_zip_many_members(tmp_path):
+    """More members than the ones compressed ahead are all written."""
+    members = {}
+    for idx in range(50):
+        filepath = tmp_path / f"file{idx}"
+        filepath.write_text(str(idx))
+        members[filepath.name] = filepath
+
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, members, max_workers=1)
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        assert zf.namelist() == list(members)
+        assert [zf.read(name) for name in zf.namelist()] == [
+            str(idx).encode("ascii") for idx in range(50)
+        ]
+
+
+@pytest.mark.parametrize(
+    "compression, expected_type",
+    [
+        ("none", zipfile.ZIP_STORED),
+        ("fast", zipfile.ZIP_DEFLATED),
+        ("default", zipfile.ZIP_DEFLATED),
+        ("max", zipfile.ZIP_DEFLATED),
+    ],
+)
+def test_write_zip_compression_levels(tmp_path, compression, expected_type):
+    """The compression level is respected for compressible files."""
+    filepath = tmp_path / "file.txt"
+    filepath.write_text("content " * 1000)
+
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, {"file.txt": filepath}, compression=compression)
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        assert zf.getinfo("file.txt").compress_type == expected_type
+        assert zf.read("file.txt") == filepath.read_bytes()
+
+
+def test_write_zip_compression_levels_sizes(tmp_path):
+    """Higher compression levels produce smaller members."""
+    filepath = tmp_path / "file.txt"
+    rand = random.Random(42)
+    words = [
+        f"{rand.choice(['foo', 'bar', 'baz'])}{rand.randint(0, 99)}"
+        for _ in range(20000)
+    ]
+    filepath.write_text(" ".join(words))
+
+    sizes = {}
+    for compression in ("none", "fast", "max"):
+        zippath = tmp_path / f"{compression}.zip"
+        write_zip(zippath, {"file.txt": filepath}, compression=compression)
+        with zipfile.ZipFile(str(zippath)) as zf:
+            sizes[compression] = zf.getinfo("file.txt").compress_size
+    assert sizes["none"] > sizes["fast"] > sizes["max"]
+
+
+def test_write_zip_already_compressed_stored(tmp_path):
+    """Files already compressed are stored without trying to compress them."""
+    filepath = tmp_path / "package.whl"
+    filepath.write_text("content " * 1000)
+
+    zippath = tmp_path / "test.zip"
+    with patch("zlib.compressobj") as mock_compressobj:
+        write_zip(zippath, {"package.whl": filepath})
+    mock_compressobj.assert_not_called()
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        assert zf.getinfo("package.whl").compress_type == zipfile.ZIP_STORED
+        assert zf.read("package.whl") == filepath.read_bytes()
+
+
+def test_write_zip_high_entropy_stored(tmp_path):
+    """Files that don't compress enough are stored."""
+    filepath = tmp_path / "random.bin"
+    filepath.write_bytes(os.urandom(10000))
+
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, {"random.bin": filepath})
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        assert zf.getinfo("random.bin").compress_type == zipfile.ZIP_STORED
+        assert zf.read("random.bin") == filepath.read_bytes()
+
+
+def test_write_zip_report(tmp_path, caplog):
+    """The bytes saved and time spent are reported to the user."""
+    caplog.set_level(logging.INFO, logger="charmcraft.archive")
+    filepath = tmp_path / "file.txt"
+    filepath.write_text("content " * 1000)
+
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, {"file.txt": filepath})
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        compress_size = zf.getinfo("file.txt").compress_size
+    (record,) = [rec for rec in caplog.records if "saved" in rec.message]
+    assert record.levelno == logging.INFO
+    assert record.message.startswith(
+        f"Compression 'default' saved {8000 - compress_size} bytes "
+        f"(8000 to {compress_size}) in "
+    )
+
+
+def test_write_zip_repack_reuses_unchanged(tmp_path):
+    """Unchanged members are copied from the previous archive, changed ones compressed."""
+    unchanged = tmp_path / "unchanged.txt"
+    unchanged.write_text("unchanged " * 1000)
+    changed = tmp_path / "changed.txt"
+    changed.write_text("original " * 1000)
+    members = {"unchanged.txt": unchanged, "changed.txt": changed}
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, members)
+
+    changed.write_text("modified " * 1000)
+    os.utime(str(changed), (1600000000, 1600000000))
+    newpath = tmp_path / "new.zip"
+    with patch("charmcraft.archive.zlib.compressobj", wraps=zlib.compressobj) as mock:
+        write_zip(newpath, members, previous=zippath)
+    assert mock.call_count == 1
+
+    with zipfile.ZipFile(str(newpath)) as zf:
+        assert zf.testzip() is None
+        assert zf.read("unchanged.txt") == unchanged.read_bytes()
+        assert zf.read("changed.txt") == changed.read_bytes()
+
+
+def test_write_zip_repack_same_mtime_different_crc(tmp_path):
+    """A member with the same size and mtime but different content is not reused."""
+    filepath = tmp_path / "file.txt"
+    filepath.write_text("content1")
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, {"file.txt": filepath})
+
+    stat = filepath.stat()
+    filepath.write_text("content2")
+    os.utime(str(filepath), ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    newpath = tmp_path / "new.zip"
+    write_zip(newpath, {"file.txt": filepath}, previous=zippath)
+
+    with zipfile.ZipFile(str(newpath)) as zf:
+        assert zf.testzip() is None
+        assert zf.read("file.txt") == b"content2"
+
+
+def test_write_zip_repack_different_compression(tmp_path):
+    """Nothing is reused if the previous archive used a different compression."""
+    filepath = tmp_path / "file.txt"
+    filepath.write_text("content " * 1000)
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, {"file.txt": filepath}, compression="none")
+
+    newpath = tmp_path / "new.zip"
+    write_zip(newpath, {"file.txt": filepath}, compression="max", previous=zippath)
+
+    with zipfile.ZipFile(str(newpath)) as zf:
+        assert zf.getinfo("file.txt").compress_type == zipfile.ZIP_DEFLATED
+
+
+@pytest.mark.parametrize("content", [None, b"this is not a zip"])
+def test_write_zip_repack_no_previous(tmp_path, content):
+    """A missing or broken previous archive is just not used."""
+    filepath = tmp_path / "file.txt"
+    filepath.write_text("content")
+    previous = tmp_path / "previous.zip"
+    if content is not None:
+        previous.write_bytes(content)
+
+    zippath = tmp_path / "test.zip"
+    write_zip(zippath, {"file.txt": filepath}, previous=previous)
+
+    with zipfile.ZipFile(str(zippath)) as zf:
+        assert zf.read("file.txt") == b"content"
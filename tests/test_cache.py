@@ -0,0 +1,387 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+import hashlib
+import os
+import pathlib
+import zipfile
+from textwrap import dedent
+from unittest.mock import patch
+
+import pytest
+
+from charmcraft.cache import (
+    DependenciesCache,
+    AnalysisCache,
+    RequirementsLocks,
+    WheelStore,
+    build_lock,
+    get_cache_dirpath,
+    get_non_index_requirements,
+    link_tree,
+)
+from charmcraft.config import Base
+
+
+@pytest.fixture
+def venv(tmp_path):
+    """Create a small installed virtualenv."""
+    venvpath = tmp_path / "venv"
+    (venvpath / "ops").mkdir(parents=True)
+    (venvpath / "ops" / "__init__.py").write_text("ops code")
+    (venvpath / "ops" / "alias.py").symlink_to("__init__.py")
+    (venvpath / "six.py").write_text("six code")
+    return venvpath
+
+
+# -- tests for the cache location
+
+
+def test_get_cache_dirpath_host(monkeypatch):
+    monkeypatch.delenv("CHARMCRAFT_MANAGED_MODE", raising=False)
+    with patch("appdirs.user_cache_dir", return_value="/home/user/.cache/charmcraft"):
+        assert get_cache_dirpath() == pathlib.Path("/home/user/.cache/charmcraft")
+
+
+def test_get_cache_dirpath_managed_mode(monkeypatch):
+    monkeypatch.setenv("CHARMCRAFT_MANAGED_MODE", "1")
+    assert get_cache_dirpath() == pathlib.Path("/root/cache")
+
+
+# -- tests for the tree linking helper
+
+
+def test_link_tree(tmp_path, venv):
+    destpath = tmp_path / "dest"
+    size = link_tree(venv, destpath)
+
+    assert size == len("ops code") + len("six code")
+    assert (destpath / "six.py").stat().st_ino == (venv / "six.py").stat().st_ino
+    assert (destpath / "ops" / "__init__.py").read_text() == "ops code"
+    assert os.readlink(str(destpath / "ops" / "alias.py")) == "__init__.py"
+
+
+def test_link_tree_copy_fallback(tmp_path, venv):
+    destpath = tmp_path / "dest"
+    with patch("os.link", side_effect=PermissionError("No you don't.")):
+        link_tree(venv, destpath)
+
+    assert (destpath / "six.py").read_text() == "six code"
+    assert (destpath / "six.py").stat().st_ino != (venv / "six.py").stat().st_ino
+
+
+def test_link_tree_replace(tmp_path, venv):
+    destpath = tmp_path / "dest"
+    destpath.mkdir()
+    (destpath / "six.py").write_text("old six code")
+    link_tree(venv, destpath, replace=True)
+
+    assert (destpath / "six.py").stat().st_ino == (venv / "six.py").stat().st_ino
+
+
+# -- tests for the dependencies cache
+
+
+def test_dependencies_cache_key(tmp_path):
+    reqs1 = tmp_path / "reqs1.txt"
+    reqs1.write_text("ops")
+    reqs2 = tmp_path / "reqs2.txt"
+    reqs2.write_text("six")
+    base = Base(name="ubuntu", channel="20.04", architectures=["amd64"])
+
+    key = DependenciesCache.get_key([reqs1, reqs2], base, "Python 3.8.10")
+    assert key == DependenciesCache.get_key([reqs1, reqs2], base, "Python 3.8.10")
+
+    # any change in the inputs produce a different key
+    other_base = Base(name="ubuntu", channel="18.04", architectures=["amd64"])
+    assert key != DependenciesCache.get_key([reqs1, reqs2], other_base, "Python 3.8.10")
+    assert key != DependenciesCache.get_key([reqs1, reqs2], base, "Python 3.6.9")
+    assert key != DependenciesCache.get_key([reqs1], base, "Python 3.8.10")
+    reqs2.write_text("six==1.16.0")
+    assert key != DependenciesCache.get_key([reqs1, reqs2], base, "Python 3.8.10")
+
+
+def test_dependencies_cache_miss(tmp_path):
+    cache = DependenciesCache(tmp_path / "cache")
+    destpath = tmp_path / "dest"
+    assert cache.get("somekey", destpath) is False
+    assert not destpath.exists()
+
+
+def test_dependencies_cache_store_and_get(tmp_path, venv):
+    cache = DependenciesCache(tmp_path / "cache")
+    cache.store("somekey", venv)
+
+    destpath = tmp_path / "dest"
+    assert cache.get("somekey", destpath) is True
+    assert (destpath / "six.py").read_text() == "six code"
+    assert (destpath / "ops" / "__init__.py").read_text() == "ops code"
+
+    # nothing temporary left behind
+    assert [p.name for p in (tmp_path / "cache").iterdir()] == ["somekey"]
+
+
+def test_dependencies_cache_store_already_there(tmp_path, venv):
+    cache = DependenciesCache(tmp_path / "cache")
+    cache.store("somekey", venv)
+    (venv / "six.py").unlink()
+    (venv / "six.py").write_text("other code")
+    cache.store("somekey", venv)
+
+    destpath = tmp_path / "dest"
+    cache.get("somekey", destpath)
+    assert (destpath / "six.py").read_text() == "six code"
+
+
+def test_dependencies_cache_evict_least_recently_used(tmp_path, venv):
+    # budget is enough for only two entries
+    entry_size = len("ops code") + len("six code")
+    cache = DependenciesCache(tmp_path / "cache", max_size=entry_size * 2)
+    cache.store("key1", venv)
+    cache.store("key2", venv)
+    os.utime(str(tmp_path / "cache" / "key1"), (1000, 1000))
+    os.utime(str(tmp_path / "cache" / "key2"), (2000, 2000))
+
+    # use the oldest one, so the other is the one to be evicted
+    cache.get("key1", tmp_path / "dest")
+    cache.store("key3", venv)
+
+    assert sorted(p.name for p in (tmp_path / "cache").iterdir()) == ["key1", "key3"]
+
+
+# -- tests for the wheel store
+
+
+def _build_wheel(dirpath, filename, members):
+    """Create a wheel with the given members (path and content)."""
+    dirpath.mkdir(parents=True, exist_ok=True)
+    wheel_path = dirpath / filename
+    with zipfile.ZipFile(str(wheel_path), "w") as zf:
+        for name, content in members.items():
+            zf.writestr(name, content)
+    return wheel_path
+
+
+def test_wheel_store_key(tmp_path):
+    wheel_path = _build_wheel(
+        tmp_path, "PyYAML-5.4.1-cp38-cp38-manylinux1_x86_64.whl", {"yaml.py": ""}
+    )
+    wheel_hash = hashlib.sha256(wheel_path.read_bytes()).hexdigest()
+    assert WheelStore.get_key(wheel_path) == (
+        "pyyaml-5.4.1-cp38-cp38-manylinux1_x86_64-" + wheel_hash
+    )
+
+
+def test_wheel_store_key_build_tag(tmp_path):
+    wheel_path = _build_wheel(tmp_path, "ops-1.2.0-1-py3-none-any.whl", {})
+    assert WheelStore.get_key(wheel_path).startswith("ops-1.2.0-py3-none-any-")
+
+
+def test_wheel_store_key_invalid(tmp_path):
+    wheel_path = _build_wheel(tmp_path, "whatever.whl", {})
+    with pytest.raises(ValueError):
+        WheelStore.get_key(wheel_path)
+
+
+def test_wheel_store_add_and_install(tmp_path):
+    store = WheelStore(tmp_path / "store")
+    downloaded = tmp_path / "downloaded"
+    _build_wheel(
+        downloaded,
+        "ops-1.2.0-py3-none-any.whl",
+        {
+            "ops/__init__.py": "ops code",
+            "ops-1.2.0.dist-info/METADATA": "metadata",
+            "ops-1.2.0.data/scripts/opstool": "#!python\nprint('ops')\n",
+            "ops-1.2.0.data/data/share/ops.txt": "not needed",
+        },
+    )
+    _build_wheel(
+        downloaded,
+        "native-1.0-cp38-cp38-linux_x86_64.whl",
+        {"native-1.0.data/platlib/_native.so": "native code"},
+    )
+
+    keys = store.add_wheels(downloaded)
+
+    assert [key.split("-")[0] for key in keys] == ["native", "ops"]
+    assert list(downloaded.iterdir()) == []
+    assert sorted(p.name for p in store.wheels_dirpath.iterdir()) == [
+        "native-1.0-cp38-cp38-linux_x86_64.whl",
+        "ops-1.2.0-py3-none-any.whl",
+    ]
+
+    venvpath = tmp_path / "venv"
+    store.install(keys, venvpath)
+
+    installed = sorted(
+        str(path.relative_to(venvpath))
+        for path in venvpath.rglob("*")
+        if path.is_file()
+    )
+    assert installed == [
+        "_native.so",
+        "bin/opstool",
+        "ops-1.2.0.dist-info/METADATA",
+        "ops/__init__.py",
+    ]
+    assert (venvpath / "bin" / "opstool").read_text() == (
+        "#!/usr/bin/env python3\nprint('ops')\n"
+    )
+    assert os.access(str(venvpath / "bin" / "opstool"), os.X_OK)
+    unpacked_init = store.unpacked_dirpath / keys[1] / "ops" / "__init__.py"
+    assert (venvpath / "ops" / "__init__.py").stat().st_ino == (
+        unpacked_init.stat().st_ino
+    )
+
+
+def test_wheel_store_already_unpacked(tmp_path):
+    store = WheelStore(tmp_path / "store")
+    wheel_members = {"ops/__init__.py": "ops code"}
+    _build_wheel(tmp_path / "first", "ops-1.2.0-py3-none-any.whl", wheel_members)
+    (key,) = store.add_wheels(tmp_path / "first")
+    unpacked = store.unpacked_dirpath / key / "ops" / "__init__.py"
+    inode = unpacked.stat().st_ino
+
+    # the same wheel again (e.g. found locally by pip)
+    _build_wheel(tmp_path / "second", "ops-1.2.0-py3-none-any.whl", wheel_members)
+    assert store.add_wheels(tmp_path / "second") == [key]
+    assert unpacked.stat().st_ino == inode
+
+
+def test_wheel_store_same_name_different_content(tmp_path):
+    """A wheel with the same name but different content is unpacked apart."""
+    store = WheelStore(tmp_path / "store")
+    _build_wheel(tmp_path / "first", "ops-1.2.0-py3-none-any.whl", {"ops.py": "1"})
+    (key1,) = store.add_wheels(tmp_path / "first")
+    _build_wheel(tmp_path / "second", "ops-1.2.0-py3-none-any.whl", {"ops.py": "2"})
+    (key2,) = store.add_wheels(tmp_path / "second")
+
+    assert key1 != key2
+    assert (store.unpacked_dirpath / key2 / "ops.py").read_text() == "2"
+
+
+def test_wheel_store_unsafe_paths(tmp_path):
+    """Nothing is unpacked outside the entry."""
+    store = WheelStore(tmp_path / "store")
+    _build_wheel(
+        tmp_path / "downloaded",
+        "evil-1.0-py3-none-any.whl",
+        {"../evil.py": "evil", "good.py": "good"},
+    )
+    (key,) = store.add_wheels(tmp_path / "downloaded")
+
+    assert [p.name for p in (store.unpacked_dirpath / key).iterdir()] == ["good.py"]
+    assert not (store.unpacked_dirpath / "evil.py").exists()
+
+
+# -- tests for the requirements locks
+
+
+def test_build_lock(tmp_path):
+    (tmp_path / "ops-1.2.0-py3-none-any.whl").write_bytes(b"ops wheel")
+    (tmp_path / "PyYAML-5.4.1-cp38-cp38-manylinux1_x86_64.whl").write_bytes(b"yaml")
+    (tmp_path / "some-project-2.0.tar.gz").write_bytes(b"sdist")
+    (tmp_path / "whatever.txt").write_bytes(b"unknown")
+
+    lock = build_lock(tmp_path)
+
+    assert lock.splitlines() == [
+        "PyYAML==5.4.1 --hash=sha256:" + hashlib.sha256(b"yaml").hexdigest(),
+        "ops==1.2.0 --hash=sha256:" + hashlib.sha256(b"ops wheel").hexdigest(),
+        "some-project==2.0 --hash=sha256:" + hashlib.sha256(b"sdist").hexdigest(),
+    ]
+
+
+def test_get_non_index_requirements(tmp_path):
+    """The requirements that can't be locked are found, also in included files."""
+    (tmp_path / "reqs.txt").write_text(
+        dedent(
+            """            # comment
+            --index-url https://pypi.example.com/simple
+            ops==1.2.0 --hash=sha256:1234
+            PyYAML>=5  # a comment
+            git+https://github.com/canonical/operator@main#egg=ops
+            -e ./local/project
+            -r other.txt
+            """
+        )
+    )
+    (tmp_path / "other.txt").write_text(
+        dedent(
+            """            requests
+            mylib @ https://example.com/mylib-1.0.tar.gz
+            ./wheels/foo-1.0-py3-none-any.whl
+            --requirement=last.txt
+            """
+        )
+    )
+    (tmp_path / "last.txt").write_text("other/sdist-2.0.tar.gz\n")
+
+    assert get_non_index_requirements([tmp_path / "reqs.txt"]) == [
+        "git+https://github.com/canonical/operator@main#egg=ops",
+        "-e ./local/project",
+        "mylib @ https://example.com/mylib-1.0.tar.gz",
+        "./wheels/foo-1.0-py3-none-any.whl",
+        "other/sdist-2.0.tar.gz",
+    ]
+
+
+def test_get_non_index_requirements_none(tmp_path):
+    (tmp_path / "reqs.txt").write_text("ops==1.2.0\nPyYAML\n")
+    assert get_non_index_requirements([tmp_path / "reqs.txt"]) == []
+
+
+def test_requirements_locks_miss(tmp_path):
+    locks = RequirementsLocks(tmp_path / "locks")
+    assert locks.get("key") is None
+
+
+def test_requirements_locks_store_and_get(tmp_path):
+    locks = RequirementsLocks(tmp_path / "locks")
+    lock_path = locks.store("key", "ops==1.2.0 --hash=sha256:1234\n")
+
+    assert locks.get("key") == lock_path
+    assert lock_path.read_text() == "ops==1.2.0 --hash=sha256:1234\n"
+    assert [p.name for p in (tmp_path / "locks").iterdir()] == ["key.txt"]
+
+
+# -- tests for the analysis cache
+
+
+def test_analysis_cache_get_missing(tmp_path):
+    cache = AnalysisCache(tmp_path / "analysis")
+    assert cache.get("key") is None
+
+
+def test_analysis_cache_store_and_get(tmp_path):
+    cache = AnalysisCache(tmp_path / "analysis")
+    cache.store("key", {"result": "python", "inputs": {"/charm/dispatch": "1234"}})
+
+    assert cache.get("key") == {
+        "result": "python",
+        "inputs": {"/charm/dispatch": "1234"},
+    }
+    assert [p.name for p in (tmp_path / "analysis").iterdir()] == ["key.json"]
+
+
+def test_analysis_cache_broken_entry(tmp_path):
+    """A broken entry is ignored."""
+    cache = AnalysisCache(tmp_path / "analysis")
+    (tmp_path / "analysis").mkdir()
+    (tmp_path / "analysis" / "key.json").write_text("{not json")
+
+    assert cache.get("key") is None
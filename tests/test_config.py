@@ -531,6 +531,93 @@ def test_basicprime_empty():
     assert config.prime == []
 
 
+# -- tests for the charm part
+
+
+def test_charm_part_venv_prune_missing(create_config, tmp_path):
+    """No venv pruning unless configured."""
+    create_config(
+        """
+        type: charm
+    """
+    )
+    config = load(tmp_path)
+    assert config.parts.get("charm").venv_prune is None
+
+
+def test_charm_part_venv_prune_defaults(create_config, tmp_path):
+    """An empty venv pruning configuration uses the default rules."""
+    create_config(
+        """
+        type: charm
+        parts:
+            charm:
+                venv-prune: {}
+    """
+    )
+    config = load(tmp_path)
+    venv_prune = config.parts.charm.venv_prune
+    assert venv_prune.defaults is True
+    assert venv_prune.remove == []
+    assert venv_prune.keep == []
+
+
+def test_charm_part_venv_prune_full(create_config, tmp_path):
+    """A complete venv pruning configuration."""
+    create_config(
+        """
+        type: charm
+        parts:
+            charm:
+                venv-prune:
+                    defaults: false
+                    remove: ["*/examples"]
+                    keep: ["mypkg/tests"]
+    """
+    )
+    config = load(tmp_path)
+    venv_prune = config.parts.charm.venv_prune
+    assert venv_prune.defaults is False
+    assert venv_prune.remove == ["*/examples"]
+    assert venv_prune.keep == ["mypkg/tests"]
+
+
+def test_charm_part_tree_shaking(create_config, tmp_path):
+    """The tree shaking configuration, with its extra roots."""
+    create_config(
+        """
+        type: charm
+        parts:
+            charm:
+                tree-shaking:
+                    extra-roots: ["plugin"]
+    """
+    )
+    config = load(tmp_path)
+    assert config.parts.charm.tree_shaking.extra_roots == ["plugin"]
+    assert config.parts.charm.venv_prune is None
+
+
+def test_schema_charm_part_venv_prune_bad_type(create_config, check_schema_error):
+    """The venv pruning patterns must be strings."""
+    create_config(
+        """
+        type: charm
+        parts:
+            charm:
+                venv-prune:
+                    remove: [33]
+    """
+    )
+    check_schema_error(
+        dedent(
+            """\
+            Bad charmcraft.yaml content:
+            - string type expected in field 'parts.charm.venv-prune.remove[0]'"""
+        )
+    )
+
+
 # -- tests for bases
 
 
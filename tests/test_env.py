@@ -29,6 +29,12 @@ def test_get_managed_environment_home_path():
     assert dirpath == pathlib.Path("/root")
 
 
+def test_get_managed_environment_cache_path():
+    dirpath = env.get_managed_environment_cache_path()
+
+    assert dirpath == pathlib.Path("/root/cache")
+
+
 def test_get_managed_environment_log_path():
     dirpath = env.get_managed_environment_log_path()
 
@@ -0,0 +1,235 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+import shutil
+import socket
+import subprocess
+
+import pytest
+
+from charmcraft.fileindex import (
+    DIR,
+    FILE,
+    OTHER,
+    SYMLINK,
+    FileIndex,
+    get_git_files,
+)
+
+
+def test_fileindex_entries(tmp_path):
+    """All the entries are indexed with their information."""
+    (tmp_path / "dir1").mkdir(mode=0o750)
+    (tmp_path / "dir1" / "file1.txt").write_text("content")
+    (tmp_path / "dir1" / "subdir").mkdir()
+    (tmp_path / "dir1" / "subdir" / "deep.txt").touch()
+    (tmp_path / "file2.txt").write_text("more content")
+    (tmp_path / "linkdir").symlink_to("dir1")
+    (tmp_path / "linkfile").symlink_to("file2.txt")
+
+    index = FileIndex.build(tmp_path)
+
+    entries = {entry.relpath: entry for entry in index}
+    assert len(index) == 7
+    assert {relpath: entry.kind for relpath, entry in entries.items()} == {
+        "dir1": DIR,
+        "dir1/file1.txt": FILE,
+        "dir1/subdir": DIR,
+        "dir1/subdir/deep.txt": FILE,
+        "file2.txt": FILE,
+        "linkdir": SYMLINK,
+        "linkfile": SYMLINK,
+    }
+
+    stat = (tmp_path / "dir1" / "file1.txt").stat()
+    entry = entries["dir1/file1.txt"]
+    assert entry.mode == stat.st_mode
+    assert entry.size == 7
+    assert entry.mtime_ns == stat.st_mtime_ns
+    assert entry.inode == stat.st_ino
+    assert entries["dir1"].mode & 0o777 == 0o750
+    assert entries["linkfile"].mode == (tmp_path / "linkfile").lstat().st_mode
+
+
+def test_fileindex_order(tmp_path):
+    """Entries are sorted by name in each directory, always after their directory."""
+    for name in ("b", "a", "c"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "inside").touch()
+
+    index = FileIndex.build(tmp_path)
+
+    relpaths = [entry.relpath for entry in index]
+    assert relpaths[:3] == ["a", "b", "c"]
+    for name in ("a", "b", "c"):
+        assert relpaths.index(name) < relpaths.index(f"{name}/inside")
+
+
+def test_fileindex_other_types(tmp_path):
+    """Entries of other types are indexed as such."""
+    sock = socket.socket(socket.AF_UNIX)
+    sock.bind(str(tmp_path / "test-socket"))
+    try:
+        index = FileIndex.build(tmp_path)
+    finally:
+        sock.close()
+
+    assert [(entry.relpath, entry.kind) for entry in index] == [("test-socket", OTHER)]
+
+
+def test_fileindex_skip(tmp_path):
+    """Skipped entries are not indexed, and skipped directories are not walked."""
+    (tmp_path / "skipped").mkdir()
+    (tmp_path / "skipped" / "inside").touch()
+    (tmp_path / "kept").mkdir()
+    (tmp_path / "kept" / "skipped.txt").touch()
+    (tmp_path / "kept" / "kept.txt").touch()
+    (tmp_path / "linkdir").symlink_to("kept")
+    (tmp_path / "linkfile").symlink_to("kept/kept.txt")
+
+    calls = []
+
+    def skip(relpath, is_dir):
+        calls.append((relpath, is_dir))
+        return relpath.startswith("skipped") or relpath.endswith("skipped.txt")
+
+    index = FileIndex.build(tmp_path, skip=skip)
+
+    assert [entry.relpath for entry in index] == [
+        "kept",
+        "linkdir",
+        "linkfile",
+        "kept/kept.txt",
+    ]
+    assert sorted(calls) == [
+        ("kept", True),
+        ("kept/kept.txt", False),
+        ("kept/skipped.txt", False),
+        ("linkdir", True),
+        ("linkfile", False),
+        ("skipped", True),
+    ]
+
+
+def test_fileindex_prune(tmp_path):
+    """Pruned directories are indexed, but not walked."""
+    (tmp_path / "pruned" / "subdir").mkdir(parents=True)
+    (tmp_path / "pruned" / "inside").touch()
+    (tmp_path / "walked").mkdir()
+    (tmp_path / "walked" / "inside").touch()
+
+    calls = []
+
+    def prune(relpath):
+        calls.append(relpath)
+        return relpath == "pruned"
+
+    index = FileIndex.build(tmp_path, prune=prune)
+
+    assert [entry.relpath for entry in index] == [
+        "pruned",
+        "walked",
+        "walked/inside",
+    ]
+    assert calls == ["pruned", "walked"]
+
+
+def test_fileindex_from_paths(tmp_path):
+    """The index from the paths is the same than walking, but only for those paths."""
+    (tmp_path / "b" / "sub").mkdir(parents=True)
+    (tmp_path / "b" / "sub" / "deep.txt").touch()
+    (tmp_path / "b" / "file.txt").write_text("content")
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "file.txt").touch()
+    (tmp_path / "a" / "untracked.txt").touch()
+    (tmp_path / "untracked").mkdir()
+    (tmp_path / "untracked" / "file.txt").touch()
+    (tmp_path / "link").symlink_to("b")
+    relpaths = ["link", "b/file.txt", "a/file.txt", "b/sub/deep.txt", "missing.txt"]
+
+    index = FileIndex.build_from_paths(tmp_path, relpaths)
+
+    walked = [
+        entry for entry in FileIndex.build(tmp_path) if "untracked" not in entry.relpath
+    ]
+    assert list(index) == walked
+
+
+def test_fileindex_from_paths_skip_and_prune(tmp_path):
+    """The paths are skipped and pruned the same than when walking."""
+    for relpath in ("skipped/file.txt", "pruned/file.txt", "kept/file.txt"):
+        (tmp_path / relpath).parent.mkdir(exist_ok=True)
+        (tmp_path / relpath).touch()
+    (tmp_path / "linkdir").symlink_to("kept")
+
+    calls = []
+
+    def skip(relpath, is_dir):
+        calls.append((relpath, is_dir))
+        return relpath.startswith("skipped")
+
+    index = FileIndex.build_from_paths(
+        tmp_path,
+        ["skipped/file.txt", "pruned/file.txt", "kept/file.txt", "linkdir"],
+        skip=skip,
+        prune=lambda relpath: relpath == "pruned",
+    )
+
+    assert [entry.relpath for entry in index] == [
+        "kept",
+        "linkdir",
+        "pruned",
+        "kept/file.txt",
+    ]
+    assert sorted(calls) == [
+        ("kept", True),
+        ("kept/file.txt", False),
+        ("linkdir", True),
+        ("pruned", True),
+        ("skipped", True),
+    ]
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+def test_get_git_files(tmp_path):
+    """The files tracked by git are listed, relative to the given directory."""
+    subprocess.run(["git", "init", "-q", str(tmp_path)], check=True)
+    project = tmp_path / "project"
+    (project / "src").mkdir(parents=True)
+    (project / "src" / "charm.py").touch()
+    (project / "with space.txt").touch()
+    (project / "untracked.txt").touch()
+    (tmp_path / "outside.txt").touch()
+    subprocess.run(
+        ["git", "add", "src/charm.py", "with space.txt", "../outside.txt"],
+        cwd=str(project),
+        check=True,
+    )
+
+    assert sorted(get_git_files(project)) == ["src/charm.py", "with space.txt"]
+
+
+@pytest.mark.skipif(shutil.which("git") is None, reason="needs git")
+def test_get_git_files_not_a_repo(tmp_path, monkeypatch):
+    """Nothing is listed outside a git working tree."""
+    monkeypatch.setenv("GIT_CEILING_DIRECTORIES", str(tmp_path))
+    assert get_git_files(tmp_path) is None
+
+
+def test_get_git_files_no_git(tmp_path, monkeypatch):
+    """Nothing is listed if git is not available."""
+    monkeypatch.setenv("PATH", str(tmp_path))
+    assert get_git_files(tmp_path) is None
@@ -0,0 +1,103 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+import hashlib
+import zipfile
+
+import pytest
+
+from charmcraft.fingerprint import (
+    Fingerprint,
+    hash_file,
+    hash_files,
+    read_fingerprint,
+)
+
+
+def test_hash_file_simple(tmp_path):
+    """The file is hashed with SHA256."""
+    filepath = tmp_path / "file.txt"
+    filepath.write_bytes(b"content" * 1000)
+    assert hash_file(filepath) == hashlib.sha256(b"content" * 1000).digest()
+
+
+def test_hash_file_empty(tmp_path):
+    """Empty files can be hashed too."""
+    filepath = tmp_path / "empty"
+    filepath.touch()
+    assert hash_file(filepath) == hashlib.sha256(b"").digest()
+
+
+def test_hash_files_order(tmp_path):
+    """The hashes are returned in the same order than the files."""
+    paths = []
+    for idx in range(20):
+        filepath = tmp_path / f"file{idx}"
+        filepath.write_text(str(idx) * idx)
+        paths.append(filepath)
+
+    hashes = hash_files(paths, max_workers=4)
+    assert hashes == [hashlib.sha256(p.read_bytes()).digest() for p in paths]
+
+
+def test_fingerprint_records():
+    """The fingerprint depends on the fields and how they are grouped in records."""
+    fp1 = Fingerprint()
+    fp1.add("a", "b")
+    fp2 = Fingerprint()
+    fp2.add("a", "b")
+    fp3 = Fingerprint()
+    fp3.add("a")
+    fp3.add("b")
+    assert fp1.hexdigest() == fp2.hexdigest()
+    assert fp1.hexdigest() != fp3.hexdigest()
+
+
+def _build_charm(charm_path, manifest_content):
+    """Build a simple charm with the given manifest."""
+    with zipfile.ZipFile(str(charm_path), "w") as zf:
+        if manifest_content is not None:
+            zf.writestr("manifest.yaml", manifest_content)
+
+
+def test_read_fingerprint_ok(tmp_path):
+    """The fingerprint is read from the charm's manifest."""
+    charm_path = tmp_path / "test.charm"
+    _build_charm(charm_path, "charmcraft-fingerprint: abcd\n")
+    assert read_fingerprint(charm_path) == "abcd"
+
+
+@pytest.mark.parametrize(
+    "manifest_content",
+    [
+        None,  # no manifest
+        "charmcraft-version: 1.0\n",  # no fingerprint
+        "- just a list\n",
+        ":\n  - [invalid yaml",
+    ],
+)
+def test_read_fingerprint_missing(tmp_path, manifest_content):
+    """There is no fingerprint if the charm doesn't have a proper manifest."""
+    charm_path = tmp_path / "test.charm"
+    _build_charm(charm_path, manifest_content)
+    assert read_fingerprint(charm_path) is None
+
+
+def test_read_fingerprint_bad_charm(tmp_path):
+    """There is no fingerprint if the charm is not a zip."""
+    charm_path = tmp_path / "test.charm"
+    charm_path.write_text("not a zip")
+    assert read_fingerprint(charm_path) is None
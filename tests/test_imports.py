@@ -0,0 +1,150 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+from textwrap import dedent
+
+from charmcraft.imports import (
+    get_imports,
+    get_reachable_modules,
+    get_top_level_modules,
+)
+
+
+def _create_files(basedir, files):
+    """Create the files with the given content."""
+    for relpath, content in files.items():
+        path = basedir / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(dedent(content))
+
+
+# -- tests for getting the imports
+
+
+def test_get_imports_all_kinds(tmp_path):
+    """All the absolute imports are found, even the nested ones."""
+    filepath = tmp_path / "module.py"
+    filepath.write_text(
+        dedent(
+            """\
+            import os, foo.bar
+            from baz import stuff
+            from . import sibling
+            from .sibling import other
+
+            def func():
+                try:
+                    import optional
+                except ImportError:
+                    pass
+            """
+        )
+    )
+    imports = list(get_imports(filepath))
+    assert sorted(imports) == [["baz"], ["foo", "bar"], ["optional"], ["os"]]
+
+
+def test_get_imports_broken(tmp_path):
+    """Nothing is found in files that can't be parsed or are not there."""
+    filepath = tmp_path / "module.py"
+    filepath.write_text("import os\nthis is not valid python")
+    assert list(get_imports(filepath)) == []
+    assert list(get_imports(tmp_path / "missing.py")) == []
+
+
+# -- tests for the top level modules
+
+
+def test_get_top_level_modules(tmp_path):
+    """Modules, packages, namespace packages and native modules are found."""
+    _create_files(
+        tmp_path,
+        {
+            "module.py": "",
+            "package/__init__.py": "",
+            "namespace/sub/module.py": "",
+            "_native.cpython-38-x86_64-linux-gnu.so": "",
+            "package-1.0.dist-info/METADATA": "",
+            "package.libs/libstuff.so.1": "",
+            "bin/script": "",
+            "README.txt": "",
+        },
+    )
+    modules = get_top_level_modules(tmp_path)
+    assert sorted(modules) == ["_native", "module", "namespace", "package"]
+    assert modules["package"] == [tmp_path / "package"]
+
+
+def test_get_top_level_modules_missing_dir(tmp_path):
+    """Nothing is found in a directory that is not there."""
+    assert get_top_level_modules(tmp_path / "missing") == {}
+
+
+# -- tests for the reachable modules
+
+
+def test_get_reachable_modules(tmp_path):
+    """The imports are followed through all the search paths."""
+    _create_files(
+        tmp_path,
+        {
+            "src/charm.py": "import ops\nimport helpers\n",
+            "src/helpers.py": "from charms.foo.v0 import lib\n",
+            "lib/charms/foo/v0/lib.py": "import requests\n",
+            "venv/ops/__init__.py": "import yaml\n",
+            "venv/yaml/__init__.py": "from yaml.loader import *\n",
+            "venv/requests/__init__.py": "import urllib3\n",
+            "venv/urllib3/__init__.py": "",
+            "venv/unused/__init__.py": "import other_unused\n",
+            "venv/other_unused.py": "",
+        },
+    )
+    search_paths = [tmp_path / "src", tmp_path / "lib", tmp_path / "venv"]
+    reachable = get_reachable_modules(tmp_path / "src" / "charm.py", search_paths)
+    assert reachable == {"charms", "helpers", "ops", "requests", "urllib3", "yaml"}
+
+
+def test_get_reachable_modules_deep_import(tmp_path):
+    """Anything imported inside the package is followed, not only from __init__."""
+    _create_files(
+        tmp_path,
+        {
+            "src/charm.py": "from ops.main import main\n",
+            "venv/ops/__init__.py": "",
+            "venv/ops/main.py": "import yaml\n",
+            "venv/yaml/__init__.py": "",
+        },
+    )
+    search_paths = [tmp_path / "src", tmp_path / "venv"]
+    reachable = get_reachable_modules(tmp_path / "src" / "charm.py", search_paths)
+    assert reachable == {"ops", "yaml"}
+
+
+def test_get_reachable_modules_extra_roots(tmp_path):
+    """The extra roots and what they import are always reachable."""
+    _create_files(
+        tmp_path,
+        {
+            "src/charm.py": "import importlib\nimportlib.import_module('plugin')\n",
+            "venv/plugin/__init__.py": "import dependency\n",
+            "venv/dependency.py": "",
+        },
+    )
+    search_paths = [tmp_path / "src", tmp_path / "venv"]
+    reachable = get_reachable_modules(
+        tmp_path / "src" / "charm.py", search_paths, ["plugin.submodule"]
+    )
+    assert reachable == {"plugin", "dependency"}
@@ -183,6 +183,83 @@ def test_jujuignore_negation():
     assert ignore.match("foo/baz.py", is_dir=False)
 
 
+def test_jujuignore_negation_in_any_order():
+    """A matching negated rule always keeps the path, even if other rules come after."""
+    ignore = jujuignore.JujuIgnore(["!foo.py", "*.py", "foo.py", "/foo.py"])
+    assert not ignore.match("foo.py", is_dir=False)
+    assert not ignore.match("bar/foo.py", is_dir=False)
+    assert ignore.match("bar.py", is_dir=False)
+
+
+def test_jujuignore_literal_rules_mixed():
+    """Names, name suffixes, paths and generic rules work together."""
+    ignore = jujuignore.JujuIgnore(
+        [
+            ".tox",
+            "*.pyc",
+            "/build",
+            "docs/build",
+            "logs/",
+            "test_*.py",
+            "!keep.pyc",
+        ]
+    )
+    assert ignore.match("/.tox", is_dir=True)
+    assert ignore.match("/foo/.tox", is_dir=False)
+    assert not ignore.match("/foo/.tox2", is_dir=False)
+    assert ignore.match("/foo/bar.pyc", is_dir=False)
+    assert ignore.match("/.pyc", is_dir=False)
+    assert not ignore.match("/foo.pyc/bar", is_dir=False)
+    assert not ignore.match("/foo/keep.pyc", is_dir=False)
+    assert ignore.match("/build", is_dir=True)
+    assert not ignore.match("/src/build", is_dir=True)
+    assert ignore.match("/docs/build", is_dir=True)
+    assert ignore.match("/src/docs/build", is_dir=False)
+    assert not ignore.match("/mydocs/build", is_dir=False)
+    assert ignore.match("/src/logs", is_dir=True)
+    assert not ignore.match("/src/logs", is_dir=False)
+    assert ignore.match("/tests/test_foo.py", is_dir=False)
+    assert not ignore.match("/tests/foo.py", is_dir=False)
+
+
+def test_jujuignore_can_keep_under():
+    """Directories whose whole content is ignored are detected."""
+    ignore = jujuignore.JujuIgnore(["node_modules/**", "/.venv/**", "*.egg/**"])
+    assert not ignore.can_keep_under("node_modules")
+    assert not ignore.can_keep_under("/foo/node_modules")
+    assert not ignore.can_keep_under("/.venv")
+    assert ignore.can_keep_under("/foo/.venv")
+    assert not ignore.can_keep_under("/foo/bar.egg")
+    assert ignore.can_keep_under("/foo")
+    assert ignore.can_keep_under("/")
+
+
+def test_jujuignore_can_keep_under_only_dirs():
+    """A rule that applies only to directories leaves the files in there."""
+    ignore = jujuignore.JujuIgnore(["node_modules/**/"])
+    assert ignore.can_keep_under("/node_modules")
+
+
+def test_jujuignore_can_keep_under_negated():
+    """Negated rules that could match something inside are respected."""
+    ignore = jujuignore.JujuIgnore(
+        ["/foo/**", "/bar/**", "baz/**", "!/foo/keep.txt", "!/bar/*/keep.txt"]
+    )
+    assert ignore.can_keep_under("/foo")
+    assert ignore.can_keep_under("/bar")
+    assert not ignore.can_keep_under("/baz")
+    assert not ignore.can_keep_under("/foo/baz")
+    assert not ignore.can_keep_under("/bar/baz/baz")
+
+    # negated rules not anchored, or with wildcards that may cross directories
+    ignore = jujuignore.JujuIgnore(["foo/**", "!keep.txt"])
+    assert ignore.can_keep_under("/foo")
+    ignore = jujuignore.JujuIgnore(["foo/**", "!/b**/keep.txt"])
+    assert ignore.can_keep_under("/bar/foo")
+    ignore = jujuignore.JujuIgnore(["foo/**", "!/b/**/keep.txt"])
+    assert ignore.can_keep_under("/bar/foo")
+
+
 def test_jujuignore_multiple_doublestar():
     ignore = jujuignore.JujuIgnore(["foo/**/bar/**/baz"])
     assert ignore.match("/foo/1/2/bar/baz", is_dir=True)
@@ -16,12 +16,15 @@
 
 """Tests for analyze and lint code."""
 
+import threading
 from unittest.mock import patch
 
 import pytest
 
+from charmcraft.cache import AnalysisCache
 from charmcraft.linters import (
     CHECKERS,
+    AnalysisContext,
     CheckType,
     FATAL,
     Framework,
@@ -29,8 +32,8 @@ from charmcraft.linters import (
     Language,
     UNKNOWN,
     analyze,
-    shared_state,
 )
+from charmcraft.metadata import CharmMetadata
 
 
 EXAMPLE_DISPATCH = """
@@ -125,7 +128,7 @@ def test_framework_text_before_check():
 def test_framework_run_operator():
     """Check for Operator Framework was succesful."""
     checker = Framework()
-    with patch.object(Framework, "_check_operator", lambda self, path: True):
+    with patch.object(Framework, "_check_operator", lambda self, path, context: True):
         result = checker.run("somepath")
     assert result == Framework.Result.operator
     assert checker.text == "The charm is based on the Operator Framework."
@@ -134,8 +137,10 @@ def test_framework_run_operator():
 def test_framework_run_reactive():
     """Check for Reactive Framework was succesful."""
     checker = Framework()
-    with patch.object(Framework, "_check_operator", lambda self, path: False):
-        with patch.object(Framework, "_check_reactive", lambda self, path: True):
+    with patch.object(Framework, "_check_operator", lambda self, path, context: False):
+        with patch.object(
+            Framework, "_check_reactive", lambda self, path, context: True
+        ):
             result = checker.run("somepath")
     assert result == Framework.Result.reactive
     assert checker.text == "The charm is based on the Reactive Framework."
@@ -144,8 +149,10 @@ def test_framework_run_reactive():
 def test_framework_run_unknown():
     """No check for any framework was succesful."""
     checker = Framework()
-    with patch.object(Framework, "_check_operator", lambda self, path: False):
-        with patch.object(Framework, "_check_reactive", lambda self, path: False):
+    with patch.object(Framework, "_check_operator", lambda self, path, context: False):
+        with patch.object(
+            Framework, "_check_reactive", lambda self, path, context: False
+        ):
             result = checker.run("somepath")
     assert result == Framework.Result.unknown
     assert checker.text == "The charm is not based on any known Framework."
@@ -160,7 +167,7 @@ def test_framework_run_unknown():
         "from ops.charm import CharmBase",
     ],
 )
-def test_framework_operator_used_ok(tmp_path, monkeypatch, import_line):
+def test_framework_operator_used_ok(tmp_path, import_line):
     """All conditions for 'framework' are in place."""
     # an entry point that import ops
     entrypoint = tmp_path / "charm.py"
@@ -171,16 +178,16 @@ def test_framework_operator_used_ok(tmp_path, monkeypatch, import_line):
     opsdir.mkdir(parents=True)
 
     # the result from previously run Language
-    monkeypatch.setitem(
-        shared_state, "language", {"result": "python", "entrypoint": entrypoint}
-    )
+    context = AnalysisContext(tmp_path)
+    context.results["language"] = "python"
+    context.info["language"]["entrypoint"] = entrypoint
 
     # check
-    result = Framework()._check_operator(tmp_path)
+    result = Framework()._check_operator(tmp_path, context)
     assert result is True
 
 
-def test_framework_operator_language_not_python(tmp_path, monkeypatch):
+def test_framework_operator_language_not_python(tmp_path):
     """The language trait is not set to Python."""
     # an entry point that is not really python
     entrypoint = tmp_path / "charm.py"
@@ -191,59 +198,60 @@ def test_framework_operator_language_not_python(tmp_path, monkeypatch):
     opsdir.mkdir(parents=True)
 
     # the result from previously run Language
-    monkeypatch.setitem(shared_state, "language", {"result": "unknown"})
+    context = AnalysisContext(tmp_path)
+    context.results["language"] = "unknown"
 
     # check
-    result = Framework()._check_operator(tmp_path)
+    result = Framework()._check_operator(tmp_path, context)
     assert result is False
 
 
-def test_framework_operator_venv_directory_missing(tmp_path, monkeypatch):
+def test_framework_operator_venv_directory_missing(tmp_path):
     """The charm has not a specific 'venv' dir."""
     # an entry point that import ops
     entrypoint = tmp_path / "charm.py"
     entrypoint.write_text("import ops")
 
     # the result from previously run Language
-    monkeypatch.setitem(
-        shared_state, "language", {"result": "python", "entrypoint": "whatever"}
-    )
+    context = AnalysisContext(tmp_path)
+    context.results["language"] = "python"
+    context.info["language"]["entrypoint"] = "whatever"
 
     # check
-    result = Framework()._check_operator(tmp_path)
+    result = Framework()._check_operator(tmp_path, context)
     assert result is False
 
 
-def test_framework_operator_no_venv_ops_directory(tmp_path, monkeypatch):
+def test_framework_operator_no_venv_ops_directory(tmp_path):
     """The charm *has not* a specific 'venv/ops' dir."""
     # an entry point that import ops
     entrypoint = tmp_path / "charm.py"
     entrypoint.write_text("import ops")
 
     # the result from previously run Language
-    monkeypatch.setitem(
-        shared_state, "language", {"result": "python", "entrypoint": "whatever"}
-    )
+    context = AnalysisContext(tmp_path)
+    context.results["language"] = "python"
+    context.info["language"]["entrypoint"] = "whatever"
 
     # an empty venv
     venvdir = tmp_path / "venv"
     venvdir.mkdir()
 
     # check
-    result = Framework()._check_operator(tmp_path)
+    result = Framework()._check_operator(tmp_path, context)
     assert result is False
 
 
-def test_framework_operator_venv_ops_directory_is_not_a_dir(tmp_path, monkeypatch):
+def test_framework_operator_venv_ops_directory_is_not_a_dir(tmp_path):
     """The charm has not a specific 'venv/ops' *dir*."""
     # an entry point that import ops
     entrypoint = tmp_path / "charm.py"
     entrypoint.write_text("import ops")
 
     # the result from previously run Language
-    monkeypatch.setitem(
-        shared_state, "language", {"result": "python", "entrypoint": "whatever"}
-    )
+    context = AnalysisContext(tmp_path)
+    context.results["language"] = "python"
+    context.info["language"]["entrypoint"] = "whatever"
 
     # an ops *file* inside venv
     opsfile = tmp_path / "venv" / "ops"
@@ -251,11 +259,11 @@ def test_framework_operator_venv_ops_directory_is_not_a_dir(tmp_path, monkeypatc
     opsfile.touch()
 
     # check
-    result = Framework()._check_operator(tmp_path)
+    result = Framework()._check_operator(tmp_path, context)
     assert result is False
 
 
-def test_framework_operator_corrupted_entrypoint(tmp_path, monkeypatch):
+def test_framework_operator_corrupted_entrypoint(tmp_path):
     """Cannot parse the Python file."""
     # an entry point that import ops
     entrypoint = tmp_path / "charm.py"
@@ -266,12 +274,12 @@ def test_framework_operator_corrupted_entrypoint(tmp_path, monkeypatch):
     opsdir.mkdir(parents=True)
 
     # the result from previously run Language
-    monkeypatch.setitem(
-        shared_state, "language", {"result": "python", "entrypoint": entrypoint}
-    )
+    context = AnalysisContext(tmp_path)
+    context.results["language"] = "python"
+    context.info["language"]["entrypoint"] = entrypoint
 
     # check
-    result = Framework()._check_operator(tmp_path)
+    result = Framework()._check_operator(tmp_path, context)
     assert result is False
 
 
@@ -284,7 +292,7 @@ def test_framework_operator_corrupted_entrypoint(tmp_path, monkeypatch):
         "from stuff.ops import whatever",
     ],
 )
-def test_framework_operator_no_ops_imported(tmp_path, monkeypatch, import_line):
+def test_framework_operator_no_ops_imported(tmp_path, import_line):
     """Different imports that are NOT importing the Operator Framework."""
     # an entry point that import ops
     entrypoint = tmp_path / "charm.py"
@@ -295,12 +303,12 @@ def test_framework_operator_no_ops_imported(tmp_path, monkeypatch, import_line):
     opsdir.mkdir(parents=True)
 
     # the result from previously run Language
-    monkeypatch.setitem(
-        shared_state, "language", {"result": "python", "entrypoint": entrypoint}
-    )
+    context = AnalysisContext(tmp_path)
+    context.results["language"] = "python"
+    context.info["language"]["entrypoint"] = entrypoint
 
     # check
-    result = Framework()._check_operator(tmp_path)
+    result = Framework()._check_operator(tmp_path, context)
     assert result is False
 
 
@@ -313,7 +321,7 @@ def test_framework_operator_no_ops_imported(tmp_path, monkeypatch, import_line):
         "from charms.reactive.stuff import Stuff",
     ],
 )
-def test_framework_reactive_used_ok(tmp_path, monkeypatch, import_line):
+def test_framework_reactive_used_ok(tmp_path, import_line):
     """The reactive framework was used."""
     # metdata file with proper name
     metadata_file = tmp_path / "metadata.yaml"
@@ -330,7 +338,7 @@ def test_framework_reactive_used_ok(tmp_path, monkeypatch, import_line):
     reactive_lib.touch()
 
     # check
-    result = Framework()._check_reactive(tmp_path)
+    result = Framework()._check_reactive(tmp_path, AnalysisContext(tmp_path))
     assert result is True
 
 
@@ -347,7 +355,7 @@ def test_framework_reactive_no_metadata(tmp_path):
     reactive_lib.touch()
 
     # check
-    result = Framework()._check_reactive(tmp_path)
+    result = Framework()._check_reactive(tmp_path, AnalysisContext(tmp_path))
     assert result is False
 
 
@@ -363,7 +371,7 @@ def test_framework_reactive_no_entrypoint(tmp_path):
     reactive_lib.touch()
 
     # check
-    result = Framework()._check_reactive(tmp_path)
+    result = Framework()._check_reactive(tmp_path, AnalysisContext(tmp_path))
     assert result is False
 
 
@@ -385,7 +393,7 @@ def test_framework_reactive_unaccesible_entrypoint(tmp_path):
     reactive_lib.touch()
 
     # check
-    result = Framework()._check_reactive(tmp_path)
+    result = Framework()._check_reactive(tmp_path, AnalysisContext(tmp_path))
     assert result is False
 
 
@@ -406,7 +414,7 @@ def test_framework_reactive_corrupted_entrypoint(tmp_path):
     reactive_lib.touch()
 
     # check
-    result = Framework()._check_reactive(tmp_path)
+    result = Framework()._check_reactive(tmp_path, AnalysisContext(tmp_path))
     assert result is False
 
 
@@ -422,7 +430,7 @@ def test_framework_reactive_no_wheelhouse(tmp_path):
     entrypoint.write_text("import charms.reactive")
 
     # check
-    result = Framework()._check_reactive(tmp_path)
+    result = Framework()._check_reactive(tmp_path, AnalysisContext(tmp_path))
     assert result is False
 
 
@@ -443,7 +451,7 @@ def test_framework_reactive_no_reactive_lib(tmp_path):
     reactive_lib.touch()
 
     # check
-    result = Framework()._check_reactive(tmp_path)
+    result = Framework()._check_reactive(tmp_path, AnalysisContext(tmp_path))
     assert result is False
 
 
@@ -458,7 +466,7 @@ def test_framework_reactive_no_reactive_lib(tmp_path):
         "from stuff.charms.reactive import whatever",
     ],
 )
-def test_framework_reactive_no_reactive_imported(tmp_path, monkeypatch, import_line):
+def test_framework_reactive_no_reactive_imported(tmp_path, import_line):
     """Different imports that are NOT importing the Reactive Framework."""
     # metdata file with proper name
     metadata_file = tmp_path / "metadata.yaml"
@@ -475,7 +483,7 @@ def test_framework_reactive_no_reactive_imported(tmp_path, monkeypatch, import_l
     reactive_lib.touch()
 
     # check
-    result = Framework()._check_reactive(tmp_path)
+    result = Framework()._check_reactive(tmp_path, AnalysisContext(tmp_path))
     assert result is False
 
 
@@ -496,7 +504,7 @@ def create_fake_checker(**kwargs):
         url = params["url"]
         text = params["text"]
 
-        def run(self, basedir):
+        def run(self, basedir, context):
             return params["result"]
 
     return FakeChecker
@@ -512,7 +520,7 @@ def test_analyze_run_everything(config):
     )
 
     # hack the first fake checker to validate that it receives the indicated path
-    def dir_validator(self, basedir):
+    def dir_validator(self, basedir, context):
         assert basedir == "test-buildpath"
         return "result1"
 
@@ -633,3 +641,258 @@ def test_shared_state_dependency_language_framework(config, tmp_path):
     r1, r2 = result
     assert r1.name == Language.name
     assert r2.name == Framework.name
+
+
+def test_analyze_dependencies(config):
+    """The checkers run after the ones they depend on, seeing their results."""
+    FakeChecker1 = create_fake_checker(name="name1", result="res1")
+    FakeChecker2 = create_fake_checker(name="name2", result="res2")
+    FakeChecker2.depends_on = ("name1",)
+    FakeChecker3 = create_fake_checker(name="name3", result="res3")
+    FakeChecker3.depends_on = ("ignored", "unknown")
+    FakeIgnored = create_fake_checker(
+        check_type=CheckType.attribute, name="ignored", result="res"
+    )
+    config.analysis.ignore.attributes.append("ignored")
+
+    seen = {}
+
+    def run_after(self, basedir, context):
+        seen[self.name] = dict(context.results)
+        return "res2"
+
+    FakeChecker2.run = run_after
+    FakeChecker3.run = run_after
+
+    checkers = [FakeChecker2, FakeChecker1, FakeIgnored, FakeChecker3]
+    with patch("charmcraft.linters.CHECKERS", checkers):
+        result = analyze(config, "somepath")
+
+    assert [res.name for res in result] == ["name2", "name1", "ignored", "name3"]
+    assert seen["name2"]["name1"] == "res1"
+    assert seen["name3"]["ignored"] == IGNORED
+
+
+def test_analyze_concurrent(config):
+    """The checkers that don't depend on each other run at the same time."""
+    barrier = threading.Barrier(2, timeout=5)
+
+    def run_together(self, basedir, context):
+        barrier.wait()
+        return "ok"
+
+    FakeChecker1 = create_fake_checker(name="name1")
+    FakeChecker2 = create_fake_checker(name="name2")
+    FakeChecker1.run = FakeChecker2.run = run_together
+
+    with patch("charmcraft.linters.CHECKERS", [FakeChecker1, FakeChecker2]):
+        result = analyze(config, "somepath")
+
+    assert [res.result for res in result] == ["ok", "ok"]
+
+
+def test_analyze_circular_dependencies(config):
+    """Checkers depending on each other can not be run."""
+    FakeChecker1 = create_fake_checker(name="name1")
+    FakeChecker1.depends_on = ("name2",)
+    FakeChecker2 = create_fake_checker(name="name2")
+    FakeChecker2.depends_on = ("name1",)
+
+    with patch("charmcraft.linters.CHECKERS", [FakeChecker1, FakeChecker2]):
+        with pytest.raises(RuntimeError) as cm:
+            analyze(config, "somepath")
+
+    assert str(cm.value) == (
+        "Cannot run checkers with circular dependencies: name1, name2."
+    )
+
+
+def test_analyze_metadata_given(config, tmp_path):
+    """The metadata already parsed is used by the checkers."""
+    metadata = CharmMetadata(name="foobar")
+
+    def get_name(self, basedir, context):
+        return context.get_metadata().name
+
+    FakeChecker = create_fake_checker(name="name")
+    FakeChecker.run = get_name
+
+    with patch("charmcraft.linters.CHECKERS", [FakeChecker]):
+        (res,) = analyze(config, tmp_path, metadata=metadata)
+
+    assert res.result == "foobar"
+
+
+def test_context_memoized(tmp_path):
+    """The files are read and parsed only once."""
+    filepath = tmp_path / "charm.py"
+    filepath.write_text("import ops")
+    context = AnalysisContext(tmp_path)
+
+    assert context.read_text(filepath) == "import ops"
+    assert context.get_imports(filepath) == [["ops"]]
+    filepath.write_text("import other")
+    assert context.read_text(filepath) == "import ops"
+    assert context.get_imports(filepath) == [["ops"]]
+
+
+def test_context_memoized_errors(tmp_path):
+    """The problems are also memoized, and raised every time."""
+    context = AnalysisContext(tmp_path)
+
+    with pytest.raises(FileNotFoundError):
+        context.read_text(tmp_path / "missing")
+    (tmp_path / "missing").touch()
+    with pytest.raises(FileNotFoundError):
+        context.read_text(tmp_path / "missing")
+
+    with pytest.raises(Exception):
+        context.get_metadata()
+    (tmp_path / "metadata.yaml").write_text("name: foobar")
+    with pytest.raises(Exception):
+        context.get_metadata()
+
+
+def test_context_records_inputs(tmp_path):
+    """Each checker's context records the paths it used, sharing the rest."""
+    (tmp_path / "dispatch").write_text("./charm.py")
+    context = AnalysisContext(tmp_path)
+    checker_context = context.for_checker()
+
+    checker_context.read_text(tmp_path / "dispatch")
+    checker_context.get_imports(tmp_path / "charm.py")
+    with pytest.raises(Exception):
+        checker_context.get_metadata()
+    checker_context.use(tmp_path / "venv")
+    checker_context.results["name"] = "result"
+
+    assert checker_context.inputs == {
+        str(tmp_path / "dispatch"),
+        str(tmp_path / "charm.py"),
+        str(tmp_path / "metadata.yaml"),
+        str(tmp_path / "venv"),
+    }
+    assert context.inputs == set()
+    assert context.results == {"name": "result"}
+    assert context.read_text(tmp_path / "dispatch") == "./charm.py"
+
+
+def _create_counting_checker(runs, filename):
+    """Create a fake checker that reads a file, counting its runs."""
+
+    def read_file(self, basedir, context):
+        runs.append(self.name)
+        return context.read_text(basedir / filename)
+
+    FakeChecker = create_fake_checker(name="name")
+    FakeChecker.version = 1
+    FakeChecker.run = read_file
+    return FakeChecker
+
+
+def test_analyze_cache_reused(config, tmp_path):
+    """The cached result is reused while the checker's inputs don't change."""
+    (tmp_path / "charm").mkdir()
+    (tmp_path / "charm" / "somefile").write_text("content")
+    cache = AnalysisCache(tmp_path / "cache")
+    runs = []
+    FakeChecker = _create_counting_checker(runs, "somefile")
+
+    with patch("charmcraft.linters.CHECKERS", [FakeChecker]):
+        first = analyze(config, tmp_path / "charm", cache=cache)
+        second = analyze(config, tmp_path / "charm", cache=cache)
+
+    assert runs == ["name"]
+    assert first == second
+    assert second[0].result == "content"
+
+
+def test_analyze_cache_input_changed(config, tmp_path):
+    """The checker is run again when any of its inputs changes."""
+    (tmp_path / "charm").mkdir()
+    (tmp_path / "charm" / "somefile").write_text("content")
+    cache = AnalysisCache(tmp_path / "cache")
+    runs = []
+    FakeChecker = _create_counting_checker(runs, "somefile")
+
+    with patch("charmcraft.linters.CHECKERS", [FakeChecker]):
+        analyze(config, tmp_path / "charm", cache=cache)
+        (tmp_path / "charm" / "somefile").write_text("other content")
+        (res,) = analyze(config, tmp_path / "charm", cache=cache)
+        (tmp_path / "charm" / "somefile").chmod(0o755)
+        analyze(config, tmp_path / "charm", cache=cache)
+
+    assert runs == ["name", "name", "name"]
+    assert res.result == "other content"
+
+
+def test_analyze_cache_other_version(config, tmp_path):
+    """The results from other version of the checker are not reused."""
+    (tmp_path / "charm").mkdir()
+    (tmp_path / "charm" / "somefile").write_text("content")
+    cache = AnalysisCache(tmp_path / "cache")
+    runs = []
+    FakeChecker = _create_counting_checker(runs, "somefile")
+
+    with patch("charmcraft.linters.CHECKERS", [FakeChecker]):
+        analyze(config, tmp_path / "charm", cache=cache)
+        FakeChecker.version = 2
+        analyze(config, tmp_path / "charm", cache=cache)
+
+    assert runs == ["name", "name"]
+
+
+def test_analyze_cache_crash_not_stored(config, tmp_path):
+    """The result of a crashed checker is not cached."""
+    cache = AnalysisCache(tmp_path / "cache")
+    runs = []
+    FakeChecker = _create_counting_checker(runs, "missing")
+
+    with patch("charmcraft.linters.CHECKERS", [FakeChecker]):
+        analyze(config, tmp_path, cache=cache)
+        (res,) = analyze(config, tmp_path, cache=cache)
+
+    assert runs == ["name", "name"]
+    assert res.result == FATAL
+
+
+def test_analyze_cache_real_checkers(config, tmp_path):
+    """The real checkers record all their inputs, and share their cached info."""
+    test_checkers = [c for c in CHECKERS if c is Language or c is Framework]
+    (tmp_path / "dispatch").write_text(EXAMPLE_DISPATCH)
+    entrypoint = tmp_path / "charm.py"
+    entrypoint.write_text("import ops")
+    entrypoint.chmod(0o700)
+    (tmp_path / "venv" / "ops").mkdir(parents=True)
+    cache = AnalysisCache(tmp_path / "cache")
+
+    with patch("charmcraft.linters.CHECKERS", test_checkers):
+        first = analyze(config, tmp_path, cache=cache)
+        with patch.object(Language, "run", side_effect=ValueError):
+            with patch.object(Framework, "run", side_effect=ValueError):
+                second = analyze(config, tmp_path, cache=cache)
+        assert first == second
+        assert [res.result for res in second] == ["python", "operator"]
+
+        entrypoint.chmod(0o600)
+        third = analyze(config, tmp_path, cache=cache)
+        assert [res.result for res in third] == ["unknown", "unknown"]
+
+
+def test_analyze_cache_dependency_info_changed(config, tmp_path):
+    """The checker is run again when the information shared by a dependency changes."""
+    test_checkers = [c for c in CHECKERS if c is Language or c is Framework]
+    (tmp_path / "dispatch").write_text(EXAMPLE_DISPATCH)
+    for name, content in [("charm.py", "import ops"), ("other.py", "import os")]:
+        (tmp_path / name).write_text(content)
+        (tmp_path / name).chmod(0o700)
+    (tmp_path / "venv" / "ops").mkdir(parents=True)
+    cache = AnalysisCache(tmp_path / "cache")
+
+    with patch("charmcraft.linters.CHECKERS", test_checkers):
+        first = analyze(config, tmp_path, cache=cache)
+        (tmp_path / "dispatch").write_text(EXAMPLE_DISPATCH.replace("charm", "other"))
+        second = analyze(config, tmp_path, cache=cache)
+
+    assert [res.result for res in first] == ["python", "operator"]
+    assert [res.result for res in second] == ["python", "unknown"]
@@ -15,6 +15,7 @@
 # For further info, check https://github.com/canonical/charmcraft
 
 import datetime
+import zipfile
 from unittest.mock import patch
 
 import pytest
@@ -22,7 +23,7 @@ import yaml
 
 from charmcraft import __version__, config, linters
 from charmcraft.cmdbase import CommandError
-from charmcraft.manifest import create_manifest
+from charmcraft.manifest import create_manifest, read_venv_resource
 from charmcraft.utils import OSPlatform
 
 
@@ -114,6 +115,42 @@ def test_manifest_no_bases(tmp_path):
     }
 
 
+def test_manifest_fingerprint(tmp_path):
+    """Manifest including the build fingerprint."""
+    tstamp = datetime.datetime(2020, 2, 1, 15, 40, 33)
+    result_filepath = create_manifest(tmp_path, tstamp, None, [], fingerprint="1234")
+
+    saved = yaml.safe_load(result_filepath.read_text())
+    assert saved["charmcraft-fingerprint"] == "1234"
+
+
+def test_manifest_venv_resource(tmp_path):
+    """Manifest including the venv resource, which can be read from the charm."""
+    tstamp = datetime.datetime(2020, 2, 1, 15, 40, 33)
+    venv_resource = {"name": "venv", "filename": "test.venv.zip", "sha256": "1234"}
+    result_filepath = create_manifest(
+        tmp_path, tstamp, None, [], venv_resource=venv_resource
+    )
+
+    saved = yaml.safe_load(result_filepath.read_text())
+    assert saved["venv-resource"] == venv_resource
+
+    charm_path = tmp_path / "test.charm"
+    with zipfile.ZipFile(str(charm_path), "w") as zf:
+        zf.write(str(result_filepath), "manifest.yaml")
+    assert read_venv_resource(charm_path) == venv_resource
+
+
+@pytest.mark.parametrize("manifest", [None, "", "charmcraft-version: 1.2.3"])
+def test_read_venv_resource_missing(tmp_path, manifest):
+    """Nothing is read from a charm without manifest or a venv resource in it."""
+    charm_path = tmp_path / "test.charm"
+    with zipfile.ZipFile(str(charm_path), "w") as zf:
+        if manifest is not None:
+            zf.writestr("manifest.yaml", manifest)
+    assert read_venv_resource(charm_path) is None
+
+
 def test_manifest_dont_overwrite(tmp_path):
     """Don't overwrite the already-existing file."""
     (tmp_path / "manifest.yaml").touch()
@@ -0,0 +1,189 @@
+# Copyright 2021 Canonical Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# For further info, check https://github.com/canonical/charmcraft
+
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from charmcraft.prune import (
+    DEFAULT_PRUNE_PATTERNS,
+    STALE_PYCS_RULE,
+    STRIP_RULE,
+    prune_tree,
+)
+
+
+def _create_tree(basedir, relpaths):
+    """Create the files (with their path as content) in the tree."""
+    for relpath in relpaths:
+        path = basedir / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(relpath)
+
+
+def _list_tree(basedir):
+    """List all the files in the tree."""
+    result = []
+    for dirpath, dirnames, filenames in os.walk(str(basedir)):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            result.append(os.path.relpath(path, str(basedir)))
+    return sorted(result)
+
+
+def test_prune_tree_default_patterns(tmp_path):
+    """The default rules remove what is not needed at run time."""
+    _create_tree(
+        tmp_path,
+        [
+            "pkg/__init__.py",
+            "pkg/tests/test_pkg.py",
+            "pkg/sub/test/test_sub.py",
+            "pkg/docs/index.rst",
+            "pkg/native.h",
+            "pkg/native.pxd",
+            "pkg/testing.py",
+            "pkg-1.0.dist-info/METADATA",
+            "pkg-1.0.dist-info/RECORD",
+            "tests/__init__.py",
+        ],
+    )
+
+    report = prune_tree(tmp_path, DEFAULT_PRUNE_PATTERNS)
+
+    assert _list_tree(tmp_path) == [
+        "pkg-1.0.dist-info/METADATA",
+        "pkg/__init__.py",
+        "pkg/testing.py",
+    ]
+    assert report["*/tests"] == [1, len("pkg/tests/test_pkg.py")]
+    assert report["tests"] == [1, len("tests/__init__.py")]
+    assert report["*.dist-info/RECORD"] == [1, len("pkg-1.0.dist-info/RECORD")]
+
+
+def test_prune_tree_only_non_packages(tmp_path):
+    """Some rules don't remove the directories that are Python packages."""
+    _create_tree(
+        tmp_path,
+        [
+            "botocore/__init__.py",
+            "botocore/docs/__init__.py",
+            "botocore/docs/docstring.py",
+            "botocore/tests/__init__.py",
+            "other/docs/index.rst",
+            "other/tests/test_other.py",
+        ],
+    )
+
+    report = prune_tree(
+        tmp_path,
+        DEFAULT_PRUNE_PATTERNS,
+        only_non_packages=DEFAULT_PRUNE_PATTERNS,
+    )
+
+    assert _list_tree(tmp_path) == [
+        "botocore/__init__.py",
+        "botocore/docs/__init__.py",
+        "botocore/docs/docstring.py",
+        "botocore/tests/__init__.py",
+    ]
+    assert report == {
+        "*/docs": [1, len("other/docs/index.rst")],
+        "*/tests": [1, len("other/tests/test_other.py")],
+    }
+
+
+def test_prune_tree_keep(tmp_path):
+    """What matches the keep patterns is never removed."""
+    _create_tree(tmp_path, ["pkg/tests/helpers.py", "other/tests/test_other.py"])
+
+    report = prune_tree(tmp_path, ["*/tests"], keep=["pkg/tests"])
+
+    assert _list_tree(tmp_path) == ["pkg/tests/helpers.py"]
+    assert report == {"*/tests": [1, len("other/tests/test_other.py")]}
+
+
+def test_prune_tree_nothing_matched(tmp_path):
+    """Nothing is reported if nothing is removed."""
+    _create_tree(tmp_path, ["pkg/__init__.py"])
+
+    assert prune_tree(tmp_path, ["*/tests"]) == {}
+    assert _list_tree(tmp_path) == ["pkg/__init__.py"]
+
+
+def test_prune_tree_stale_pycs(tmp_path):
+    """The pycs for other interpreters are removed."""
+    _create_tree(
+        tmp_path,
+        [
+            "pkg/__pycache__/__init__.cpython-38.pyc",
+            "pkg/__pycache__/__init__.cpython-36.pyc",
+            "pkg/__pycache__/__init__.cpython-38.opt-1.pyc",
+        ],
+    )
+
+    report = prune_tree(tmp_path, [], cache_tag="cpython-38")
+
+    assert _list_tree(tmp_path) == [
+        "pkg/__pycache__/__init__.cpython-38.opt-1.pyc",
+        "pkg/__pycache__/__init__.cpython-38.pyc",
+    ]
+    assert report == {
+        STALE_PYCS_RULE: [1, len("pkg/__pycache__/__init__.cpython-36.pyc")]
+    }
+
+
+@pytest.mark.skipif(
+    shutil.which("gcc") is None or shutil.which("strip") is None,
+    reason="needs a compiler and strip",
+)
+def test_prune_tree_strip(tmp_path):
+    """The debug symbols are removed from native libraries, keeping other links."""
+    source = tmp_path / "native.c"
+    source.write_text("int answer(void) { return 42; }\n")
+    library = tmp_path / "venv" / "pkg" / "_native.so"
+    library.parent.mkdir(parents=True)
+    subprocess.run(
+        ["gcc", "-g", "-shared", "-fPIC", "-o", str(library), str(source)], check=True
+    )
+    cached = tmp_path / "cached.so"
+    os.link(str(library), str(cached))
+    original_size = library.stat().st_size
+
+    report = prune_tree(tmp_path / "venv", [], strip=True)
+
+    assert report[STRIP_RULE][1] == original_size - library.stat().st_size > 0
+    assert cached.stat().st_size == original_size
+    assert os.access(str(library), os.X_OK)
+
+
+def test_prune_tree_strip_not_available(tmp_path, monkeypatch):
+    """Nothing is stripped if the tool is not there."""
+    _create_tree(tmp_path, ["pkg/_native.so"])
+    monkeypatch.setattr(shutil, "which", lambda name: None)
+
+    assert prune_tree(tmp_path, [], strip=True) == {}
+    assert _list_tree(tmp_path) == ["pkg/_native.so"]
+
+
+def test_prune_tree_strip_failure(tmp_path):
+    """A library that can not be stripped is left as it is."""
+    _create_tree(tmp_path, ["pkg/_native.so"])
+
+    assert prune_tree(tmp_path, [], strip=True) == {}
+    assert _list_tree(tmp_path) == ["pkg/_native.so"]
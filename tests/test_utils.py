@@ -14,6 +14,7 @@
 #
 # For further info, check https://github.com/canonical/charmcraft
 
+import errno
 import logging
 import os
 import pathlib
@@ -22,6 +23,7 @@ from unittest.mock import call, patch
 
 import pytest
 
+from charmcraft import utils
 from charmcraft.cmdbase import CommandError
 from charmcraft.utils import (
     ResourceOption,
@@ -29,6 +31,7 @@ from charmcraft.utils import (
     confirm_with_user,
     get_host_architecture,
     get_os_platform,
+    link_or_copy,
     load_yaml,
     make_executable,
     useful_filepath,
@@ -66,6 +69,154 @@ def test_make_executable_read_bits(tmp_path):
         assert pth.stat().st_mode & 0o777 == 0o750
 
 
+# -- tests for the link or copy helper
+
+
+@pytest.fixture
+def clean_copy_strategies():
+    """Forget what was learnt about copying between devices in other tests."""
+    with patch.dict(utils._unsupported_copy_strategies, clear=True):
+        with patch.object(utils, "_informed_copy_strategies", set()):
+            yield
+
+
+def _exdev_error(*args):
+    raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+
+def _unsupported_error(*args):
+    raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+
+
+@pytest.fixture
+def source_file(tmp_path):
+    """A file to copy, with some particular mode and times."""
+    src = tmp_path / "source.txt"
+    src.write_text("content")
+    src.chmod(0o751)
+    os.utime(str(src), (1600000000, 1600000000))
+    return src
+
+
+def _assert_copied(src, dest):
+    """Verify that the file was copied (not linked), with its content and metadata."""
+    assert dest.read_text() == "content"
+    assert dest.stat().st_ino != src.stat().st_ino
+    assert dest.stat().st_mode == src.stat().st_mode
+    assert dest.stat().st_mtime == src.stat().st_mtime
+
+
+def test_link_or_copy_hardlink(tmp_path, source_file, clean_copy_strategies):
+    """Files are hard linked if possible."""
+    dest = tmp_path / "dest.txt"
+    assert link_or_copy(source_file, dest) == "hardlink"
+    assert dest.stat().st_ino == source_file.stat().st_ino
+
+
+def test_link_or_copy_exists(tmp_path, source_file, clean_copy_strategies):
+    """The destination is never overwritten."""
+    dest = tmp_path / "dest.txt"
+    dest.write_text("previous")
+    with pytest.raises(FileExistsError):
+        link_or_copy(source_file, dest)
+    assert dest.read_text() == "previous"
+
+
+@pytest.mark.parametrize(
+    "link_error", [PermissionError("No you don't."), OSError(errno.EXDEV, "xdev")]
+)
+def test_link_or_copy_reflink(
+    tmp_path, source_file, clean_copy_strategies, link_error, caplog
+):
+    """The file is cloned if can not be linked."""
+    caplog.set_level(logging.DEBUG, logger="charmcraft")
+    dest = tmp_path / "dest.txt"
+    with patch("os.link", side_effect=link_error):
+        with patch("fcntl.ioctl") as mock_ioctl:
+            strategy = link_or_copy(source_file, dest)
+
+    assert strategy == "reflink"
+    assert mock_ioctl.call_count == 1
+    assert mock_ioctl.call_args[0][1] == utils.FICLONE
+    assert any(
+        rec.message.startswith("Using reflink to copy files from device")
+        for rec in caplog.records
+    )
+
+
+def test_link_or_copy_kernel_copy(tmp_path, source_file, clean_copy_strategies):
+    """The file is copied in the kernel if it can not be cloned."""
+    dest = tmp_path / "dest.txt"
+    with patch("os.link", side_effect=_exdev_error):
+        with patch("fcntl.ioctl", side_effect=_unsupported_error):
+            strategy = link_or_copy(source_file, dest)
+
+    assert strategy in ("copy_file_range", "sendfile")
+    _assert_copied(source_file, dest)
+
+
+def test_link_or_copy_regular_copy(tmp_path, source_file, clean_copy_strategies):
+    """The file is copied as the last resort."""
+    dest = tmp_path / "dest.txt"
+    with patch("os.link", side_effect=_exdev_error):
+        with patch("fcntl.ioctl", side_effect=_unsupported_error):
+            with patch("os.copy_file_range", side_effect=_exdev_error, create=True):
+                with patch("os.sendfile", side_effect=_unsupported_error):
+                    strategy = link_or_copy(source_file, dest)
+
+    assert strategy == "copy"
+    _assert_copied(source_file, dest)
+
+
+def test_link_or_copy_short_kernel_copy(tmp_path, source_file, clean_copy_strategies):
+    """A kernel copy that ends before the whole file is copied is not used."""
+    dest = tmp_path / "dest.txt"
+    with patch("os.link", side_effect=_exdev_error):
+        with patch("fcntl.ioctl", side_effect=_unsupported_error):
+            with patch("os.copy_file_range", return_value=0, create=True):
+                strategy = link_or_copy(source_file, dest)
+
+    assert strategy == "sendfile"
+    _assert_copied(source_file, dest)
+
+
+def test_sendfile_short_copy(tmp_path, source_file):
+    """A short copy with sendfile is an error."""
+    dest = tmp_path / "dest.txt"
+    with patch("os.sendfile", return_value=0):
+        with pytest.raises(OSError) as cm:
+            utils._sendfile(str(source_file), str(dest))
+    assert cm.value.errno == errno.EIO
+
+
+def test_link_or_copy_unsupported_remembered(tmp_path, clean_copy_strategies):
+    """What is not supported between two devices is not tried again."""
+    for name in ("file1", "file2"):
+        (tmp_path / name).write_text("content")
+
+    with patch("os.link", side_effect=_exdev_error) as mock_link:
+        with patch("fcntl.ioctl", side_effect=_unsupported_error) as mock_ioctl:
+            link_or_copy(tmp_path / "file1", tmp_path / "dest1")
+            link_or_copy(tmp_path / "file2", tmp_path / "dest2")
+
+    # the hard link is always tried first, as it's the cheapest
+    assert mock_link.call_count == 2
+    assert mock_ioctl.call_count == 1
+    assert (tmp_path / "dest2").read_text() == "content"
+
+
+def test_link_or_copy_other_link_error(tmp_path, source_file, clean_copy_strategies):
+    """Other problems when linking are not hidden."""
+    dest = tmp_path / "dest.txt"
+    with patch("os.link", side_effect=OSError(errno.EIO, "io error")):
+        with pytest.raises(OSError) as cm:
+            link_or_copy(source_file, dest)
+    assert cm.value.errno == errno.EIO
+
+
+# -- tests for yaml loading
+
+
 def test_load_yaml_success(tmp_path):
     test_file = tmp_path / "testfile.yaml"
     test_file.write_text(